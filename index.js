@@ -3,7 +3,7 @@ const cors = require('cors');
 const helmet = require('helmet');
 const winston = require('winston');
 const rateLimit = require('express-rate-limit');
-const { spawn } = require('child_process');
+const { BridgePool } = require('./bridgePool');
 require('dotenv').config();
 
 // Configuración de logging
@@ -28,8 +28,15 @@ class NyxServer {
     this.app = express();
     this.port = process.env.PORT || 3000;
     this.host = process.env.HOST || 'localhost';
-    this.pythonBridge = null;
-    this.pendingRequests = new Map();
+    this.bridgePool = new BridgePool({
+      size: parseInt(process.env.NYX_BRIDGE_WORKERS || '1', 10),
+      standby: parseInt(process.env.NYX_BRIDGE_STANDBY || '1', 10),
+      args: process.env.NYX_BRIDGE_PROFILE_STARTUP === 'true'
+        ? ['../bridge/main.py', '--profile-startup']
+        : ['../bridge/main.py'],
+      protocol: process.env.NYX_BRIDGE_PROTOCOL || 'framed',
+      logger
+    });
 
     this.setupMiddleware();
     this.setupRoutes();
@@ -67,13 +74,14 @@ class NyxServer {
         status: 'healthy', 
         timestamp: new Date().toISOString(),
         uptime: process.uptime(),
-        bridge: this.pythonBridge ? 'connected' : 'disconnected'
+        bridge: this.bridgePool.available ? 'connected' : 'disconnected',
+        workers: this.bridgePool.status()
       });
     });
 
     this.app.post('/api/query', async (req, res) => {
       try {
-        const { message, userId } = req.body;
+        const { message, userId, noCache, timing } = req.body;
 
         if (!message) {
           return res.status(400).json({ error: 'Mensaje requerido' });
@@ -85,28 +93,154 @@ class NyxServer {
           type: 'query',
           message,
           userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
           timestamp: new Date().toISOString()
-        });
+        }, { signal: this.abortOnDisconnect(res) });
 
-        res.json(response);
+        this.sendBridgeResponse(res, response);
       } catch (error) {
+        if (res.destroyed) {
+          logger.info('Cliente desconectado, query cancelada');
+          return;
+        }
         logger.error('Error procesando query:', error);
         res.status(500).json({ error: 'Error interno del servidor' });
       }
     });
 
+    // Varias consultas en una sola request: el puente las ejecuta a la vez,
+    // deduplica las idénticas y devuelve un resultado por elemento
+    this.app.post('/api/query/batch', async (req, res) => {
+      try {
+        const { queries, userId, noCache, timing } = req.body;
+        const maxItems = parseInt(process.env.NYX_BATCH_MAX_ITEMS || '50', 10);
+
+        if (!Array.isArray(queries) || queries.length === 0) {
+          return res.status(400).json({ error: 'Se requiere una lista de consultas' });
+        }
+        if (queries.length > maxItems) {
+          return res.status(400).json({ error: `Máximo ${maxItems} consultas por lote` });
+        }
+
+        const items = queries.map(item => (typeof item === 'string' ? { message: item } : item));
+        if (items.some(item => !item || typeof item.message !== 'string' || !item.message)) {
+          return res.status(400).json({ error: 'Cada consulta requiere un mensaje' });
+        }
+
+        logger.info(`Lote de ${items.length} consultas recibido`);
+
+        const response = await this.sendToPythonBridge({
+          type: 'batch_query',
+          queries: items.map(item => ({ message: item.message, userId: item.userId })),
+          userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
+          timestamp: new Date().toISOString()
+        }, { signal: this.abortOnDisconnect(res) });
+
+        this.sendBridgeResponse(res, response);
+      } catch (error) {
+        if (res.destroyed) {
+          logger.info('Cliente desconectado, lote cancelado');
+          return;
+        }
+        logger.error('Error procesando lote:', error);
+        res.status(500).json({ error: 'Error interno del servidor' });
+      }
+    });
+
+    // Respuesta incremental con Server-Sent Events. GET admite EventSource
+    // (?message=...&userId=...); POST recibe el mismo cuerpo que /api/query.
+    const streamQuery = async (req, res) => {
+      const params = req.method === 'GET' ? req.query : req.body;
+      const { message, userId, noCache, timing } = params || {};
+
+      if (!message) {
+        return res.status(400).json({ error: 'Mensaje requerido' });
+      }
+
+      logger.info(`Query (streaming) recibida: ${message}`);
+
+      // Las cabeceras SSE se envían con el primer evento, para poder responder
+      // con un código HTTP normal si el puente rechaza la consulta
+      let started = false;
+      const signal = this.abortOnDisconnect(res);
+
+      const sendEvent = (event, data) => {
+        if (signal.aborted) {
+          return;
+        }
+        if (!started) {
+          started = true;
+          res.set({
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+          });
+          res.flushHeaders();
+        }
+        res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+      };
+
+      try {
+        const response = await this.bridgePool.stream({
+          type: 'query_stream',
+          message,
+          userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
+          timestamp: new Date().toISOString()
+        }, (chunk) => sendEvent('chunk', chunk), { signal });
+
+        if ((response.overloaded || response.deadline_exceeded) && !started) {
+          return this.sendBridgeResponse(res, response);
+        }
+        sendEvent(response.success ? 'done' : 'error', response);
+      } catch (error) {
+        if (signal.aborted) {
+          logger.info('Cliente desconectado, query (streaming) cancelada');
+          return;
+        }
+        logger.error('Error procesando query (streaming):', error);
+        if (!started) {
+          return res.status(500).json({ error: 'Error interno del servidor' });
+        }
+        sendEvent('error', { error: 'Error interno del servidor' });
+      }
+
+      res.end();
+    };
+
+    this.app.get('/api/query/stream', streamQuery);
+    this.app.post('/api/query/stream', streamQuery);
+
     this.app.get('/api/skills', async (req, res) => {
       try {
         const response = await this.sendToPythonBridge({
           type: 'list_skills'
         });
-        res.json(response);
+        this.sendBridgeResponse(res, response);
       } catch (error) {
         logger.error('Error obteniendo skills:', error);
         res.status(500).json({ error: 'Error obteniendo habilidades' });
       }
     });
 
+    // Métricas del proceso del puente que atiende la request (caché, carriles)
+    this.app.get('/api/stats', async (req, res) => {
+      try {
+        const response = await this.sendToPythonBridge({
+          type: 'stats'
+        });
+        this.sendBridgeResponse(res, response);
+      } catch (error) {
+        logger.error('Error obteniendo métricas:', error);
+        res.status(500).json({ error: 'Error obteniendo métricas' });
+      }
+    });
+
     this.app.use(express.static('public'));
 
     this.app.use('*', (req, res) => {
@@ -115,72 +249,44 @@ class NyxServer {
   }
 
   startPythonBridge() {
-    logger.info('Iniciando puente Python...');
-
-    this.pythonBridge = spawn('python', ['../bridge/main.py'], {
-      stdio: ['pipe', 'pipe', 'pipe']
-    });
-
-    let buffer = '';
-
-    this.pythonBridge.stdout.on('data', (data) => {
-      buffer += data.toString();
-      const lines = buffer.split('\n');
-      buffer = lines.pop() || '';
-
-      lines.forEach(line => {
-        if (line.trim()) {
-          try {
-            const response = JSON.parse(line);
-            this.handlePythonResponse(response);
-          } catch (error) {
-            logger.error('Error parsing Python response:', error);
-          }
-        }
-      });
-    });
+    logger.info(`Iniciando pool de ${this.bridgePool.size} puente(s) Python...`);
+    this.bridgePool.start();
+  }
 
-    this.pythonBridge.stderr.on('data', (data) => {
-      logger.error(`Python bridge error: ${data}`);
-    });
+  async sendToPythonBridge(data, options) {
+    return this.bridgePool.send(data, options);
+  }
 
-    this.pythonBridge.on('close', (code) => {
-      logger.warn(`Python bridge cerrado con código ${code}`);
-      setTimeout(() => this.startPythonBridge(), 5000);
-    });
+  // Opciones booleanas (noCache, timing): llegan como booleano en JSON o como
+  // texto en la query string (SSE)
+  isFlag(value) {
+    return value === true || value === 'true' || value === '1';
   }
 
-  async sendToPythonBridge(data) {
-    return new Promise((resolve, reject) => {
-      if (!this.pythonBridge) {
-        reject(new Error('Python bridge no disponible'));
-        return;
+  // Señal que se aborta si el cliente cierra la conexión antes de la respuesta,
+  // para que el puente cancele el trabajo pendiente
+  abortOnDisconnect(res) {
+    const controller = new AbortController();
+    res.on('close', () => {
+      if (!res.writableFinished) {
+        controller.abort();
       }
-
-      const requestId = Date.now() + Math.random();
-      data.requestId = requestId;
-
-      const request = JSON.stringify(data) + '\n';
-      this.pythonBridge.stdin.write(request);
-
-      const timeout = setTimeout(() => {
-        this.pendingRequests.delete(requestId);
-        reject(new Error('Timeout esperando respuesta de Python bridge'));
-      }, 30000);
-
-      this.pendingRequests.set(requestId, { resolve, reject, timeout });
     });
+    return controller.signal;
   }
 
-  handlePythonResponse(response) {
-    if (response.requestId && this.pendingRequests.has(response.requestId)) {
-      const { resolve, timeout } = this.pendingRequests.get(response.requestId);
-      clearTimeout(timeout);
-      this.pendingRequests.delete(response.requestId);
-      resolve(response);
-    } else {
-      logger.debug('Respuesta sin request ID:', response);
+  // Un puente saturado responde 'overloaded' con una estimación en segundos
+  sendBridgeResponse(res, response) {
+    if (response.overloaded) {
+      logger.warn(`Python bridge saturado (carril ${response.lane}), reintentar en ${response.retry_after}s`);
+      res.set('Retry-After', String(Math.ceil(response.retry_after || 1)));
+      return res.status(503).json(response);
     }
+    if (response.deadline_exceeded) {
+      logger.warn(`Python bridge sin tiempo para la request (${response.stage})`);
+      return res.status(504).json(response);
+    }
+    return res.json(response);
   }
 
   start() {
@@ -191,9 +297,7 @@ class NyxServer {
 
     process.on('SIGINT', () => {
       logger.info('Cerrando servidor...');
-      if (this.pythonBridge) {
-        this.pythonBridge.kill();
-      }
+      this.bridgePool.stop();
       process.exit(0);
     });
   }
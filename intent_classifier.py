@@ -2,18 +2,165 @@
 Clasificador de intenciones de nivel 1 (local)
 """
 
+import os
 import re
-from typing import Dict, List, Optional, Tuple
+import sys
+import copy
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from normalization import normalize, fold_pattern
+
 logger = logging.getLogger(__name__)
 
+# Modelo estadístico entrenado con intent_model.py (vacío: solo patrones)
+INTENT_MODEL = os.getenv('NYX_INTENT_MODEL', '')
+
+# Confianza mínima del clasificador local para resolver en el nivel 1
+LEVEL1_CONFIDENCE = float(os.getenv('NYX_LEVEL1_CONFIDENCE', '0.8'))
+
+# Prefijo que fija el comienzo de una coincidencia: \b(a|b c|...) o ^(a|b|...)
+_LEADING_WORDS = re.compile(r'(\^|\\b)\((?:\?:)?([\w ]+(?:\|[\w ]+)*)\)')
+
+# Caracteres con los que IGNORECASE equivale a str.lower(); fuera de ellos
+# (p. ej. 'ſ', que coincide con 's') no se usa el índice de palabras
+_SIMPLE_CASE = re.compile(r"[\sa-zA-Z0-9_áéíóúüñÁÉÍÓÚÜÑ¿?¡!.,;:'\"()-]*")
+
+_WORD = re.compile(r'\w+')
+
+class PatternMatcher:
+    """
+    Patrones de todas las intenciones compilados e indexados por palabra inicial
+
+    Casi todos los patrones empiezan por una lista de palabras, \b(cita|agenda)
+    o ^(qué|cómo), y no pueden coincidir si la consulta no contiene ninguna.
+    Una pasada por las palabras de la consulta elige los patrones candidatos y
+    solo esos se evalúan, ya compilados, con search() y findall(); el resto no
+    podría coincidir, así que las confianzas son las mismas que evaluando
+    todos. Los patrones sin lista inicial se evalúan siempre.
+
+    Los patrones se compilan sin tildes (fold_pattern) y se buscan en la forma
+    sin tildes de la consulta, de modo que "reunion" coincide con "reunión".
+    """
+
+    def __init__(self, patterns: Dict[str, List[str]], flags: int = re.IGNORECASE):
+        self.sizes = {intent: len(intent_patterns) for intent, intent_patterns in patterns.items()}
+
+        # Índice global de cada patrón -> (intención, patrón compilado)
+        self._slots: List[Tuple[str, re.Pattern]] = []
+        # Palabra completa -> patrones, prefijo de palabra -> patrones
+        self._words: Dict[str, List[int]] = {}
+        self._prefixes: Dict[str, List[int]] = {}
+        self._always: List[int] = []
+
+        for intent, intent_patterns in patterns.items():
+            for pattern in map(fold_pattern, intent_patterns):
+                slot = len(self._slots)
+                self._slots.append((intent, re.compile(pattern, flags)))
+
+                # El índice supone \w y \b de Unicode y sin distinguir mayúsculas
+                indexable = flags & re.IGNORECASE and not flags & (re.ASCII | re.LOCALE | re.VERBOSE)
+                keys = self._leading_words(pattern) if indexable else None
+                if keys is None:
+                    self._always.append(slot)
+                    continue
+
+                for word, whole in keys:
+                    index = self._words if whole else self._prefixes
+                    slots = index.setdefault(word, [])
+                    if slot not in slots:
+                        slots.append(slot)
+
+    @staticmethod
+    def _leading_words(pattern: str) -> Optional[List[Tuple[str, bool]]]:
+        """
+        Primera palabra de cada alternativa inicial y si es una palabra completa
+
+        None si el patrón no empieza por una lista de palabras que toda
+        coincidencia tenga que contener.
+        """
+        match = _LEADING_WORDS.match(pattern)
+        if not match:
+            return None
+
+        rest = pattern[match.end():]
+        if rest[:1] in ('?', '*', '{') or _has_top_level_alternative(rest):
+            return None
+
+        keys = []
+        for alternative in match.group(2).split('|'):
+            word = _WORD.match(alternative)
+            if not word or not _SIMPLE_CASE.fullmatch(alternative):
+                return None
+            # Completa si la sigue un separador o el patrón exige fin de palabra
+            whole = word.end() < len(alternative) or rest.startswith('\\b')
+            keys.append((word.group().lower(), whole))
+        return keys
+
+    def confidences(self, query: str, weights: Dict[str, float]) -> Dict[str, float]:
+        """
+        Confianza de cada intención con coincidencias
+        """
+        if _SIMPLE_CASE.fullmatch(query):
+            candidates = set(self._always)
+            words = set(_WORD.findall(query.lower()))
+            for word in words:
+                candidates.update(self._words.get(word, ()))
+            for prefix, slots in self._prefixes.items():
+                if any(word.startswith(prefix) for word in words):
+                    candidates.update(slots)
+        else:
+            candidates = range(len(self._slots))
+
+        # Se suman en el orden de los patrones para dar exactamente el mismo float
+        totals: Dict[str, float] = {}
+        for slot in sorted(candidates):
+            intent, compiled = self._slots[slot]
+            if not compiled.search(query):
+                continue
+            weight = weights['exact_match'] if len(compiled.findall(query)) > 1 else weights['partial_match']
+            totals[intent] = totals.get(intent, 0.0) + weight
+
+        return {intent: min(total / self.sizes[intent], 1.0) for intent, total in totals.items()}
+
+def _has_top_level_alternative(pattern: str) -> bool:
+    """
+    Indica si el patrón tiene un | fuera de grupos y clases de caracteres
+    """
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
 class IntentClassifier:
     """
     Clasificador simple basado en palabras clave y patrones
+
+    Con un modelo entrenado (NYX_INTENT_MODEL, ver intent_model.py) las
+    consultas que los patrones no clasifican se pasan al modelo, que las
+    acepta si la intención más probable supera NYX_INTENT_MODEL_THRESHOLD.
     """
 
-    def __init__(self):
+    def __init__(self, model: Optional['IntentModel'] = None):
         self.patterns = {
             'calendar': [
                 r'\b(calendario|evento|reunión|cita|agenda|meeting)\b',
@@ -41,20 +188,76 @@ class IntentClassifier:
             'context_match': 0.5
         }
 
+        self._matcher: Optional[PatternMatcher] = None
+        self._matcher_shape: Optional[Tuple] = None
+
+        # numpy solo se importa si hay un modelo configurado
+        if model is None and INTENT_MODEL:
+            from intent_model import load_model
+            model = load_model(INTENT_MODEL)
+        self.model = model
+        self.stats = {'patterns': 0, 'model': 0, 'unclassified': 0}
+        self.level1 = 0
+
     def classify(self, query: str) -> Tuple[Optional[str], float]:
         """
         Clasifica una consulta y retorna la intención más probable con confianza
         """
-        query_clean = query.lower().strip()
+        return self.classify_batch([query])[0]
+
+    def classify_batch(self, queries: List[str], quiet: bool = False) -> List[Tuple[Optional[str], float]]:
+        """
+        Clasifica un lote de consultas
+
+        Los patrones se evalúan consulta a consulta; el modelo puntúa de una
+        vez, en una sola matriz, todas las que los patrones no clasifican.
+        Con quiet no se cuentan en las estadísticas ni se registran en el log
+        (evaluaciones fuera de línea).
+        """
+        queries = [normalize(query) for query in queries]
+        results = [self._classify_patterns(query.folded) for query in queries]
+        sources = ['patterns' if intent else 'unclassified' for intent, _ in results]
+
+        pending = [i for i, (intent, _) in enumerate(results) if intent is None and queries[i].text]
+        if self.model is not None and pending:
+            predictions = self.model.classify_batch([queries[i] for i in pending])
+            for i, (intent, probability) in zip(pending, predictions):
+                if intent and probability >= self.model.threshold:
+                    results[i] = (intent, probability)
+                    sources[i] = 'model'
 
+        if quiet:
+            return results
+
+        for query, (intent, confidence), source in zip(queries, results, sources):
+            if not query.text:
+                continue
+            self.stats[source] += 1
+            if intent and confidence >= LEVEL1_CONFIDENCE:
+                self.level1 += 1
+            if source == 'patterns':
+                logger.info(f"Intent clasificado: {intent} (confianza: {confidence:.2f})")
+            elif source == 'model':
+                logger.info(f"Intent clasificado por el modelo: {intent} (probabilidad: {confidence:.2f})")
+            else:
+                logger.info(f"No se pudo clasificar con confianza: {query[:50]}...")
+
+        return results
+
+    def _classify_patterns(self, query_clean: str) -> Tuple[Optional[str], float]:
+        """
+        Intención según los patrones, o None con la mejor confianza si no llega a 0.5
+        """
         if not query_clean:
             return None, 0.0
 
         best_intent = None
         best_confidence = 0.0
 
-        for intent, patterns in self.patterns.items():
-            confidence = self._calculate_confidence(query_clean, patterns)
+        confidences = self._get_matcher().confidences(query_clean, self.confidence_weights)
+
+        for intent in self.patterns:
+            confidence = confidences.get(intent, 0.0)
 
             if confidence > best_confidence:
                 best_confidence = confidence
@@ -62,15 +265,50 @@ class IntentClassifier:
 
         # Solo retornar si la confianza es suficientemente alta
         if best_confidence >= 0.5:
-            logger.info(f"Intent clasificado: {best_intent} (confianza: {best_confidence:.2f})")
             return best_intent, best_confidence
 
-        logger.info(f"No se pudo clasificar con confianza: {query[:50]}...")
         return None, best_confidence
 
+    def _get_matcher(self) -> PatternMatcher:
+        """
+        Matcher compilado de los patrones actuales; se recompila si han cambiado
+
+        Se detectan los patrones añadidos o quitados (add_pattern() o la lista
+        de self.patterns); si se reemplaza uno en su sitio, llamar a recompile().
+        """
+        shape = tuple((intent, len(patterns)) for intent, patterns in self.patterns.items())
+        if self._matcher is None or shape != self._matcher_shape:
+            self._matcher = PatternMatcher(self.patterns)
+            self._matcher_shape = shape
+        return self._matcher
+
+    def snapshot(self) -> 'IntentClassifier':
+        """
+        Copia para clasificar fuera del loop (p. ej. en un hilo)
+
+        Tiene sus propios patrones y matcher, así que los cambios del
+        clasificador en uso no le afectan; el modelo es el mismo objeto, que
+        no se modifica (se reemplaza entero).
+        """
+        clone = copy.copy(self)
+        clone.patterns = {intent: list(patterns) for intent, patterns in self.patterns.items()}
+        clone.stats = dict(self.stats)
+        clone._matcher = None
+        clone._matcher_shape = None
+        return clone
+
+    def recompile(self):
+        """
+        Descarta el matcher compilado tras modificar self.patterns
+        """
+        self._matcher = None
+
     def _calculate_confidence(self, query: str, patterns: List[str]) -> float:
         """
         Calcula la confianza de un intent basado en patrones
+
+        Versión de referencia, patrón a patrón: classify() usa PatternMatcher,
+        que da el mismo resultado evaluando solo los patrones candidatos.
         """
         total_confidence = 0.0
         matches = 0
@@ -99,10 +337,30 @@ class IntentClassifier:
             self.patterns[intent] = []
 
         self.patterns[intent].append(pattern)
+        self.recompile()
         logger.info(f"Patrón añadido para {intent}: {pattern}")
 
     def get_supported_intents(self) -> List[str]:
         """
         Retorna la lista de intenciones soportadas
         """
-        return list(self.patterns.keys())
+        intents = list(self.patterns.keys())
+        if self.model is not None:
+            intents += [label for label in self.model.intents() if label not in self.patterns]
+        return intents
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Consultas clasificadas por los patrones, por el modelo y sin clasificar
+
+        local_rate solo cuenta las que llegan a LEVEL1_CONFIDENCE: las
+        clasificadas por debajo (p. ej. por el modelo entre su umbral y
+        LEVEL1_CONFIDENCE) no se resuelven en el nivel 1.
+        """
+        total = sum(self.stats.values())
+        return {
+            **self.stats,
+            'level1': self.level1,
+            'model_loaded': self.model is not None,
+            'local_rate': round(self.level1 / total, 3) if total else 0.0
+        }
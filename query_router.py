@@ -2,60 +2,173 @@
 Router de consultas - Sistema de enrutamiento de 3 niveles
 """
 
+import os
 import sys
+import copy
+import time
+import asyncio
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import logging
 
 # Añadir clients al path
 sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
 
-from intent_classifier import IntentClassifier
-from skill_manager import SkillManager
-from gemini_client import GeminiClient
-from perplexity_client import PerplexityClient
-from budget_governor import BudgetGovernor
+import timing
+import traffic
+import deadline
+from deadline import DeadlineExceeded
+from circuit_breaker import CircuitOpen
+from services import ServiceContainer
+from tiers import TierRegistry, TierContext
+from normalization import normalize
+from keyword_matcher import keywords
+from intent_classifier import LEVEL1_CONFIDENCE
 
 logger = logging.getLogger(__name__)
 
+# Consultas de un mismo lote que se ejecutan a la vez
+BATCH_CONCURRENCY = int(os.getenv('NYX_BATCH_CONCURRENCY', '8'))
+
+# Enrutado especulativo: con una confianza de nivel 1 en la zona gris
+# [SPECULATION_MIN_CONFIDENCE, LEVEL1_CONFIDENCE) se lanzan a la vez la skill local (si es de
+# solo lectura) y el análisis de Gemini, y gana el primer resultado aceptable
+SPECULATIVE_ROUTING = os.getenv('NYX_SPECULATIVE_ROUTING', 'false').lower() == 'true'
+SPECULATION_MIN_CONFIDENCE = float(os.getenv('NYX_SPECULATION_MIN_CONFIDENCE', '0.5'))
+
+# Expresiones que indican que la consulta necesita búsqueda web
+WEB_INDICATORS = [
+    'qué es', 'quién es', 'cuál es',
+    'noticias', 'último', 'reciente',
+    'información sobre', 'datos de',
+    'precio de', 'cotización',
+    'weather in', 'clima en',
+    'latest', 'news about'
+]
+keywords.register('web_search', WEB_INDICATORS)
+
 class QueryRouter:
     """
     Enrutador de consultas que implementa el sistema de 3 niveles:
     1. Clasificación local de intenciones
     2. Razonamiento avanzado (Gemini)
     3. Búsqueda web en tiempo real (Perplexity)
+
+    Cada nivel es un tier del registro (tiers.py); la configuración puede
+    añadir otros, p. ej. una base de conocimiento local delante de Gemini.
     """
 
-    def __init__(self):
-        self.intent_classifier = IntentClassifier()
-        self.skill_manager = SkillManager()
-        self.gemini_client = GeminiClient()
-        self.perplexity_client = PerplexityClient()
-        self.budget_governor = BudgetGovernor()
+    def __init__(self, services: Optional[ServiceContainer] = None):
+        # Los clientes, el gobernador de presupuesto y las skills son los
+        # mismos que usan las skills y el resto del puente
+        self.services = services or ServiceContainer()
+        self.intent_classifier = self.services.intent_classifier
+        self.skill_manager = self.services.skill_manager
+        self.response_cache = self.services.response_cache
+        self.single_flight = self.services.single_flight
+        self.routing_policy = self.services.routing_policy
+        self.circuit_breakers = self.services.circuit_breakers
+        self.traffic_recorder = self.services.traffic_recorder
+        self.verdict_log = self.services.verdict_log
+        # Confianza con la que una intención se resuelve en el nivel 1 (la usa la destilación)
+        self.level1_confidence = LEVEL1_CONFIDENCE
+
+        # Respuestas servidas por cada alternativa cuando falla una API externa
+        self.fallback_stats = {
+            'gemini_direct': 0,
+            'cache': 0,
+            'local_help': 0
+        }
+
+        # Niveles configurados, del más barato al más caro
+        self.tiers = TierRegistry(self)
+
+        # Resultados acumulados del enrutado especulativo
+        self.speculation_stats = {
+            'races': 0,
+            'level1_wins': 0,
+            'level2_wins': 0,
+            'prefetch_hits': 0,
+            'wasted_level1': 0,
+            'wasted_level2': 0,
+            'saved_ms': 0.0
+        }
+        # Media móvil de la latencia del análisis de Gemini, para estimar el ahorro
+        self._analysis_ms = None
 
         logger.info("Query Router inicializado")
 
-    async def route_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+    # Los clientes de APIs externas (y sus SDKs) se crean al usarlos por primera vez
+    @property
+    def gemini_client(self):
+        return self.services.gemini_client
+
+    @property
+    def perplexity_client(self):
+        return self.services.perplexity_client
+
+    @property
+    def budget_governor(self):
+        return self.services.budget_governor
+
+    async def route_query(self, query: str, user_id: str = 'anonymous',
+                          classification: Optional[Tuple[Optional[str], float]] = None,
+                          use_cache: bool = True) -> Dict[str, Any]:
         """
         Enruta una consulta a través del sistema de 3 niveles
+
+        classification permite pasar el resultado previo de
+        IntentClassifier.classify() para no repetirlo. Con use_cache=False no se
+        consulta la caché de respuestas, pero el resultado nuevo sí se guarda.
+
+        La consulta se normaliza aquí si no llega ya normalizada (normalization.py),
+        y el resto de etapas reutiliza esa NormalizedQuery.
+        """
+        query = normalize(query)
+        capture = self.traffic_recorder.begin('query', query, user_id, use_cache)
+        result = None
+
+        try:
+            if use_cache:
+                result = self.response_cache.get(query, user_id)
+                if result is not None:
+                    logger.info("Respuesta servida desde la caché")
+                    return result
+            else:
+                self.response_cache.record_bypass()
+
+            result = await self._route(query, user_id, classification)
+            self.response_cache.put(query, user_id, result)
+
+            return result
+        finally:
+            self.traffic_recorder.finish(capture, result)
+
+    async def _route(self, query: str, user_id: str,
+                     classification: Optional[Tuple[Optional[str], float]]) -> Dict[str, Any]:
+        """
+        Recorre los niveles de routing para una consulta no cacheada
         """
         try:
             # Nivel 1: Clasificación local de intenciones
-            intent, confidence = self.intent_classifier.classify(query)
+            intent, confidence = classification or self.classify(query)
 
-            if intent and confidence >= 0.8:
-                logger.info(f"Nivel 1: Intent {intent} detectado con alta confianza")
-                return await self._handle_level1(query, intent, user_id)
+            # Las reglas proponen un nivel y la política de enrutado decide
+            with timing.stage('policy'):
+                decision = self.routing_policy.decide(
+                    query, intent, confidence, self._rule_level(query, intent, confidence)
+                )
+            traffic.note_decision(decision)
 
-            # Nivel 2: Determinar si necesita razonamiento o búsqueda web
-            needs_web_search = self._needs_web_search(query)
+            started = time.perf_counter()
+            result = await self._dispatch(query, user_id, intent, confidence, decision['level'])
+            self.routing_policy.record_outcome(decision, result, (time.perf_counter() - started) * 1000)
 
-            if needs_web_search:
-                logger.info("Nivel 3: Consulta requiere búsqueda web")
-                return await self._handle_level3(query, user_id)
-            else:
-                logger.info("Nivel 2: Consulta requiere razonamiento avanzado")
-                return await self._handle_level2(query, user_id)
+            return result
+
+        except DeadlineExceeded as e:
+            logger.warning(f"{e}: consulta abandonada")
+            return self._deadline_result(e)
 
         except Exception as e:
             logger.error(f"Error en routing: {e}")
@@ -65,50 +178,639 @@ class QueryRouter:
                 'level': 'error'
             }
 
-    async def _handle_level1(self, query: str, intent: str, user_id: str) -> Dict[str, Any]:
+    def _rule_level(self, query: str, intent: Optional[str], confidence: float) -> int:
         """
-        Maneja consultas del Nivel 1 (clasificación local)
+        Nivel que corresponde a una consulta según las reglas fijas
         """
-        # Buscar skill que maneje este intent
-        skill_name = self._map_intent_to_skill(intent)
+        if intent and confidence >= LEVEL1_CONFIDENCE:
+            return 1
+
+        # Nivel 2: Determinar si necesita razonamiento o búsqueda web
+        return 3 if self._needs_web_search(query) else 2
+
+    async def _dispatch(self, query: str, user_id: str, intent: Optional[str],
+                        confidence: float, level: int) -> Dict[str, Any]:
+        """
+        Ejecuta la consulta en el nivel decidido, con alternativas si falla su API
+        """
+        result = await self._walk_tiers(query, TierContext(user_id, intent, confidence, level))
+
+        if result.get('backend'):
+            result = await self._fall_back(query, user_id, result)
+
+        return result
+
+    async def _walk_tiers(self, query: str, context: TierContext) -> Dict[str, Any]:
+        """
+        Prueba los niveles que pueden atender la consulta, del más barato al más
+        caro, hasta el primero que da una respuesta
+        """
+        for tier in self.tiers.candidates(query, context):
+            tier.counters['attempts'] += 1
+            result = await tier.handle(query, context)
+
+            if result is not None:
+                tier.counters['answered'] += 1
+                return result
+
+            tier.counters['passed'] += 1
+            logger.info(f"Nivel {tier.name} sin respuesta, se prueba el siguiente")
+
+        return self._no_tier_result()
+
+    def _deadline_result(self, error: DeadlineExceeded) -> Dict[str, Any]:
+        """
+        Resultado de una consulta cuyo plazo se agotó mientras se enrutaba
+        """
+        return {
+            'error': str(error),
+            'success': False,
+            'level': 'error',
+            'deadline_exceeded': True,
+            'stage': error.stage
+        }
+
+    def _no_tier_result(self) -> Dict[str, Any]:
+        return {
+            'error': 'Ningún nivel configurado puede atender la consulta',
+            'success': False,
+            'level': 'error'
+        }
+
+    async def _run_skill(self, skill_name: str, query: str, context: TierContext) -> Dict[str, Any]:
+        """
+        Nivel 1: ejecuta la skill de la intención detectada con alta confianza
+        """
+        logger.info(f"Nivel 1: Intent {context.intent} detectado con alta confianza")
+
+        result = await self.skill_manager.execute_skill(skill_name, query, self._skill_context(context))
+        result['level'] = 1
+        result['method'] = 'local_classification'
+
+        return result
+
+    def _skill_context(self, context: TierContext) -> Dict[str, Any]:
+        return {
+            'user_id': context.user_id,
+            'intent': context.intent,
+            'level': 1
+        }
+
+    async def _run_gemini(self, query: str, context: TierContext) -> Dict[str, Any]:
+        """
+        Nivel 2: análisis de Gemini, en paralelo con la skill local si procede especular
+        """
+        if SPECULATIVE_ROUTING and context.intent and context.confidence >= SPECULATION_MIN_CONFIDENCE:
+            speculative = await self._route_speculative(query, context.intent, context.confidence, context.user_id)
+            if speculative is not None:
+                return speculative
+
+        logger.info("Nivel 2: Consulta requiere razonamiento avanzado")
+        return await self._handle_level2(query, context.user_id)
+
+    async def route_batch(self, items: List[Any], user_id: str = 'anonymous',
+                          use_cache: bool = True,
+                          classifications: Optional[Dict[str, Tuple[Optional[str], float]]] = None) -> Dict[str, Any]:
+        """
+        Enruta un lote de consultas de forma concurrente
+
+        Cada elemento es un texto o {'message': ..., 'userId': ...}. Las
+        consultas idénticas del mismo usuario se clasifican y ejecutan una sola
+        vez, y cada elemento recibe su propia copia del resultado, en el mismo
+        orden que la entrada. classifications permite pasar el resultado previo
+        de classify_batch() para no repetirlo.
+        """
+        keys = [self._batch_key(item, user_id) for item in items]
+        unique = list(dict.fromkeys(keys))
+
+        if classifications is None:
+            classifications = self.classify_batch(items)
+
+        slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run(key: Tuple[str, str]) -> Dict[str, Any]:
+            query, item_user = key
+            async with slots:
+                return await self.route_query(query, item_user, classifications.get(query), use_cache)
+
+        outcomes = await asyncio.gather(*(run(key) for key in unique))
+        by_key = dict(zip(unique, outcomes))
+
+        logger.info(f"Lote de {len(items)} consultas ({len(unique)} distintas) procesado")
+
+        return {
+            'results': [copy.deepcopy(by_key[key]) for key in keys],
+            'count': len(items),
+            'unique': len(unique)
+        }
+
+    def _batch_key(self, item: Any, user_id: str) -> Tuple[str, str]:
+        """
+        Clave de deduplicación de un elemento del lote
+        """
+        if isinstance(item, str):
+            item = {'message': item}
 
-        if skill_name:
-            context = {
-                'user_id': user_id,
-                'intent': intent,
-                'level': 1
+        return (normalize(str(item.get('message', '')).strip()), item.get('userId') or user_id)
+
+    def classify(self, query: str) -> Tuple[Optional[str], float]:
+        """
+        Clasificación local de una consulta, la que reciben predict_level() y route_query()
+        """
+        with timing.stage('classify'):
+            return self.intent_classifier.classify(query)
+
+    def classify_batch(self, items: List[Any]) -> Dict[str, Tuple[Optional[str], float]]:
+        """
+        Clasifica una vez cada texto distinto de un lote, todo el lote a la vez
+
+        Retorna la clasificación por consulta normalizada, como la espera route_batch().
+        """
+        texts = list(dict.fromkeys(self._batch_key(item, '')[0] for item in items))
+
+        with timing.stage('classify'):
+            return dict(zip(texts, self.intent_classifier.classify_batch(texts)))
+
+    def predict_level(self, query: str, classification: Tuple[Optional[str], float]) -> int:
+        """
+        Predice el nivel que atenderá una consulta sin ejecutar nada
+
+        Recibe la clasificación de classify(), que después se pasa a
+        route_query() para no repetirla, y aplica las mismas reglas y la misma
+        política de enrutado sin contar la decisión. Solo hace trabajo local.
+        """
+        query = normalize(query)
+        intent, confidence = classification
+
+        if intent and confidence >= LEVEL1_CONFIDENCE and self._map_intent_to_skill(intent):
+            return 1
+
+        proposed = 3 if self._needs_web_search(query) else 2
+        return self.routing_policy.predict(query, intent, confidence, proposed)
+
+    async def route_query_stream(self, query: str, user_id: str = 'anonymous',
+                                 use_cache: bool = True,
+                                 classification: Optional[Tuple[Optional[str], float]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Enruta una consulta emitiendo el texto de la respuesta según se genera
+
+        Produce {'chunk': texto} por cada fragmento y termina con {'result': ...},
+        el mismo Dict que retornaría route_query(). Una respuesta en caché se
+        emite en un solo fragmento. classification es como en route_query().
+        """
+        query = normalize(query)
+        capture = self.traffic_recorder.begin('stream', query, user_id, use_cache)
+        result = None
+
+        try:
+            async for event in self._route_stream(query, user_id, use_cache, classification):
+                if 'result' in event:
+                    result = event['result']
+                yield event
+        finally:
+            self.traffic_recorder.finish(capture, result)
+
+    async def _route_stream(self, query: str, user_id: str, use_cache: bool,
+                            classification: Optional[Tuple[Optional[str], float]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Recorre la caché y los niveles para route_query_stream()
+        """
+        if use_cache:
+            cached = self.response_cache.get(query, user_id)
+            if cached is not None:
+                logger.info("Respuesta servida desde la caché (streaming)")
+                text = self._result_text(cached)
+                if text:
+                    yield {'chunk': text}
+                yield {'result': cached}
+                return
+        else:
+            self.response_cache.record_bypass()
+
+        try:
+            intent, confidence = classification or self.classify(query)
+            with timing.stage('policy'):
+                decision = self.routing_policy.decide(
+                    query, intent, confidence, self._rule_level(query, intent, confidence)
+                )
+            traffic.note_decision(decision)
+            context = TierContext(user_id, intent, confidence, decision['level'])
+            started = time.perf_counter()
+            streamed = False
+
+            for tier in self.tiers.candidates(query, context):
+                tier.counters['attempts'] += 1
+                answered = False
+
+                async for event in tier.stream(query, context):
+                    if 'result' in event:
+                        answered = True
+                        result = event['result']
+
+                        # Si la API falló antes de emitir nada, se sirve la alternativa
+                        if result.get('backend') and not streamed:
+                            result = await self._fall_back(query, user_id, result)
+                            text = self._result_text(result)
+                            if text:
+                                yield {'chunk': text}
+                            event = {'result': result}
+
+                        self.routing_policy.record_outcome(
+                            decision, result, (time.perf_counter() - started) * 1000
+                        )
+                        self.response_cache.put(query, user_id, result)
+                    else:
+                        streamed = True
+                    yield event
+
+                if answered:
+                    tier.counters['answered'] += 1
+                    return
+
+                tier.counters['passed'] += 1
+                logger.info(f"Nivel {tier.name} sin respuesta (streaming), se prueba el siguiente")
+
+            yield {'result': self._no_tier_result()}
+
+        except DeadlineExceeded as e:
+            logger.warning(f"{e}: consulta abandonada (streaming)")
+            yield {'result': self._deadline_result(e)}
+
+        except Exception as e:
+            logger.error(f"Error en routing (streaming): {e}")
+            yield {
+                'result': {
+                    'error': str(e),
+                    'success': False,
+                    'level': 'error'
+                }
             }
 
-            result = self.skill_manager.execute_skill(skill_name, query, context)
-            result['level'] = 1
-            result['method'] = 'local_classification'
+    async def _stream_local_skill(self, skill_name: str, query: str,
+                                  context: TierContext) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Nivel 1 en streaming
+        """
+        logger.info(f"Nivel 1 (streaming): Intent {context.intent} detectado con alta confianza")
+        async for event in self._stream_skill(skill_name, query, self._skill_context(context),
+                                              1, 'local_classification'):
+            yield event
 
-            return result
+    async def _stream_gemini(self, query: str, context: TierContext) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Nivel 2 en streaming
+
+        Decide con el mismo análisis de Gemini que route_query() (compartido con
+        las consultas idénticas y guardado para la destilación), así que llega
+        a la misma skill o a la misma respuesta directa; esta se vuelve a pedir
+        a Gemini en streaming para emitirla según se genera.
+        """
+        if SPECULATIVE_ROUTING and context.intent and context.confidence >= SPECULATION_MIN_CONFIDENCE:
+            # La especulación compite con la skill local: sin streaming, como en route_query()
+            async for event in self._stream_result(self._run_gemini(query, context)):
+                yield event
+            return
+
+        logger.info("Nivel 2 (streaming): Consulta requiere razonamiento avanzado")
+
+        try:
+            analysis = await self._analyze(query, context.user_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 2 (streaming): {e}")
+            yield {'result': self._backend_error({'error': str(e)}, 2, 'gemini')}
+            return
+
+        skill_name = analysis.get('skill_name') if analysis.get('success') is not False else None
+        if analysis.get('skill_required') and skill_name:
+            async for event in self._stream_skill(skill_name, query, self._level2_context(context.user_id, analysis),
+                                                  2, 'gemini_reasoning'):
+                if 'result' in event:
+                    event['result']['analysis'] = analysis
+                yield event
+            return
+
+        if analysis.get('success') is False:
+            yield {'result': self._backend_error(analysis, 2, 'gemini')}
+            return
+
+        async for event in self._stream_level2(query, context.user_id, analysis):
+            yield event
+
+    async def _stream_level2(self, query: str, user_id: str,
+                             analysis: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Respuesta directa de Gemini emitida según se genera
+
+        Si el streaming falla antes del primer fragmento se sirve la respuesta
+        que ya traía el análisis.
+        """
+        parts = []
+
+        try:
+            async for text in self.gemini_client.stream_response(query, user_id):
+                parts.append(text)
+                yield {'chunk': text}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not parts:
+                logger.warning(f"Streaming de Gemini no disponible, se usa la respuesta del análisis: {e}")
+                async for event in self._stream_result(self._complete_level2(query, user_id, analysis)):
+                    yield event
+                return
+
+            logger.error(f"Error en Nivel 2 (streaming): {e}")
+            yield {
+                'result': self._backend_error(
+                    {'error': str(e), 'circuit_open': isinstance(e, CircuitOpen)}, 2, 'gemini'
+                )
+            }
+            return
+
+        yield {
+            'result': {
+                'success': True,
+                'level': 2,
+                'method': 'gemini_direct',
+                'result': {
+                    'response': ''.join(parts),
+                    'type': 'text',
+                    'analysis': analysis
+                }
+            }
+        }
+
+    async def _stream_skill(self, skill_name: str, query: str, context: Dict[str, Any],
+                            level: int, method: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta una skill en streaming y etiqueta el resultado final con el nivel
+        """
+        async for event in self.skill_manager.execute_skill_stream(skill_name, query, context):
+            if 'result' in event:
+                event['result']['level'] = level
+                event['result']['method'] = method
+            yield event
+
+    async def _stream_result(self, pending) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Adapta un resultado no incremental al formato de streaming
+        """
+        result = await pending
+        text = self._result_text(result)
+
+        if text:
+            yield {'chunk': text}
+        yield {'result': result}
+
+    async def _stream_level3(self, query: str, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Búsqueda de Perplexity emitida según se genera
+        """
+        logger.info("Nivel 3 (streaming): Consulta requiere búsqueda web")
+
+        if not self.budget_governor.can_spend():
+            yield {
+                'result': {
+                    'error': 'Presupuesto de búsqueda web agotado',
+                    'success': False,
+                    'level': 3,
+                    'budget_exceeded': True
+                }
+            }
+            return
+
+        response = {}
 
-        # Si no hay skill disponible, pasar al nivel 2
-        return await self._handle_level2(query, user_id)
+        try:
+            async for event in self.perplexity_client.search_stream(query, user_id):
+                if 'chunk' in event:
+                    yield event
+                else:
+                    response = event['response']
+        except asyncio.CancelledError:
+            self.budget_governor.record_abandoned({'query': query[:100], 'level': 3})
+            raise
+
+        if not response.get('success'):
+            yield {
+                'result': self._backend_error(response, 3, 'perplexity')
+            }
+            return
+
+        estimated_cost = self.perplexity_client.estimate_cost(response)
+        self.budget_governor.record_usage(estimated_cost)
+
+        yield {
+            'result': {
+                'success': True,
+                'level': 3,
+                'method': 'perplexity_search',
+                'result': {
+                    'response': response.get('answer', ''),
+                    'sources': response.get('sources', []),
+                    'type': 'search_result',
+                    'cost': estimated_cost
+                }
+            }
+        }
+
+    def _result_text(self, result: Dict[str, Any]) -> str:
+        """
+        Extrae el texto mostrable de un resultado de routing
+        """
+        inner = result.get('result')
+
+        if isinstance(inner, dict):
+            for key in ('response', 'content'):
+                if isinstance(inner.get(key), str):
+                    return inner[key]
+
+        return ''
+
+    async def _route_speculative(self, query: str, intent: str, confidence: float,
+                                 user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Ejecuta a la vez la skill del nivel 1 y el análisis de Gemini
+
+        Si la skill termina antes con un resultado válido, gana y se cancela
+        Gemini. Si Gemini termina antes y elige la misma acción de la skill, se
+        reutiliza el resultado adelantado (p. ej. los eventos del calendario) en
+        lugar de ejecutarla otra vez. Retorna None si la skill no admite
+        ejecución especulativa.
+        """
+        skill_name = self._map_intent_to_skill(intent)
+        context = {
+            'user_id': user_id,
+            'intent': intent,
+            'level': 1,
+            'speculative': True
+        }
+
+        key = self.skill_manager.get_speculation_key(skill_name, query, context) if skill_name else None
+        if key is None:
+            return None
+
+        logger.info(f"Especulación: {skill_name}/{key} en paralelo con Gemini (confianza {confidence:.2f})")
+
+        started = time.perf_counter()
+        finished = {}
+
+        def track(name):
+            return lambda _: finished.setdefault(name, (time.perf_counter() - started) * 1000)
+
+        level1 = asyncio.create_task(self.skill_manager.execute_skill(skill_name, query, context))
+        level2 = asyncio.create_task(self._analyze(query, user_id))
+        level1.add_done_callback(track('level1'))
+        level2.add_done_callback(track('level2'))
+
+        try:
+            await asyncio.wait({level1, level2}, return_when=asyncio.FIRST_COMPLETED)
+
+            # La skill local terminó primero con un resultado válido
+            if level1.done() and not level2.done() and self._acceptable(level1.result()):
+                level2.cancel()
+                result = level1.result()
+                result['level'] = 1
+                result['method'] = 'speculative_local'
+                return self._report_speculation(result, intent, confidence, started, finished,
+                                                winner='level1', wasted='level2')
+
+            analysis = await level2
+
+            if analysis.get('skill_required') and analysis.get('skill_name') == skill_name:
+                level2_context = self._level2_context(user_id, analysis)
+                same_action = self.skill_manager.get_speculation_key(skill_name, query, level2_context) == key
+
+                if same_action:
+                    result = await level1
+                    if self._acceptable(result):
+                        result['level'] = 2
+                        result['method'] = 'gemini_reasoning'
+                        result['analysis'] = analysis
+                        return self._report_speculation(result, intent, confidence, started, finished,
+                                                        winner='level2', prefetch=True)
+
+            # Gemini eligió otra cosa: el resultado adelantado no sirve
+            level1.cancel()
+            result = await self._complete_level2(query, user_id, analysis)
+            return self._report_speculation(result, intent, confidence, started, finished,
+                                            winner='level2', wasted='level1')
+        finally:
+            for task in (level1, level2):
+                if not task.done():
+                    task.cancel()
+
+    def _acceptable(self, result: Dict[str, Any]) -> bool:
+        """
+        Un resultado de skill es aceptable si ni la ejecución ni la skill fallaron
+        """
+        inner = result.get('result')
+        return bool(result.get('success')) and not (isinstance(inner, dict) and inner.get('success') is False)
+
+    def _report_speculation(self, result: Dict[str, Any], intent: str, confidence: float,
+                            started: float, finished: Dict[str, float], winner: str,
+                            wasted: Optional[str] = None, prefetch: bool = False) -> Dict[str, Any]:
+        """
+        Añade al resultado el informe de la especulación y actualiza las estadísticas
+
+        saved_ms estima la latencia ahorrada frente al camino secuencial
+        (análisis de Gemini y después la skill).
+        """
+        elapsed = (time.perf_counter() - started) * 1000
+        level1_ms = finished.get('level1')
+        level2_ms = finished.get('level2') if wasted != 'level2' else None
+
+        if level2_ms is not None:
+            self._analysis_ms = level2_ms if self._analysis_ms is None else 0.8 * self._analysis_ms + 0.2 * level2_ms
+
+        if prefetch:
+            # Secuencial: análisis + skill; especulativo: el más lento de los dos
+            saved = min(level1_ms or 0.0, level2_ms or 0.0)
+        elif winner == 'level1':
+            # Gemini se canceló: su latencia se estima con la media observada
+            saved = max(0.0, (self._analysis_ms or 0.0) - elapsed)
+        else:
+            saved = 0.0
+
+        stats = self.speculation_stats
+        stats['races'] += 1
+        stats[f'{winner}_wins'] += 1
+        stats['saved_ms'] = round(stats['saved_ms'] + saved, 1)
+        if prefetch:
+            stats['prefetch_hits'] += 1
+        if wasted:
+            stats[f'wasted_{wasted}'] += 1
+
+        report = {
+            'intent': intent,
+            'confidence': round(confidence, 2),
+            'winner': winner,
+            'prefetch_used': prefetch,
+            'wasted': wasted,
+            'level1_ms': round(level1_ms, 1) if level1_ms is not None else None,
+            'level2_ms': round(level2_ms, 1) if level2_ms is not None else None,
+            'elapsed_ms': round(elapsed, 1),
+            'saved_ms': round(saved, 1)
+        }
+        logger.info(f"Especulación: {report}")
+
+        result['speculation'] = report
+        return result
 
     async def _handle_level2(self, query: str, user_id: str) -> Dict[str, Any]:
         """
         Maneja consultas del Nivel 2 (Gemini para razonamiento)
         """
         try:
-            response = await self.gemini_client.analyze_query(query, user_id)
+            response = await self._analyze(query, user_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 2: {e}")
+            return self._backend_error({'error': str(e)}, 2, 'gemini')
+
+        return await self._complete_level2(query, user_id, response)
+
+    async def _analyze(self, query: str, user_id: str) -> Dict[str, Any]:
+        """
+        Análisis de Gemini, compartido por las consultas idénticas en curso
+
+        El prompt de análisis no incluye datos del usuario, así que la clave
+        es solo la consulta normalizada.
+        """
+        return await deadline.within(
+            self.single_flight.do(
+                ('gemini_analysis', normalize(query).key),
+                lambda: self._analyze_and_log(query, user_id)
+            ),
+            'gemini.analysis'
+        )
+
+    async def _analyze_and_log(self, query: str, user_id: str) -> Dict[str, Any]:
+        """
+        Llamada a Gemini; su decisión se guarda para destilarla en el clasificador local
+        """
+        analysis = await self.gemini_client.analyze_query(query, user_id)
+        self.verdict_log.record(query, analysis)
+        return analysis
+
+    async def _complete_level2(self, query: str, user_id: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Actúa según el análisis de Gemini: ejecutar una skill o responder directamente
+        """
+        try:
+            if response.get('success') is False:
+                return self._backend_error(response, 2, 'gemini')
 
             # Si Gemini identifica que necesita ejecutar una skill
             if response.get('skill_required'):
                 skill_name = response.get('skill_name')
-                structured_data = response.get('structured_data', {})
 
                 if skill_name:
-                    context = {
-                        'user_id': user_id,
-                        'level': 2,
-                        'gemini_analysis': response,
-                        'structured_data': structured_data
-                    }
-
-                    result = self.skill_manager.execute_skill(skill_name, query, context)
+                    context = self._level2_context(user_id, response)
+                    result = await self.skill_manager.execute_skill(skill_name, query, context)
                     result['level'] = 2
                     result['method'] = 'gemini_reasoning'
                     result['analysis'] = response
@@ -127,6 +829,8 @@ class QueryRouter:
                 }
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error en Nivel 2: {e}")
             return {
@@ -135,10 +839,23 @@ class QueryRouter:
                 'level': 2
             }
 
+    def _level2_context(self, user_id: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Contexto de la skill que elige el análisis de Gemini
+        """
+        return {
+            'user_id': user_id,
+            'level': 2,
+            'gemini_analysis': analysis,
+            'structured_data': analysis.get('structured_data', {})
+        }
+
     async def _handle_level3(self, query: str, user_id: str) -> Dict[str, Any]:
         """
         Maneja consultas del Nivel 3 (Perplexity para búsqueda web)
         """
+        logger.info("Nivel 3: Consulta requiere búsqueda web")
+
         try:
             # Verificar presupuesto
             if not self.budget_governor.can_spend():
@@ -149,11 +866,19 @@ class QueryRouter:
                     'budget_exceeded': True
                 }
 
-            response = await self.perplexity_client.search(query, user_id)
+            # Las búsquedas idénticas en curso se hacen y se cobran una sola vez
+            search = await deadline.within(
+                self.single_flight.do(
+                    ('perplexity', normalize(query).key),
+                    lambda: self._search_and_charge(query, user_id)
+                ),
+                'perplexity.search'
+            )
+            response = search['response']
+            estimated_cost = search['cost']
 
-            # Registrar gasto en el presupuesto
-            estimated_cost = self.perplexity_client.estimate_cost(response)
-            self.budget_governor.record_usage(estimated_cost)
+            if not response.get('success'):
+                return self._backend_error(response, 3, 'perplexity')
 
             return {
                 'success': True,
@@ -167,40 +892,161 @@ class QueryRouter:
                 }
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error en Nivel 3: {e}")
-            return {
-                'error': str(e),
-                'success': False,
-                'level': 3
+            return self._backend_error({'error': str(e)}, 3, 'perplexity')
+
+    async def _search_and_charge(self, query: str, user_id: str) -> Dict[str, Any]:
+        """
+        Búsqueda de Perplexity con su registro en el presupuesto
+        """
+        try:
+            response = await self.perplexity_client.search(query, user_id)
+        except asyncio.CancelledError:
+            # Todas las requests que esperaban la búsqueda se cancelaron: se
+            # aborta pero se deja constancia
+            self.budget_governor.record_abandoned({'query': query[:100], 'level': 3})
+            raise
+
+        # Registrar gasto en el presupuesto
+        estimated_cost = self.perplexity_client.estimate_cost(response)
+        self.budget_governor.record_usage(estimated_cost)
+
+        return {
+            'response': response,
+            'cost': estimated_cost
+        }
+
+    def _backend_error(self, response: Dict[str, Any], level: int, backend: str) -> Dict[str, Any]:
+        """
+        Resultado de error de un nivel cuya API externa falló o tiene el circuito abierto
+
+        backend indica a _fall_back() qué API hay que evitar.
+        """
+        return {
+            'error': response.get('error', 'Error desconocido'),
+            'success': False,
+            'level': level,
+            'backend': backend,
+            'circuit_open': bool(response.get('circuit_open'))
+        }
+
+    async def _fall_back(self, query: str, user_id: str, failed: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Alternativas cuando falla la API externa de un nivel
+
+        Perplexity -> respuesta directa de Gemini -> respuesta en caché (aunque
+        haya caducado) -> ayuda local. Con el circuito abierto la API caída ni
+        se intenta, así que la alternativa llega sin esperar a su timeout. Si no
+        queda ninguna, se retorna el error original.
+        """
+        backend = failed['backend']
+        logger.warning(
+            f"{backend} no disponible ({'circuito abierto' if failed.get('circuit_open') else failed.get('error')}), "
+            f"se busca una alternativa"
+        )
+
+        if backend == 'perplexity':
+            direct = await self._gemini_direct(query, user_id)
+            if direct.get('success'):
+                return self._mark_fallback(direct, failed, 'gemini_direct')
+
+        cached = self.response_cache.get_stale(query, user_id)
+        if cached is not None:
+            return self._mark_fallback(cached, failed, 'cache')
+
+        help_result = self._local_help(backend)
+        if help_result is not None:
+            return self._mark_fallback(help_result, failed, 'local_help')
+
+        return failed
+
+    async def _gemini_direct(self, query: str, user_id: str) -> Dict[str, Any]:
+        """
+        Respuesta directa de Gemini sin skills, como alternativa a Perplexity
+        """
+        try:
+            response = await deadline.within(
+                self.single_flight.do(
+                    ('gemini_answer', normalize(query).key),
+                    lambda: self.gemini_client.answer_query(query, user_id)
+                ),
+                'gemini.answer'
+            )
+        except Exception as e:
+            # También DeadlineExceeded: aún quedan la caché y la ayuda local
+            logger.warning(f"Alternativa Gemini no disponible: {e}")
+            return {'error': str(e), 'success': False}
+
+        if not response.get('success'):
+            return response
+
+        return {
+            'success': True,
+            'level': 2,
+            'method': 'gemini_direct',
+            'result': {
+                'response': response.get('response', ''),
+                'type': 'text'
             }
+        }
 
-    def _needs_web_search(self, query: str) -> bool:
+    def _local_help(self, backend: str) -> Optional[Dict[str, Any]]:
         """
-        Determina si una consulta necesita búsqueda web
+        Respuesta local con lo que Nyx puede hacer sin la API caída
         """
-        web_indicators = [
-            'qué es', 'quién es', 'cuál es',
-            'noticias', 'último', 'reciente',
-            'información sobre', 'datos de',
-            'precio de', 'cotización',
-            'weather in', 'clima en',
-            'latest', 'news about'
-        ]
+        try:
+            skills = [
+                skill for skill in self.skill_manager.get_available_skills()
+                if skill['name'] != backend
+            ]
+        except Exception as e:
+            logger.error(f"Error preparando la ayuda local: {e}")
+            return None
 
-        query_lower = query.lower()
+        lines = ['Ahora mismo no puedo consultar mis servicios externos; inténtalo de nuevo en unos minutos.']
+        if skills:
+            lines.append('Mientras tanto puedo ayudarte con:')
+            lines.extend(f"- {skill['name']}: {skill['description']}" for skill in skills)
 
-        return any(indicator in query_lower for indicator in web_indicators)
+        return {
+            'success': True,
+            'level': 1,
+            'method': 'local_help',
+            'result': {
+                'response': '\n'.join(lines),
+                'type': 'help'
+            }
+        }
 
-    def _map_intent_to_skill(self, intent: str) -> Optional[str]:
+    def _mark_fallback(self, result: Dict[str, Any], failed: Dict[str, Any], source: str) -> Dict[str, Any]:
         """
-        Mapea una intención a una skill específica
+        Indica en el resultado que es una alternativa y por qué
         """
-        mapping = {
-            'calendar': 'calendar',
-            'search': None,  # Se maneja en nivel 3
-            'weather': None,  # Se maneja en nivel 3
-            'general': None   # Se maneja en nivel 2
+        self.fallback_stats[source] += 1
+        logger.info(f"Alternativa servida: {source} (en lugar de {failed['backend']})")
+
+        result['fallback'] = {
+            'source': source,
+            'from': failed['backend'],
+            'reason': 'circuit_open' if failed.get('circuit_open') else 'error',
+            'error': failed.get('error')
         }
+        return result
 
-        return mapping.get(intent)
+    def _needs_web_search(self, query: str) -> bool:
+        """
+        Determina si una consulta necesita búsqueda web
+        """
+        return 'web_search' in keywords.matches(query)
+
+    def _map_intent_to_skill(self, intent: str) -> Optional[str]:
+        """
+        Mapea una intención a una skill específica
+
+        El mapa es el parámetro 'intents' del nivel local_skill; las
+        intenciones sin skill (search, weather, general) siguen por Gemini o Perplexity.
+        """
+        return self.tiers.skill_for_intent(intent)
@@ -167,6 +167,81 @@ NODE_ENV=development
 PORT=3000
 HOST=localhost
 
+# Python Bridge
+NYX_BRIDGE_WORKERS=1
+# Puentes de reserva ya inicializados que sustituyen al momento a uno caído
+NYX_BRIDGE_STANDBY=1
+# framed (negociado al arrancar) o ndjson
+NYX_BRIDGE_PROTOCOL=framed
+# Informe de tiempos de importación e inicialización en stderr
+NYX_BRIDGE_PROFILE_STARTUP=false
+# Skills que se cargan al arrancar, separadas por comas ('all': todas); el resto se carga en su primer uso
+NYX_SKILLS_WARMUP=
+# Plazo de cada request al puente (ms); el puente lo reparte entre los niveles
+NYX_BRIDGE_TIMEOUT_MS=30000
+NYX_DEADLINE_MARGIN_MS=250
+NYX_DEADLINE_MIN_LEVEL2_MS=2000
+NYX_DEADLINE_MIN_LEVEL3_MS=6000
+# Carriles del planificador: consultas locales (fast) y APIs externas (slow)
+NYX_BRIDGE_FAST_CONCURRENCY=16
+NYX_BRIDGE_FAST_QUEUE=256
+NYX_BRIDGE_SLOW_CONCURRENCY=16
+NYX_BRIDGE_SLOW_QUEUE=64
+# Lotes de /api/query/batch: tamaño máximo y consultas simultáneas
+NYX_BATCH_MAX_ITEMS=50
+NYX_BATCH_CONCURRENCY=8
+# Enrutado especulativo en la zona gris de confianza del nivel 1
+NYX_SPECULATIVE_ROUTING=false
+NYX_SPECULATION_MIN_CONFIDENCE=0.5
+# Caché de respuestas del router (TTL en segundos por nivel)
+NYX_RESPONSE_CACHE=true
+NYX_RESPONSE_CACHE_SIZE=1000
+NYX_CACHE_TTL_LEVEL1=60
+NYX_CACHE_TTL_LEVEL2=86400
+NYX_CACHE_TTL_LEVEL3=86400
+# Segundos que se conserva una respuesta caducada para servirla si fallan las APIs
+NYX_CACHE_MAX_STALE=86400
+# Política de enrutado: static (reglas fijas) o adaptive (latencia, errores y presupuesto)
+NYX_LEVEL1_CONFIDENCE=0.8
+NYX_ROUTING_POLICY=static
+NYX_POLICY_WINDOW=200
+NYX_POLICY_WINDOW_SECONDS=900
+NYX_POLICY_MAX_P95_MS=10000
+NYX_POLICY_MAX_ERROR_RATE=0.5
+NYX_POLICY_MIN_SAMPLES=5
+NYX_POLICY_BUDGET_TIGHT=75
+# Niveles del router (JSON con orden, coste, latencia y parámetros; vacío: skill local, Gemini y Perplexity)
+NYX_ROUTING_TIERS=
+# Decisiones de enrutado en JSONL para evaluarlas fuera de línea (vacío: no se guardan)
+NYX_ROUTING_DECISION_LOG=
+# Consultas del router con las respuestas de las APIs en JSONL, para reproducirlas con benchmarks/replay.py (vacío: no se graban)
+NYX_TRAFFIC_LOG=
+# Modelo local de intenciones entrenado con bridge/src/intent_model.py (.npz; vacío: solo patrones)
+NYX_INTENT_MODEL=
+# Probabilidad mínima para aceptar la intención del modelo (por debajo de NYX_LEVEL1_CONFIDENCE no se resuelve en el nivel 1)
+NYX_INTENT_MODEL_THRESHOLD=0.6
+# Decisiones de enrutado de Gemini en JSONL, para destilarlas en el modelo local (vacío: no se guardan)
+NYX_VERDICT_LOG=
+# Segundos entre destilaciones automáticas con cambio del modelo en caliente (0: desactivado)
+NYX_DISTILL_INTERVAL=0
+# Confianza mínima de Gemini para usar una decisión como etiqueta
+NYX_DISTILL_MIN_CONFIDENCE=0.7
+# Precisión mínima del nuevo modelo sobre las decisiones reservadas para aceptarlo
+NYX_DISTILL_MIN_PRECISION=0.95
+# Ejemplos etiquetados mínimos para entrenar
+NYX_DISTILL_MIN_EXAMPLES=50
+# JSONL etiquetado a mano que se añade a las decisiones destiladas (opcional; debe cubrir las intenciones del modelo actual que no salgan en las decisiones)
+NYX_DISTILL_BASE=
+# Desglose de tiempos por etapa en todas las respuestas (también por request con "timing": true)
+NYX_TIMING_BREAKDOWN=false
+# Circuit breakers de Gemini y Perplexity: fallos seguidos que lo abren (0: desactivado),
+# segundos abierto antes de probar, llamadas de prueba y llamadas lentas que cuentan como fallo.
+# Por backend: NYX_BREAKER_GEMINI_FAILURES, NYX_BREAKER_PERPLEXITY_RESET_SECONDS, ...
+NYX_BREAKER_FAILURES=5
+NYX_BREAKER_RESET_SECONDS=30
+NYX_BREAKER_HALF_OPEN_CALLS=1
+NYX_BREAKER_SLOW_CALL_MS=20000
+
 # Logging
 LOG_LEVEL=info
 
@@ -425,15 +425,15 @@ def execute(self, query, context):
 ```
 
 ### Nivel 3: Búsqueda Web
-Normalmente las habilidades no son llamadas en Nivel 3, pero pueden usar Perplexity:
+Normalmente las habilidades no son llamadas en Nivel 3, pero pueden usar Perplexity. Los clientes se piden al contenedor de servicios del puente con `get_service`, así todas las skills y el router comparten el mismo cliente y el mismo presupuesto (fuera del puente se crea una instancia propia):
 
 ```python
 from perplexity_client import PerplexityClient
 
 class MiSkill(Skill):
-    def __init__(self, config):
-        super().__init__(config)
-        self.perplexity = PerplexityClient()
+    @property
+    def perplexity(self):
+        return self.get_service('perplexity_client', PerplexityClient)
     
     async def execute(self, query, context):
         # Usar Perplexity para información adicional
@@ -639,7 +639,10 @@ http://localhost:3000
 |--------|----------|-------------|
 | GET | `/health` | Estado del servidor |
 | POST | `/api/query` | Enviar consulta a Nyx |
+| POST | `/api/query/batch` | Enviar varias consultas en una sola request |
+| GET/POST | `/api/query/stream` | Enviar consulta y recibir la respuesta en streaming (SSE) |
 | GET | `/api/skills` | Listar habilidades disponibles |
+| GET | `/api/stats` | Métricas del puente (caché de respuestas, carriles) |
 
 ## 🔍 Ejemplos de Uso
 
@@ -788,6 +791,233 @@ curl http://localhost:3000/api/skills
 }
 ```
 
+El puente solo lee los `skill.json` al arrancar, así que la lista no carga ninguna skill. El `main.py` de cada una se importa y se instancia (con el OAuth de Google en el caso del calendario) la primera vez que se ejecuta, en un hilo, y las consultas que llegan mientras tanto esperan a esa misma carga. `NYX_SKILLS_WARMUP=calendar` (o `all`) carga al arrancar las skills cuya primera consulta no debe pagar ese coste. El enrutado especulativo nunca espera a una carga: si la skill aún no está cargada, la consulta va directamente a Gemini y la carga empieza en segundo plano para las siguientes. `/api/stats` muestra en `skills` las descubiertas y las cargadas.
+
+### 7. Lote de Consultas
+
+Varias consultas en una sola request (máximo 50). Se ejecutan a la vez, las idénticas se procesan una sola vez y `results` conserva el orden de entrada. Cada elemento puede ser un texto o un objeto con `message` y `userId`.
+
+```bash
+curl -X POST http://localhost:3000/api/query/batch \\
+  -H "Content-Type: application/json" \\
+  -d '{"queries": ["¿Qué eventos tengo hoy?", "Busca noticias sobre tecnología", "¿Qué eventos tengo hoy?"], "userId": "user123"}'
+```
+
+**Respuesta:**
+```json
+{
+  "success": true,
+  "data": {
+    "results": [
+      {"success": true, "level": 1, "method": "local_classification", "skill": "calendar", "result": {"...": "..."}},
+      {"success": true, "level": 3, "method": "perplexity_search", "result": {"...": "..."}},
+      {"success": true, "level": 1, "method": "local_classification", "skill": "calendar", "result": {"...": "..."}}
+    ],
+    "count": 3,
+    "unique": 2
+  }
+}
+```
+
+### 8. Consulta en Streaming (SSE)
+
+La respuesta se envía como Server-Sent Events según se genera: un evento `chunk` por fragmento de texto y un evento final `done` con la misma respuesta que `/api/query` (o `error` si falla).
+
+El nivel se elige igual que en `/api/query`: en el nivel 2 decide el mismo análisis de Gemini, así que su respuesta directa llega en un solo fragmento; las skills con streaming y las búsquedas de Perplexity se emiten según se generan.
+
+```bash
+curl -N -X POST http://localhost:3000/api/query/stream \\
+  -H "Content-Type: application/json" \\
+  -d '{"message": "Últimas noticias sobre computación cuántica"}'
+```
+
+**Respuesta:**
+```
+event: chunk
+data: {"text":"Esta semana se ha presentado "}
+
+event: chunk
+data: {"text":"un procesador de 1.000 qubits..."}
+
+event: done
+data: {"success":true,"data":{"success":true,"level":3,"method":"perplexity_search","result":{"response":"Esta semana se ha presentado un procesador de 1.000 qubits...","sources":["https://..."],"type":"search_result","cost":0.005}},"requestId":1705312800000.123}
+```
+
+Desde el navegador se puede usar `EventSource` con la variante GET:
+
+```javascript
+const source = new EventSource('/api/query/stream?message=' + encodeURIComponent('¿Qué es Nyx?'));
+source.addEventListener('chunk', (e) => console.log(JSON.parse(e.data).text));
+source.addEventListener('done', () => source.close());
+source.addEventListener('error', () => source.close());
+```
+
+### 9. Caché de Respuestas
+
+Las consultas repetidas se responden desde una caché del puente, sin volver a llamar a Gemini ni a Perplexity ni consumir presupuesto. La clave es la consulta normalizada (minúsculas, sin tildes ni signos de puntuación) y el usuario; las respuestas de Gemini directo y Perplexity se comparten entre usuarios, las que pasan por una skill no. La vigencia depende del nivel (nivel 1: 60 s) y de la categoría (noticias: 10 min, precios: 1 min, clima: 15 min, definiciones y biografías: 1 día, resto: 1 h). Crear un evento invalida lo guardado para ese usuario.
+
+Una respuesta de la caché lleva el campo `cache`:
+
+```json
+{
+  "success": true,
+  "level": 3,
+  "method": "perplexity_search",
+  "result": {"...": "..."},
+  "cache": {"hit": true, "scope": "shared", "category": "news", "age_s": 42.3, "ttl_s": 557.7}
+}
+```
+
+Para forzar una respuesta nueva se envía `noCache` (en el cuerpo, o `?noCache=true` en la variante GET de streaming). El resultado nuevo reemplaza al guardado:
+
+```bash
+curl -X POST http://localhost:3000/api/query \\
+  -H "Content-Type: application/json" \\
+  -d '{"message": "Noticias sobre IA", "noCache": true}'
+```
+
+Si varias consultas idénticas llegan a la vez antes de que haya nada en caché, el análisis de Gemini y la búsqueda de Perplexity se hacen una sola vez y se cobran una sola vez; cada request recibe su propia copia del resultado.
+
+Las métricas (aciertos, fallos, expulsiones y llamadas agrupadas en `single_flight`) se consultan en `/api/stats`. Cada proceso del puente tiene su propia caché, y la respuesta corresponde al proceso que atendió la request:
+
+```bash
+curl http://localhost:3000/api/stats
+```
+
+### 10. Política de Enrutado
+
+Las reglas fijas (confianza del clasificador ≥ `NYX_LEVEL1_CONFIDENCE`, palabras clave de búsqueda web) proponen un nivel y la política configurada en `NYX_ROUTING_POLICY` decide el definitivo:
+
+- `static` (por defecto): siempre el nivel propuesto.
+- `adaptive`: responde con Gemini en lugar de Perplexity si el presupuesto está agotado, si supera `NYX_POLICY_BUDGET_TIGHT` % y la consulta no es de noticias, precios o clima, o si el p95 o la tasa de error recientes de Perplexity superan los umbrales mientras Gemini está sano.
+
+El campo `routing` de `/api/stats` muestra la latencia (p50/p95), la tasa de error y el coste medio de cada nivel, en total y por intención, y las últimas decisiones. Con `NYX_ROUTING_DECISION_LOG` cada decisión se guarda en JSONL junto con su resultado, para comparar políticas fuera de línea:
+
+```json
+{"timestamp": "2024-01-15T10:30:00", "query": "¿Qué es la fotosíntesis?", "intent": "general", "confidence": 0.3, "proposed": 3, "level": 2, "policy": "adaptive", "reason": "budget_tight", "budget_used": 81.4, "served_level": 2, "latency_ms": 1834.2, "success": true, "cost": 0.0}
+```
+
+#### Normalización de consultas
+
+El puente normaliza cada consulta una sola vez al recibirla (`clients/normalization.py`, etapa `normalize` del desglose de tiempos): forma NFKC, minúsculas, forma sin tildes, palabras, idioma detectado (`es`, `en` o ninguno) y un hash del contenido. El carril, el clasificador, las reglas de búsqueda web, los triggers de las skills, las categorías de la caché y las skills reutilizan ese resultado en lugar de repetir `lower()`, y todos comparan sin tildes: "reunion manana" se clasifica igual que "reunión mañana", y un trigger `próximos` acepta "proximos".
+
+Las listas de palabras clave (triggers de `skill.json`, indicadores de búsqueda web, categorías de la caché y palabras de las skills) se registran en `clients/keyword_matcher.py`, que las reúne en un único autómata de Aho-Corasick: cada consulta se recorre una sola vez, con un coste que no depende del número de triggers, y todas las etapas de la request comparten las coincidencias. El autómata se reconstruye cuando cambian las skills; `/api/stats` muestra en `keywords` cuántas listas y palabras tiene y cuántas veces se ha construido. `python benchmarks/bench_keywords.py` lo compara con el recorrido lineal con miles de triggers.
+
+#### Modelo local de intenciones
+
+Los patrones del clasificador solo cubren unas pocas formulaciones; el resto de consultas acaba en Gemini. `bridge/src/intent_model.py` entrena un clasificador lineal (regresión logística sobre n-gramas de palabras y caracteres con hashing, en NumPy) a partir de un JSONL etiquetado:
+
+```json
+{"query": "¿tengo algo libre el martes?", "intent": "calendar"}
+{"query": "explícame la relatividad", "intent": "none"}
+```
+
+```bash
+cd bridge
+python src/intent_model.py train ../data/intents.jsonl -o ../data/intent_model.npz
+python src/intent_model.py evaluate ../data/intent_model.npz ../data/intents_test.jsonl
+python src/intent_model.py predict ../data/intent_model.npz "¿tengo hueco el jueves?"
+```
+
+Con `NYX_INTENT_MODEL=data/intent_model.npz` (y `numpy` instalado), las consultas que los patrones no clasifican pasan por el modelo, y su intención se acepta si la probabilidad llega a `NYX_INTENT_MODEL_THRESHOLD`; la probabilidad es la confianza que ven las reglas de nivel 1. Los lotes (`/api/query/batch`) se puntúan con una sola operación de matrices. `evaluate` indica en `covered` qué fracción de las consultas con intención aceptaría el modelo, y `/api/stats` muestra en `intents` cuántas clasificaron los patrones, cuántas el modelo y cuántas quedaron sin clasificar.
+
+#### Destilación de las decisiones de Gemini
+
+Cada consulta que llega a Gemini deja una decisión de enrutado que luego se pierde. Con `NYX_VERDICT_LOG=data/verdicts.jsonl` el router la guarda junto a la consulta (solo las llamadas reales, no las servidas desde caché):
+
+```json
+{"ts": "2024-01-15T10:30:00", "query": "¿tengo hueco el jueves?", "skill_required": true, "skill_name": "calendar", "confidence": 0.92, "type": "skill"}
+```
+
+`bridge/src/distillation.py` convierte esas decisiones en ejemplos del modelo local: la skill elegida se traduce a la intención del nivel local que la atiende, las decisiones sin skill son `none`, y las de confianza menor que `NYX_DISTILL_MIN_CONFIDENCE` o con votos empatados para la misma consulta se descartan. El modelo entrenado se compara con el actual sobre un 20 % de decisiones reservadas, y solo se acepta si acierta la skill en al menos `NYX_DISTILL_MIN_PRECISION` de las que resolvería en local y resuelve más que el actual:
+
+```bash
+cd bridge
+python src/distillation.py report ../data/verdicts.jsonl
+python src/distillation.py train ../data/verdicts.jsonl -o ../data/intent_model.npz --base ../data/intents.jsonl
+```
+
+`report` indica qué fracción de las decisiones guardadas resolvería ya el clasificador en el nivel 1 y con qué precisión; `train` añade la proyección con el nuevo modelo y el motivo si no se acepta (`--force` lo guarda igualmente). Un modelo nuevo que perdería intenciones del actual no se acepta (`missing_labels`): hay que añadir ejemplos suyos con `--base` o `NYX_DISTILL_BASE`. Con `NYX_DISTILL_INTERVAL` el puente repite la destilación en segundo plano cuando el fichero crece, guarda el modelo aceptado en `NYX_INTENT_MODEL` (o `data/intent_model.npz`) y lo cambia en caliente; `/api/stats` muestra en `distillation` las decisiones guardadas y el último informe.
+
+#### Niveles configurables
+
+Cada nivel del router es un *tier* con un coste por consulta, una latencia esperada y un predicado `can_handle`. El router prueba los que pueden atender la consulta de menor a mayor coste (y latencia) y se queda con la primera respuesta; un nivel sin respuesta segura deja pasar la consulta al siguiente. `NYX_ROUTING_TIERS` apunta a un JSON con la lista; sin él se usan estos tres:
+
+```json
+{
+  "tiers": [
+    {"type": "local_skill", "cost": 0.0, "latency_ms": 50, "intents": {"calendar": "calendar"}},
+    {"type": "knowledge_base", "name": "faq", "cost": 0.0, "latency_ms": 1, "path": "data/faq.json"},
+    {"type": "gemini", "cost": 0.0005, "latency_ms": 1500},
+    {"type": "perplexity", "cost": 0.005, "latency_ms": 3000}
+  ]
+}
+```
+
+- `local_skill`: la skill de la intención detectada con alta confianza (`intents` mapea intención → skill).
+- `knowledge_base`: respuestas fijas de un JSON `{"pregunta": "respuesta"}`; solo responde si la consulta normalizada está en el fichero.
+- `gemini` y `perplexity`: los niveles 2 y 3.
+- Cualquier otro tipo se registra con `tiers.register_tier()` o se indica como `"paquete.modulo:Clase"` (una subclase de `RoutingTier`). `"enabled": false` desactiva una entrada.
+
+`/api/stats` muestra en `tiers` el orden efectivo y cuántas consultas intentó, respondió y dejó pasar cada nivel.
+
+### 11. Desglose de Tiempos
+
+Con `"timing": true` (o `?timing=true` en la variante GET de streaming, o `NYX_TIMING_BREAKDOWN=true` para todas las requests) la respuesta incluye cuánto tardó cada etapa en el puente:
+
+```bash
+curl -X POST http://localhost:3000/api/query \\
+  -H "Content-Type: application/json" \\
+  -d '{"message": "¿Qué es la fotosíntesis?", "timing": true}'
+```
+
+```json
+{
+  "success": true,
+  "data": {"...": "..."},
+  "timing": {
+    "total_ms": 2143.7,
+    "stages": {"select_lane": 0.4, "queue": 0.1, "classify": 0.3, "policy": 0.1, "init.perplexity_client": 38.2, "perplexity.api": 2087.5, "budget.save": 1.9}
+  }
+}
+```
+
+Etapas: `normalize`, `select_lane`, `queue` (espera en el carril), `classify`, `policy`, `init.<servicio>` (creación de un cliente en su primer uso), `skill.load` (carga de una skill en su primer uso), `skill.lock_wait`, `skill.<nombre>`, `gemini.api`, `gemini.parse`, `perplexity.api` y `budget.save`. Si una etapa se repite en la request (p. ej. en un lote) se suman sus duraciones. `/api/stats` incluye en `timing` un histograma por etapa de todas las requests del proceso.
+
+### 12. Circuit Breakers y Alternativas
+
+Gemini y Perplexity tienen cada uno un circuit breaker. Tras `NYX_BREAKER_FAILURES` fallos seguidos (errores, timeouts o llamadas más lentas que `NYX_BREAKER_SLOW_CALL_MS`) el circuito se abre y las llamadas a esa API se rechazan al momento durante `NYX_BREAKER_RESET_SECONDS`; después pasa una llamada de prueba que lo cierra si sale bien.
+
+Mientras una API falla o tiene el circuito abierto, el router responde con la primera alternativa disponible: Perplexity → respuesta directa de Gemini → respuesta en caché (aunque haya caducado, hasta `NYX_CACHE_MAX_STALE` segundos) → ayuda local con las habilidades disponibles. La respuesta lo indica en `fallback` y no se guarda en la caché:
+
+```json
+{
+  "success": true,
+  "level": 2,
+  "method": "gemini_direct",
+  "result": {"response": "...", "type": "text"},
+  "fallback": {"source": "gemini_direct", "from": "perplexity", "reason": "circuit_open", "error": "perplexity no disponible temporalmente (circuito abierto)"}
+}
+```
+
+`/api/stats` incluye el estado de cada circuito en `circuit_breakers` y las respuestas servidas por cada alternativa en `fallbacks`.
+
+### 13. Grabación y Reproducción de Tráfico
+
+Con `NYX_TRAFFIC_LOG` cada consulta del router se añade como una línea JSONL con la decisión de enrutado, el resultado (nivel, método, coste, alternativa), la latencia con su desglose por etapas y las respuestas de Gemini, Perplexity y las skills que hicieron falta. `bridge/benchmarks/replay.py` vuelve a pasar ese tráfico por el router con las respuestas grabadas en lugar de las APIs, así que dos versiones del código (otra política, otros niveles, otras reglas) se comparan con las mismas consultas sin gastar presupuesto:
+
+```bash
+cd bridge
+python benchmarks/replay.py run ../data/traffic.jsonl -o antes.json
+git checkout mi-rama
+python benchmarks/replay.py run ../data/traffic.jsonl -o despues.json
+python benchmarks/replay.py compare antes.json despues.json
+```
+
+La latencia de cada consulta reproducida es el tiempo local del router más la latencia grabada de las APIs que usa, y el presupuesto se fija al porcentaje que había al grabarla. `compare` muestra cuántas consultas cambian de nivel o método (`L3 perplexity_search -> L2 gemini_direct`), la latencia media, p50, p95 y p99, la tasa de éxito y el gasto proyectado de cada versión. Si la versión nueva llama a una API con una consulta que no está grabada se usa una respuesta genérica con la latencia y el consumo medianos, y el informe lo cuenta en `unrecorded_calls`. La propia grabación también se puede comparar con un informe (`compare ../data/traffic.jsonl despues.json`).
+
+`/api/stats` indica en `traffic` si la grabación está activa y cuántas consultas lleva.
+
 ## 🐍 Ejemplos en Python
 
 ### Cliente Python Simple
@@ -860,15 +1090,15 @@ class AsyncNyxClient:
         async with session.post(url, json=payload) as response:
             return await response.json()
     
-    async def multiple_queries(self, queries):
-        """Envía múltiples consultas en paralelo"""
+    async def multiple_queries(self, queries, user_id="anonymous"):
+        """Envía múltiples consultas en una sola request de lote"""
+        url = f"{self.base_url}/api/query/batch"
+        payload = {"queries": queries, "userId": user_id}
+        
         async with aiohttp.ClientSession() as session:
-            tasks = [
-                self.query(session, query) 
-                for query in queries
-            ]
-            results = await asyncio.gather(*tasks)
-            return results
+            async with session.post(url, json=payload) as response:
+                data = await response.json()
+                return data["data"]["results"]
 
 # Uso
 async def main():
@@ -1077,6 +1307,31 @@ main();
 }
 ```
 
+Cuando el puente Python está saturado responde con HTTP `503` y la cabecera `Retry-After` (en segundos). Las consultas locales (nivel 1) y las que dependen de Gemini o Perplexity tienen colas separadas, así que una ráfaga de consultas lentas no bloquea las rápidas.
+
+```json
+// HTTP 503, Retry-After: 4
+{
+  "success": false,
+  "error": "Bridge saturado, reintentar más tarde",
+  "overloaded": true,
+  "lane": "slow",
+  "retry_after": 3.2
+}
+```
+
+Cada request tiene un plazo (`NYX_BRIDGE_TIMEOUT_MS`, 30 s por defecto) que el puente reparte entre los niveles: si no queda tiempo para Perplexity responde con Gemini, y si ya no queda ni para Gemini la consulta falla de inmediato con `deadline_exceeded` en lugar de esperar al timeout. Las llamadas a Gemini y Perplexity, también en streaming, tienen como timeout lo que queda del plazo. Si el plazo se agota, ya sea en la cola o durante el enrutado, la respuesta es HTTP `504` (en `/api/query/stream`, si aún no se ha emitido ningún fragmento):
+
+```json
+// HTTP 504
+{
+  "success": false,
+  "error": "Plazo de la request agotado en queue",
+  "deadline_exceeded": true,
+  "stage": "queue"
+}
+```
+
 ### Manejo de Errores en Cliente
 
 ```python
@@ -237,6 +237,9 @@ package_json = {
         "winston": "^3.11.0",
         "express-rate-limit": "^7.1.5"
     },
+    "optionalDependencies": {
+        "@msgpack/msgpack": "^3.0.0"
+    },
     "devDependencies": {
         "nodemon": "^3.0.2",
         "jest": "^29.7.0",
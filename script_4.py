@@ -35,7 +35,7 @@ const cors = require('cors');
 const helmet = require('helmet');
 const winston = require('winston');
 const rateLimit = require('express-rate-limit');
-const { spawn } = require('child_process');
+const { BridgePool } = require('./bridgePool');
 require('dotenv').config();
 
 // Configuración de logging
@@ -60,8 +60,15 @@ class NyxServer {
     this.app = express();
     this.port = process.env.PORT || 3000;
     this.host = process.env.HOST || 'localhost';
-    this.pythonBridge = null;
-    this.pendingRequests = new Map();
+    this.bridgePool = new BridgePool({
+      size: parseInt(process.env.NYX_BRIDGE_WORKERS || '1', 10),
+      standby: parseInt(process.env.NYX_BRIDGE_STANDBY || '1', 10),
+      args: process.env.NYX_BRIDGE_PROFILE_STARTUP === 'true'
+        ? ['../bridge/main.py', '--profile-startup']
+        : ['../bridge/main.py'],
+      protocol: process.env.NYX_BRIDGE_PROTOCOL || 'framed',
+      logger
+    });
     
     this.setupMiddleware();
     this.setupRoutes();
@@ -99,13 +106,14 @@ class NyxServer {
         status: 'healthy', 
         timestamp: new Date().toISOString(),
         uptime: process.uptime(),
-        bridge: this.pythonBridge ? 'connected' : 'disconnected'
+        bridge: this.bridgePool.available ? 'connected' : 'disconnected',
+        workers: this.bridgePool.status()
       });
     });
 
     this.app.post('/api/query', async (req, res) => {
       try {
-        const { message, userId } = req.body;
+        const { message, userId, noCache, timing } = req.body;
         
         if (!message) {
           return res.status(400).json({ error: 'Mensaje requerido' });
@@ -117,28 +125,154 @@ class NyxServer {
           type: 'query',
           message,
           userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
           timestamp: new Date().toISOString()
-        });
+        }, { signal: this.abortOnDisconnect(res) });
 
-        res.json(response);
+        this.sendBridgeResponse(res, response);
       } catch (error) {
+        if (res.destroyed) {
+          logger.info('Cliente desconectado, query cancelada');
+          return;
+        }
         logger.error('Error procesando query:', error);
         res.status(500).json({ error: 'Error interno del servidor' });
       }
     });
 
+    // Varias consultas en una sola request: el puente las ejecuta a la vez,
+    // deduplica las idénticas y devuelve un resultado por elemento
+    this.app.post('/api/query/batch', async (req, res) => {
+      try {
+        const { queries, userId, noCache, timing } = req.body;
+        const maxItems = parseInt(process.env.NYX_BATCH_MAX_ITEMS || '50', 10);
+
+        if (!Array.isArray(queries) || queries.length === 0) {
+          return res.status(400).json({ error: 'Se requiere una lista de consultas' });
+        }
+        if (queries.length > maxItems) {
+          return res.status(400).json({ error: `Máximo ${maxItems} consultas por lote` });
+        }
+
+        const items = queries.map(item => (typeof item === 'string' ? { message: item } : item));
+        if (items.some(item => !item || typeof item.message !== 'string' || !item.message)) {
+          return res.status(400).json({ error: 'Cada consulta requiere un mensaje' });
+        }
+
+        logger.info(`Lote de ${items.length} consultas recibido`);
+
+        const response = await this.sendToPythonBridge({
+          type: 'batch_query',
+          queries: items.map(item => ({ message: item.message, userId: item.userId })),
+          userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
+          timestamp: new Date().toISOString()
+        }, { signal: this.abortOnDisconnect(res) });
+
+        this.sendBridgeResponse(res, response);
+      } catch (error) {
+        if (res.destroyed) {
+          logger.info('Cliente desconectado, lote cancelado');
+          return;
+        }
+        logger.error('Error procesando lote:', error);
+        res.status(500).json({ error: 'Error interno del servidor' });
+      }
+    });
+
+    // Respuesta incremental con Server-Sent Events. GET admite EventSource
+    // (?message=...&userId=...); POST recibe el mismo cuerpo que /api/query.
+    const streamQuery = async (req, res) => {
+      const params = req.method === 'GET' ? req.query : req.body;
+      const { message, userId, noCache, timing } = params || {};
+
+      if (!message) {
+        return res.status(400).json({ error: 'Mensaje requerido' });
+      }
+
+      logger.info(`Query (streaming) recibida: ${message}`);
+
+      // Las cabeceras SSE se envían con el primer evento, para poder responder
+      // con un código HTTP normal si el puente rechaza la consulta
+      let started = false;
+      const signal = this.abortOnDisconnect(res);
+
+      const sendEvent = (event, data) => {
+        if (signal.aborted) {
+          return;
+        }
+        if (!started) {
+          started = true;
+          res.set({
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+          });
+          res.flushHeaders();
+        }
+        res.write(`event: ${event}\\ndata: ${JSON.stringify(data)}\\n\\n`);
+      };
+
+      try {
+        const response = await this.bridgePool.stream({
+          type: 'query_stream',
+          message,
+          userId: userId || 'anonymous',
+          noCache: this.isFlag(noCache),
+          timing: this.isFlag(timing),
+          timestamp: new Date().toISOString()
+        }, (chunk) => sendEvent('chunk', chunk), { signal });
+
+        if ((response.overloaded || response.deadline_exceeded) && !started) {
+          return this.sendBridgeResponse(res, response);
+        }
+        sendEvent(response.success ? 'done' : 'error', response);
+      } catch (error) {
+        if (signal.aborted) {
+          logger.info('Cliente desconectado, query (streaming) cancelada');
+          return;
+        }
+        logger.error('Error procesando query (streaming):', error);
+        if (!started) {
+          return res.status(500).json({ error: 'Error interno del servidor' });
+        }
+        sendEvent('error', { error: 'Error interno del servidor' });
+      }
+
+      res.end();
+    };
+
+    this.app.get('/api/query/stream', streamQuery);
+    this.app.post('/api/query/stream', streamQuery);
+
     this.app.get('/api/skills', async (req, res) => {
       try {
         const response = await this.sendToPythonBridge({
           type: 'list_skills'
         });
-        res.json(response);
+        this.sendBridgeResponse(res, response);
       } catch (error) {
         logger.error('Error obteniendo skills:', error);
         res.status(500).json({ error: 'Error obteniendo habilidades' });
       }
     });
 
+    // Métricas del proceso del puente que atiende la request (caché, carriles)
+    this.app.get('/api/stats', async (req, res) => {
+      try {
+        const response = await this.sendToPythonBridge({
+          type: 'stats'
+        });
+        this.sendBridgeResponse(res, response);
+      } catch (error) {
+        logger.error('Error obteniendo métricas:', error);
+        res.status(500).json({ error: 'Error obteniendo métricas' });
+      }
+    });
+
     this.app.use(express.static('public'));
     
     this.app.use('*', (req, res) => {
@@ -147,99 +281,804 @@ class NyxServer {
   }
 
   startPythonBridge() {
-    logger.info('Iniciando puente Python...');
-    
-    this.pythonBridge = spawn('python', ['../bridge/main.py'], {
+    logger.info(`Iniciando pool de ${this.bridgePool.size} puente(s) Python...`);
+    this.bridgePool.start();
+  }
+
+  async sendToPythonBridge(data, options) {
+    return this.bridgePool.send(data, options);
+  }
+
+  // Opciones booleanas (noCache, timing): llegan como booleano en JSON o como
+  // texto en la query string (SSE)
+  isFlag(value) {
+    return value === true || value === 'true' || value === '1';
+  }
+
+  // Señal que se aborta si el cliente cierra la conexión antes de la respuesta,
+  // para que el puente cancele el trabajo pendiente
+  abortOnDisconnect(res) {
+    const controller = new AbortController();
+    res.on('close', () => {
+      if (!res.writableFinished) {
+        controller.abort();
+      }
+    });
+    return controller.signal;
+  }
+
+  // Un puente saturado responde 'overloaded' con una estimación en segundos
+  sendBridgeResponse(res, response) {
+    if (response.overloaded) {
+      logger.warn(`Python bridge saturado (carril ${response.lane}), reintentar en ${response.retry_after}s`);
+      res.set('Retry-After', String(Math.ceil(response.retry_after || 1)));
+      return res.status(503).json(response);
+    }
+    if (response.deadline_exceeded) {
+      logger.warn(`Python bridge sin tiempo para la request (${response.stage})`);
+      return res.status(504).json(response);
+    }
+    return res.json(response);
+  }
+
+  start() {
+    this.app.listen(this.port, this.host, () => {
+      logger.info(`🚀 Nyx Server iniciado en http://${this.host}:${this.port}`);
+      logger.info(`Ambiente: ${process.env.NODE_ENV || 'development'}`);
+    });
+
+    process.on('SIGINT', () => {
+      logger.info('Cerrando servidor...');
+      this.bridgePool.stop();
+      process.exit(0);
+    });
+  }
+}
+
+const server = new NyxServer();
+server.start();
+
+module.exports = NyxServer;
+"""
+
+with open('nyx/server/src/index.js', 'w') as f:
+    f.write(server_index)
+
+print("✅ Servidor Node.js principal creado")
+
+# Pool de procesos del puente Python
+bridge_pool = """const { spawn } = require('child_process');
+const bridgeProtocol = require('./bridgeProtocol');
+
+// Tiempo máximo de espera de una respuesta del puente
+const REQUEST_TIMEOUT_MS = parseInt(process.env.NYX_BRIDGE_TIMEOUT_MS || '30000', 10);
+
+// Requests sin efectos secundarios que se pueden repetir en otro worker si el
+// suyo se cae; el resto se rechaza al momento
+const REPLAYABLE_TYPES = new Set(['list_skills']);
+
+class BridgeWorker {
+  constructor(id, options) {
+    this.id = id;
+    this.command = options.command;
+    this.args = options.args;
+    this.logger = options.logger;
+    this.onExit = options.onExit;
+    this.role = options.role || 'active';
+    this.negotiate = options.protocol !== 'ndjson';
+    this.process = null;
+    this.ready = false;
+    this.pendingRequests = new Map();
+    this.restarts = 0;
+  }
+
+  start() {
+    this.logger.info(`Iniciando puente Python #${this.id}...`);
+
+    this.process = spawn(this.command, this.args, {
       stdio: ['pipe', 'pipe', 'pipe']
     });
 
-    let buffer = '';
-    
-    this.pythonBridge.stdout.on('data', (data) => {
-      buffer += data.toString();
-      const lines = buffer.split('\\n');
-      buffer = lines.pop() || '';
-      
-      lines.forEach(line => {
-        if (line.trim()) {
-          try {
-            const response = JSON.parse(line);
-            this.handlePythonResponse(response);
-          } catch (error) {
-            logger.error('Error parsing Python response:', error);
+    // Hasta completar el handshake todo va en ndjson y los envíos se encolan
+    this.ready = false;
+    this.protocol = 'ndjson';
+    this.decoder = bridgeProtocol.createDecoder('ndjson');
+    this.handshaking = this.negotiate;
+    this.outbox = [];
+
+    if (this.negotiate) {
+      this.process.stdin.write(bridgeProtocol.encode('ndjson', {
+        type: 'hello',
+        protocols: bridgeProtocol.supportedProtocols()
+      }));
+    }
+
+    this.process.stdout.on('data', (data) => {
+      this.decoder.push(data);
+
+      while (true) {
+        let message;
+        try {
+          message = this.decoder.next();
+        } catch (error) {
+          this.logger.error(`Error parsing Python response (#${this.id}):`, error);
+          if (error.fatal) {
+            this.kill();
+            break;
           }
+          continue;
         }
-      });
+
+        if (message === undefined) {
+          break;
+        }
+        this.handleMessage(message);
+      }
     });
 
-    this.pythonBridge.stderr.on('data', (data) => {
-      logger.error(`Python bridge error: ${data}`);
+    this.process.stderr.on('data', (data) => {
+      this.logger.error(`Python bridge #${this.id} error: ${data}`);
     });
 
-    this.pythonBridge.on('close', (code) => {
-      logger.warn(`Python bridge cerrado con código ${code}`);
-      setTimeout(() => this.startPythonBridge(), 5000);
+    this.process.on('close', (code) => {
+      this.logger.warn(`Python bridge #${this.id} cerrado con código ${code}`);
+      this.process = null;
+      this.ready = false;
+      this.onExit(this, this.takePending());
     });
   }
 
-  async sendToPythonBridge(data) {
+  get alive() {
+    return this.process !== null;
+  }
+
+  // options.onChunk recibe los fragmentos parciales de una consulta en streaming.
+  // options.signal (AbortSignal) cancela la request también en el puente.
+  send(data, options = {}) {
     return new Promise((resolve, reject) => {
-      if (!this.pythonBridge) {
+      if (!this.process) {
         reject(new Error('Python bridge no disponible'));
         return;
       }
+      if (options.signal && options.signal.aborted) {
+        reject(new Error('Request cancelada por el cliente'));
+        return;
+      }
 
       const requestId = Date.now() + Math.random();
       data.requestId = requestId;
 
-      const request = JSON.stringify(data) + '\\n';
-      this.pythonBridge.stdin.write(request);
+      // Plazo de la request: el puente reparte este tiempo entre los niveles y
+      // abandona lo que ya no llegaría. En streaming el timeout se reinicia con
+      // cada fragmento, así que no hay un plazo fijo que enviar.
+      if (!options.onChunk) {
+        data.timeoutMs = REQUEST_TIMEOUT_MS;
+      }
+
+      this.write(data);
 
-      const timeout = setTimeout(() => {
-        this.pendingRequests.delete(requestId);
-        reject(new Error('Timeout esperando respuesta de Python bridge'));
-      }, 30000);
+      const pending = { data, options, resolve, reject, onChunk: options.onChunk };
+      pending.timeout = this.startTimeout(requestId);
+      this.pendingRequests.set(requestId, pending);
 
-      this.pendingRequests.set(requestId, { resolve, reject, timeout });
+      if (options.signal) {
+        const onAbort = () => this.cancel(requestId, new Error('Request cancelada por el cliente'));
+        options.signal.addEventListener('abort', onAbort, { once: true });
+        pending.cleanup = () => options.signal.removeEventListener('abort', onAbort);
+      }
     });
   }
 
-  handlePythonResponse(response) {
-    if (response.requestId && this.pendingRequests.has(response.requestId)) {
-      const { resolve, timeout } = this.pendingRequests.get(response.requestId);
-      clearTimeout(timeout);
-      this.pendingRequests.delete(response.requestId);
-      resolve(response);
+  startTimeout(requestId) {
+    return setTimeout(() => {
+      this.cancel(requestId, new Error('Timeout esperando respuesta de Python bridge'));
+    }, REQUEST_TIMEOUT_MS);
+  }
+
+  // Descarta una request pendiente y avisa al puente para que deje de procesarla
+  cancel(requestId, error) {
+    const pending = this.settle(requestId);
+    if (!pending) {
+      return;
+    }
+
+    if (this.handshaking) {
+      // Aún no se ha enviado: basta con quitarla de la cola
+      this.outbox = this.outbox.filter(message => message.requestId !== requestId);
+    } else if (this.process) {
+      this.write({ type: 'cancel', requestId });
+    }
+    pending.reject(error);
+  }
+
+  // Saca una request de las pendientes y libera su timeout y su listener
+  settle(requestId) {
+    const pending = this.pendingRequests.get(requestId);
+    if (!pending) {
+      return null;
+    }
+
+    clearTimeout(pending.timeout);
+    if (pending.cleanup) {
+      pending.cleanup();
+    }
+    this.pendingRequests.delete(requestId);
+    return pending;
+  }
+
+  write(message) {
+    if (this.handshaking) {
+      this.outbox.push(message);
+      return;
+    }
+    this.process.stdin.write(bridgeProtocol.encode(this.protocol, message));
+  }
+
+  handleMessage(message) {
+    if (message.type === 'ready') {
+      // El puente terminó de inicializar QueryRouter y las skills
+      this.ready = true;
+      this.logger.info(`Python bridge #${this.id} listo (pid ${message.pid})`);
+      return;
+    }
+
+    if (this.handshaking) {
+      if (message.type === 'hello') {
+        this.switchProtocol(message.protocol);
+        return;
+      }
+      if (!message.requestId) {
+        // Un puente antiguo responde al hello con un error: seguir en ndjson
+        this.switchProtocol('ndjson');
+        return;
+      }
+    }
+
+    this.handleResponse(message);
+  }
+
+  switchProtocol(name) {
+    this.protocol = name;
+    this.decoder = bridgeProtocol.createDecoder(name, this.decoder.remainder());
+    this.handshaking = false;
+    this.logger.info(`Python bridge #${this.id} usando protocolo ${name}`);
+
+    const queued = this.outbox;
+    this.outbox = [];
+    queued.forEach(message => this.write(message));
+  }
+
+  handleResponse(response) {
+    if (response.type === 'chunk') {
+      this.handleChunk(response);
+    } else if (response.requestId && this.pendingRequests.has(response.requestId)) {
+      this.settle(response.requestId).resolve(response);
     } else {
-      logger.debug('Respuesta sin request ID:', response);
+      this.logger.debug(`Respuesta sin request ID (#${this.id}):`, response);
+    }
+  }
+
+  handleChunk(chunk) {
+    const pending = this.pendingRequests.get(chunk.requestId);
+    if (!pending) {
+      return;
+    }
+
+    // Mientras lleguen fragmentos el puente sigue trabajando: reiniciar el timeout
+    clearTimeout(pending.timeout);
+    pending.timeout = this.startTimeout(chunk.requestId);
+
+    if (pending.onChunk) {
+      pending.onChunk(chunk.data);
     }
   }
 
+  // Retira todas las requests pendientes para reintentarlas o rechazarlas
+  takePending() {
+    return [...this.pendingRequests.keys()].map(requestId => this.settle(requestId));
+  }
+
+  kill() {
+    if (this.process) {
+      this.process.kill();
+    }
+  }
+}
+
+// Pool de procesos del puente Python. Cada request va al worker activo y listo
+// con menos requests pendientes. Además se mantienen workers de reserva ya
+// inicializados: si un activo se cae, una reserva ocupa su lugar al momento y
+// la reserva se repone en segundo plano.
+class BridgePool {
+  constructor(options) {
+    this.size = Math.max(1, options.size || 1);
+    this.standby = Math.max(0, options.standby ?? 1);
+    this.command = options.command || 'python';
+    this.args = options.args || ['../bridge/main.py'];
+    this.restartDelayMs = options.restartDelayMs ?? 5000;
+    this.protocol = options.protocol || 'framed';
+    this.logger = options.logger;
+    this.workers = [];
+    this.nextId = 0;
+    this.stopping = false;
+  }
+
   start() {
-    this.app.listen(this.port, this.host, () => {
-      logger.info(`🚀 Nyx Server iniciado en http://${this.host}:${this.port}`);
-      logger.info(`Ambiente: ${process.env.NODE_ENV || 'development'}`);
+    for (let i = 0; i < this.size; i++) {
+      this.spawnWorker('active');
+    }
+    for (let i = 0; i < this.standby; i++) {
+      this.spawnWorker('standby');
+    }
+  }
+
+  spawnWorker(role) {
+    const worker = new BridgeWorker(this.nextId++, {
+      command: this.command,
+      args: this.args,
+      logger: this.logger,
+      protocol: this.protocol,
+      role,
+      onExit: (w, pending) => this.handleWorkerExit(w, pending)
     });
+    this.workers.push(worker);
+    worker.start();
+    return worker;
+  }
 
-    process.on('SIGINT', () => {
-      logger.info('Cerrando servidor...');
-      if (this.pythonBridge) {
-        this.pythonBridge.kill();
+  handleWorkerExit(worker, pending) {
+    if (this.stopping) {
+      pending.forEach(entry => entry.reject(new Error(`Python bridge #${worker.id} cerrado`)));
+      return;
+    }
+
+    const replacement = worker.role === 'active' ? this.promoteStandby() : null;
+
+    if (replacement) {
+      this.logger.info(`Python bridge #${replacement.id} (reserva) sustituye a #${worker.id}`);
+      this.workers = this.workers.filter(w => w !== worker);
+      // Reponer la reserva tras la espera, para no entrar en un bucle de caídas
+      setTimeout(() => {
+        if (!this.stopping) {
+          this.spawnWorker('standby');
+        }
+      }, this.restartDelayMs);
+    } else {
+      worker.restarts++;
+      setTimeout(() => worker.start(), this.restartDelayMs);
+    }
+
+    this.recoverPending(worker, pending);
+  }
+
+  promoteStandby() {
+    const standby = this.workers.find(w => w.role === 'standby' && w.alive && w.ready);
+    if (standby) {
+      standby.role = 'active';
+    }
+    return standby || null;
+  }
+
+  // Reenvía las requests repetibles de un worker caído y rechaza el resto
+  recoverPending(worker, pending) {
+    for (const entry of pending) {
+      const target = this.pickWorker();
+
+      if (target && REPLAYABLE_TYPES.has(entry.data.type) && !entry.options.replayed) {
+        this.logger.info(`Reintentando request ${entry.data.type} de #${worker.id} en #${target.id}`);
+        target.send(entry.data, { ...entry.options, replayed: true }).then(entry.resolve, entry.reject);
+      } else {
+        entry.reject(new Error(`Python bridge #${worker.id} cerrado`));
       }
-      process.exit(0);
-    });
+    }
+  }
+
+  // Worker activo y listo con menos requests pendientes. Durante el arranque,
+  // cuando aún no hay ninguno listo, se usa uno activo que esté iniciándose:
+  // sus requests esperan en stdin hasta que termine de inicializar.
+  pickWorker() {
+    let best = null;
+    let starting = null;
+
+    for (const worker of this.workers) {
+      if (!worker.alive || worker.role !== 'active') {
+        continue;
+      }
+      if (!worker.ready) {
+        starting = starting || worker;
+        continue;
+      }
+      if (!best || worker.pendingRequests.size < best.pendingRequests.size) {
+        best = worker;
+      }
+    }
+
+    return best || starting;
+  }
+
+  send(data, options) {
+    const worker = this.pickWorker();
+
+    if (!worker) {
+      return Promise.reject(new Error('Python bridge no disponible'));
+    }
+
+    return worker.send(data, options);
+  }
+
+  stream(data, onChunk, options = {}) {
+    return this.send(data, { ...options, onChunk });
+  }
+
+  get available() {
+    return this.workers.some(worker => worker.alive && worker.role === 'active');
+  }
+
+  status() {
+    return this.workers.map(worker => ({
+      id: worker.id,
+      role: worker.role,
+      status: worker.alive ? (worker.ready ? 'connected' : 'starting') : 'disconnected',
+      protocol: worker.protocol,
+      pending: worker.pendingRequests.size,
+      restarts: worker.restarts
+    }));
+  }
+
+  stop() {
+    this.stopping = true;
+    this.workers.forEach(worker => worker.kill());
   }
 }
 
-const server = new NyxServer();
-server.start();
+module.exports = { BridgePool, BridgeWorker };
+"""
 
-module.exports = NyxServer;
+with open('nyx/server/src/bridgePool.js', 'w') as f:
+    f.write(bridge_pool)
+
+# Protocolo de mensajes con el puente Python
+bridge_protocol = """// Protocolo de mensajes con el puente Python.
+//
+// 'ndjson' es un mensaje JSON por línea. Los protocolos 'framed-*' usan un
+// prefijo de longitud de 4 bytes (big-endian) seguido del mensaje en
+// MessagePack o JSON compacto, y se negocian con un mensaje 'hello' al arrancar.
+
+let msgpack = null;
+try {
+  msgpack = require('@msgpack/msgpack');
+} catch (error) {
+  // Dependencia opcional: sin ella se negocia framed-json
+}
+
+const HEADER_BYTES = 4;
+const MAX_MESSAGE_BYTES = 16 * 1024 * 1024;
+const PROTOCOLS = ['framed-msgpack', 'framed-json', 'ndjson'];
+
+function supportedProtocols() {
+  return PROTOCOLS.filter(name => name !== 'framed-msgpack' || msgpack !== null);
+}
+
+class LineDecoder {
+  constructor() {
+    this.name = 'ndjson';
+    this.buffer = Buffer.alloc(0);
+  }
+
+  push(chunk) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+  }
+
+  // Retorna el siguiente mensaje completo o undefined si falta información
+  next() {
+    while (true) {
+      const newline = this.buffer.indexOf(0x0a);
+      if (newline === -1) {
+        return undefined;
+      }
+
+      const line = this.buffer.subarray(0, newline).toString('utf8');
+      this.buffer = this.buffer.subarray(newline + 1);
+
+      if (line.trim()) {
+        return JSON.parse(line);
+      }
+    }
+  }
+
+  remainder() {
+    return this.buffer;
+  }
+}
+
+class FrameDecoder {
+  constructor(serializer, initial) {
+    this.name = `framed-${serializer}`;
+    this.serializer = serializer;
+    this.buffer = initial || Buffer.alloc(0);
+  }
+
+  push(chunk) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+  }
+
+  next() {
+    if (this.buffer.length < HEADER_BYTES) {
+      return undefined;
+    }
+
+    const length = this.buffer.readUInt32BE(0);
+    if (length > MAX_MESSAGE_BYTES) {
+      // Sin framing válido no hay forma de resincronizar el stream
+      const error = new Error(`Frame demasiado grande: ${length} bytes`);
+      error.fatal = true;
+      throw error;
+    }
+    if (this.buffer.length < HEADER_BYTES + length) {
+      return undefined;
+    }
+
+    const payload = this.buffer.subarray(HEADER_BYTES, HEADER_BYTES + length);
+    this.buffer = this.buffer.subarray(HEADER_BYTES + length);
+
+    return this.serializer === 'msgpack'
+      ? msgpack.decode(payload)
+      : JSON.parse(payload.toString('utf8'));
+  }
+
+  remainder() {
+    return this.buffer;
+  }
+}
+
+function createDecoder(name, initial) {
+  if (name === 'framed-msgpack') {
+    return new FrameDecoder('msgpack', initial);
+  }
+  if (name === 'framed-json') {
+    return new FrameDecoder('json', initial);
+  }
+
+  const decoder = new LineDecoder();
+  if (initial && initial.length) {
+    decoder.push(initial);
+  }
+  return decoder;
+}
+
+function encode(name, message) {
+  if (name === 'ndjson') {
+    return Buffer.from(JSON.stringify(message) + '\\n', 'utf8');
+  }
+
+  const payload = name === 'framed-msgpack'
+    ? Buffer.from(msgpack.encode(message))
+    : Buffer.from(JSON.stringify(message), 'utf8');
+
+  const header = Buffer.alloc(HEADER_BYTES);
+  header.writeUInt32BE(payload.length, 0);
+  return Buffer.concat([header, payload]);
+}
+
+module.exports = {
+  PROTOCOLS,
+  supportedProtocols,
+  createDecoder,
+  encode
+};
 """
 
-with open('nyx/server/src/index.js', 'w') as f:
-    f.write(server_index)
+with open('nyx/server/src/bridgeProtocol.js', 'w') as f:
+    f.write(bridge_protocol)
 
-print("✅ Servidor Node.js principal creado")
+# Benchmark del protocolo
+os.makedirs('nyx/server/benchmarks', exist_ok=True)
+
+bench_protocol = """// Benchmark de throughput del protocolo con el puente Python (lado Node).
+//
+// Compara el ndjson actual con el framing por prefijo de longitud: codifica un
+// lote de respuestas, las trocea como llegarían por stdout y las decodifica.
+//
+// Uso: node benchmarks/bench_protocol.js [mensajes] [tamaño de chunk]
+
+const bridgeProtocol = require('../src/bridgeProtocol');
+
+const MESSAGES = parseInt(process.argv[2] || '2000', 10);
+const CHUNK_BYTES = parseInt(process.argv[3] || '65536', 10);
+
+function buildPayload(kind) {
+  let result;
+
+  if (kind === 'events') {
+    const events = [];
+    for (let i = 0; i < 50; i++) {
+      events.push({
+        id: `evt${i}`,
+        title: `Reunión de seguimiento ${i}`,
+        start: '2024-05-10T10:00:00Z',
+        end: '2024-05-10T11:00:00Z',
+        location: 'Sala 3\\nEdificio B',
+        attendees: [0, 1, 2, 3, 4].map(j => `persona${j}@example.com`),
+        description: 'Revisión semanal del proyecto. '.repeat(8)
+      });
+    }
+    result = { content: events, type: 'calendar_events', skill: 'calendar' };
+  } else if (kind === 'search') {
+    const sources = [];
+    for (let i = 0; i < 10; i++) {
+      sources.push({ id: String(i), title: `Fuente ${i}`, url: `https://example.com/${i}` });
+    }
+    result = {
+      response: 'La inteligencia artificial avanza rápidamente.\\n'.repeat(80),
+      sources,
+      type: 'search_result',
+      cost: 0.0012
+    };
+  } else {
+    result = { response: 'Hola, ¿en qué puedo ayudarte?', type: 'text' };
+  }
+
+  return {
+    success: true,
+    requestId: 1718030400123.4567,
+    data: { success: true, level: 2, method: 'gemini_direct', result }
+  };
+}
+
+function run(protocol, messages) {
+  const start = process.hrtime.bigint();
+  const stream = Buffer.concat(messages.map(message => bridgeProtocol.encode(protocol, message)));
+  const encoded = process.hrtime.bigint();
+
+  const decoder = bridgeProtocol.createDecoder(protocol);
+  let decoded = 0;
+
+  for (let offset = 0; offset < stream.length; offset += CHUNK_BYTES) {
+    decoder.push(stream.subarray(offset, offset + CHUNK_BYTES));
+    while (decoder.next() !== undefined) {
+      decoded++;
+    }
+  }
+  const finished = process.hrtime.bigint();
+
+  if (decoded !== messages.length) {
+    throw new Error(`${protocol}: ${decoded}/${messages.length} mensajes decodificados`);
+  }
+
+  const seconds = Number(finished - start) / 1e9;
+  return {
+    bytes: stream.length,
+    encodeMs: Number(encoded - start) / 1e6,
+    decodeMs: Number(finished - encoded) / 1e6,
+    msgsPerSecond: messages.length / seconds,
+    mbPerSecond: stream.length / seconds / (1024 * 1024)
+  };
+}
+
+const protocols = bridgeProtocol.supportedProtocols().reverse();
+if (!protocols.includes('framed-msgpack')) {
+  console.log('(@msgpack/msgpack no instalado: se omite framed-msgpack)\\n');
+}
+
+console.log('payload  protocolo        bytes/msg       msgs/s      MB/s    enc ms    dec ms');
+
+for (const kind of ['small', 'search', 'events']) {
+  const messages = Array.from({ length: MESSAGES }, () => buildPayload(kind));
+
+  for (const protocol of protocols) {
+    // Mejor de 3 repeticiones para reducir ruido
+    const best = [0, 1, 2]
+      .map(() => run(protocol, messages))
+      .reduce((a, b) => (b.msgsPerSecond > a.msgsPerSecond ? b : a));
+
+    console.log(
+      `${kind.padEnd(8)} ${protocol.padEnd(15)} ` +
+      `${String(Math.floor(best.bytes / messages.length)).padStart(10)} ` +
+      `${best.msgsPerSecond.toFixed(0).padStart(12)} ${best.mbPerSecond.toFixed(1).padStart(9)} ` +
+      `${best.encodeMs.toFixed(1).padStart(9)} ${best.decodeMs.toFixed(1).padStart(9)}`
+    );
+  }
+}
+"""
+
+with open('nyx/server/benchmarks/bench_protocol.js', 'w') as f:
+    f.write(bench_protocol)
+
+# Pruebas del protocolo (Jest)
+os.makedirs('nyx/server/tests', exist_ok=True)
+
+bridge_protocol_test = """// Pruebas de los decodificadores del protocolo con el puente Python: los
+// mensajes llegan por stdout partidos en trozos de cualquier tamaño.
+
+const bridgeProtocol = require('../src/bridgeProtocol');
+
+const MESSAGES = [
+  { success: true, requestId: 1, data: { level: 2, result: { response: 'Mañana: reunión a las 10' } } },
+  { chunk: 'La fotosíntesis ', requestId: 2 },
+  { type: 'ready', pid: 1234 }
+];
+
+const PROTOCOLS = bridgeProtocol.supportedProtocols();
+
+function encodeAll(protocol, messages) {
+  return Buffer.concat(messages.map(message => bridgeProtocol.encode(protocol, message)));
+}
+
+// Alimenta el decodificador con trozos de size bytes y recoge los mensajes
+function decodeInChunks(decoder, data, size) {
+  const messages = [];
+  for (let start = 0; start < data.length; start += size) {
+    decoder.push(data.subarray(start, start + size));
+    let message;
+    while ((message = decoder.next()) !== undefined) {
+      messages.push(message);
+    }
+  }
+  return messages;
+}
+
+describe.each(PROTOCOLS)('decodificador %s', (protocol) => {
+  test.each([1, 2, 3, 5, 7, 64, 4096])('mensajes partidos en trozos de %i bytes', (size) => {
+    const data = encodeAll(protocol, MESSAGES);
+
+    expect(decodeInChunks(bridgeProtocol.createDecoder(protocol), data, size)).toEqual(MESSAGES);
+  });
+
+  test('un frame incompleto espera al resto', () => {
+    const data = encodeAll(protocol, MESSAGES.slice(0, 1));
+    const decoder = bridgeProtocol.createDecoder(protocol);
+
+    decoder.push(data.subarray(0, data.length - 1));
+    expect(decoder.next()).toBeUndefined();
+
+    decoder.push(data.subarray(data.length - 1));
+    expect(decoder.next()).toEqual(MESSAGES[0]);
+    expect(decoder.remainder().length).toBe(0);
+  });
+});
+
+describe('FrameDecoder', () => {
+  test('conserva los bytes leídos antes de negociar el protocolo', () => {
+    const data = encodeAll('framed-json', MESSAGES);
+    const decoder = bridgeProtocol.createDecoder('framed-json', data.subarray(0, 3));
+
+    expect(decodeInChunks(decoder, data.subarray(3), 2)).toEqual(MESSAGES);
+  });
+
+  test('un frame demasiado grande es un error fatal', () => {
+    const decoder = bridgeProtocol.createDecoder('framed-json');
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(16 * 1024 * 1024 + 1, 0);
+
+    decoder.push(header);
+
+    let error;
+    try {
+      decoder.next();
+    } catch (e) {
+      error = e;
+    }
+    expect(error.fatal).toBe(true);
+  });
+
+  test('la cabecera partida entre dos trozos', () => {
+    const data = encodeAll('framed-json', MESSAGES.slice(0, 2));
+    const decoder = bridgeProtocol.createDecoder('framed-json');
+
+    decoder.push(data.subarray(0, 2));
+    expect(decoder.next()).toBeUndefined();
+
+    decoder.push(data.subarray(2));
+    expect(decoder.next()).toEqual(MESSAGES[0]);
+    expect(decoder.next()).toEqual(MESSAGES[1]);
+    expect(decoder.next()).toBeUndefined();
+  });
+});
+"""
+
+with open('nyx/server/tests/bridgeProtocol.test.js', 'w') as f:
+    f.write(bridge_protocol_test)
+
+print("✅ Pool del puente Python creado")
 
 print("\n🟢 Archivos del servidor configurados exitosamente")
\ No newline at end of file
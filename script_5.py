@@ -7,8 +7,9 @@ Nyx Python Bridge - Puente de comunicación entre Node.js y Python
 Maneja la lógica de IA y la ejecución de habilidades
 \"\"\"
 
+import os
 import sys
-import json
+import time
 import asyncio
 import logging
 from pathlib import Path
@@ -16,10 +17,25 @@ from typing import Dict, Any, Optional
 
 # Añadir el directorio clients al path
 sys.path.append(str(Path(__file__).parent.parent / 'clients'))
+# Los módulos de src se importan entre sí sin prefijo de paquete
+sys.path.append(str(Path(__file__).parent / 'src'))
+
+# Sin prefijo src: es el mismo módulo que usan QueryRouter y SkillManager
+from startup import profiler
 
-from src.skill_manager import SkillManager
-from src.intent_classifier import IntentClassifier
+# El perfilado tiene que activarse antes de importar el resto de módulos
+if '--profile-startup' in sys.argv:
+    profiler.enable()
+
+import timing
+import deadline
+import distillation
+import jsonl_writer
+from normalization import normalize
+from keyword_matcher import keywords
 from src.query_router import QueryRouter
+from src import protocol
+from src.scheduler import RequestScheduler, LaneOverloaded, FAST_LANE, SLOW_LANE
 
 # Configurar logging
 logging.basicConfig(
@@ -33,6 +49,35 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Máximo de consultas en una request 'batch_query'
+MAX_BATCH_ITEMS = int(os.getenv('NYX_BATCH_MAX_ITEMS', '50'))
+
+# Desglose de tiempos por etapa en todas las respuestas (o por request con 'timing')
+TIMING_BREAKDOWN = os.getenv('NYX_TIMING_BREAKDOWN', 'false').lower() == 'true'
+
+# Margen que se descuenta del timeoutMs de Node por el transporte de la respuesta
+DEADLINE_MARGIN_MS = int(os.getenv('NYX_DEADLINE_MARGIN_MS', '250'))
+
+
+class ThreadedStdinReader:
+    \"\"\"
+    Lector de stdin en un hilo aparte, para cuando stdin no es un pipe
+    (fichero, Windows...) y no se puede conectar al loop
+    \"\"\"
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.stream = sys.stdin.buffer
+    
+    async def readline(self) -> bytes:
+        return await self.loop.run_in_executor(None, self.stream.readline)
+    
+    async def readexactly(self, n: int) -> bytes:
+        data = await self.loop.run_in_executor(None, self.stream.read, n)
+        if len(data) < n:
+            raise asyncio.IncompleteReadError(data, n)
+        return data
+
 class NyxBridge:
     \"\"\"
     Puente principal de Nyx que maneja la comunicación con Node.js
@@ -40,9 +85,19 @@ class NyxBridge:
     \"\"\"
     
     def __init__(self):
-        self.skill_manager = SkillManager()
-        self.intent_classifier = IntentClassifier()
-        self.query_router = QueryRouter()
+        with profiler.stage('QueryRouter'):
+            self.query_router = QueryRouter()
+        
+        # Un único contenedor de servicios: skills, clientes y presupuesto compartidos
+        self.services = self.query_router.services
+        self.skill_manager = self.services.skill_manager
+        self.intent_classifier = self.services.intent_classifier
+        
+        self.scheduler = RequestScheduler()
+        self.in_flight = set()
+        # Tareas en curso por requestId, para poder cancelarlas desde Node
+        self.tasks = {}
+        self.codec = protocol.NdjsonCodec()
         
         logger.info("🐍 Nyx Python Bridge iniciado")
         
@@ -58,8 +113,14 @@ class NyxBridge:
             
             if request_type == 'query':
                 response = await self.handle_query(request)
+            elif request_type == 'query_stream':
+                response = await self.handle_query_stream(request)
+            elif request_type == 'batch_query':
+                response = await self.handle_batch_query(request)
             elif request_type == 'list_skills':
                 response = await self.handle_list_skills()
+            elif request_type == 'stats':
+                response = self.handle_stats()
             else:
                 response = {
                     'error': f'Tipo de request desconocido: {request_type}',
@@ -85,7 +146,84 @@ class NyxBridge:
         user_id = request.get('userId', 'anonymous')
         
         # Enrutar la consulta a través del sistema de 3 niveles
-        result = await self.query_router.route_query(message, user_id)
+        result = await self.query_router.route_query(
+            message, user_id, request.get('classification'), use_cache=not request.get('noCache')
+        )
+        
+        return self._query_response(request, result)
+    
+    async def handle_query_stream(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Maneja una consulta en modo streaming
+        
+        Cada fragmento de texto se envía en cuanto se genera como un mensaje
+        'chunk' con el requestId de la consulta; la respuesta final es la misma
+        que la de una consulta normal.
+        \"\"\"
+        message = request.get('message', '')
+        user_id = request.get('userId', 'anonymous')
+        request_id = request.get('requestId')
+        result = None
+        
+        use_cache = not request.get('noCache')
+        
+        async for event in self.query_router.route_query_stream(message, user_id, use_cache,
+                                                                request.get('classification')):
+            if 'chunk' in event:
+                self.send_message({
+                    'type': 'chunk',
+                    'requestId': request_id,
+                    'data': {'text': event['chunk']}
+                })
+            else:
+                result = event['result']
+        
+        return self._query_response(request, result)
+    
+    def _query_response(self, request: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Respuesta de una consulta enrutada
+        
+        Si el plazo se agotó durante el enrutado se indica en la propia
+        respuesta, como cuando se agota en la cola, para que Node responda 504.
+        \"\"\"
+        if result.get('deadline_exceeded'):
+            return {
+                'error': result['error'],
+                'success': False,
+                'deadline_exceeded': True,
+                'stage': result.get('stage')
+            }
+        
+        return {
+            'success': True,
+            'data': result,
+            'timestamp': request.get('timestamp')
+        }
+    
+    async def handle_batch_query(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Maneja un lote de consultas en una sola request
+        \"\"\"
+        queries = request.get('queries')
+        
+        if not isinstance(queries, list) or not queries:
+            return {'error': 'Se requiere una lista de consultas', 'success': False}
+        if not all(isinstance(item, (str, dict)) for item in queries):
+            return {'error': 'Cada consulta debe ser un texto o un objeto con message', 'success': False}
+        # Mismo error que una consulta suelta cuyo message no es un texto (o está vacío)
+        messages = [item if isinstance(item, str) else item.get('message') for item in queries]
+        if not all(isinstance(message, str) and message.strip() for message in messages):
+            return {'error': 'El campo message debe ser un texto', 'success': False}
+        if len(queries) > MAX_BATCH_ITEMS:
+            return {'error': f'Máximo {MAX_BATCH_ITEMS} consultas por lote', 'success': False}
+        
+        result = await self.query_router.route_batch(
+            queries,
+            request.get('userId', 'anonymous'),
+            use_cache=not request.get('noCache'),
+            classifications=request.get('classifications')
+        )
         
         return {
             'success': True,
@@ -107,42 +245,264 @@ class NyxBridge:
             }
         }
     
+    def handle_stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Retorna las métricas de este proceso del puente
+        \"\"\"
+        return {
+            'success': True,
+            'data': {
+                'pid': os.getpid(),
+                'cache': self.query_router.response_cache.stats(),
+                'single_flight': self.query_router.single_flight.stats(),
+                'routing': self.query_router.routing_policy.summary(),
+                'timing': timing.histograms.summary(),
+                'lanes': self.scheduler.stats(),
+                'speculation': self.query_router.speculation_stats,
+                'circuit_breakers': self.query_router.circuit_breakers.stats(),
+                'tiers': self.query_router.tiers.summary(),
+                'traffic': self.query_router.traffic_recorder.stats(),
+                'distillation': self.query_router.verdict_log.stats(),
+                'intents': self.intent_classifier.get_stats(),
+                'keywords': keywords.stats(),
+                'skills': self.skill_manager.get_stats(),
+                'fallbacks': self.query_router.fallback_stats
+            }
+        }
+    
+    def send_message(self, message: Dict[str, Any]):
+        \"\"\"
+        Escribe un mensaje en stdout con el protocolo negociado
+        \"\"\"
+        sys.stdout.buffer.write(self.codec.encode(message))
+        sys.stdout.flush()
+    
+    async def _open_stdin(self):
+        \"\"\"
+        Retorna un lector de stdin que no bloquea el loop
+        \"\"\"
+        loop = asyncio.get_running_loop()
+        
+        try:
+            reader = asyncio.StreamReader(limit=protocol.MAX_MESSAGE_BYTES)
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+            return reader
+        except (NotImplementedError, ValueError, OSError):
+            return ThreadedStdinReader(loop)
+    
+    def handle_hello(self, request: Dict[str, Any]):
+        \"\"\"
+        Negocia el protocolo: la respuesta va aún en ndjson y a partir de ahí
+        ambos lados usan el protocolo elegido
+        \"\"\"
+        name = protocol.negotiate(request.get('protocols', []))
+        
+        self.send_message({
+            'type': 'hello',
+            'protocol': name,
+            'pid': os.getpid()
+        })
+        self.codec = protocol.get_codec(name)
+        
+        logger.info(f"Protocolo negociado con Node: {name}")
+    
+    def select_lane(self, request: Dict[str, Any]) -> str:
+        \"\"\"
+        Decide el carril de una request: las consultas que acabarán en Gemini o
+        Perplexity van al lento y todo lo que se resuelve localmente al rápido
+        
+        La clasificación hecha aquí se guarda en la request (classification o
+        classifications) para que el router no la repita.
+        \"\"\"
+        if request.get('type') in ('query', 'query_stream'):
+            message = request.get('message', '')
+            
+            # Una respuesta en caché se sirve sin llamar a ninguna API
+            if not request.get('noCache') and self.query_router.response_cache.contains(
+                    message, request.get('userId', 'anonymous')):
+                return FAST_LANE
+            
+            classification = self.query_router.classify(message)
+            request['classification'] = classification
+            level = self.query_router.predict_level(message, classification)
+            return FAST_LANE if level == 1 else SLOW_LANE
+        
+        if request.get('type') == 'batch_query':
+            queries = request.get('queries')
+            items = [
+                item for item in (queries if isinstance(queries, list) else [])
+                if isinstance(item, (str, dict))
+            ]
+            classifications = self.query_router.classify_batch(items)
+            request['classifications'] = classifications
+            local = all(
+                self.query_router.predict_level(query, classification) == 1
+                for query, classification in classifications.items()
+            )
+            return FAST_LANE if local else SLOW_LANE
+        
+        return FAST_LANE
+    
+    def request_timeout(self, request: Dict[str, Any]) -> Optional[float]:
+        \"\"\"
+        Segundos de plazo de una request según el timeoutMs con el que Node la espera
+        \"\"\"
+        timeout_ms = request.get('timeoutMs')
+        if not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0:
+            return None
+        
+        return max(0.0, timeout_ms - DEADLINE_MARGIN_MS) / 1000
+    
+    def cancel_request(self, request_id):
+        \"\"\"
+        Cancela la tarea de una request que Node ya no espera (timeout o
+        cliente desconectado), abortando la llamada a la API en curso
+        \"\"\"
+        task = self.tasks.get(request_id)
+        
+        if task and not task.done():
+            logger.info(f"Cancelando request {request_id}")
+            task.cancel()
+    
+    async def _serve_request(self, request: Dict[str, Any]):
+        \"\"\"
+        Procesa una request como tarea independiente y envía su respuesta al terminar
+        \"\"\"
+        request_id = request.get('requestId')
+        recorder = timing.begin()
+        deadline.begin(self.request_timeout(request))
+        
+        # Una sola normalización por request, que reutilizan el carril, el router y las skills
+        message = request.get('message')
+        if message is not None and not isinstance(message, str):
+            self.tasks.pop(request_id, None)
+            self.send_message({
+                'error': 'El campo message debe ser un texto',
+                'success': False,
+                'requestId': request_id
+            })
+            return
+        if message is not None:
+            with timing.stage('normalize'):
+                request['message'] = normalize(message)
+        
+        try:
+            with timing.stage('select_lane'):
+                lane = self.select_lane(request)
+        except Exception as e:
+            # La request mal formada se responde desde process_request(), como las demás
+            logger.warning(f"No se pudo elegir carril para la request {request_id}: {e}")
+            lane = SLOW_LANE
+        queued = time.perf_counter()
+        
+        async def job():
+            recorder.add('queue', (time.perf_counter() - queued) * 1000)
+            # Si la espera en el carril agotó el plazo, no empezar siquiera
+            deadline.check('queue')
+            return await self.process_request(request)
+        
+        try:
+            response = await self.scheduler.submit(lane, job)
+        except asyncio.CancelledError:
+            # Node ya descartó la request: no hay a quién responder
+            logger.info(f"Request {request_id} cancelada")
+            return
+        except LaneOverloaded as e:
+            logger.warning(f"{e}: request rechazada (reintentar en {e.retry_after}s)")
+            response = {
+                'error': 'Bridge saturado, reintentar más tarde',
+                'success': False,
+                'overloaded': True,
+                'lane': e.lane,
+                'retry_after': e.retry_after,
+                'requestId': request_id
+            }
+        except deadline.DeadlineExceeded as e:
+            logger.warning(f"{e}: request {request_id} descartada")
+            response = {
+                'error': str(e),
+                'success': False,
+                'deadline_exceeded': True,
+                'stage': e.stage,
+                'requestId': request_id
+            }
+        except Exception as e:
+            # Cualquier otro fallo también se responde: Node espera un requestId
+            logger.error(f"Error sirviendo request {request_id}: {e}")
+            response = {
+                'error': str(e),
+                'success': False,
+                'requestId': request_id
+            }
+        finally:
+            self.tasks.pop(request_id, None)
+        
+        timing.histograms.observe_request(recorder)
+        if TIMING_BREAKDOWN or request.get('timing'):
+            response['timing'] = recorder.summary()
+        
+        self.send_message(response)
+        profiler.mark_first_response(f"{request.get('type')}, carril {lane}")
+    
     async def run(self):
         \"\"\"
         Loop principal del puente
+        
+        Cada request se procesa en su propia tarea dentro de su carril, de modo
+        que una llamada lenta a Gemini o Perplexity no bloquea al resto. Las
+        respuestas se envían según terminan y Node las empareja por requestId.
         \"\"\"
+        reader = await self._open_stdin()
+        first_message = True
+        
+        # Avisar a Node de que la inicialización terminó y ya se pueden enrutar requests
+        self.send_message({
+            'type': 'ready',
+            'pid': os.getpid()
+        })
         logger.info("Bridge listo para recibir requests")
+        profiler.report()
+        
+        # Reentrenar el clasificador local con las decisiones de Gemini
+        if distillation.DISTILL_INTERVAL > 0 and self.query_router.verdict_log.enabled:
+            self.distill_task = asyncio.create_task(distillation.distill_periodically(self.query_router))
         
         while True:
             try:
-                # Leer línea de stdin
-                line = sys.stdin.readline()
+                # Leer el siguiente mensaje de stdin
+                request = await self.codec.read(reader)
                 
-                if not line:
+                if request is None:
                     break
-                    
-                line = line.strip()
-                if not line:
+                
+                # El handshake solo es válido como primer mensaje
+                if first_message and request.get('type') == 'hello':
+                    first_message = False
+                    self.handle_hello(request)
                     continue
+                first_message = False
                 
-                # Parsear JSON
-                request = json.loads(line)
+                if request.get('type') == 'cancel':
+                    self.cancel_request(request.get('requestId'))
+                    continue
                 
-                # Procesar request
-                response = await self.process_request(request)
+                # La admisión la controla el carril: si está lleno se responde al momento
+                task = asyncio.create_task(self._serve_request(request))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
                 
-                # Enviar respuesta a stdout
-                print(json.dumps(response), flush=True)
+                if request.get('requestId') is not None:
+                    self.tasks[request['requestId']] = task
                 
-            except json.JSONDecodeError as e:
+            except protocol.ProtocolError as e:
                 logger.error(f"Error parsing JSON: {e}")
                 error_response = {
                     'error': 'JSON malformado',
                     'success': False
                 }
-                print(json.dumps(error_response), flush=True)
+                self.send_message(error_response)
                 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, asyncio.CancelledError, ConnectionError):
                 logger.info("Cerrando bridge...")
                 break
                 
@@ -152,7 +512,15 @@ class NyxBridge:
                     'error': str(e),
                     'success': False
                 }
-                print(json.dumps(error_response), flush=True)
+                self.send_message(error_response)
+        
+        # stdin cerrado: terminar las requests pendientes antes de salir
+        if self.in_flight:
+            logger.info(f"Esperando {len(self.in_flight)} request(s) en curso...")
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+        
+        # Escribir las decisiones que aún están en cola
+        await jsonl_writer.flush_all()
 
 if __name__ == '__main__':
     bridge = NyxBridge()
@@ -169,45 +537,90 @@ skill_manager = """\"\"\"
 Gestor de habilidades de Nyx
 \"\"\"
 
+import os
 import json
-import importlib
+import time
+import asyncio
+import inspect
+import importlib.util
 import sys
+import threading
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, AsyncIterator, Optional
 import logging
 
+import timing
+import traffic
+import deadline
+from deadline import DeadlineExceeded
+from keyword_matcher import keywords
+from startup import profiler
+
 logger = logging.getLogger(__name__)
 
+# Skills que se importan e instancian al arrancar, separadas por comas ('all':
+# todas); el resto se carga en su primera ejecución
+SKILLS_WARMUP = os.getenv('NYX_SKILLS_WARMUP', '')
+
 class SkillManager:
     \"\"\"
     Maneja la carga, descubrimiento y ejecución de habilidades
+    
+    Al arrancar solo se leen los skill.json: nombre, descripción y triggers
+    bastan para listar las skills y enrutar. El main.py de cada skill se
+    importa y se instancia (p. ej. el OAuth de Google del calendario) la
+    primera vez que se ejecuta, salvo las de NYX_SKILLS_WARMUP.
     \"\"\"
     
-    def __init__(self):
+    def __init__(self, services=None):
+        # Contenedor de servicios compartidos que se inyecta en las skills
+        self.services = services
         self.skills = {}
+        self.sync_locks = {}
+        # Cargas en curso por skill, y lock para no instanciar una skill dos veces
+        self.loading = {}
+        self._load_lock = threading.Lock()
+        # Triggers registrados en keyword_matcher y forma de self.skills al registrarlos
+        self._trigger_owners = set()
+        self._trigger_shape = None
         self.skills_path = Path(__file__).parent.parent.parent / 'skills'
         self.load_skills()
     
     def load_skills(self):
         \"\"\"
-        Descubre y carga todas las habilidades disponibles
+        Descubre las habilidades disponibles leyendo solo sus skill.json
+        
+        Las de NYX_SKILLS_WARMUP se cargan además en este momento.
         \"\"\"
-        logger.info("Cargando habilidades...")
+        logger.info("Descubriendo habilidades...")
         
         if not self.skills_path.exists():
             logger.warning(f"Directorio de skills no encontrado: {self.skills_path}")
             return
         
-        for skill_dir in self.skills_path.iterdir():
+        for skill_dir in sorted(self.skills_path.iterdir()):
             if skill_dir.is_dir() and (skill_dir / 'skill.json').exists():
                 try:
-                    self.load_skill(skill_dir)
+                    self.discover_skill(skill_dir)
                 except Exception as e:
-                    logger.error(f"Error cargando skill {skill_dir.name}: {e}")
+                    logger.error(f"Error leyendo el manifiesto de {skill_dir.name}: {e}")
+        
+        warmup = list(self.skills) if SKILLS_WARMUP.strip() == 'all' else [
+            name.strip() for name in SKILLS_WARMUP.split(',') if name.strip()
+        ]
+        for skill_name in warmup:
+            if skill_name not in self.skills:
+                logger.warning(f"Skill de NYX_SKILLS_WARMUP no encontrada: {skill_name}")
+                continue
+            try:
+                with profiler.stage(f'skill:{skill_name}'):
+                    self.load_skill(skill_name)
+            except Exception as e:
+                logger.error(f"Error cargando skill {skill_name}: {e}")
     
-    def load_skill(self, skill_dir: Path):
+    def discover_skill(self, skill_dir: Path):
         \"\"\"
-        Carga una habilidad específica
+        Registra una habilidad a partir de su skill.json, sin importarla
         \"\"\"
         skill_json_path = skill_dir / 'skill.json'
         
@@ -216,27 +629,109 @@ class SkillManager:
         
         skill_name = skill_config['name']
         
+        self.skills[skill_name] = {
+            'instance': None,
+            'config': skill_config,
+            'path': skill_dir
+        }
+        
+        logger.info(f"Skill descubierta: {skill_name}")
+    
+    def load_skill(self, skill_name: str):
+        \"\"\"
+        Importa e instancia una habilidad descubierta, si no lo estaba ya
+        \"\"\"
+        with self._load_lock:
+            skill_data = self.skills[skill_name]
+            if skill_data['instance'] is None:
+                skill_data['instance'] = self._instantiate(skill_name, skill_data)
+                logger.info(f"Skill cargada: {skill_name}")
+            return skill_data['instance']
+    
+    def _instantiate(self, skill_name: str, skill_data: Dict[str, Any]):
+        \"\"\"
+        Importa el main.py de la skill y crea su instancia
+        \"\"\"
+        skill_dir = skill_data['path']
+        skill_config = skill_data['config']
+        
         # Añadir el directorio de la skill al path
         if str(skill_dir) not in sys.path:
             sys.path.append(str(skill_dir))
         
-        # Importar el módulo principal
-        module = importlib.import_module('main')
+        # Importar el módulo principal con un nombre propio: todas las skills
+        # tienen un main.py y con import_module('main') se pisarían entre ellas
+        module_name = f'nyx_skill_{skill_name}'
+        module = sys.modules.get(module_name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, skill_dir / 'main.py')
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except Exception:
+                del sys.modules[module_name]
+                raise
         
         # Obtener la clase principal
         skill_class_name = skill_config.get('class', f"{skill_name.title()}Skill")
         skill_class = getattr(module, skill_class_name)
         
-        # Instanciar la skill
-        skill_instance = skill_class(skill_config)
+        # Instanciar la skill con los servicios compartidos; las que no aceptan
+        # 'services' en el constructor los reciben como atributo
+        if 'services' in inspect.signature(skill_class).parameters:
+            skill_instance = skill_class(skill_config, services=self.services)
+        else:
+            skill_instance = skill_class(skill_config)
+            skill_instance.services = self.services
         
-        self.skills[skill_name] = {
-            'instance': skill_instance,
-            'config': skill_config,
-            'path': skill_dir
-        }
+        return skill_instance
+    
+    async def _get_instance(self, skill_name: str):
+        \"\"\"
+        Instancia de la skill, cargándola en un hilo la primera vez
+        
+        La carga puede ser lenta (OAuth, clientes de APIs) y no debe bloquear el
+        loop; las requests concurrentes esperan a la misma carga, que sigue
+        aunque la request que la empezó agote su plazo.
+        \"\"\"
+        instance = self.skills[skill_name]['instance']
+        if instance is not None:
+            return instance
+        
+        loading = self._start_loading(skill_name)
+        with timing.stage('skill.load'):
+            return await deadline.within(asyncio.shield(loading), 'skill.load')
+    
+    def _start_loading(self, skill_name: str) -> asyncio.Future:
+        \"\"\"
+        Carga en curso de la skill, empezándola en un hilo si no lo estaba
+        \"\"\"
+        loading = self.loading.get(skill_name)
+        if loading is None:
+            loading = asyncio.ensure_future(asyncio.to_thread(self.load_skill, skill_name))
+            self.loading[skill_name] = loading
+            loading.add_done_callback(lambda task: self._finish_loading(skill_name, task))
+        return loading
+    
+    def _finish_loading(self, skill_name: str, loading: asyncio.Future):
+        \"\"\"
+        Olvida la carga terminada; si falló, la próxima ejecución lo reintenta
+        \"\"\"
+        self.loading.pop(skill_name, None)
         
-        logger.info(f"Skill cargada: {skill_name}")
+        # Marcar el error como recuperado aunque nadie espere ya el resultado
+        if not loading.cancelled():
+            loading.exception()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Skills descubiertas y cargadas
+        \"\"\"
+        return {
+            'discovered': len(self.skills),
+            'loaded': [name for name, data in self.skills.items() if data['instance'] is not None]
+        }
     
     def get_available_skills(self) -> List[Dict[str, Any]]:
         \"\"\"
@@ -256,19 +751,51 @@ class SkillManager:
         
         return skills_list
     
-    def execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         \"\"\"
         Ejecuta una habilidad específica
+        
+        Las skills asíncronas se esperan directamente. Las síncronas se ejecutan
+        en un hilo para no bloquear el loop del puente, de una en una por skill
+        porque sus clientes (p. ej. googleapiclient) no son thread-safe. Ninguna
+        espera más allá del plazo de la request.
         \"\"\"
+        started = time.perf_counter()
+        result = await self._execute_skill(skill_name, query, context)
+        
+        # Con la grabación de tráfico activa, el resultado se guarda para reproducirlo
+        traffic.record_call('skill', skill_name, query, result, (time.perf_counter() - started) * 1000)
+        
+        return result
+    
+    async def _execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         if skill_name not in self.skills:
             return {
                 'error': f'Skill no encontrada: {skill_name}',
                 'success': False
             }
         
+        stage = f'skill.{skill_name}'
+        
         try:
-            skill = self.skills[skill_name]['instance']
-            result = skill.execute(query, context)
+            deadline.check(stage)
+            skill = await self._get_instance(skill_name)
+            
+            if asyncio.iscoroutinefunction(skill.execute):
+                with timing.stage(stage):
+                    result = await deadline.within(skill.execute(query, context), stage)
+            else:
+                lock = self.sync_locks.setdefault(skill_name, asyncio.Lock())
+                with timing.stage('skill.lock_wait'):
+                    await deadline.within(lock.acquire(), 'skill.lock_wait')
+                
+                # El hilo no se puede interrumpir: el lock se libera cuando termina,
+                # aunque la request se cancele o agote su plazo antes
+                work = asyncio.ensure_future(asyncio.to_thread(skill.execute, query, context))
+                work.add_done_callback(lambda task: self._release_sync_lock(lock, task))
+                
+                with timing.stage(stage):
+                    result = await deadline.within(asyncio.shield(work), stage)
             
             return {
                 'success': True,
@@ -276,6 +803,8 @@ class SkillManager:
                 'result': result
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error ejecutando skill {skill_name}: {e}")
             return {
@@ -284,20 +813,134 @@ class SkillManager:
                 'skill': skill_name
             }
     
+    def _release_sync_lock(self, lock: asyncio.Lock, work: asyncio.Future):
+        \"\"\"
+        Libera el lock de una skill síncrona cuando su hilo termina
+        \"\"\"
+        lock.release()
+        
+        # Marcar el error como recuperado aunque nadie espere ya el resultado
+        if not work.cancelled():
+            work.exception()
+    
+    def get_speculation_key(self, skill_name: str, query: str, context: Dict[str, Any]) -> Optional[str]:
+        \"\"\"
+        Acción de solo lectura que la skill haría con este contexto, o None si
+        no se puede ejecutar de forma especulativa
+        
+        Si la skill aún no está cargada retorna None (la consulta sigue sin
+        especular) y empieza a cargarla en un hilo para las siguientes.
+        \"\"\"
+        if skill_name not in self.skills:
+            return None
+        
+        try:
+            instance = self.skills[skill_name]['instance']
+            if instance is None:
+                self._start_loading(skill_name)
+                return None
+            return instance.speculation_key(query, context)
+        except Exception as e:
+            logger.error(f"Error evaluando especulación de {skill_name}: {e}")
+            return None
+    
+    async def execute_skill_stream(self, skill_name: str, query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Ejecuta una habilidad emitiendo {'chunk': texto} y al final {'result': ...}
+        
+        Las skills sin streaming se ejecutan normalmente y su contenido se emite
+        como un único fragmento.
+        \"\"\"
+        skill = None
+        if skill_name in self.skills:
+            try:
+                skill = await self._get_instance(skill_name)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Error cargando skill {skill_name}: {e}")
+                yield {'result': {'error': str(e), 'success': False, 'skill': skill_name}}
+                return
+        
+        if not getattr(skill, 'streaming', False):
+            result = await self.execute_skill(skill_name, query, context)
+            skill_result = result.get('result')
+            content = skill_result.get('content') if isinstance(skill_result, dict) else None
+            if isinstance(content, str) and content:
+                yield {'chunk': content}
+            yield {'result': result}
+            return
+        
+        started = time.perf_counter()
+        events = []
+        
+        try:
+            async for event in skill.execute_stream(query, context):
+                if 'result' in event:
+                    event = {
+                        'result': {
+                            'success': True,
+                            'skill': skill_name,
+                            'result': event['result']
+                        }
+                    }
+                events.append(event)
+                yield event
+            
+        except Exception as e:
+            logger.error(f"Error ejecutando skill {skill_name}: {e}")
+            event = {
+                'result': {
+                    'error': str(e),
+                    'success': False,
+                    'skill': skill_name
+                }
+            }
+            events.append(event)
+            yield event
+        
+        traffic.record_call('skill', f'{skill_name}.stream', query, {'events': events},
+                            (time.perf_counter() - started) * 1000)
+    
     def get_skill_by_trigger(self, query: str) -> Optional[str]:
         \"\"\"
         Encuentra una skill basada en triggers de palabras clave
+        
+        Los triggers de todas las skills están en el registro de keyword_matcher,
+        que recorre la consulta una sola vez, sin tildes ni mayúsculas; si hay
+        varias, gana la primera skill cargada.
         \"\"\"
-        query_lower = query.lower()
+        self._sync_triggers()
+        found = keywords.matches(query)
         
-        for skill_name, skill_data in self.skills.items():
-            triggers = skill_data['config'].get('triggers', [])
-            
-            for trigger in triggers:
-                if trigger.lower() in query_lower:
-                    return skill_name
+        for skill_name in self.skills:
+            if f'trigger:{skill_name}' in found:
+                return skill_name
         
         return None
+    
+    def _sync_triggers(self):
+        \"\"\"
+        Registra los triggers de las skills si han cambiado
+        
+        Se detectan las skills añadidas o quitadas y cualquier cambio en sus
+        triggers (también si se reemplaza uno por otro); el autómata se
+        reconstruye la próxima vez que se usa.
+        \"\"\"
+        shape = tuple((name, tuple(data['config'].get('triggers', []))) for name, data in self.skills.items())
+        if shape == self._trigger_shape:
+            return
+        
+        owners = set()
+        for skill_name, skill_data in self.skills.items():
+            owner = f'trigger:{skill_name}'
+            keywords.register(owner, skill_data['config'].get('triggers', []))
+            owners.add(owner)
+        for owner in self._trigger_owners - owners:
+            keywords.unregister(owner)
+        
+        self._trigger_owners = owners
+        self._trigger_shape = shape
 """
 
 with open('nyx/bridge/src/skill_manager.py', 'w') as f:
@@ -310,18 +953,165 @@ intent_classifier = """\"\"\"
 Clasificador de intenciones de nivel 1 (local)
 \"\"\"
 
+import os
 import re
-from typing import Dict, List, Optional, Tuple
+import sys
+import copy
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from normalization import normalize, fold_pattern
+
 logger = logging.getLogger(__name__)
 
+# Modelo estadístico entrenado con intent_model.py (vacío: solo patrones)
+INTENT_MODEL = os.getenv('NYX_INTENT_MODEL', '')
+
+# Confianza mínima del clasificador local para resolver en el nivel 1
+LEVEL1_CONFIDENCE = float(os.getenv('NYX_LEVEL1_CONFIDENCE', '0.8'))
+
+# Prefijo que fija el comienzo de una coincidencia: \\b(a|b c|...) o ^(a|b|...)
+_LEADING_WORDS = re.compile(r'(\\^|\\\\b)\\((?:\\?:)?([\\w ]+(?:\\|[\\w ]+)*)\\)')
+
+# Caracteres con los que IGNORECASE equivale a str.lower(); fuera de ellos
+# (p. ej. 'ſ', que coincide con 's') no se usa el índice de palabras
+_SIMPLE_CASE = re.compile(r"[\\sa-zA-Z0-9_áéíóúüñÁÉÍÓÚÜÑ¿?¡!.,;:'\\"()-]*")
+
+_WORD = re.compile(r'\\w+')
+
+class PatternMatcher:
+    \"\"\"
+    Patrones de todas las intenciones compilados e indexados por palabra inicial
+    
+    Casi todos los patrones empiezan por una lista de palabras, \\b(cita|agenda)
+    o ^(qué|cómo), y no pueden coincidir si la consulta no contiene ninguna.
+    Una pasada por las palabras de la consulta elige los patrones candidatos y
+    solo esos se evalúan, ya compilados, con search() y findall(); el resto no
+    podría coincidir, así que las confianzas son las mismas que evaluando
+    todos. Los patrones sin lista inicial se evalúan siempre.
+    
+    Los patrones se compilan sin tildes (fold_pattern) y se buscan en la forma
+    sin tildes de la consulta, de modo que "reunion" coincide con "reunión".
+    \"\"\"
+    
+    def __init__(self, patterns: Dict[str, List[str]], flags: int = re.IGNORECASE):
+        self.sizes = {intent: len(intent_patterns) for intent, intent_patterns in patterns.items()}
+        
+        # Índice global de cada patrón -> (intención, patrón compilado)
+        self._slots: List[Tuple[str, re.Pattern]] = []
+        # Palabra completa -> patrones, prefijo de palabra -> patrones
+        self._words: Dict[str, List[int]] = {}
+        self._prefixes: Dict[str, List[int]] = {}
+        self._always: List[int] = []
+        
+        for intent, intent_patterns in patterns.items():
+            for pattern in map(fold_pattern, intent_patterns):
+                slot = len(self._slots)
+                self._slots.append((intent, re.compile(pattern, flags)))
+                
+                # El índice supone \\w y \\b de Unicode y sin distinguir mayúsculas
+                indexable = flags & re.IGNORECASE and not flags & (re.ASCII | re.LOCALE | re.VERBOSE)
+                keys = self._leading_words(pattern) if indexable else None
+                if keys is None:
+                    self._always.append(slot)
+                    continue
+                
+                for word, whole in keys:
+                    index = self._words if whole else self._prefixes
+                    slots = index.setdefault(word, [])
+                    if slot not in slots:
+                        slots.append(slot)
+    
+    @staticmethod
+    def _leading_words(pattern: str) -> Optional[List[Tuple[str, bool]]]:
+        \"\"\"
+        Primera palabra de cada alternativa inicial y si es una palabra completa
+        
+        None si el patrón no empieza por una lista de palabras que toda
+        coincidencia tenga que contener.
+        \"\"\"
+        match = _LEADING_WORDS.match(pattern)
+        if not match:
+            return None
+        
+        rest = pattern[match.end():]
+        if rest[:1] in ('?', '*', '{') or _has_top_level_alternative(rest):
+            return None
+        
+        keys = []
+        for alternative in match.group(2).split('|'):
+            word = _WORD.match(alternative)
+            if not word or not _SIMPLE_CASE.fullmatch(alternative):
+                return None
+            # Completa si la sigue un separador o el patrón exige fin de palabra
+            whole = word.end() < len(alternative) or rest.startswith('\\\\b')
+            keys.append((word.group().lower(), whole))
+        return keys
+    
+    def confidences(self, query: str, weights: Dict[str, float]) -> Dict[str, float]:
+        \"\"\"
+        Confianza de cada intención con coincidencias
+        \"\"\"
+        if _SIMPLE_CASE.fullmatch(query):
+            candidates = set(self._always)
+            words = set(_WORD.findall(query.lower()))
+            for word in words:
+                candidates.update(self._words.get(word, ()))
+            for prefix, slots in self._prefixes.items():
+                if any(word.startswith(prefix) for word in words):
+                    candidates.update(slots)
+        else:
+            candidates = range(len(self._slots))
+        
+        # Se suman en el orden de los patrones para dar exactamente el mismo float
+        totals: Dict[str, float] = {}
+        for slot in sorted(candidates):
+            intent, compiled = self._slots[slot]
+            if not compiled.search(query):
+                continue
+            weight = weights['exact_match'] if len(compiled.findall(query)) > 1 else weights['partial_match']
+            totals[intent] = totals.get(intent, 0.0) + weight
+        
+        return {intent: min(total / self.sizes[intent], 1.0) for intent, total in totals.items()}
+
+def _has_top_level_alternative(pattern: str) -> bool:
+    \"\"\"
+    Indica si el patrón tiene un | fuera de grupos y clases de caracteres
+    \"\"\"
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\\\':
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
 class IntentClassifier:
     \"\"\"
     Clasificador simple basado en palabras clave y patrones
+    
+    Con un modelo entrenado (NYX_INTENT_MODEL, ver intent_model.py) las
+    consultas que los patrones no clasifican se pasan al modelo, que las
+    acepta si la intención más probable supera NYX_INTENT_MODEL_THRESHOLD.
     \"\"\"
     
-    def __init__(self):
+    def __init__(self, model: Optional['IntentModel'] = None):
         self.patterns = {
             'calendar': [
                 r'\\b(calendario|evento|reunión|cita|agenda|meeting)\\b',
@@ -348,21 +1138,77 @@ class IntentClassifier:
             'partial_match': 0.7,
             'context_match': 0.5
         }
+        
+        self._matcher: Optional[PatternMatcher] = None
+        self._matcher_shape: Optional[Tuple] = None
+        
+        # numpy solo se importa si hay un modelo configurado
+        if model is None and INTENT_MODEL:
+            from intent_model import load_model
+            model = load_model(INTENT_MODEL)
+        self.model = model
+        self.stats = {'patterns': 0, 'model': 0, 'unclassified': 0}
+        self.level1 = 0
     
     def classify(self, query: str) -> Tuple[Optional[str], float]:
         \"\"\"
         Clasifica una consulta y retorna la intención más probable con confianza
         \"\"\"
-        query_clean = query.lower().strip()
+        return self.classify_batch([query])[0]
+    
+    def classify_batch(self, queries: List[str], quiet: bool = False) -> List[Tuple[Optional[str], float]]:
+        \"\"\"
+        Clasifica un lote de consultas
         
-        if not query_clean:
-            return None, 0.0
+        Los patrones se evalúan consulta a consulta; el modelo puntúa de una
+        vez, en una sola matriz, todas las que los patrones no clasifican.
+        Con quiet no se cuentan en las estadísticas ni se registran en el log
+        (evaluaciones fuera de línea).
+        \"\"\"
+        queries = [normalize(query) for query in queries]
+        results = [self._classify_patterns(query.folded) for query in queries]
+        sources = ['patterns' if intent else 'unclassified' for intent, _ in results]
+        
+        pending = [i for i, (intent, _) in enumerate(results) if intent is None and queries[i].text]
+        if self.model is not None and pending:
+            predictions = self.model.classify_batch([queries[i] for i in pending])
+            for i, (intent, probability) in zip(pending, predictions):
+                if intent and probability >= self.model.threshold:
+                    results[i] = (intent, probability)
+                    sources[i] = 'model'
+        
+        if quiet:
+            return results
+        
+        for query, (intent, confidence), source in zip(queries, results, sources):
+            if not query.text:
+                continue
+            self.stats[source] += 1
+            if intent and confidence >= LEVEL1_CONFIDENCE:
+                self.level1 += 1
+            if source == 'patterns':
+                logger.info(f"Intent clasificado: {intent} (confianza: {confidence:.2f})")
+            elif source == 'model':
+                logger.info(f"Intent clasificado por el modelo: {intent} (probabilidad: {confidence:.2f})")
+            else:
+                logger.info(f"No se pudo clasificar con confianza: {query[:50]}...")
+        
+        return results
+    
+    def _classify_patterns(self, query_clean: str) -> Tuple[Optional[str], float]:
+        \"\"\"
+        Intención según los patrones, o None con la mejor confianza si no llega a 0.5
+        \"\"\"
+        if not query_clean:
+            return None, 0.0
         
         best_intent = None
         best_confidence = 0.0
         
-        for intent, patterns in self.patterns.items():
-            confidence = self._calculate_confidence(query_clean, patterns)
+        confidences = self._get_matcher().confidences(query_clean, self.confidence_weights)
+        
+        for intent in self.patterns:
+            confidence = confidences.get(intent, 0.0)
             
             if confidence > best_confidence:
                 best_confidence = confidence
@@ -370,15 +1216,50 @@ class IntentClassifier:
         
         # Solo retornar si la confianza es suficientemente alta
         if best_confidence >= 0.5:
-            logger.info(f"Intent clasificado: {best_intent} (confianza: {best_confidence:.2f})")
             return best_intent, best_confidence
         
-        logger.info(f"No se pudo clasificar con confianza: {query[:50]}...")
         return None, best_confidence
     
+    def _get_matcher(self) -> PatternMatcher:
+        \"\"\"
+        Matcher compilado de los patrones actuales; se recompila si han cambiado
+        
+        Se detectan los patrones añadidos o quitados (add_pattern() o la lista
+        de self.patterns); si se reemplaza uno en su sitio, llamar a recompile().
+        \"\"\"
+        shape = tuple((intent, len(patterns)) for intent, patterns in self.patterns.items())
+        if self._matcher is None or shape != self._matcher_shape:
+            self._matcher = PatternMatcher(self.patterns)
+            self._matcher_shape = shape
+        return self._matcher
+    
+    def snapshot(self) -> 'IntentClassifier':
+        \"\"\"
+        Copia para clasificar fuera del loop (p. ej. en un hilo)
+        
+        Tiene sus propios patrones y matcher, así que los cambios del
+        clasificador en uso no le afectan; el modelo es el mismo objeto, que
+        no se modifica (se reemplaza entero).
+        \"\"\"
+        clone = copy.copy(self)
+        clone.patterns = {intent: list(patterns) for intent, patterns in self.patterns.items()}
+        clone.stats = dict(self.stats)
+        clone._matcher = None
+        clone._matcher_shape = None
+        return clone
+    
+    def recompile(self):
+        \"\"\"
+        Descarta el matcher compilado tras modificar self.patterns
+        \"\"\"
+        self._matcher = None
+    
     def _calculate_confidence(self, query: str, patterns: List[str]) -> float:
         \"\"\"
         Calcula la confianza de un intent basado en patrones
+        
+        Versión de referencia, patrón a patrón: classify() usa PatternMatcher,
+        que da el mismo resultado evaluando solo los patrones candidatos.
         \"\"\"
         total_confidence = 0.0
         matches = 0
@@ -407,13 +1288,33 @@ class IntentClassifier:
             self.patterns[intent] = []
         
         self.patterns[intent].append(pattern)
+        self.recompile()
         logger.info(f"Patrón añadido para {intent}: {pattern}")
     
     def get_supported_intents(self) -> List[str]:
         \"\"\"
         Retorna la lista de intenciones soportadas
         \"\"\"
-        return list(self.patterns.keys())
+        intents = list(self.patterns.keys())
+        if self.model is not None:
+            intents += [label for label in self.model.intents() if label not in self.patterns]
+        return intents
+    
+    def get_stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Consultas clasificadas por los patrones, por el modelo y sin clasificar
+        
+        local_rate solo cuenta las que llegan a LEVEL1_CONFIDENCE: las
+        clasificadas por debajo (p. ej. por el modelo entre su umbral y
+        LEVEL1_CONFIDENCE) no se resuelven en el nivel 1.
+        \"\"\"
+        total = sum(self.stats.values())
+        return {
+            **self.stats,
+            'level1': self.level1,
+            'model_loaded': self.model is not None,
+            'local_rate': round(self.level1 / total, 3) if total else 0.0
+        }
 """
 
 with open('nyx/bridge/src/intent_classifier.py', 'w') as f:
@@ -426,60 +1327,173 @@ query_router = """\"\"\"
 Router de consultas - Sistema de enrutamiento de 3 niveles
 \"\"\"
 
+import os
 import sys
+import copy
+import time
+import asyncio
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import logging
 
 # Añadir clients al path
 sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
 
-from intent_classifier import IntentClassifier
-from skill_manager import SkillManager
-from gemini_client import GeminiClient
-from perplexity_client import PerplexityClient
-from budget_governor import BudgetGovernor
+import timing
+import traffic
+import deadline
+from deadline import DeadlineExceeded
+from circuit_breaker import CircuitOpen
+from services import ServiceContainer
+from tiers import TierRegistry, TierContext
+from normalization import normalize
+from keyword_matcher import keywords
+from intent_classifier import LEVEL1_CONFIDENCE
 
 logger = logging.getLogger(__name__)
 
+# Consultas de un mismo lote que se ejecutan a la vez
+BATCH_CONCURRENCY = int(os.getenv('NYX_BATCH_CONCURRENCY', '8'))
+
+# Enrutado especulativo: con una confianza de nivel 1 en la zona gris
+# [SPECULATION_MIN_CONFIDENCE, LEVEL1_CONFIDENCE) se lanzan a la vez la skill local (si es de
+# solo lectura) y el análisis de Gemini, y gana el primer resultado aceptable
+SPECULATIVE_ROUTING = os.getenv('NYX_SPECULATIVE_ROUTING', 'false').lower() == 'true'
+SPECULATION_MIN_CONFIDENCE = float(os.getenv('NYX_SPECULATION_MIN_CONFIDENCE', '0.5'))
+
+# Expresiones que indican que la consulta necesita búsqueda web
+WEB_INDICATORS = [
+    'qué es', 'quién es', 'cuál es',
+    'noticias', 'último', 'reciente',
+    'información sobre', 'datos de',
+    'precio de', 'cotización',
+    'weather in', 'clima en',
+    'latest', 'news about'
+]
+keywords.register('web_search', WEB_INDICATORS)
+
 class QueryRouter:
     \"\"\"
     Enrutador de consultas que implementa el sistema de 3 niveles:
     1. Clasificación local de intenciones
     2. Razonamiento avanzado (Gemini)
     3. Búsqueda web en tiempo real (Perplexity)
+    
+    Cada nivel es un tier del registro (tiers.py); la configuración puede
+    añadir otros, p. ej. una base de conocimiento local delante de Gemini.
     \"\"\"
     
-    def __init__(self):
-        self.intent_classifier = IntentClassifier()
-        self.skill_manager = SkillManager()
-        self.gemini_client = GeminiClient()
-        self.perplexity_client = PerplexityClient()
-        self.budget_governor = BudgetGovernor()
+    def __init__(self, services: Optional[ServiceContainer] = None):
+        # Los clientes, el gobernador de presupuesto y las skills son los
+        # mismos que usan las skills y el resto del puente
+        self.services = services or ServiceContainer()
+        self.intent_classifier = self.services.intent_classifier
+        self.skill_manager = self.services.skill_manager
+        self.response_cache = self.services.response_cache
+        self.single_flight = self.services.single_flight
+        self.routing_policy = self.services.routing_policy
+        self.circuit_breakers = self.services.circuit_breakers
+        self.traffic_recorder = self.services.traffic_recorder
+        self.verdict_log = self.services.verdict_log
+        # Confianza con la que una intención se resuelve en el nivel 1 (la usa la destilación)
+        self.level1_confidence = LEVEL1_CONFIDENCE
+        
+        # Respuestas servidas por cada alternativa cuando falla una API externa
+        self.fallback_stats = {
+            'gemini_direct': 0,
+            'cache': 0,
+            'local_help': 0
+        }
+        
+        # Niveles configurados, del más barato al más caro
+        self.tiers = TierRegistry(self)
+        
+        # Resultados acumulados del enrutado especulativo
+        self.speculation_stats = {
+            'races': 0,
+            'level1_wins': 0,
+            'level2_wins': 0,
+            'prefetch_hits': 0,
+            'wasted_level1': 0,
+            'wasted_level2': 0,
+            'saved_ms': 0.0
+        }
+        # Media móvil de la latencia del análisis de Gemini, para estimar el ahorro
+        self._analysis_ms = None
         
         logger.info("Query Router inicializado")
     
-    async def route_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+    # Los clientes de APIs externas (y sus SDKs) se crean al usarlos por primera vez
+    @property
+    def gemini_client(self):
+        return self.services.gemini_client
+    
+    @property
+    def perplexity_client(self):
+        return self.services.perplexity_client
+    
+    @property
+    def budget_governor(self):
+        return self.services.budget_governor
+    
+    async def route_query(self, query: str, user_id: str = 'anonymous',
+                          classification: Optional[Tuple[Optional[str], float]] = None,
+                          use_cache: bool = True) -> Dict[str, Any]:
         \"\"\"
         Enruta una consulta a través del sistema de 3 niveles
+        
+        classification permite pasar el resultado previo de
+        IntentClassifier.classify() para no repetirlo. Con use_cache=False no se
+        consulta la caché de respuestas, pero el resultado nuevo sí se guarda.
+        
+        La consulta se normaliza aquí si no llega ya normalizada (normalization.py),
+        y el resto de etapas reutiliza esa NormalizedQuery.
+        \"\"\"
+        query = normalize(query)
+        capture = self.traffic_recorder.begin('query', query, user_id, use_cache)
+        result = None
+        
+        try:
+            if use_cache:
+                result = self.response_cache.get(query, user_id)
+                if result is not None:
+                    logger.info("Respuesta servida desde la caché")
+                    return result
+            else:
+                self.response_cache.record_bypass()
+            
+            result = await self._route(query, user_id, classification)
+            self.response_cache.put(query, user_id, result)
+            
+            return result
+        finally:
+            self.traffic_recorder.finish(capture, result)
+    
+    async def _route(self, query: str, user_id: str,
+                     classification: Optional[Tuple[Optional[str], float]]) -> Dict[str, Any]:
+        \"\"\"
+        Recorre los niveles de routing para una consulta no cacheada
         \"\"\"
         try:
             # Nivel 1: Clasificación local de intenciones
-            intent, confidence = self.intent_classifier.classify(query)
+            intent, confidence = classification or self.classify(query)
             
-            if intent and confidence >= 0.8:
-                logger.info(f"Nivel 1: Intent {intent} detectado con alta confianza")
-                return await self._handle_level1(query, intent, user_id)
+            # Las reglas proponen un nivel y la política de enrutado decide
+            with timing.stage('policy'):
+                decision = self.routing_policy.decide(
+                    query, intent, confidence, self._rule_level(query, intent, confidence)
+                )
+            traffic.note_decision(decision)
             
-            # Nivel 2: Determinar si necesita razonamiento o búsqueda web
-            needs_web_search = self._needs_web_search(query)
+            started = time.perf_counter()
+            result = await self._dispatch(query, user_id, intent, confidence, decision['level'])
+            self.routing_policy.record_outcome(decision, result, (time.perf_counter() - started) * 1000)
             
-            if needs_web_search:
-                logger.info("Nivel 3: Consulta requiere búsqueda web")
-                return await self._handle_level3(query, user_id)
-            else:
-                logger.info("Nivel 2: Consulta requiere razonamiento avanzado")
-                return await self._handle_level2(query, user_id)
+            return result
+        
+        except DeadlineExceeded as e:
+            logger.warning(f"{e}: consulta abandonada")
+            return self._deadline_result(e)
                 
         except Exception as e:
             logger.error(f"Error en routing: {e}")
@@ -489,97 +1503,432 @@ class QueryRouter:
                 'level': 'error'
             }
     
-    async def _handle_level1(self, query: str, intent: str, user_id: str) -> Dict[str, Any]:
+    def _rule_level(self, query: str, intent: Optional[str], confidence: float) -> int:
         \"\"\"
-        Maneja consultas del Nivel 1 (clasificación local)
+        Nivel que corresponde a una consulta según las reglas fijas
         \"\"\"
-        # Buscar skill que maneje este intent
-        skill_name = self._map_intent_to_skill(intent)
+        if intent and confidence >= LEVEL1_CONFIDENCE:
+            return 1
         
-        if skill_name:
-            context = {
-                'user_id': user_id,
-                'intent': intent,
-                'level': 1
-            }
+        # Nivel 2: Determinar si necesita razonamiento o búsqueda web
+        return 3 if self._needs_web_search(query) else 2
+    
+    async def _dispatch(self, query: str, user_id: str, intent: Optional[str],
+                        confidence: float, level: int) -> Dict[str, Any]:
+        \"\"\"
+        Ejecuta la consulta en el nivel decidido, con alternativas si falla su API
+        \"\"\"
+        result = await self._walk_tiers(query, TierContext(user_id, intent, confidence, level))
+        
+        if result.get('backend'):
+            result = await self._fall_back(query, user_id, result)
+        
+        return result
+    
+    async def _walk_tiers(self, query: str, context: TierContext) -> Dict[str, Any]:
+        \"\"\"
+        Prueba los niveles que pueden atender la consulta, del más barato al más
+        caro, hasta el primero que da una respuesta
+        \"\"\"
+        for tier in self.tiers.candidates(query, context):
+            tier.counters['attempts'] += 1
+            result = await tier.handle(query, context)
             
-            result = self.skill_manager.execute_skill(skill_name, query, context)
-            result['level'] = 1
-            result['method'] = 'local_classification'
+            if result is not None:
+                tier.counters['answered'] += 1
+                return result
             
-            return result
+            tier.counters['passed'] += 1
+            logger.info(f"Nivel {tier.name} sin respuesta, se prueba el siguiente")
         
-        # Si no hay skill disponible, pasar al nivel 2
-        return await self._handle_level2(query, user_id)
+        return self._no_tier_result()
     
-    async def _handle_level2(self, query: str, user_id: str) -> Dict[str, Any]:
+    def _deadline_result(self, error: DeadlineExceeded) -> Dict[str, Any]:
         \"\"\"
-        Maneja consultas del Nivel 2 (Gemini para razonamiento)
+        Resultado de una consulta cuyo plazo se agotó mientras se enrutaba
+        \"\"\"
+        return {
+            'error': str(error),
+            'success': False,
+            'level': 'error',
+            'deadline_exceeded': True,
+            'stage': error.stage
+        }
+    
+    def _no_tier_result(self) -> Dict[str, Any]:
+        return {
+            'error': 'Ningún nivel configurado puede atender la consulta',
+            'success': False,
+            'level': 'error'
+        }
+    
+    async def _run_skill(self, skill_name: str, query: str, context: TierContext) -> Dict[str, Any]:
+        \"\"\"
+        Nivel 1: ejecuta la skill de la intención detectada con alta confianza
+        \"\"\"
+        logger.info(f"Nivel 1: Intent {context.intent} detectado con alta confianza")
+        
+        result = await self.skill_manager.execute_skill(skill_name, query, self._skill_context(context))
+        result['level'] = 1
+        result['method'] = 'local_classification'
+        
+        return result
+    
+    def _skill_context(self, context: TierContext) -> Dict[str, Any]:
+        return {
+            'user_id': context.user_id,
+            'intent': context.intent,
+            'level': 1
+        }
+    
+    async def _run_gemini(self, query: str, context: TierContext) -> Dict[str, Any]:
+        \"\"\"
+        Nivel 2: análisis de Gemini, en paralelo con la skill local si procede especular
+        \"\"\"
+        if SPECULATIVE_ROUTING and context.intent and context.confidence >= SPECULATION_MIN_CONFIDENCE:
+            speculative = await self._route_speculative(query, context.intent, context.confidence, context.user_id)
+            if speculative is not None:
+                return speculative
+        
+        logger.info("Nivel 2: Consulta requiere razonamiento avanzado")
+        return await self._handle_level2(query, context.user_id)
+    
+    async def route_batch(self, items: List[Any], user_id: str = 'anonymous',
+                          use_cache: bool = True,
+                          classifications: Optional[Dict[str, Tuple[Optional[str], float]]] = None) -> Dict[str, Any]:
+        \"\"\"
+        Enruta un lote de consultas de forma concurrente
+        
+        Cada elemento es un texto o {'message': ..., 'userId': ...}. Las
+        consultas idénticas del mismo usuario se clasifican y ejecutan una sola
+        vez, y cada elemento recibe su propia copia del resultado, en el mismo
+        orden que la entrada. classifications permite pasar el resultado previo
+        de classify_batch() para no repetirlo.
+        \"\"\"
+        keys = [self._batch_key(item, user_id) for item in items]
+        unique = list(dict.fromkeys(keys))
+        
+        if classifications is None:
+            classifications = self.classify_batch(items)
+        
+        slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+        
+        async def run(key: Tuple[str, str]) -> Dict[str, Any]:
+            query, item_user = key
+            async with slots:
+                return await self.route_query(query, item_user, classifications.get(query), use_cache)
+        
+        outcomes = await asyncio.gather(*(run(key) for key in unique))
+        by_key = dict(zip(unique, outcomes))
+        
+        logger.info(f"Lote de {len(items)} consultas ({len(unique)} distintas) procesado")
+        
+        return {
+            'results': [copy.deepcopy(by_key[key]) for key in keys],
+            'count': len(items),
+            'unique': len(unique)
+        }
+    
+    def _batch_key(self, item: Any, user_id: str) -> Tuple[str, str]:
+        \"\"\"
+        Clave de deduplicación de un elemento del lote
+        \"\"\"
+        if isinstance(item, str):
+            item = {'message': item}
+        
+        return (normalize(str(item.get('message', '')).strip()), item.get('userId') or user_id)
+    
+    def classify(self, query: str) -> Tuple[Optional[str], float]:
+        \"\"\"
+        Clasificación local de una consulta, la que reciben predict_level() y route_query()
+        \"\"\"
+        with timing.stage('classify'):
+            return self.intent_classifier.classify(query)
+    
+    def classify_batch(self, items: List[Any]) -> Dict[str, Tuple[Optional[str], float]]:
+        \"\"\"
+        Clasifica una vez cada texto distinto de un lote, todo el lote a la vez
+        
+        Retorna la clasificación por consulta normalizada, como la espera route_batch().
+        \"\"\"
+        texts = list(dict.fromkeys(self._batch_key(item, '')[0] for item in items))
+        
+        with timing.stage('classify'):
+            return dict(zip(texts, self.intent_classifier.classify_batch(texts)))
+    
+    def predict_level(self, query: str, classification: Tuple[Optional[str], float]) -> int:
+        \"\"\"
+        Predice el nivel que atenderá una consulta sin ejecutar nada
+        
+        Recibe la clasificación de classify(), que después se pasa a
+        route_query() para no repetirla, y aplica las mismas reglas y la misma
+        política de enrutado sin contar la decisión. Solo hace trabajo local.
+        \"\"\"
+        query = normalize(query)
+        intent, confidence = classification
+        
+        if intent and confidence >= LEVEL1_CONFIDENCE and self._map_intent_to_skill(intent):
+            return 1
+        
+        proposed = 3 if self._needs_web_search(query) else 2
+        return self.routing_policy.predict(query, intent, confidence, proposed)
+    
+    async def route_query_stream(self, query: str, user_id: str = 'anonymous',
+                                 use_cache: bool = True,
+                                 classification: Optional[Tuple[Optional[str], float]] = None) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Enruta una consulta emitiendo el texto de la respuesta según se genera
+        
+        Produce {'chunk': texto} por cada fragmento y termina con {'result': ...},
+        el mismo Dict que retornaría route_query(). Una respuesta en caché se
+        emite en un solo fragmento. classification es como en route_query().
+        \"\"\"
+        query = normalize(query)
+        capture = self.traffic_recorder.begin('stream', query, user_id, use_cache)
+        result = None
+        
+        try:
+            async for event in self._route_stream(query, user_id, use_cache, classification):
+                if 'result' in event:
+                    result = event['result']
+                yield event
+        finally:
+            self.traffic_recorder.finish(capture, result)
+    
+    async def _route_stream(self, query: str, user_id: str, use_cache: bool,
+                            classification: Optional[Tuple[Optional[str], float]]) -> AsyncIterator[Dict[str, Any]]:
         \"\"\"
+        Recorre la caché y los niveles para route_query_stream()
+        \"\"\"
+        if use_cache:
+            cached = self.response_cache.get(query, user_id)
+            if cached is not None:
+                logger.info("Respuesta servida desde la caché (streaming)")
+                text = self._result_text(cached)
+                if text:
+                    yield {'chunk': text}
+                yield {'result': cached}
+                return
+        else:
+            self.response_cache.record_bypass()
+        
         try:
-            response = await self.gemini_client.analyze_query(query, user_id)
+            intent, confidence = classification or self.classify(query)
+            with timing.stage('policy'):
+                decision = self.routing_policy.decide(
+                    query, intent, confidence, self._rule_level(query, intent, confidence)
+                )
+            traffic.note_decision(decision)
+            context = TierContext(user_id, intent, confidence, decision['level'])
+            started = time.perf_counter()
+            streamed = False
             
-            # Si Gemini identifica que necesita ejecutar una skill
-            if response.get('skill_required'):
-                skill_name = response.get('skill_name')
-                structured_data = response.get('structured_data', {})
+            for tier in self.tiers.candidates(query, context):
+                tier.counters['attempts'] += 1
+                answered = False
                 
-                if skill_name:
-                    context = {
-                        'user_id': user_id,
-                        'level': 2,
-                        'gemini_analysis': response,
-                        'structured_data': structured_data
-                    }
-                    
-                    result = self.skill_manager.execute_skill(skill_name, query, context)
-                    result['level'] = 2
-                    result['method'] = 'gemini_reasoning'
-                    result['analysis'] = response
-                    
-                    return result
+                async for event in tier.stream(query, context):
+                    if 'result' in event:
+                        answered = True
+                        result = event['result']
+                        
+                        # Si la API falló antes de emitir nada, se sirve la alternativa
+                        if result.get('backend') and not streamed:
+                            result = await self._fall_back(query, user_id, result)
+                            text = self._result_text(result)
+                            if text:
+                                yield {'chunk': text}
+                            event = {'result': result}
+                        
+                        self.routing_policy.record_outcome(
+                            decision, result, (time.perf_counter() - started) * 1000
+                        )
+                        self.response_cache.put(query, user_id, result)
+                    else:
+                        streamed = True
+                    yield event
+                
+                if answered:
+                    tier.counters['answered'] += 1
+                    return
+                
+                tier.counters['passed'] += 1
+                logger.info(f"Nivel {tier.name} sin respuesta (streaming), se prueba el siguiente")
             
-            # Respuesta directa de Gemini
-            return {
+            yield {'result': self._no_tier_result()}
+        
+        except DeadlineExceeded as e:
+            logger.warning(f"{e}: consulta abandonada (streaming)")
+            yield {'result': self._deadline_result(e)}
+                
+        except Exception as e:
+            logger.error(f"Error en routing (streaming): {e}")
+            yield {
+                'result': {
+                    'error': str(e),
+                    'success': False,
+                    'level': 'error'
+                }
+            }
+    
+    async def _stream_local_skill(self, skill_name: str, query: str,
+                                  context: TierContext) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Nivel 1 en streaming
+        \"\"\"
+        logger.info(f"Nivel 1 (streaming): Intent {context.intent} detectado con alta confianza")
+        async for event in self._stream_skill(skill_name, query, self._skill_context(context),
+                                              1, 'local_classification'):
+            yield event
+    
+    async def _stream_gemini(self, query: str, context: TierContext) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Nivel 2 en streaming
+        
+        Decide con el mismo análisis de Gemini que route_query() (compartido con
+        las consultas idénticas y guardado para la destilación), así que llega
+        a la misma skill o a la misma respuesta directa; esta se vuelve a pedir
+        a Gemini en streaming para emitirla según se genera.
+        \"\"\"
+        if SPECULATIVE_ROUTING and context.intent and context.confidence >= SPECULATION_MIN_CONFIDENCE:
+            # La especulación compite con la skill local: sin streaming, como en route_query()
+            async for event in self._stream_result(self._run_gemini(query, context)):
+                yield event
+            return
+        
+        logger.info("Nivel 2 (streaming): Consulta requiere razonamiento avanzado")
+        
+        try:
+            analysis = await self._analyze(query, context.user_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 2 (streaming): {e}")
+            yield {'result': self._backend_error({'error': str(e)}, 2, 'gemini')}
+            return
+        
+        skill_name = analysis.get('skill_name') if analysis.get('success') is not False else None
+        if analysis.get('skill_required') and skill_name:
+            async for event in self._stream_skill(skill_name, query, self._level2_context(context.user_id, analysis),
+                                                  2, 'gemini_reasoning'):
+                if 'result' in event:
+                    event['result']['analysis'] = analysis
+                yield event
+            return
+        
+        if analysis.get('success') is False:
+            yield {'result': self._backend_error(analysis, 2, 'gemini')}
+            return
+        
+        async for event in self._stream_level2(query, context.user_id, analysis):
+            yield event
+    
+    async def _stream_level2(self, query: str, user_id: str,
+                             analysis: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Respuesta directa de Gemini emitida según se genera
+        
+        Si el streaming falla antes del primer fragmento se sirve la respuesta
+        que ya traía el análisis.
+        \"\"\"
+        parts = []
+        
+        try:
+            async for text in self.gemini_client.stream_response(query, user_id):
+                parts.append(text)
+                yield {'chunk': text}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not parts:
+                logger.warning(f"Streaming de Gemini no disponible, se usa la respuesta del análisis: {e}")
+                async for event in self._stream_result(self._complete_level2(query, user_id, analysis)):
+                    yield event
+                return
+            
+            logger.error(f"Error en Nivel 2 (streaming): {e}")
+            yield {
+                'result': self._backend_error(
+                    {'error': str(e), 'circuit_open': isinstance(e, CircuitOpen)}, 2, 'gemini'
+                )
+            }
+            return
+        
+        yield {
+            'result': {
                 'success': True,
                 'level': 2,
                 'method': 'gemini_direct',
                 'result': {
-                    'response': response.get('response', ''),
+                    'response': ''.join(parts),
                     'type': 'text',
-                    'analysis': response
+                    'analysis': analysis
                 }
             }
-            
-        except Exception as e:
-            logger.error(f"Error en Nivel 2: {e}")
-            return {
-                'error': str(e),
-                'success': False,
-                'level': 2
-            }
+        }
     
-    async def _handle_level3(self, query: str, user_id: str) -> Dict[str, Any]:
+    async def _stream_skill(self, skill_name: str, query: str, context: Dict[str, Any],
+                            level: int, method: str) -> AsyncIterator[Dict[str, Any]]:
         \"\"\"
-        Maneja consultas del Nivel 3 (Perplexity para búsqueda web)
+        Ejecuta una skill en streaming y etiqueta el resultado final con el nivel
         \"\"\"
-        try:
-            # Verificar presupuesto
-            if not self.budget_governor.can_spend():
-                return {
+        async for event in self.skill_manager.execute_skill_stream(skill_name, query, context):
+            if 'result' in event:
+                event['result']['level'] = level
+                event['result']['method'] = method
+            yield event
+    
+    async def _stream_result(self, pending) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Adapta un resultado no incremental al formato de streaming
+        \"\"\"
+        result = await pending
+        text = self._result_text(result)
+        
+        if text:
+            yield {'chunk': text}
+        yield {'result': result}
+    
+    async def _stream_level3(self, query: str, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Búsqueda de Perplexity emitida según se genera
+        \"\"\"
+        logger.info("Nivel 3 (streaming): Consulta requiere búsqueda web")
+        
+        if not self.budget_governor.can_spend():
+            yield {
+                'result': {
                     'error': 'Presupuesto de búsqueda web agotado',
                     'success': False,
                     'level': 3,
                     'budget_exceeded': True
                 }
-            
-            response = await self.perplexity_client.search(query, user_id)
-            
-            # Registrar gasto en el presupuesto
-            estimated_cost = self.perplexity_client.estimate_cost(response)
-            self.budget_governor.record_usage(estimated_cost)
-            
-            return {
+            }
+            return
+        
+        response = {}
+        
+        try:
+            async for event in self.perplexity_client.search_stream(query, user_id):
+                if 'chunk' in event:
+                    yield event
+                else:
+                    response = event['response']
+        except asyncio.CancelledError:
+            self.budget_governor.record_abandoned({'query': query[:100], 'level': 3})
+            raise
+        
+        if not response.get('success'):
+            yield {
+                'result': self._backend_error(response, 3, 'perplexity')
+            }
+            return
+        
+        estimated_cost = self.perplexity_client.estimate_cost(response)
+        self.budget_governor.record_usage(estimated_cost)
+        
+        yield {
+            'result': {
                 'success': True,
                 'level': 3,
                 'method': 'perplexity_search',
@@ -590,63 +1939,467 @@ class QueryRouter:
                     'cost': estimated_cost
                 }
             }
-            
-        except Exception as e:
-            logger.error(f"Error en Nivel 3: {e}")
-            return {
-                'error': str(e),
-                'success': False,
-                'level': 3
-            }
+        }
     
-    def _needs_web_search(self, query: str) -> bool:
+    def _result_text(self, result: Dict[str, Any]) -> str:
         \"\"\"
-        Determina si una consulta necesita búsqueda web
+        Extrae el texto mostrable de un resultado de routing
         \"\"\"
-        web_indicators = [
-            'qué es', 'quién es', 'cuál es',
-            'noticias', 'último', 'reciente',
-            'información sobre', 'datos de',
-            'precio de', 'cotización',
-            'weather in', 'clima en',
-            'latest', 'news about'
-        ]
+        inner = result.get('result')
         
-        query_lower = query.lower()
+        if isinstance(inner, dict):
+            for key in ('response', 'content'):
+                if isinstance(inner.get(key), str):
+                    return inner[key]
         
-        return any(indicator in query_lower for indicator in web_indicators)
+        return ''
     
-    def _map_intent_to_skill(self, intent: str) -> Optional[str]:
+    async def _route_speculative(self, query: str, intent: str, confidence: float,
+                                 user_id: str) -> Optional[Dict[str, Any]]:
         \"\"\"
-        Mapea una intención a una skill específica
+        Ejecuta a la vez la skill del nivel 1 y el análisis de Gemini
+        
+        Si la skill termina antes con un resultado válido, gana y se cancela
+        Gemini. Si Gemini termina antes y elige la misma acción de la skill, se
+        reutiliza el resultado adelantado (p. ej. los eventos del calendario) en
+        lugar de ejecutarla otra vez. Retorna None si la skill no admite
+        ejecución especulativa.
         \"\"\"
-        mapping = {
-            'calendar': 'calendar',
-            'search': None,  # Se maneja en nivel 3
-            'weather': None,  # Se maneja en nivel 3
-            'general': None   # Se maneja en nivel 2
+        skill_name = self._map_intent_to_skill(intent)
+        context = {
+            'user_id': user_id,
+            'intent': intent,
+            'level': 1,
+            'speculative': True
         }
         
-        return mapping.get(intent)
-"""
-
-with open('nyx/bridge/src/query_router.py', 'w') as f:
-    f.write(query_router)
-
-print("✅ Query Router creado")
-
-# 5. requirements.txt del bridge
-bridge_requirements = """# APIs de IA
-google-generativeai>=0.3.2
-google-auth>=2.23.4
-google-auth-oauthlib>=1.1.0
-google-auth-httplib2>=0.1.1
-google-api-python-client>=2.108.0
-
+        key = self.skill_manager.get_speculation_key(skill_name, query, context) if skill_name else None
+        if key is None:
+            return None
+        
+        logger.info(f"Especulación: {skill_name}/{key} en paralelo con Gemini (confianza {confidence:.2f})")
+        
+        started = time.perf_counter()
+        finished = {}
+        
+        def track(name):
+            return lambda _: finished.setdefault(name, (time.perf_counter() - started) * 1000)
+        
+        level1 = asyncio.create_task(self.skill_manager.execute_skill(skill_name, query, context))
+        level2 = asyncio.create_task(self._analyze(query, user_id))
+        level1.add_done_callback(track('level1'))
+        level2.add_done_callback(track('level2'))
+        
+        try:
+            await asyncio.wait({level1, level2}, return_when=asyncio.FIRST_COMPLETED)
+            
+            # La skill local terminó primero con un resultado válido
+            if level1.done() and not level2.done() and self._acceptable(level1.result()):
+                level2.cancel()
+                result = level1.result()
+                result['level'] = 1
+                result['method'] = 'speculative_local'
+                return self._report_speculation(result, intent, confidence, started, finished,
+                                                winner='level1', wasted='level2')
+            
+            analysis = await level2
+            
+            if analysis.get('skill_required') and analysis.get('skill_name') == skill_name:
+                level2_context = self._level2_context(user_id, analysis)
+                same_action = self.skill_manager.get_speculation_key(skill_name, query, level2_context) == key
+                
+                if same_action:
+                    result = await level1
+                    if self._acceptable(result):
+                        result['level'] = 2
+                        result['method'] = 'gemini_reasoning'
+                        result['analysis'] = analysis
+                        return self._report_speculation(result, intent, confidence, started, finished,
+                                                        winner='level2', prefetch=True)
+            
+            # Gemini eligió otra cosa: el resultado adelantado no sirve
+            level1.cancel()
+            result = await self._complete_level2(query, user_id, analysis)
+            return self._report_speculation(result, intent, confidence, started, finished,
+                                            winner='level2', wasted='level1')
+        finally:
+            for task in (level1, level2):
+                if not task.done():
+                    task.cancel()
+    
+    def _acceptable(self, result: Dict[str, Any]) -> bool:
+        \"\"\"
+        Un resultado de skill es aceptable si ni la ejecución ni la skill fallaron
+        \"\"\"
+        inner = result.get('result')
+        return bool(result.get('success')) and not (isinstance(inner, dict) and inner.get('success') is False)
+    
+    def _report_speculation(self, result: Dict[str, Any], intent: str, confidence: float,
+                            started: float, finished: Dict[str, float], winner: str,
+                            wasted: Optional[str] = None, prefetch: bool = False) -> Dict[str, Any]:
+        \"\"\"
+        Añade al resultado el informe de la especulación y actualiza las estadísticas
+        
+        saved_ms estima la latencia ahorrada frente al camino secuencial
+        (análisis de Gemini y después la skill).
+        \"\"\"
+        elapsed = (time.perf_counter() - started) * 1000
+        level1_ms = finished.get('level1')
+        level2_ms = finished.get('level2') if wasted != 'level2' else None
+        
+        if level2_ms is not None:
+            self._analysis_ms = level2_ms if self._analysis_ms is None else 0.8 * self._analysis_ms + 0.2 * level2_ms
+        
+        if prefetch:
+            # Secuencial: análisis + skill; especulativo: el más lento de los dos
+            saved = min(level1_ms or 0.0, level2_ms or 0.0)
+        elif winner == 'level1':
+            # Gemini se canceló: su latencia se estima con la media observada
+            saved = max(0.0, (self._analysis_ms or 0.0) - elapsed)
+        else:
+            saved = 0.0
+        
+        stats = self.speculation_stats
+        stats['races'] += 1
+        stats[f'{winner}_wins'] += 1
+        stats['saved_ms'] = round(stats['saved_ms'] + saved, 1)
+        if prefetch:
+            stats['prefetch_hits'] += 1
+        if wasted:
+            stats[f'wasted_{wasted}'] += 1
+        
+        report = {
+            'intent': intent,
+            'confidence': round(confidence, 2),
+            'winner': winner,
+            'prefetch_used': prefetch,
+            'wasted': wasted,
+            'level1_ms': round(level1_ms, 1) if level1_ms is not None else None,
+            'level2_ms': round(level2_ms, 1) if level2_ms is not None else None,
+            'elapsed_ms': round(elapsed, 1),
+            'saved_ms': round(saved, 1)
+        }
+        logger.info(f"Especulación: {report}")
+        
+        result['speculation'] = report
+        return result
+    
+    async def _handle_level2(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Maneja consultas del Nivel 2 (Gemini para razonamiento)
+        \"\"\"
+        try:
+            response = await self._analyze(query, user_id)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 2: {e}")
+            return self._backend_error({'error': str(e)}, 2, 'gemini')
+        
+        return await self._complete_level2(query, user_id, response)
+    
+    async def _analyze(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Análisis de Gemini, compartido por las consultas idénticas en curso
+        
+        El prompt de análisis no incluye datos del usuario, así que la clave
+        es solo la consulta normalizada.
+        \"\"\"
+        return await deadline.within(
+            self.single_flight.do(
+                ('gemini_analysis', normalize(query).key),
+                lambda: self._analyze_and_log(query, user_id)
+            ),
+            'gemini.analysis'
+        )
+    
+    async def _analyze_and_log(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Llamada a Gemini; su decisión se guarda para destilarla en el clasificador local
+        \"\"\"
+        analysis = await self.gemini_client.analyze_query(query, user_id)
+        self.verdict_log.record(query, analysis)
+        return analysis
+    
+    async def _complete_level2(self, query: str, user_id: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Actúa según el análisis de Gemini: ejecutar una skill o responder directamente
+        \"\"\"
+        try:
+            if response.get('success') is False:
+                return self._backend_error(response, 2, 'gemini')
+            
+            # Si Gemini identifica que necesita ejecutar una skill
+            if response.get('skill_required'):
+                skill_name = response.get('skill_name')
+                
+                if skill_name:
+                    context = self._level2_context(user_id, response)
+                    result = await self.skill_manager.execute_skill(skill_name, query, context)
+                    result['level'] = 2
+                    result['method'] = 'gemini_reasoning'
+                    result['analysis'] = response
+                    
+                    return result
+            
+            # Respuesta directa de Gemini
+            return {
+                'success': True,
+                'level': 2,
+                'method': 'gemini_direct',
+                'result': {
+                    'response': response.get('response', ''),
+                    'type': 'text',
+                    'analysis': response
+                }
+            }
+            
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 2: {e}")
+            return {
+                'error': str(e),
+                'success': False,
+                'level': 2
+            }
+    
+    def _level2_context(self, user_id: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Contexto de la skill que elige el análisis de Gemini
+        \"\"\"
+        return {
+            'user_id': user_id,
+            'level': 2,
+            'gemini_analysis': analysis,
+            'structured_data': analysis.get('structured_data', {})
+        }
+    
+    async def _handle_level3(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Maneja consultas del Nivel 3 (Perplexity para búsqueda web)
+        \"\"\"
+        logger.info("Nivel 3: Consulta requiere búsqueda web")
+        
+        try:
+            # Verificar presupuesto
+            if not self.budget_governor.can_spend():
+                return {
+                    'error': 'Presupuesto de búsqueda web agotado',
+                    'success': False,
+                    'level': 3,
+                    'budget_exceeded': True
+                }
+            
+            # Las búsquedas idénticas en curso se hacen y se cobran una sola vez
+            search = await deadline.within(
+                self.single_flight.do(
+                    ('perplexity', normalize(query).key),
+                    lambda: self._search_and_charge(query, user_id)
+                ),
+                'perplexity.search'
+            )
+            response = search['response']
+            estimated_cost = search['cost']
+            
+            if not response.get('success'):
+                return self._backend_error(response, 3, 'perplexity')
+            
+            return {
+                'success': True,
+                'level': 3,
+                'method': 'perplexity_search',
+                'result': {
+                    'response': response.get('answer', ''),
+                    'sources': response.get('sources', []),
+                    'type': 'search_result',
+                    'cost': estimated_cost
+                }
+            }
+            
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Error en Nivel 3: {e}")
+            return self._backend_error({'error': str(e)}, 3, 'perplexity')
+    
+    async def _search_and_charge(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Búsqueda de Perplexity con su registro en el presupuesto
+        \"\"\"
+        try:
+            response = await self.perplexity_client.search(query, user_id)
+        except asyncio.CancelledError:
+            # Todas las requests que esperaban la búsqueda se cancelaron: se
+            # aborta pero se deja constancia
+            self.budget_governor.record_abandoned({'query': query[:100], 'level': 3})
+            raise
+        
+        # Registrar gasto en el presupuesto
+        estimated_cost = self.perplexity_client.estimate_cost(response)
+        self.budget_governor.record_usage(estimated_cost)
+        
+        return {
+            'response': response,
+            'cost': estimated_cost
+        }
+    
+    def _backend_error(self, response: Dict[str, Any], level: int, backend: str) -> Dict[str, Any]:
+        \"\"\"
+        Resultado de error de un nivel cuya API externa falló o tiene el circuito abierto
+        
+        backend indica a _fall_back() qué API hay que evitar.
+        \"\"\"
+        return {
+            'error': response.get('error', 'Error desconocido'),
+            'success': False,
+            'level': level,
+            'backend': backend,
+            'circuit_open': bool(response.get('circuit_open'))
+        }
+    
+    async def _fall_back(self, query: str, user_id: str, failed: Dict[str, Any]) -> Dict[str, Any]:
+        \"\"\"
+        Alternativas cuando falla la API externa de un nivel
+        
+        Perplexity -> respuesta directa de Gemini -> respuesta en caché (aunque
+        haya caducado) -> ayuda local. Con el circuito abierto la API caída ni
+        se intenta, así que la alternativa llega sin esperar a su timeout. Si no
+        queda ninguna, se retorna el error original.
+        \"\"\"
+        backend = failed['backend']
+        logger.warning(
+            f"{backend} no disponible ({'circuito abierto' if failed.get('circuit_open') else failed.get('error')}), "
+            f"se busca una alternativa"
+        )
+        
+        if backend == 'perplexity':
+            direct = await self._gemini_direct(query, user_id)
+            if direct.get('success'):
+                return self._mark_fallback(direct, failed, 'gemini_direct')
+        
+        cached = self.response_cache.get_stale(query, user_id)
+        if cached is not None:
+            return self._mark_fallback(cached, failed, 'cache')
+        
+        help_result = self._local_help(backend)
+        if help_result is not None:
+            return self._mark_fallback(help_result, failed, 'local_help')
+        
+        return failed
+    
+    async def _gemini_direct(self, query: str, user_id: str) -> Dict[str, Any]:
+        \"\"\"
+        Respuesta directa de Gemini sin skills, como alternativa a Perplexity
+        \"\"\"
+        try:
+            response = await deadline.within(
+                self.single_flight.do(
+                    ('gemini_answer', normalize(query).key),
+                    lambda: self.gemini_client.answer_query(query, user_id)
+                ),
+                'gemini.answer'
+            )
+        except Exception as e:
+            # También DeadlineExceeded: aún quedan la caché y la ayuda local
+            logger.warning(f"Alternativa Gemini no disponible: {e}")
+            return {'error': str(e), 'success': False}
+        
+        if not response.get('success'):
+            return response
+        
+        return {
+            'success': True,
+            'level': 2,
+            'method': 'gemini_direct',
+            'result': {
+                'response': response.get('response', ''),
+                'type': 'text'
+            }
+        }
+    
+    def _local_help(self, backend: str) -> Optional[Dict[str, Any]]:
+        \"\"\"
+        Respuesta local con lo que Nyx puede hacer sin la API caída
+        \"\"\"
+        try:
+            skills = [
+                skill for skill in self.skill_manager.get_available_skills()
+                if skill['name'] != backend
+            ]
+        except Exception as e:
+            logger.error(f"Error preparando la ayuda local: {e}")
+            return None
+        
+        lines = ['Ahora mismo no puedo consultar mis servicios externos; inténtalo de nuevo en unos minutos.']
+        if skills:
+            lines.append('Mientras tanto puedo ayudarte con:')
+            lines.extend(f"- {skill['name']}: {skill['description']}" for skill in skills)
+        
+        return {
+            'success': True,
+            'level': 1,
+            'method': 'local_help',
+            'result': {
+                'response': '\\n'.join(lines),
+                'type': 'help'
+            }
+        }
+    
+    def _mark_fallback(self, result: Dict[str, Any], failed: Dict[str, Any], source: str) -> Dict[str, Any]:
+        \"\"\"
+        Indica en el resultado que es una alternativa y por qué
+        \"\"\"
+        self.fallback_stats[source] += 1
+        logger.info(f"Alternativa servida: {source} (en lugar de {failed['backend']})")
+        
+        result['fallback'] = {
+            'source': source,
+            'from': failed['backend'],
+            'reason': 'circuit_open' if failed.get('circuit_open') else 'error',
+            'error': failed.get('error')
+        }
+        return result
+    
+    def _needs_web_search(self, query: str) -> bool:
+        \"\"\"
+        Determina si una consulta necesita búsqueda web
+        \"\"\"
+        return 'web_search' in keywords.matches(query)
+    
+    def _map_intent_to_skill(self, intent: str) -> Optional[str]:
+        \"\"\"
+        Mapea una intención a una skill específica
+        
+        El mapa es el parámetro 'intents' del nivel local_skill; las
+        intenciones sin skill (search, weather, general) siguen por Gemini o Perplexity.
+        \"\"\"
+        return self.tiers.skill_for_intent(intent)
+"""
+
+with open('nyx/bridge/src/query_router.py', 'w') as f:
+    f.write(query_router)
+
+print("✅ Query Router creado")
+
+# 5. requirements.txt del bridge
+bridge_requirements = """# APIs de IA
+google-generativeai>=0.3.2
+google-auth>=2.23.4
+google-auth-oauthlib>=1.1.0
+google-auth-httplib2>=0.1.1
+google-api-python-client>=2.108.0
+
 # HTTP y requests
 aiohttp>=3.9.1
 requests>=2.31.0
 
+# Protocolo binario con Node (opcional, si falta se usa JSON compacto)
+msgpack>=1.0.7
+
+# Modelo local de intenciones (opcional, solo con NYX_INTENT_MODEL)
+numpy>=1.24.0
+
 # Utilidades
 python-dotenv>=1.0.0
 asyncio>=3.4.3
@@ -654,6 +2407,7 @@ typing>=3.7.4
 
 # Logging y desarrollo
 colorlog>=6.8.0
+pytest>=7.4.0
 """
 
 with open('nyx/bridge/requirements.txt', 'w') as f:
@@ -661,4 +2415,4382 @@ with open('nyx/bridge/requirements.txt', 'w') as f:
 
 print("✅ requirements.txt del bridge creado")
 
+# 6. Protocolo de mensajes Node <-> Python
+bridge_protocol = """\"\"\"
+Protocolo de mensajes entre Node.js y el puente Python
+
+Por defecto se usa JSON delimitado por saltos de línea (ndjson). Si Node envía
+un mensaje 'hello' como primera línea, ambos lados cambian a un protocolo con
+framing binario: prefijo de longitud de 4 bytes (big-endian) seguido del
+mensaje en MessagePack o JSON compacto.
+\"\"\"
+
+import json
+import struct
+import asyncio
+from typing import Dict, Any, Iterator, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional
+    msgpack = None
+
+HEADER = struct.Struct('>I')
+
+# Tamaño máximo de un mensaje (Node acepta cuerpos de hasta 10mb)
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+# Protocolos por orden de preferencia
+PROTOCOLS = ['framed-msgpack', 'framed-json', 'ndjson']
+
+class ProtocolError(ValueError):
+    \"\"\"
+    Mensaje que no se puede decodificar
+    \"\"\"
+    pass
+
+class NdjsonCodec:
+    \"\"\"
+    Un mensaje JSON por línea
+    \"\"\"
+    
+    name = 'ndjson'
+    
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        \"\"\"
+        Serializa un mensaje como una línea JSON
+        \"\"\"
+        return (json.dumps(message) + '\\n').encode('utf-8')
+    
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        \"\"\"
+        Decodifica una línea JSON
+        \"\"\"
+        try:
+            return json.loads(payload)
+        except ValueError as e:
+            raise ProtocolError(str(e))
+    
+    async def read(self, reader) -> Optional[Dict[str, Any]]:
+        \"\"\"
+        Lee el siguiente mensaje; None al cerrarse stdin
+        \"\"\"
+        while True:
+            line = await reader.readline()
+            
+            if not line:
+                return None
+            
+            line = line.strip()
+            if line:
+                return self.decode(line)
+    
+    def iter_messages(self, buffer: bytes) -> Iterator[Dict[str, Any]]:
+        \"\"\"
+        Decodifica todos los mensajes de un buffer completo
+        \"\"\"
+        for line in buffer.split(b'\\n'):
+            if line.strip():
+                yield self.decode(line)
+
+class FramedCodec:
+    \"\"\"
+    Prefijo de longitud + MessagePack o JSON compacto
+    \"\"\"
+    
+    def __init__(self, serializer: str = 'json'):
+        if serializer == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack no está instalado")
+        
+        self.serializer = serializer
+        self.name = f'framed-{serializer}'
+    
+    def _dumps(self, message: Dict[str, Any]) -> bytes:
+        if self.serializer == 'msgpack':
+            return msgpack.packb(message, use_bin_type=True)
+        return json.dumps(message, separators=(',', ':')).encode('utf-8')
+    
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        \"\"\"
+        Serializa un mensaje como frame con prefijo de longitud
+        \"\"\"
+        payload = self._dumps(message)
+        return HEADER.pack(len(payload)) + payload
+    
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        \"\"\"
+        Decodifica el payload de un frame
+        \"\"\"
+        try:
+            if self.serializer == 'msgpack':
+                return msgpack.unpackb(payload, raw=False)
+            return json.loads(payload)
+        except Exception as e:
+            raise ProtocolError(str(e))
+    
+    async def read(self, reader) -> Optional[Dict[str, Any]]:
+        \"\"\"
+        Lee el siguiente frame; None al cerrarse stdin
+        \"\"\"
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError:
+            return None
+        
+        (length,) = HEADER.unpack(header)
+        if length > MAX_MESSAGE_BYTES:
+            # Sin framing válido no hay forma de resincronizar el stream
+            raise ConnectionError(f"Frame demasiado grande: {length} bytes")
+        
+        try:
+            payload = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        
+        return self.decode(payload)
+    
+    def iter_messages(self, buffer: bytes) -> Iterator[Dict[str, Any]]:
+        \"\"\"
+        Decodifica todos los frames de un buffer completo
+        \"\"\"
+        offset = 0
+        end = len(buffer)
+        
+        while offset + HEADER.size <= end:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            offset += HEADER.size
+            yield self.decode(buffer[offset:offset + length])
+            offset += length
+
+def supported_protocols() -> List[str]:
+    \"\"\"
+    Protocolos disponibles en este proceso
+    \"\"\"
+    return [name for name in PROTOCOLS if name != 'framed-msgpack' or msgpack is not None]
+
+def negotiate(offered: List[str]) -> str:
+    \"\"\"
+    Elige el primer protocolo ofrecido por Node que este lado soporte
+    \"\"\"
+    supported = supported_protocols()
+    
+    for name in offered or []:
+        if name in supported:
+            return name
+    
+    return 'ndjson'
+
+def get_codec(name: str):
+    \"\"\"
+    Retorna el codec para un protocolo negociado
+    \"\"\"
+    if name == 'framed-msgpack':
+        return FramedCodec('msgpack')
+    if name == 'framed-json':
+        return FramedCodec('json')
+    return NdjsonCodec()
+"""
+
+with open('nyx/bridge/src/protocol.py', 'w') as f:
+    f.write(bridge_protocol)
+
+print("✅ Protocolo del puente creado")
+
+# 7. Benchmark del protocolo
+import os
+os.makedirs('nyx/bridge/benchmarks', exist_ok=True)
+
+bench_protocol = """#!/usr/bin/env python3
+\"\"\"
+Benchmark de throughput del protocolo Node <-> Python
+
+Compara ndjson (json.dumps + salto de línea, split por '\\\\n') con el framing
+por prefijo de longitud en JSON compacto y MessagePack. Mide codificar un lote
+de mensajes y decodificarlo desde un buffer, como hacen ambos extremos del pipe.
+
+Uso:
+    python benchmarks/bench_protocol.py [--messages 2000] [--payload events|search|small]
+\"\"\"
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, Any, List
+
+sys.path.append(str(Path(__file__).parent.parent / 'src'))
+
+import protocol
+
+def build_payload(kind: str) -> Dict[str, Any]:
+    \"\"\"
+    Construye una respuesta representativa del puente
+    \"\"\"
+    if kind == 'events':
+        events = [
+            {
+                'id': f'evt{i:04d}',
+                'title': f'Reunión de seguimiento {i}',
+                'start': '2024-05-%02dT10:00:00Z' % (i % 28 + 1),
+                'end': '2024-05-%02dT11:00:00Z' % (i % 28 + 1),
+                'location': 'Sala 3\\nEdificio B',
+                'attendees': [f'persona{j}@example.com' for j in range(5)],
+                'description': 'Revisión semanal del proyecto. ' * 8
+            }
+            for i in range(50)
+        ]
+        result = {'content': events, 'type': 'calendar_events', 'skill': 'calendar'}
+    elif kind == 'search':
+        answer = ('La inteligencia artificial avanza rápidamente.\\n' * 80)
+        sources = [{'id': str(i), 'title': f'Fuente {i}', 'url': f'https://example.com/{i}'} for i in range(10)]
+        result = {'response': answer, 'sources': sources, 'type': 'search_result', 'cost': 0.0012}
+    else:
+        result = {'response': 'Hola, ¿en qué puedo ayudarte?', 'type': 'text'}
+    
+    return {
+        'success': True,
+        'requestId': 1718030400123.4567,
+        'data': {'success': True, 'level': 2, 'method': 'gemini_direct', 'result': result}
+    }
+
+def run_codec(codec, messages: List[Dict[str, Any]]) -> Dict[str, float]:
+    \"\"\"
+    Codifica y decodifica todos los mensajes, midiendo cada fase
+    \"\"\"
+    start = time.perf_counter()
+    buffer = b''.join(codec.encode(message) for message in messages)
+    encoded = time.perf_counter()
+    decoded_count = sum(1 for _ in codec.iter_messages(buffer))
+    finished = time.perf_counter()
+    
+    assert decoded_count == len(messages)
+    
+    total = finished - start
+    return {
+        'bytes': len(buffer),
+        'encode_s': encoded - start,
+        'decode_s': finished - encoded,
+        'msgs_per_s': len(messages) / total,
+        'mb_per_s': len(buffer) / total / (1024 * 1024)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del protocolo del puente')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--payload', choices=['events', 'search', 'small'], default=None,
+                        help='Tipo de payload (por defecto, todos)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    kinds = [args.payload] if args.payload else ['small', 'search', 'events']
+    codecs = [protocol.get_codec(name) for name in reversed(protocol.supported_protocols())]
+    
+    if 'framed-msgpack' not in protocol.supported_protocols():
+        print("(msgpack no instalado: se omite framed-msgpack)\\n")
+    
+    print(f"{'payload':<8} {'protocolo':<15} {'bytes/msg':>10} {'msgs/s':>12} {'MB/s':>9} {'enc ms':>9} {'dec ms':>9}")
+    
+    for kind in kinds:
+        messages = [build_payload(kind) for _ in range(args.messages)]
+        
+        for codec in codecs:
+            # Mejor de N repeticiones para reducir ruido
+            runs = [run_codec(codec, messages) for _ in range(args.repeat)]
+            best = max(runs, key=lambda r: r['msgs_per_s'])
+            
+            print(
+                f"{kind:<8} {codec.name:<15} {best['bytes'] // len(messages):>10} "
+                f"{best['msgs_per_s']:>12.0f} {best['mb_per_s']:>9.1f} "
+                f"{best['encode_s'] * 1000:>9.1f} {best['decode_s'] * 1000:>9.1f}"
+            )
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/benchmarks/bench_protocol.py', 'w') as f:
+    f.write(bench_protocol)
+
+print("✅ Benchmark del protocolo creado")
+
+# 8. Planificador con carriles de prioridad
+bridge_scheduler = """\"\"\"
+Planificador de requests del puente con carriles de prioridad
+
+Las consultas locales (nivel 1, listado de skills) y las que dependen de APIs
+externas (Gemini, Perplexity) van por carriles separados, cada uno con su
+propia concurrencia y una cola acotada. Así una ráfaga de llamadas lentas no
+retrasa a las rápidas, y cuando un carril está lleno la request se rechaza de
+inmediato con una estimación de cuándo reintentar.
+\"\"\"
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+FAST_LANE = 'fast'
+SLOW_LANE = 'slow'
+
+class LaneOverloaded(Exception):
+    \"\"\"
+    El carril no admite más requests en este momento
+    \"\"\"
+    
+    def __init__(self, lane: str, retry_after: float):
+        super().__init__(f"Carril {lane} saturado")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class Lane:
+    \"\"\"
+    Carril con concurrencia limitada y cola de espera acotada
+    \"\"\"
+    
+    def __init__(self, name: str, concurrency: int, max_queue: int, default_service_time: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        
+        # Media móvil exponencial del tiempo de servicio, para estimar retry_after
+        self.service_time = default_service_time
+    
+    @property
+    def full(self) -> bool:
+        return self.queued >= self.max_queue and self.running >= self.concurrency
+    
+    def retry_after(self) -> float:
+        \"\"\"
+        Segundos estimados hasta que se libere sitio en la cola
+        \"\"\"
+        backlog = self.queued + self.running
+        return max(1.0, round(backlog / self.concurrency * self.service_time, 1))
+    
+    async def run(self, job: Callable[[], Awaitable[Any]]) -> Any:
+        \"\"\"
+        Ejecuta un trabajo en cuanto haya un hueco libre en el carril
+        \"\"\"
+        if self.full:
+            self.rejected += 1
+            raise LaneOverloaded(self.name, self.retry_after())
+        
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        
+        self.running += 1
+        start = time.monotonic()
+        try:
+            return await job()
+        finally:
+            elapsed = time.monotonic() - start
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'concurrency': self.concurrency,
+            'max_queue': self.max_queue,
+            'running': self.running,
+            'queued': self.queued,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_service_ms': round(self.service_time * 1000, 1)
+        }
+
+class RequestScheduler:
+    \"\"\"
+    Reparte las requests entre el carril rápido y el lento
+    \"\"\"
+    
+    def __init__(self):
+        self.lanes = {
+            FAST_LANE: Lane(
+                FAST_LANE,
+                concurrency=int(os.getenv('NYX_BRIDGE_FAST_CONCURRENCY', '16')),
+                max_queue=int(os.getenv('NYX_BRIDGE_FAST_QUEUE', '256')),
+                default_service_time=0.05
+            ),
+            SLOW_LANE: Lane(
+                SLOW_LANE,
+                concurrency=int(os.getenv('NYX_BRIDGE_SLOW_CONCURRENCY', '16')),
+                max_queue=int(os.getenv('NYX_BRIDGE_SLOW_QUEUE', '64')),
+                default_service_time=2.0
+            )
+        }
+        
+        for lane in self.lanes.values():
+            logger.info(f"Carril {lane.name}: concurrencia {lane.concurrency}, cola {lane.max_queue}")
+    
+    async def submit(self, lane_name: str, job: Callable[[], Awaitable[Any]]) -> Any:
+        \"\"\"
+        Ejecuta un trabajo en el carril indicado
+        
+        Lanza LaneOverloaded si el carril está lleno.
+        \"\"\"
+        return await self.lanes[lane_name].run(job)
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+"""
+
+with open('nyx/bridge/src/scheduler.py', 'w') as f:
+    f.write(bridge_scheduler)
+
+print("✅ Planificador del puente creado")
+
+# 9. Perfilado del arranque
+bridge_startup = """\"\"\"
+Perfilado del arranque del puente (--profile-startup)
+
+Mide el tiempo de importación de cada módulo y el de inicialización de cada
+componente, y escribe un informe en stderr cuando el puente está listo. Los
+componentes que se crean bajo demanda se informan cuando se usan por primera vez.
+\"\"\"
+
+import sys
+import time
+import threading
+import importlib.abc
+from contextlib import contextmanager
+from typing import List, Tuple
+
+# Módulos que se muestran en el informe
+REPORT_TOP_IMPORTS = 20
+
+class _TimedLoader:
+    \"\"\"
+    Envuelve el loader de un módulo para medir su ejecución
+    \"\"\"
+    
+    def __init__(self, loader, profiler: 'StartupProfiler'):
+        self._loader = loader
+        self._profiler = profiler
+    
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+    
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+    
+    def exec_module(self, module):
+        self._profiler._enter_import()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit_import(module.__name__, time.perf_counter() - start)
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    \"\"\"
+    Finder que delega en los demás y envuelve el loader encontrado
+    \"\"\"
+    
+    def __init__(self, profiler: 'StartupProfiler'):
+        self.profiler = profiler
+    
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self.profiler)
+                return spec
+        
+        return None
+
+class StartupProfiler:
+    \"\"\"
+    Recoge tiempos de importación e inicialización; inactivo por defecto
+    \"\"\"
+    
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        # (módulo, tiempo total, tiempo propio, profundidad)
+        self.imports: List[Tuple[str, float, float, int]] = []
+        self.components: List[Tuple[str, float]] = []
+        self.reported = False
+        self.first_response = False
+        # Pila de tiempos de importaciones anidadas, por hilo
+        self._local = threading.local()
+    
+    def enable(self):
+        \"\"\"
+        Activa el perfilado; debe llamarse antes de importar los módulos a medir
+        \"\"\"
+        if self.enabled:
+            return
+        
+        self.enabled = True
+        self.started = time.perf_counter()
+        sys.meta_path.insert(0, _ImportTimer(self))
+    
+    def _stack(self) -> List[float]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+    
+    def _enter_import(self):
+        self._stack().append(0.0)
+    
+    def _exit_import(self, name: str, elapsed: float):
+        stack = self._stack()
+        children = stack.pop()
+        depth = len(stack)
+        
+        if stack:
+            stack[-1] += elapsed
+        
+        self.imports.append((name, elapsed, elapsed - children, depth))
+    
+    @contextmanager
+    def stage(self, name: str):
+        \"\"\"
+        Mide la inicialización de un componente
+        \"\"\"
+        if not self.enabled:
+            yield
+            return
+        
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.components.append((name, elapsed))
+            
+            if self.reported:
+                self._write(f"[startup] {name} inicializado bajo demanda en {elapsed * 1000:.1f} ms")
+    
+    def mark_first_response(self, description: str):
+        \"\"\"
+        Registra el tiempo hasta la primera respuesta enviada a Node
+        \"\"\"
+        if not self.enabled or self.first_response:
+            return
+        
+        self.first_response = True
+        self._write(f"[startup] Primera respuesta ({description}) a los {self._since_start():.1f} ms")
+    
+    def report(self):
+        \"\"\"
+        Escribe en stderr el informe de arranque
+        \"\"\"
+        if not self.enabled:
+            return
+        
+        self.reported = True
+        lines = [f"[startup] Puente listo en {self._since_start():.1f} ms"]
+        
+        lines.append("[startup] Componentes:")
+        for name, elapsed in self.components:
+            lines.append(f"[startup]   {elapsed * 1000:>9.1f} ms  {name}")
+        
+        total_imports = sum(elapsed for _, elapsed, _, depth in self.imports if depth == 0)
+        lines.append(f"[startup] Importaciones ({len(self.imports)} módulos, {total_imports * 1000:.1f} ms):")
+        lines.append(f"[startup]   {'total':>9}    {'propio':>9}     módulo")
+        
+        slowest = sorted(self.imports, key=lambda item: item[1], reverse=True)[:REPORT_TOP_IMPORTS]
+        for name, elapsed, own, depth in slowest:
+            lines.append(f"[startup]   {elapsed * 1000:>9.1f} ms {own * 1000:>9.1f} ms  {'  ' * depth}{name}")
+        
+        self._write('\\n'.join(lines))
+    
+    def _since_start(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def _write(self, text: str):
+        sys.stderr.write(text + '\\n')
+        sys.stderr.flush()
+
+# Instancia compartida por main.py y los módulos de src
+profiler = StartupProfiler()
+"""
+
+with open('nyx/bridge/src/startup.py', 'w') as f:
+    f.write(bridge_startup)
+
+print("✅ Perfilado de arranque del puente creado")
+
+# 10. Contenedor de servicios compartidos
+bridge_services = """\"\"\"
+Contenedor de servicios compartidos del puente
+
+Cada cliente, gobernador y gestor existe una sola vez por proceso y se inyecta
+en el router y en las skills. Los servicios se crean en el primer uso, así que
+los SDKs de las APIs externas no se importan hasta que hacen falta.
+\"\"\"
+
+import logging
+from typing import Any, Callable, Dict, List
+
+import timing
+from startup import profiler
+
+logger = logging.getLogger(__name__)
+
+def _intent_classifier(services: 'ServiceContainer'):
+    from intent_classifier import IntentClassifier
+    return IntentClassifier()
+
+def _skill_manager(services: 'ServiceContainer'):
+    from skill_manager import SkillManager
+    return SkillManager(services)
+
+def _gemini_client(services: 'ServiceContainer'):
+    from gemini_client import GeminiClient
+    client = GeminiClient(breaker=services.circuit_breakers.get('gemini'))
+    return services.traffic_recorder.wrap(client, 'gemini')
+
+def _perplexity_client(services: 'ServiceContainer'):
+    from perplexity_client import PerplexityClient
+    client = PerplexityClient(breaker=services.circuit_breakers.get('perplexity'))
+    return services.traffic_recorder.wrap(client, 'perplexity')
+
+def _budget_governor(services: 'ServiceContainer'):
+    from budget_governor import BudgetGovernor
+    return BudgetGovernor()
+
+def _calendar_client(services: 'ServiceContainer'):
+    from calendar_client import CalendarClient
+    return CalendarClient()
+
+def _circuit_breakers(services: 'ServiceContainer'):
+    from circuit_breaker import CircuitBreakers
+    return CircuitBreakers()
+
+def _traffic_recorder(services: 'ServiceContainer'):
+    from traffic import TrafficRecorder
+    return TrafficRecorder()
+
+def _verdict_log(services: 'ServiceContainer'):
+    from distillation import VerdictLog
+    return VerdictLog()
+
+def _response_cache(services: 'ServiceContainer'):
+    from response_cache import ResponseCache
+    return ResponseCache()
+
+def _single_flight(services: 'ServiceContainer'):
+    from single_flight import SingleFlight
+    return SingleFlight()
+
+def _routing_policy(services: 'ServiceContainer'):
+    from routing_policy import RoutingPolicyEngine
+    return RoutingPolicyEngine(services)
+
+DEFAULT_SERVICES = {
+    'intent_classifier': _intent_classifier,
+    'skill_manager': _skill_manager,
+    'gemini_client': _gemini_client,
+    'perplexity_client': _perplexity_client,
+    'budget_governor': _budget_governor,
+    'calendar_client': _calendar_client,
+    'circuit_breakers': _circuit_breakers,
+    'traffic_recorder': _traffic_recorder,
+    'verdict_log': _verdict_log,
+    'response_cache': _response_cache,
+    'single_flight': _single_flight,
+    'routing_policy': _routing_policy
+}
+
+class ServiceContainer:
+    \"\"\"
+    Registro de servicios con creación perezosa
+    
+    Se accede por nombre (services.get('budget_governor')) o como atributo
+    (services.budget_governor).
+    \"\"\"
+    
+    def __init__(self):
+        self._factories: Dict[str, Callable[['ServiceContainer'], Any]] = dict(DEFAULT_SERVICES)
+        self._instances: Dict[str, Any] = {}
+    
+    def register(self, name: str, factory: Callable[['ServiceContainer'], Any]):
+        \"\"\"
+        Registra o reemplaza la fábrica de un servicio
+        \"\"\"
+        self._factories[name] = factory
+        self._instances.pop(name, None)
+    
+    def provide(self, name: str, instance: Any):
+        \"\"\"
+        Registra una instancia ya creada
+        \"\"\"
+        self._instances[name] = instance
+    
+    def get(self, name: str) -> Any:
+        \"\"\"
+        Retorna el servicio, creándolo la primera vez
+        \"\"\"
+        if name not in self._instances:
+            if name not in self._factories:
+                raise KeyError(f"Servicio no registrado: {name}")
+            
+            with profiler.stage(name), timing.stage(f'init.{name}'):
+                self._instances[name] = self._factories[name](self)
+            
+            logger.info(f"Servicio creado: {name}")
+        
+        return self._instances[name]
+    
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        
+        try:
+            return self.get(name)
+        except KeyError as e:
+            raise AttributeError(str(e))
+    
+    def created(self) -> List[str]:
+        \"\"\"
+        Nombres de los servicios ya instanciados
+        \"\"\"
+        return list(self._instances)
+"""
+
+with open('nyx/bridge/src/services.py', 'w') as f:
+    f.write(bridge_services)
+
+print("✅ Contenedor de servicios del puente creado")
+
+# 11. Caché de respuestas del router
+bridge_response_cache = """\"\"\"
+Caché de respuestas del router
+
+Guarda los resultados de route_query() por consulta normalizada y usuario, de
+modo que una pregunta repetida se responde sin volver a llamar a Gemini ni a
+Perplexity ni cargarla al presupuesto. Cada entrada caduca según el nivel que
+la resolvió y la categoría de la consulta, y al llegar al tamaño máximo se
+descartan las entradas usadas hace más tiempo (LRU). Las entradas caducadas se
+conservan un tiempo más como último recurso mientras Gemini y Perplexity no
+están disponibles.
+\"\"\"
+
+import os
+import copy
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from query_categories import categorize_query
+from normalization import normalize, normalize_query
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv('NYX_RESPONSE_CACHE', 'true').lower() == 'true'
+CACHE_MAX_ENTRIES = int(os.getenv('NYX_RESPONSE_CACHE_SIZE', '1000'))
+
+# Segundos que se conserva una entrada caducada para servirla si fallan las APIs
+CACHE_MAX_STALE = int(os.getenv('NYX_CACHE_MAX_STALE', '86400'))
+
+# TTL máximo (segundos) según el nivel que resolvió la consulta. El nivel 1
+# lee datos personales que cambian (calendario), así que caduca pronto
+LEVEL_TTLS = {
+    1: int(os.getenv('NYX_CACHE_TTL_LEVEL1', '60')),
+    2: int(os.getenv('NYX_CACHE_TTL_LEVEL2', '86400')),
+    3: int(os.getenv('NYX_CACHE_TTL_LEVEL3', '86400'))
+}
+
+# TTL máximo según la categoría de la consulta; se aplica el menor de los dos
+CATEGORY_TTLS = {
+    'news': 600,
+    'financial': 60,
+    'weather': 900,
+    'definition': 86400,
+    'biography': 86400,
+    'general': 3600
+}
+
+# Resultados con efectos secundarios: no se guardan e invalidan lo del usuario
+SIDE_EFFECT_TYPES = {'event_created'}
+
+# Resultados que dependen del estado del momento y no se guardan
+UNCACHEABLE_TYPES = {'budget_exceeded'}
+
+# Ámbito de las respuestas que no dependen del usuario (Gemini directo, Perplexity)
+SHARED_SCOPE = '*'
+
+def cache_key(query: str) -> str:
+    \"\"\"
+    Clave de una consulta en la caché: normalize_query() de la forma sin
+    tildes, así que "reunión" y "reunion" comparten entrada
+    \"\"\"
+    return normalize_query(normalize(query).folded)
+
+class ResponseCache:
+    \"\"\"
+    Caché LRU con TTL por nivel y categoría
+    \"\"\"
+    
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, enabled: bool = CACHE_ENABLED,
+                 max_stale: int = CACHE_MAX_STALE):
+        self.max_entries = max(1, max_entries)
+        self.enabled = enabled
+        self.max_stale = max(0, max_stale)
+        
+        # (consulta normalizada, ámbito) -> (caduca, guardado, categoría, resultado)
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[float, float, str, Dict[str, Any]]]' = OrderedDict()
+        
+        self.stats_counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+        
+        logger.info(f"Caché de respuestas: {'activa' if enabled else 'desactivada'}, máximo {self.max_entries} entradas")
+    
+    def get(self, query: str, user_id: str) -> Optional[Dict[str, Any]]:
+        \"\"\"
+        Retorna una copia del resultado guardado, o None si no hay uno vigente
+        
+        Se busca primero en las respuestas del usuario y después en las compartidas.
+        \"\"\"
+        if not self.enabled:
+            return None
+        
+        hit = self._find(query, user_id, stale=False)
+        self.stats_counters['hits' if hit is not None else 'misses'] += 1
+        return hit
+    
+    def get_stale(self, query: str, user_id: str) -> Optional[Dict[str, Any]]:
+        \"\"\"
+        Como get(), pero admite entradas caducadas hace menos de max_stale segundos
+        
+        Es el último recurso cuando no se puede consultar la API que respondería;
+        el resultado lleva cache['stale'] = True si ya había caducado.
+        \"\"\"
+        if not self.enabled:
+            return None
+        
+        hit = self._find(query, user_id, stale=True)
+        if hit is not None:
+            self.stats_counters['stale_hits'] += 1
+        return hit
+    
+    def _find(self, query: str, user_id: str, stale: bool) -> Optional[Dict[str, Any]]:
+        normalized = cache_key(query)
+        now = time.monotonic()
+        
+        for scope in (user_id, SHARED_SCOPE):
+            entry = self._lookup((normalized, scope), now, stale=stale)
+            if entry is None:
+                continue
+            
+            expires, stored, category, result = entry
+            
+            hit = copy.deepcopy(result)
+            hit['cache'] = {
+                'hit': True,
+                'scope': 'user' if scope != SHARED_SCOPE else 'shared',
+                'category': category,
+                'age_s': round(now - stored, 1),
+                'ttl_s': round(expires - now, 1)
+            }
+            if expires <= now:
+                hit['cache']['stale'] = True
+            return hit
+        
+        return None
+    
+    def contains(self, query: str, user_id: str) -> bool:
+        \"\"\"
+        Indica si hay un resultado vigente sin contarlo como acierto
+        \"\"\"
+        if not self.enabled:
+            return False
+        
+        normalized = cache_key(query)
+        now = time.monotonic()
+        
+        return any(
+            self._lookup((normalized, scope), now, touch=False) is not None
+            for scope in (user_id, SHARED_SCOPE)
+        )
+    
+    def record_bypass(self):
+        \"\"\"
+        Cuenta una consulta que pidió saltarse la caché
+        \"\"\"
+        self.stats_counters['bypassed'] += 1
+    
+    def put(self, query: str, user_id: str, result: Dict[str, Any]):
+        \"\"\"
+        Guarda el resultado de una consulta si se puede reutilizar
+        \"\"\"
+        if not self.enabled:
+            return
+        
+        inner = result.get('result')
+        result_type = inner.get('type') if isinstance(inner, dict) else None
+        
+        if result_type in SIDE_EFFECT_TYPES:
+            # Lo guardado del usuario (p. ej. su agenda de hoy) ya no es válido
+            self.invalidate(user_id)
+            return
+        
+        if not self._cacheable(result, inner, result_type):
+            return
+        
+        category = categorize_query(query)
+        ttl = min(LEVEL_TTLS.get(result['level'], 0), CATEGORY_TTLS.get(category, 0))
+        if ttl <= 0:
+            return
+        
+        # Lo que pasa por una skill depende del usuario; Gemini y Perplexity no
+        scope = user_id if 'skill' in result or result['level'] == 1 else SHARED_SCOPE
+        key = (cache_key(query), scope)
+        now = time.monotonic()
+        
+        stored = copy.deepcopy(result)
+        stored.pop('cache', None)
+        
+        self._entries[key] = (now + ttl, now, category, stored)
+        self._entries.move_to_end(key)
+        self.stats_counters['stores'] += 1
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats_counters['evictions'] += 1
+    
+    def invalidate(self, user_id: Optional[str] = None):
+        \"\"\"
+        Descarta las respuestas de un usuario, o todas si no se indica ninguno
+        \"\"\"
+        if user_id is None:
+            removed = len(self._entries)
+            self._entries.clear()
+        else:
+            keys = [key for key in self._entries if key[1] == user_id]
+            for key in keys:
+                del self._entries[key]
+            removed = len(keys)
+        
+        if removed:
+            self.stats_counters['invalidations'] += removed
+            logger.info(f"Caché de respuestas: {removed} entradas invalidadas")
+    
+    def stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Métricas de uso de la caché
+        \"\"\"
+        lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+        
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hit_rate': round(self.stats_counters['hits'] / lookups, 3) if lookups else 0.0,
+            **self.stats_counters
+        }
+    
+    def _lookup(self, key: Tuple[str, str], now: float, touch: bool = True, stale: bool = False):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        if entry[0] + self.max_stale <= now:
+            del self._entries[key]
+            self.stats_counters['expirations'] += 1
+            return None
+        
+        # Caducada pero aún dentro del margen: solo sirve para get_stale()
+        if entry[0] <= now and not stale:
+            return None
+        
+        if touch:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def _cacheable(self, result: Dict[str, Any], inner: Any, result_type: Optional[str]) -> bool:
+        \"\"\"
+        Solo se guardan resultados correctos de un nivel conocido
+        \"\"\"
+        if not result.get('success') or result.get('level') not in LEVEL_TTLS:
+            return False
+        if result.get('fallback'):
+            # Respuesta de emergencia mientras una API falla: no sustituye a la buena
+            return False
+        if isinstance(inner, dict) and inner.get('success') is False:
+            return False
+        return result_type not in UNCACHEABLE_TYPES
+"""
+
+with open('nyx/bridge/src/response_cache.py', 'w') as f:
+    f.write(bridge_response_cache)
+
+print("✅ Caché de respuestas del puente creada")
+
+# 12. Política de enrutado adaptativa
+bridge_routing_policy = """\"\"\"
+Política de enrutado según latencia, errores y coste de cada nivel
+
+Las reglas fijas del router (confianza del clasificador, palabras clave de
+búsqueda web) proponen un nivel y la política activa decide el definitivo con
+las estadísticas recientes de cada nivel e intención y el estado del
+presupuesto. Cada decisión se guarda junto con su resultado (nivel servido,
+latencia, éxito, coste) para poder evaluar las políticas fuera de línea.
+\"\"\"
+
+import os
+import math
+import time
+import logging
+from collections import deque
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, Any, Iterator, Optional, Tuple, Type
+
+import deadline
+from deadline import DeadlineExceeded
+from jsonl_writer import JsonlWriter
+from query_categories import categorize_query
+
+logger = logging.getLogger(__name__)
+
+ROUTING_POLICY = os.getenv('NYX_ROUTING_POLICY', 'static')
+
+# Ventana de las estadísticas: últimas N muestras de los últimos M segundos
+STATS_MAX_SAMPLES = int(os.getenv('NYX_POLICY_WINDOW', '200'))
+STATS_MAX_AGE = float(os.getenv('NYX_POLICY_WINDOW_SECONDS', '900'))
+
+# Umbrales de la política adaptativa
+MAX_P95_MS = float(os.getenv('NYX_POLICY_MAX_P95_MS', '10000'))
+MAX_ERROR_RATE = float(os.getenv('NYX_POLICY_MAX_ERROR_RATE', '0.5'))
+MIN_SAMPLES = int(os.getenv('NYX_POLICY_MIN_SAMPLES', '5'))
+BUDGET_TIGHT_PERCENT = float(os.getenv('NYX_POLICY_BUDGET_TIGHT', '75'))
+
+# Fichero JSONL con las decisiones (vacío: solo en memoria)
+DECISION_LOG = os.getenv('NYX_ROUTING_DECISION_LOG', '')
+
+# Tiempo mínimo que tiene que quedar del plazo de la request para intentar
+# cada nivel; si no llega para Perplexity se responde con Gemini
+DEADLINE_MIN_LEVEL2 = float(os.getenv('NYX_DEADLINE_MIN_LEVEL2_MS', '2000')) / 1000
+DEADLINE_MIN_LEVEL3 = float(os.getenv('NYX_DEADLINE_MIN_LEVEL3_MS', '6000')) / 1000
+
+# Categorías que necesitan datos actuales aunque el presupuesto vaya justo
+FRESH_CATEGORIES = {'news', 'financial', 'weather'}
+
+class RollingStats:
+    \"\"\"
+    Latencia, errores y coste de las últimas muestras
+    \"\"\"
+    
+    def __init__(self, max_samples: int = STATS_MAX_SAMPLES, max_age: float = STATS_MAX_AGE):
+        self.max_age = max_age
+        # (instante, latencia en ms, éxito, coste)
+        self.samples = deque(maxlen=max(1, max_samples))
+    
+    def add(self, latency_ms: float, ok: bool, cost: float = 0.0):
+        self.samples.append((time.monotonic(), latency_ms, ok, cost))
+    
+    def summary(self) -> Dict[str, Any]:
+        \"\"\"
+        Percentiles de latencia, tasa de error y coste medio de la ventana
+        \"\"\"
+        cutoff = time.monotonic() - self.max_age
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        
+        count = len(self.samples)
+        if not count:
+            return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'error_rate': 0.0, 'avg_cost': 0.0}
+        
+        latencies = sorted(sample[1] for sample in self.samples)
+        errors = sum(1 for sample in self.samples if not sample[2])
+        
+        return {
+            'count': count,
+            'p50_ms': round(self._percentile(latencies, 0.5), 1),
+            'p95_ms': round(self._percentile(latencies, 0.95), 1),
+            'error_rate': round(errors / count, 3),
+            'avg_cost': round(sum(sample[3] for sample in self.samples) / count, 6)
+        }
+    
+    def _percentile(self, ordered, fraction: float) -> float:
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class RoutingStats:
+    \"\"\"
+    Estadísticas por nivel, en total ('*') y por intención
+    \"\"\"
+    
+    def __init__(self):
+        self._stats: Dict[Tuple[int, str], RollingStats] = {}
+    
+    def record(self, level: int, intent: Optional[str], latency_ms: float, ok: bool, cost: float = 0.0):
+        for key in ((level, '*'), (level, intent or 'none')):
+            if key not in self._stats:
+                self._stats[key] = RollingStats()
+            self._stats[key].add(latency_ms, ok, cost)
+    
+    def summary(self, level: int, intent: str = '*') -> Dict[str, Any]:
+        stats = self._stats.get((level, intent))
+        return stats.summary() if stats else RollingStats().summary()
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result: Dict[str, Dict[str, Any]] = {}
+        for (level, intent), stats in sorted(self._stats.items()):
+            result.setdefault(f'level{level}', {})[intent] = stats.summary()
+        return result
+
+class LazyBudget(Mapping):
+    \"\"\"
+    Estado del presupuesto que solo se pide a BudgetGovernor al leerlo
+    
+    Las consultas de nivel 1 con la política estática no llegan a crear el
+    servicio (ServiceContainer lo crea la primera vez que se usa).
+    \"\"\"
+    
+    def __init__(self, services):
+        self._services = services
+        self._status: Optional[Dict[str, Any]] = None
+    
+    @property
+    def loaded(self) -> bool:
+        return self._status is not None
+    
+    def _load(self) -> Dict[str, Any]:
+        if self._status is None:
+            self._status = self._services.budget_governor.get_budget_status()
+        return self._status
+    
+    def __getitem__(self, key: str) -> Any:
+        return self._load()[key]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+    
+    def __len__(self) -> int:
+        return len(self._load())
+
+class RoutingPolicy:
+    \"\"\"
+    Decide el nivel definitivo de una consulta
+    
+    proposed es el nivel que eligen las reglas fijas del router (1, 2 o 3).
+    Retorna (nivel, motivo). budget es el estado de BudgetGovernor, que solo
+    se consulta (y se crea el servicio) si la política lo lee.
+    \"\"\"
+    
+    name = 'base'
+    
+    def decide(self, query: str, intent: Optional[str], confidence: float, proposed: int,
+               stats: RoutingStats, budget: Mapping) -> Tuple[int, str]:
+        raise NotImplementedError
+
+class StaticPolicy(RoutingPolicy):
+    \"\"\"
+    Usa siempre el nivel de las reglas fijas
+    \"\"\"
+    
+    name = 'static'
+    
+    def decide(self, query, intent, confidence, proposed, stats, budget):
+        return proposed, 'rules'
+
+class AdaptivePolicy(RoutingPolicy):
+    \"\"\"
+    Responde con Gemini en lugar de Perplexity cuando la búsqueda web está
+    lenta, falla a menudo o el presupuesto no da para ella
+    \"\"\"
+    
+    name = 'adaptive'
+    
+    def __init__(self, max_p95_ms: float = MAX_P95_MS, max_error_rate: float = MAX_ERROR_RATE,
+                 min_samples: int = MIN_SAMPLES, budget_tight_percent: float = BUDGET_TIGHT_PERCENT):
+        self.max_p95_ms = max_p95_ms
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.budget_tight_percent = budget_tight_percent
+    
+    def decide(self, query, intent, confidence, proposed, stats, budget):
+        if proposed != 3:
+            return proposed, 'rules'
+        
+        if not budget.get('can_spend', True):
+            return 2, 'budget_exhausted'
+        
+        if (budget.get('percentage_used', 0) >= self.budget_tight_percent
+                and categorize_query(query) not in FRESH_CATEGORIES):
+            return 2, 'budget_tight'
+        
+        if self._degraded(stats.summary(3)) and not self._degraded(stats.summary(2)):
+            return 2, 'perplexity_degraded'
+        
+        return 3, 'rules'
+    
+    def _degraded(self, summary: Dict[str, Any]) -> bool:
+        if summary['count'] < self.min_samples:
+            return False
+        return summary['p95_ms'] > self.max_p95_ms or summary['error_rate'] > self.max_error_rate
+
+# Políticas disponibles por nombre (NYX_ROUTING_POLICY)
+POLICIES: Dict[str, Type[RoutingPolicy]] = {
+    StaticPolicy.name: StaticPolicy,
+    AdaptivePolicy.name: AdaptivePolicy
+}
+
+def register_policy(policy_class: Type[RoutingPolicy]):
+    \"\"\"
+    Añade una política seleccionable con NYX_ROUTING_POLICY
+    \"\"\"
+    POLICIES[policy_class.name] = policy_class
+    return policy_class
+
+class RoutingPolicyEngine:
+    \"\"\"
+    Aplica la política activa y registra decisiones y resultados
+    \"\"\"
+    
+    def __init__(self, services, policy: Optional[RoutingPolicy] = None, log_path: str = DECISION_LOG):
+        self.services = services
+        self.stats = RoutingStats()
+        self.recent = deque(maxlen=100)
+        self.log = JsonlWriter(log_path, 'la decisión de enrutado')
+        self.counters = {'decisions': 0, 'overrides': 0, 'deadline_exceeded': 0}
+        
+        if policy is None:
+            if ROUTING_POLICY not in POLICIES:
+                logger.warning(f"Política de enrutado desconocida: {ROUTING_POLICY}, se usa 'static'")
+            policy = POLICIES.get(ROUTING_POLICY, StaticPolicy)()
+        self.policy = policy
+        
+        logger.info(f"Política de enrutado: {self.policy.name}")
+    
+    def decide(self, query: str, intent: Optional[str], confidence: float, proposed: int) -> Dict[str, Any]:
+        \"\"\"
+        Retorna la decisión para una consulta; decision['level'] es el nivel elegido
+        
+        Lanza DeadlineExceeded si el plazo de la request no llega para el nivel elegido.
+        \"\"\"
+        budget = LazyBudget(self.services)
+        level, reason = self.policy.decide(query, intent, confidence, proposed, self.stats, budget)
+        level, reason = self._fit_deadline(level, reason)
+        
+        self.counters['decisions'] += 1
+        if level != proposed:
+            self.counters['overrides'] += 1
+            logger.info(f"Política {self.policy.name}: nivel {proposed} -> {level} ({reason})")
+        
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'query': query[:100],
+            'intent': intent,
+            'confidence': round(confidence, 3),
+            'proposed': proposed,
+            'level': level,
+            'policy': self.policy.name,
+            'reason': reason,
+            'budget_used': budget.get('percentage_used') if budget.loaded else None,
+            'remaining_ms': round(deadline.remaining() * 1000) if deadline.remaining() is not None else None
+        }
+    
+    def predict(self, query: str, intent: Optional[str], confidence: float, proposed: int) -> int:
+        \"\"\"
+        Nivel que elegiría la política para una consulta, sin contar ni guardar la decisión
+        \"\"\"
+        level, _ = self.policy.decide(query, intent, confidence, proposed, self.stats, LazyBudget(self.services))
+        return level
+    
+    def _fit_deadline(self, level: int, reason: str) -> Tuple[int, str]:
+        \"\"\"
+        Ajusta el nivel al tiempo que le queda a la request
+        \"\"\"
+        left = deadline.remaining()
+        if left is None or level == 1:
+            return level, reason
+        
+        if level == 3 and left < DEADLINE_MIN_LEVEL3:
+            level, reason = 2, 'deadline'
+        
+        if left < DEADLINE_MIN_LEVEL2:
+            self.counters['deadline_exceeded'] += 1
+            raise DeadlineExceeded(f'nivel {level}')
+        
+        return level, reason
+    
+    def record_outcome(self, decision: Dict[str, Any], result: Dict[str, Any], latency_ms: float):
+        \"\"\"
+        Actualiza las estadísticas con el resultado y guarda la decisión completa
+        \"\"\"
+        inner = result.get('result')
+        level = result.get('level') if result.get('level') in (1, 2, 3) else decision['level']
+        ok = bool(result.get('success')) and not (isinstance(inner, dict) and inner.get('success') is False)
+        cost = inner.get('cost', 0.0) if isinstance(inner, dict) else 0.0
+        
+        fallback = result.get('fallback')
+        if fallback:
+            # La API del nivel elegido falló: la alternativa no cuenta como acierto suyo
+            level, ok = decision['level'], False
+            decision['fallback'] = fallback['source']
+        
+        self.stats.record(level, decision['intent'], latency_ms, ok, cost or 0.0)
+        
+        decision.update({
+            'served_level': level,
+            'latency_ms': round(latency_ms, 1),
+            'success': ok,
+            'cost': cost or 0.0
+        })
+        self.recent.append(decision)
+        self.log.append(decision)
+    
+    def summary(self) -> Dict[str, Any]:
+        \"\"\"
+        Política activa, contadores, estadísticas por nivel y últimas decisiones
+        \"\"\"
+        return {
+            'policy': self.policy.name,
+            **self.counters,
+            'tiers': self.stats.snapshot(),
+            'recent': list(self.recent)[-10:]
+        }
+"""
+
+with open('nyx/bridge/src/routing_policy.py', 'w') as f:
+    f.write(bridge_routing_policy)
+
+print("✅ Política de enrutado del puente creada")
+
+# 13. Registro de niveles del router
+bridge_tiers = """\"\"\"
+Registro de niveles (tiers) del router
+
+Cada nivel declara su coste por consulta, su latencia esperada y un predicado
+can_handle(). El router recorre los niveles que pueden atender la consulta de
+menor a mayor coste (y, a igual coste, de menor latencia) y se queda con la
+primera respuesta; un nivel que no tiene una respuesta segura retorna None y
+la consulta pasa al siguiente.
+
+El orden y los parámetros se leen del fichero JSON de NYX_ROUTING_TIERS; sin
+él se usan los tres niveles de siempre: skill local, Gemini y Perplexity.
+\"\"\"
+
+import os
+import json
+import importlib
+import logging
+from typing import Dict, Any, AsyncIterator, List, Optional, Type
+
+from normalization import normalize
+
+logger = logging.getLogger(__name__)
+
+# Fichero JSON con la lista de niveles (vacío: DEFAULT_TIERS)
+TIERS_CONFIG = os.getenv('NYX_ROUTING_TIERS', '')
+
+# Coste en dólares por consulta y latencia típica en ms de cada nivel
+DEFAULT_TIERS = [
+    {'type': 'local_skill', 'cost': 0.0, 'latency_ms': 50, 'intents': {'calendar': 'calendar'}},
+    {'type': 'gemini', 'cost': 0.0005, 'latency_ms': 1500},
+    {'type': 'perplexity', 'cost': 0.005, 'latency_ms': 3000}
+]
+
+class TierContext:
+    \"\"\"
+    Lo que sabe el router de una consulta al recorrer los niveles
+    
+    level es el nivel mínimo que necesita según las reglas y la política de
+    enrutado: 1 (local), 2 (razonamiento) o 3 (búsqueda web).
+    \"\"\"
+    
+    def __init__(self, user_id: str, intent: Optional[str], confidence: float, level: int):
+        self.user_id = user_id
+        self.intent = intent
+        self.confidence = confidence
+        self.level = level
+
+class RoutingTier:
+    \"\"\"
+    Nivel del router
+    
+    level es la capacidad del nivel en la escala 1-3: por defecto atiende las
+    consultas que necesitan ese nivel o uno inferior. handle() retorna el
+    resultado con el formato de route_query(), o None si no tiene una
+    respuesta segura.
+    \"\"\"
+    
+    type = 'base'
+    level = 2
+    
+    def __init__(self, router, name: Optional[str] = None, cost: float = 0.0,
+                 latency_ms: float = 1000, **params):
+        self.router = router
+        self.name = name or self.type
+        self.cost = float(cost)
+        self.latency_ms = float(latency_ms)
+        self.params = params
+        self.counters = {'attempts': 0, 'answered': 0, 'passed': 0}
+    
+    def can_handle(self, query: str, context: TierContext) -> bool:
+        return context.level <= self.level
+    
+    async def handle(self, query: str, context: TierContext) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    async def stream(self, query: str, context: TierContext) -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Versión en streaming de handle(); por defecto emite la respuesta en un fragmento
+        
+        Si el nivel no tiene respuesta no emite ningún evento.
+        \"\"\"
+        result = await self.handle(query, context)
+        if result is None:
+            return
+        
+        text = self.router._result_text(result)
+        if text:
+            yield {'chunk': text}
+        yield {'result': result}
+    
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'type': self.type,
+            'level': self.level,
+            'cost': self.cost,
+            'latency_ms': self.latency_ms,
+            **self.counters
+        }
+
+class LocalSkillTier(RoutingTier):
+    \"\"\"
+    Nivel 1: la skill asociada a la intención detectada por el clasificador local
+    \"\"\"
+    
+    type = 'local_skill'
+    level = 1
+    
+    def __init__(self, router, intents: Optional[Dict[str, str]] = None, **params):
+        super().__init__(router, **params)
+        self.intents = dict(intents or {})
+    
+    def skill_for(self, intent: Optional[str]) -> Optional[str]:
+        return self.intents.get(intent) if intent else None
+    
+    def can_handle(self, query, context):
+        return context.level <= self.level and self.skill_for(context.intent) is not None
+    
+    async def handle(self, query, context):
+        return await self.router._run_skill(self.skill_for(context.intent), query, context)
+    
+    async def stream(self, query, context):
+        async for event in self.router._stream_local_skill(self.skill_for(context.intent), query, context):
+            yield event
+
+class GeminiTier(RoutingTier):
+    \"\"\"
+    Nivel 2: razonamiento con Gemini, que puede delegar en una skill
+    \"\"\"
+    
+    type = 'gemini'
+    level = 2
+    
+    async def handle(self, query, context):
+        return await self.router._run_gemini(query, context)
+    
+    async def stream(self, query, context):
+        async for event in self.router._stream_gemini(query, context):
+            yield event
+
+class PerplexityTier(RoutingTier):
+    \"\"\"
+    Nivel 3: búsqueda web en tiempo real con Perplexity
+    \"\"\"
+    
+    type = 'perplexity'
+    level = 3
+    
+    async def handle(self, query, context):
+        return await self.router._handle_level3(query, context.user_id)
+    
+    async def stream(self, query, context):
+        async for event in self.router._stream_level3(query, context.user_id):
+            yield event
+
+class KnowledgeBaseTier(RoutingTier):
+    \"\"\"
+    Respuestas fijas de un fichero JSON {pregunta: respuesta}
+    
+    Atiende cualquier consulta cuya forma normalizada esté en el fichero y
+    deja pasar el resto, así que puede ir delante de Gemini con coste cero.
+    \"\"\"
+    
+    type = 'knowledge_base'
+    level = 1
+    
+    def __init__(self, router, path: str = '', **params):
+        super().__init__(router, **params)
+        self.path = path
+        self.answers: Dict[str, str] = {}
+        
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.answers = {normalize(q).key: a for q, a in json.load(f).items()}
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"Error cargando la base de conocimiento {path}: {e}")
+        
+        logger.info(f"Base de conocimiento {self.name}: {len(self.answers)} respuestas")
+    
+    def can_handle(self, query, context):
+        return bool(self.answers)
+    
+    async def handle(self, query, context):
+        answer = self.answers.get(normalize(query).key)
+        if answer is None:
+            return None
+        
+        return {
+            'success': True,
+            'level': self.level,
+            'method': self.name,
+            'result': {
+                'response': answer,
+                'type': 'text'
+            }
+        }
+
+# Tipos de nivel disponibles en la configuración por nombre
+TIER_TYPES: Dict[str, Type[RoutingTier]] = {
+    LocalSkillTier.type: LocalSkillTier,
+    GeminiTier.type: GeminiTier,
+    PerplexityTier.type: PerplexityTier,
+    KnowledgeBaseTier.type: KnowledgeBaseTier
+}
+
+def register_tier(tier_class: Type[RoutingTier]):
+    \"\"\"
+    Añade un tipo de nivel utilizable en NYX_ROUTING_TIERS
+    \"\"\"
+    TIER_TYPES[tier_class.type] = tier_class
+    return tier_class
+
+def _tier_class(type_name: str) -> Type[RoutingTier]:
+    \"\"\"
+    Clase de un tipo registrado, o importada de 'paquete.modulo:Clase'
+    \"\"\"
+    if type_name in TIER_TYPES:
+        return TIER_TYPES[type_name]
+    
+    if ':' not in type_name:
+        raise ValueError(f"Tipo de nivel desconocido: {type_name}")
+    
+    module_name, class_name = type_name.split(':', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+class TierRegistry:
+    \"\"\"
+    Niveles configurados, ordenados por coste y latencia
+    \"\"\"
+    
+    def __init__(self, router, config: Optional[List[Dict[str, Any]]] = None, config_path: str = TIERS_CONFIG):
+        if config is None:
+            config = self._load(config_path)
+        
+        self.tiers: List[RoutingTier] = []
+        for entry in config:
+            entry = dict(entry)
+            if not entry.pop('enabled', True):
+                continue
+            self.tiers.append(_tier_class(entry.pop('type'))(router, **entry))
+        
+        # sorted() es estable: a igual coste y latencia se respeta el orden del fichero
+        self.tiers = sorted(self.tiers, key=lambda tier: (tier.cost, tier.latency_ms))
+        
+        logger.info(f"Niveles del router: {' -> '.join(tier.name for tier in self.tiers)}")
+    
+    def _load(self, path: str) -> List[Dict[str, Any]]:
+        if not path:
+            return DEFAULT_TIERS
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data['tiers'] if isinstance(data, dict) else data
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error cargando los niveles de {path}: {e}, se usan los de por defecto")
+            return DEFAULT_TIERS
+    
+    def candidates(self, query: str, context: TierContext) -> List[RoutingTier]:
+        \"\"\"
+        Niveles que pueden atender la consulta, en el orden en que se prueban
+        \"\"\"
+        return [tier for tier in self.tiers if tier.can_handle(query, context)]
+    
+    def local_intents(self) -> Dict[str, str]:
+        \"\"\"
+        Intención -> skill de todos los niveles de skill local
+        \"\"\"
+        intents: Dict[str, str] = {}
+        for tier in self.tiers:
+            if isinstance(tier, LocalSkillTier):
+                for intent, skill in tier.intents.items():
+                    intents.setdefault(intent, skill)
+        return intents
+    
+    def skill_for_intent(self, intent: Optional[str]) -> Optional[str]:
+        \"\"\"
+        Skill que atiende una intención en el nivel local, si hay alguna
+        \"\"\"
+        for tier in self.tiers:
+            if isinstance(tier, LocalSkillTier) and tier.skill_for(intent):
+                return tier.skill_for(intent)
+        return None
+    
+    def summary(self) -> List[Dict[str, Any]]:
+        return [tier.summary() for tier in self.tiers]
+"""
+
+with open('nyx/bridge/src/tiers.py', 'w') as f:
+    f.write(bridge_tiers)
+
+print("✅ Registro de niveles del puente creado")
+
+# 14. Reproducción del tráfico grabado
+bridge_replay = """#!/usr/bin/env python3
+\"\"\"
+Reproducción determinista del tráfico grabado con NYX_TRAFFIC_LOG
+
+run pasa cada consulta de la grabación por QueryRouter, en el mismo orden y
+con el mismo usuario. Gemini, Perplexity y las skills responden con lo
+grabado, y el presupuesto se fija al que había en cada consulta. La latencia
+de las APIs no se espera: se suma la grabada al tiempo local del router, así
+que la reproducción es rápida y da siempre el mismo resultado. Las llamadas
+que la versión nueva hace y la grabación no tiene se responden con una
+respuesta genérica con la latencia y el coste medianos de esa API, y se
+cuentan en el informe.
+
+compare enfrenta dos informes de run (o la propia grabación, que es la
+versión que la generó): cambios de nivel y método, distribución de
+latencias y gasto proyectado.
+
+Uso:
+    python benchmarks/replay.py run traffic.jsonl -o antes.json
+    (cambiar de versión)
+    python benchmarks/replay.py run traffic.jsonl -o despues.json
+    python benchmarks/replay.py compare antes.json despues.json
+    python benchmarks/replay.py compare traffic.jsonl despues.json
+\"\"\"
+
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import contextvars
+import subprocess
+import statistics
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent / 'src'))
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from query_categories import normalize_query
+from traffic import TrafficRecorder, FORMAT_VERSION
+
+# Latencia grabada de las APIs que ha usado la consulta en curso (ms)
+_backend_ms: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar('nyx_replay_ms', default=None)
+
+# Respuesta de las llamadas que no están en la grabación
+UNRECORDED_TEXT = '(respuesta no grabada)'
+
+def load_traffic(path: str) -> List[Dict[str, Any]]:
+    \"\"\"
+    Líneas válidas de una grabación, en orden
+    \"\"\"
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('v') == FORMAT_VERSION:
+                records.append(record)
+    return records
+
+class Recording:
+    \"\"\"
+    Respuestas grabadas por (backend, método, consulta normalizada)
+    
+    Si una clave aparece varias veces se sirven en el orden grabado y, al
+    agotarse, se repite la última.
+    \"\"\"
+    
+    def __init__(self, records: List[Dict[str, Any]]):
+        self._calls: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._served: Counter = Counter()
+        self._latencies: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self._costs: List[Dict[str, Any]] = []
+        self.misses: Counter = Counter()
+        
+        for record in records:
+            for call in record.get('calls', []):
+                key = (call['backend'], call['method'], normalize_query(call['query']))
+                self._calls[key].append(call)
+                self._latencies[(call['backend'], call['method'])].append(call.get('latency_ms', 0.0))
+                usage = call['response'].get('usage') if isinstance(call['response'], dict) else None
+                if call['method'] == 'search' and usage:
+                    self._costs.append(usage)
+    
+    def lookup(self, backend: str, method: str, query: str) -> Optional[Any]:
+        \"\"\"
+        Respuesta grabada (una copia) y su latencia sumada a la consulta en curso
+        \"\"\"
+        key = (backend, method, normalize_query(query))
+        calls = self._calls.get(key)
+        
+        if not calls:
+            self.misses[f'{backend}.{method}'] += 1
+            self._charge(self.median_latency(backend, method))
+            return None
+        
+        call = calls[min(self._served[key], len(calls) - 1)]
+        self._served[key] += 1
+        self._charge(call.get('latency_ms', 0.0))
+        return json.loads(json.dumps(call['response']))
+    
+    def median_latency(self, backend: str, method: str) -> float:
+        latencies = self._latencies.get((backend, method))
+        return statistics.median(latencies) if latencies else 0.0
+    
+    def median_usage(self) -> Dict[str, Any]:
+        \"\"\"
+        Consumo de tokens mediano de las búsquedas grabadas
+        \"\"\"
+        if not self._costs:
+            return {}
+        return {
+            key: statistics.median(usage.get(key, 0) for usage in self._costs)
+            for key in ('prompt_tokens', 'completion_tokens')
+        }
+    
+    def _charge(self, latency_ms: float):
+        pending = _backend_ms.get()
+        if pending is not None:
+            pending.append(latency_ms)
+
+class ReplayGemini:
+    \"\"\"
+    GeminiClient que responde con la grabación
+    \"\"\"
+    
+    def __init__(self, recording: Recording):
+        self.recording = recording
+    
+    async def analyze_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        response = self.recording.lookup('gemini', 'analyze_query', query)
+        return response if response is not None else {
+            'response': UNRECORDED_TEXT,
+            'skill_required': False,
+            'type': 'text_response'
+        }
+    
+    async def answer_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        response = self.recording.lookup('gemini', 'answer_query', query)
+        return response if response is not None else {'response': UNRECORDED_TEXT, 'success': True}
+    
+    async def stream_response(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[str]:
+        response = self.recording.lookup('gemini', 'stream_response', query) or {'chunks': [UNRECORDED_TEXT]}
+        for text in response.get('chunks', []):
+            yield text
+        if response.get('raised'):
+            raise RuntimeError(response['raised'])
+
+class ReplayPerplexity:
+    \"\"\"
+    PerplexityClient que responde con la grabación
+    \"\"\"
+    
+    def __init__(self, recording: Recording):
+        self.recording = recording
+    
+    async def search(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        response = self.recording.lookup('perplexity', 'search', query)
+        return response if response is not None else self._unrecorded()
+    
+    async def search_stream(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[Dict[str, Any]]:
+        response = self.recording.lookup('perplexity', 'search_stream', query)
+        if response is None:
+            response = {'events': [{'chunk': UNRECORDED_TEXT}, {'response': self._unrecorded()}]}
+        for event in response.get('events', []):
+            yield event
+    
+    def estimate_cost(self, response: Dict[str, Any]) -> float:
+        # Misma tarifa que PerplexityClient.estimate_cost()
+        if not response.get('success'):
+            return 0.0
+        usage = response.get('usage', {})
+        return round(usage.get('prompt_tokens', 0) / 1000 * 0.002 + usage.get('completion_tokens', 0) / 1000 * 0.002, 6)
+    
+    def _unrecorded(self) -> Dict[str, Any]:
+        return {
+            'answer': UNRECORDED_TEXT,
+            'sources': [],
+            'usage': self.recording.median_usage(),
+            'success': True
+        }
+
+class ReplaySkills:
+    \"\"\"
+    SkillManager real (triggers, claves de especulación) con ejecuciones grabadas
+    \"\"\"
+    
+    def __init__(self, manager, recording: Recording):
+        self._manager = manager
+        self.recording = recording
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._manager, name)
+    
+    async def execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        result = self.recording.lookup('skill', skill_name, query)
+        return result if result is not None else {
+            'success': True,
+            'skill': skill_name,
+            'result': {'content': UNRECORDED_TEXT, 'type': 'replay'}
+        }
+    
+    async def execute_skill_stream(self, skill_name: str, query: str,
+                                   context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        recorded = self.recording.lookup('skill', f'{skill_name}.stream', query)
+        if recorded is None:
+            result = await self.execute_skill(skill_name, query, context)
+            events = [{'chunk': result['result'].get('content', '')}, {'result': result}]
+        else:
+            events = recorded.get('events', [])
+        for event in events:
+            yield event
+
+class ReplayBudget:
+    \"\"\"
+    Presupuesto fijado al porcentaje grabado de cada consulta, sin tocar data/budget.json
+    \"\"\"
+    
+    def __init__(self):
+        self.percentage_used = 0.0
+        self.spent = 0.0
+    
+    def can_spend(self, estimated_cost: float = 0.01) -> bool:
+        return self.percentage_used < 100
+    
+    def record_usage(self, cost: float, details: Optional[Dict[str, Any]] = None):
+        self.spent += cost
+    
+    def record_abandoned(self, details: Optional[Dict[str, Any]] = None):
+        pass
+    
+    def get_budget_status(self) -> Dict[str, Any]:
+        return {'percentage_used': self.percentage_used, 'can_spend': self.can_spend(), 'spent': self.spent}
+
+class MemoryRecorder(TrafficRecorder):
+    \"\"\"
+    TrafficRecorder que guarda cada consulta reproducida en memoria
+    \"\"\"
+    
+    def __init__(self):
+        super().__init__(':memory:')
+        self.records: List[Dict[str, Any]] = []
+    
+    def _write(self, record: Dict[str, Any]):
+        self.records.append(record)
+
+async def replay(records: List[Dict[str, Any]], use_cache: bool = True) -> Tuple[List[Dict[str, Any]], Counter]:
+    \"\"\"
+    Reproduce la grabación y retorna una entrada por consulta
+    \"\"\"
+    from services import ServiceContainer
+    from query_router import QueryRouter
+    
+    recording = Recording(records)
+    budget = ReplayBudget()
+    recorder = MemoryRecorder()
+    
+    services = ServiceContainer()
+    services.provide('gemini_client', ReplayGemini(recording))
+    services.provide('perplexity_client', ReplayPerplexity(recording))
+    services.provide('budget_governor', budget)
+    services.provide('traffic_recorder', recorder)
+    services.provide('skill_manager', ReplaySkills(services.skill_manager, recording))
+    
+    router = QueryRouter(services)
+    router.response_cache.enabled = use_cache
+    
+    entries = []
+    for index, record in enumerate(records):
+        budget_used = (record.get('decision') or {}).get('budget_used')
+        if budget_used is not None:
+            budget.percentage_used = budget_used
+        
+        pending: List[float] = []
+        token = _backend_ms.set(pending)
+        try:
+            if record.get('kind') == 'stream':
+                async for _ in router.route_query_stream(record['query'], record['user_id'], record.get('use_cache', True)):
+                    pass
+            else:
+                await router.route_query(record['query'], record['user_id'], use_cache=record.get('use_cache', True))
+        finally:
+            _backend_ms.reset(token)
+        
+        replayed = recorder.records[-1]
+        entries.append(make_entry(index, replayed, replayed['latency_ms'] + sum(pending)))
+    
+    return entries, recording.misses
+
+def make_entry(index: int, record: Dict[str, Any], latency_ms: float) -> Dict[str, Any]:
+    \"\"\"
+    Lo que se compara de cada consulta
+    \"\"\"
+    decision = record.get('decision') or {}
+    result = record.get('result') or {}
+    
+    return {
+        'i': index,
+        'query': record['query'][:100],
+        'proposed': decision.get('proposed'),
+        'level': result.get('level'),
+        'method': result.get('method'),
+        'reason': decision.get('reason'),
+        'success': result.get('success'),
+        'cached': result.get('cached', False),
+        'fallback': result.get('fallback'),
+        'cost': result.get('cost', 0.0),
+        'latency_ms': round(latency_ms, 1)
+    }
+
+def load_report(path: str) -> Dict[str, Any]:
+    \"\"\"
+    Informe de run, o el equivalente de una grabación (con sus latencias reales)
+    \"\"\"
+    if path.endswith('.jsonl'):
+        records = load_traffic(path)
+        return {
+            'label': f'grabación {Path(path).name}',
+            'entries': [make_entry(i, record, record.get('latency_ms', 0.0)) for i, record in enumerate(records)],
+            'misses': {}
+        }
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def summarize(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    \"\"\"
+    Distribución de niveles, latencias y gasto de un informe
+    \"\"\"
+    latencies = sorted(entry['latency_ms'] for entry in entries)
+    
+    def percentile(fraction: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[max(0, math.ceil(fraction * len(latencies)) - 1)]
+    
+    return {
+        'requests': len(entries),
+        'success_rate': round(sum(1 for e in entries if e['success']) / len(entries), 3) if entries else 0.0,
+        'levels': dict(Counter(str(entry['level']) for entry in entries)),
+        'fallbacks': sum(1 for entry in entries if entry.get('fallback')),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 1) if latencies else 0.0,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': latencies[-1] if latencies else 0.0
+        },
+        'spend': round(sum(entry['cost'] or 0.0 for entry in entries), 6)
+    }
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    \"\"\"
+    Cambios de decisión consulta a consulta y diferencias de latencia y gasto
+    \"\"\"
+    pairs = list(zip(before['entries'], after['entries']))
+    transitions = Counter(
+        (f"L{a['level']} {a['method']}", f"L{b['level']} {b['method']}")
+        for a, b in pairs
+        if (a['level'], a['method']) != (b['level'], b['method'])
+    )
+    summary_before = summarize(before['entries'])
+    summary_after = summarize(after['entries'])
+    
+    return {
+        'before': before.get('label'),
+        'after': after.get('label'),
+        'compared': len(pairs),
+        'changed': sum(transitions.values()),
+        'transitions': [
+            {'from': old, 'to': new, 'count': count}
+            for (old, new), count in transitions.most_common()
+        ],
+        'examples': [
+            {'query': b['query'], 'from': f"L{a['level']} {a['method']}", 'to': f"L{b['level']} {b['method']}"}
+            for a, b in pairs if (a['level'], a['method']) != (b['level'], b['method'])
+        ][:10],
+        'summary_before': summary_before,
+        'summary_after': summary_after,
+        'spend_delta': round(summary_after['spend'] - summary_before['spend'], 6),
+        'unrecorded_calls': after.get('misses', {})
+    }
+
+def code_label() -> str:
+    \"\"\"
+    Commit actual del repositorio, para identificar la versión del informe
+    \"\"\"
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconocida'
+
+def print_comparison(report: Dict[str, Any]):
+    before, after = report['summary_before'], report['summary_after']
+    
+    print(f"\\n{report['before']}  ->  {report['after']}")
+    print(f"Consultas comparadas: {report['compared']}, decisiones distintas: {report['changed']}")
+    
+    for transition in report['transitions']:
+        print(f"  {transition['from']:<32} -> {transition['to']:<32} {transition['count']:>6}")
+    
+    print(f"\\n{'':<14}{'antes':>12}{'después':>12}{'diferencia':>12}")
+    for key in ('mean', 'p50', 'p95', 'p99', 'max'):
+        old, new = before['latency_ms'][key], after['latency_ms'][key]
+        print(f"{'latencia ' + key:<14}{old:>10.1f}ms{new:>10.1f}ms{new - old:>+10.1f}ms")
+    print(f"{'éxito':<14}{before['success_rate']:>12.1%}{after['success_rate']:>12.1%}")
+    print(f"{'alternativas':<14}{before['fallbacks']:>12}{after['fallbacks']:>12}")
+    print(f"{'gasto':<14}{before['spend']:>11.4f}${after['spend']:>11.4f}${report['spend_delta']:>+11.4f}$")
+    
+    if report['unrecorded_calls']:
+        print(f"\\nLlamadas sin grabar (respuesta genérica): {report['unrecorded_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproducción del tráfico grabado del router')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = commands.add_parser('run', help='Reproduce una grabación con el código actual')
+    run_parser.add_argument('traffic', help='Fichero JSONL de NYX_TRAFFIC_LOG')
+    run_parser.add_argument('-o', '--output', required=True, help='Informe JSON')
+    run_parser.add_argument('--label', default=None, help='Nombre de la versión (por defecto, el commit)')
+    run_parser.add_argument('--no-cache', action='store_true', help='Desactiva la caché de respuestas')
+    
+    compare_parser = commands.add_parser('compare', help='Compara dos informes o una grabación con un informe')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--json', action='store_true', help='Salida en JSON')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'run':
+        records = load_traffic(args.traffic)
+        started = time.perf_counter()
+        entries, misses = asyncio.run(replay(records, use_cache=not args.no_cache))
+        
+        report = {
+            'label': args.label or code_label(),
+            'generated': datetime.now().isoformat(),
+            'traffic': args.traffic,
+            'entries': entries,
+            'misses': dict(misses),
+            'summary': summarize(entries)
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
+        print(f"{len(entries)} consultas reproducidas en {time.perf_counter() - started:.2f}s -> {args.output}")
+        print(json.dumps(report['summary'], ensure_ascii=False, indent=2))
+    else:
+        report = compare(load_report(args.before), load_report(args.after))
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            print_comparison(report)
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/benchmarks/replay.py', 'w') as f:
+    f.write(bridge_replay)
+
+print("✅ Reproducción de tráfico creada")
+
+# 15. Benchmark del clasificador de intenciones
+bench_intents = """#!/usr/bin/env python3
+\"\"\"
+Benchmark del clasificador de intenciones con muchos patrones
+
+Compara el cálculo patrón a patrón (re.search y re.findall por cada patrón de
+cada intención, IntentClassifier._calculate_confidence) con PatternMatcher,
+que elige los candidatos en una pasada por las palabras de la consulta y solo
+evalúa esos, ya compilados. Los patrones de siempre se
+amplían con patrones sintéticos del mismo estilo hasta el tamaño pedido por
+intención, y se comprueba que ambos dan las mismas confianzas. Los dos
+trabajan, como classify(), con los patrones y las consultas sin tildes.
+
+Con más de 512 patrones en total el cálculo patrón a patrón ya no cabe en la
+caché de expresiones compiladas del módulo re y recompila en cada consulta.
+
+Uso:
+    python benchmarks/bench_intents.py [--sizes 3,25,100,250] [--queries 100]
+\"\"\"
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.append(str(Path(__file__).parent.parent / 'src'))
+
+from intent_classifier import IntentClassifier, PatternMatcher
+from normalization import normalize, fold_pattern
+
+QUERIES = [
+    'tengo una reunión mañana, ¿estoy libre el jueves?',
+    '¿qué es la fotosíntesis?',
+    'buscar noticias sobre inteligencia artificial',
+    '¿va a hacer frío o calor esta semana en madrid?',
+    'hola, ¿qué comandos tienes?',
+    'agendar una cita con el dentista para el mes que viene',
+    'explícame cómo funciona un motor eléctrico con detalle',
+    'precio del bitcoin hoy'
+]
+
+def build_patterns(base: Dict[str, List[str]], size: int) -> Dict[str, List[str]]:
+    \"\"\"
+    Patrones de base más sintéticos hasta size por intención
+    \"\"\"
+    patterns = {}
+    for intent, intent_patterns in base.items():
+        extended = list(intent_patterns)
+        for i in range(len(extended), size):
+            if i % 3 == 2:
+                extended.append(rf'\\b({intent}{i}|clave{i})\\b.*\\b(sobre|para)\\b')
+            else:
+                extended.append(rf'\\b({intent}{i}|termino{i}|palabra{i})\\b')
+        patterns[intent] = [fold_pattern(pattern) for pattern in extended[:max(size, 1)]]
+    return patterns
+
+def build_queries(patterns: Dict[str, List[str]], count: int, rng: random.Random) -> List[str]:
+    \"\"\"
+    Consultas reales, algunas con palabras de los patrones sintéticos
+    \"\"\"
+    size = max(len(p) for p in patterns.values())
+    queries = []
+    for i in range(count):
+        query = QUERIES[i % len(QUERIES)]
+        if i % 2 and size > 3:
+            intent = rng.choice(list(patterns))
+            query = f'{query} termino{rng.randrange(3, size)} sobre {intent}{rng.randrange(3, size)}'
+        queries.append(normalize(query).folded)
+    return queries
+
+def bench(fn, queries: List[str], repeat: int) -> float:
+    \"\"\"
+    Microsegundos por consulta (mejor de repeat pasadas)
+    \"\"\"
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for query in queries:
+            fn(query)
+        best = min(best, time.perf_counter() - started)
+    return best / len(queries) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del clasificador de intenciones')
+    parser.add_argument('--sizes', default='3,25,100,250', help='Patrones por intención, separados por comas')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+    
+    rng = random.Random(42)
+    classifier = IntentClassifier()
+    weights = classifier.confidence_weights
+    
+    print(f"{'patrones/intención':>19} {'total':>7} {'patrón a patrón':>17} {'indexado':>12} {'mejora':>8}")
+    
+    for size in (int(s) for s in args.sizes.split(',')):
+        patterns = build_patterns(classifier.patterns, size)
+        queries = build_queries(patterns, args.queries, rng)
+        
+        started = time.perf_counter()
+        matcher = PatternMatcher(patterns)
+        compile_ms = (time.perf_counter() - started) * 1000
+        
+        def per_pattern(query: str) -> Dict[str, float]:
+            confidences = {}
+            for intent, intent_patterns in patterns.items():
+                confidence = classifier._calculate_confidence(query, intent_patterns)
+                if confidence:
+                    confidences[intent] = confidence
+            return confidences
+        
+        def indexed(query: str) -> Dict[str, float]:
+            return matcher.confidences(query, weights)
+        
+        for query in queries:
+            if per_pattern(query) != indexed(query):
+                print(f"❌ Confianzas distintas para {query!r}")
+                sys.exit(1)
+        
+        old_us = bench(per_pattern, queries, args.repeat)
+        new_us = bench(indexed, queries, args.repeat)
+        total = sum(len(p) for p in patterns.values())
+        
+        print(f"{size:>19} {total:>7} {old_us:>14.1f}µs {new_us:>9.1f}µs {old_us / new_us:>7.1f}x"
+              f"   (compilación {compile_ms:.1f}ms)")
+    
+    print("\\n✅ Mismas confianzas en todas las consultas")
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/benchmarks/bench_intents.py', 'w') as f:
+    f.write(bench_intents)
+
+print("✅ Benchmark del clasificador creado")
+
+# 16. Modelo local de intenciones
+intent_model = """\"\"\"
+Modelo estadístico local de intenciones
+
+Regresión logística multinomial sobre n-gramas de palabras y de caracteres
+con hashing (sin vocabulario: cada n-grama va a una de n_features columnas
+por crc32). Se entrena con un JSONL etiquetado y clasifica lotes enteros con
+una sola multiplicación de matrices dispersa en NumPy, así que acompaña a los
+patrones de IntentClassifier como un segundo clasificador de nivel 1 que
+reconoce consultas que los patrones no cubren.
+
+Formato de entrenamiento, una consulta por línea:
+    
+    {"query": "¿tengo algo el jueves por la tarde?", "intent": "calendar"}
+    {"query": "explícame la relatividad", "intent": "none"}
+
+La etiqueta "none" (o null) marca consultas que no son de ninguna intención
+local; el modelo las aprende como una clase más y nunca la devuelve.
+
+Uso:
+    python src/intent_model.py train datos.jsonl -o data/intent_model.npz
+    python src/intent_model.py evaluate data/intent_model.npz prueba.jsonl
+    python src/intent_model.py predict data/intent_model.npz "¿qué tengo mañana?"
+\"\"\"
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from query_categories import normalize_query
+
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Probabilidad mínima para aceptar la intención del modelo
+MODEL_THRESHOLD = float(os.getenv('NYX_INTENT_MODEL_THRESHOLD', '0.6'))
+
+# Etiqueta de las consultas que no son de ninguna intención local
+NONE_LABEL = 'none'
+
+DEFAULT_FEATURES = 2 ** 16
+CHAR_NGRAMS = (2, 3, 4)
+
+def extract_features(query: str, n_features: int) -> Dict[int, float]:
+    \"\"\"
+    Columnas de los n-gramas de una consulta con su frecuencia, normalizadas (L2)
+    
+    Palabras sueltas, pares de palabras seguidas y n-gramas de 2 a 4
+    caracteres dentro de cada palabra (con un espacio delante y detrás).
+    \"\"\"
+    words = normalize_query(query).split()
+    grams = [f'w:{word}' for word in words]
+    grams += [f'b:{first} {second}' for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f' {word} '
+        for n in CHAR_NGRAMS:
+            grams += [f'c:{padded[i:i + n]}' for i in range(len(padded) - n + 1)]
+    
+    counts: Dict[int, float] = {}
+    for gram in grams:
+        column = zlib.crc32(gram.encode('utf-8')) % n_features
+        counts[column] = counts.get(column, 0.0) + 1.0
+    
+    norm = sum(value * value for value in counts.values()) ** 0.5
+    return {column: value / norm for column, value in counts.items()} if norm else counts
+
+def vectorize(queries: List[str], n_features: int) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    \"\"\"
+    Matriz dispersa de un lote: fila, columna y valor de cada n-grama presente
+    \"\"\"
+    return _sparse([extract_features(query, n_features) for query in queries])
+
+def _sparse(features: List[Dict[int, float]]) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    rows, columns, values = [], [], []
+    for row, counts in enumerate(features):
+        rows.extend([row] * len(counts))
+        columns.extend(counts.keys())
+        values.extend(counts.values())
+    
+    return (np.asarray(rows, dtype=np.int64),
+            np.asarray(columns, dtype=np.int64),
+            np.asarray(values, dtype=np.float32))
+
+def _scores(weights: 'np.ndarray', rows: 'np.ndarray', columns: 'np.ndarray',
+            values: 'np.ndarray', n_rows: int) -> 'np.ndarray':
+    \"\"\"
+    Producto de la matriz dispersa por los pesos (filas x etiquetas)
+    \"\"\"
+    contributions = weights[columns] * values[:, None]
+    
+    # Suma por fila de las contribuciones de sus n-gramas, una etiqueta a la vez
+    scores = np.empty((n_rows, weights.shape[1]), dtype=np.float32)
+    for label in range(weights.shape[1]):
+        scores[:, label] = np.bincount(rows, weights=contributions[:, label], minlength=n_rows)
+    return scores
+
+def _softmax(scores: 'np.ndarray') -> 'np.ndarray':
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def load_examples(path: str) -> List[Tuple[str, str]]:
+    \"\"\"
+    (consulta, intención) de un JSONL; acepta query/text e intent/label
+    \"\"\"
+    examples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            query = item.get('query', item.get('text'))
+            label = item.get('intent', item.get('label')) or NONE_LABEL
+            if query:
+                examples.append((str(query), str(label)))
+    return examples
+
+class IntentModel:
+    \"\"\"
+    Clasificador lineal de intenciones: pesos (n_features x clases) y sesgo
+    \"\"\"
+    
+    def __init__(self, labels: List[str], weights: 'np.ndarray', bias: 'np.ndarray',
+                 n_features: int = DEFAULT_FEATURES, meta: Optional[Dict[str, Any]] = None):
+        if np is None:
+            raise RuntimeError("El modelo de intenciones necesita numpy (pip install numpy)")
+        
+        self.labels = list(labels)
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.n_features = n_features
+        self.meta = meta or {}
+        self.threshold = MODEL_THRESHOLD
+    
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], n_features: int = DEFAULT_FEATURES,
+              epochs: int = 30, learning_rate: float = 2.0, l2: float = 1e-5,
+              batch_size: int = 32, seed: int = 0) -> 'IntentModel':
+        \"\"\"
+        Entrena con descenso de gradiente por minilotes sobre la entropía cruzada
+        \"\"\"
+        if np is None:
+            raise RuntimeError("El modelo de intenciones necesita numpy (pip install numpy)")
+        if not examples:
+            raise ValueError("No hay ejemplos de entrenamiento")
+        
+        labels = sorted({label for _, label in examples})
+        index = {label: i for i, label in enumerate(labels)}
+        features = [extract_features(query, n_features) for query, _ in examples]
+        targets = np.asarray([index[label] for _, label in examples])
+        
+        weights = np.zeros((n_features, len(labels)), dtype=np.float32)
+        bias = np.zeros(len(labels), dtype=np.float32)
+        order = list(range(len(examples)))
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch * 0.1)
+            
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                rows, columns, values = _sparse([features[example] for example in batch])
+                
+                delta = _softmax(_scores(weights, rows, columns, values, len(batch)) + bias)
+                delta[np.arange(len(batch)), targets[batch]] -= 1.0
+                delta /= len(batch)
+                
+                gradient = delta[rows] * values[:, None]
+                touched = np.unique(columns)
+                weights[touched] *= 1 - rate * l2
+                np.add.at(weights, columns, -rate * gradient)
+                bias -= rate * delta.sum(axis=0)
+        
+        meta = {
+            'examples': len(examples),
+            'epochs': epochs,
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'train_seconds': round(time.perf_counter() - started, 2)
+        }
+        return cls(labels, weights, bias, n_features, meta)
+    
+    @classmethod
+    def load(cls, path: str) -> 'IntentModel':
+        if np is None:
+            raise RuntimeError("El modelo de intenciones necesita numpy (pip install numpy)")
+        
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            return cls(header['labels'], data['weights'], data['bias'], header['n_features'], header.get('meta'))
+    
+    def save(self, path: str):
+        \"\"\"
+        Guarda pesos, sesgo y etiquetas en un .npz comprimido
+        \"\"\"
+        header = {'labels': self.labels, 'n_features': self.n_features, 'meta': self.meta}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # np.savez añade .npz si falta: se abre el fichero para respetar el nombre
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, weights=self.weights, bias=self.bias, header=np.asarray(json.dumps(header)))
+    
+    def intents(self) -> List[str]:
+        \"\"\"
+        Intenciones que puede retornar el modelo
+        \"\"\"
+        return [label for label in self.labels if label != NONE_LABEL]
+    
+    def predict_proba(self, queries: List[str]) -> 'np.ndarray':
+        \"\"\"
+        Probabilidad de cada etiqueta para cada consulta del lote (consultas x etiquetas)
+        \"\"\"
+        rows, columns, values = vectorize(queries, self.n_features)
+        return _softmax(_scores(self.weights, rows, columns, values, len(queries)) + self.bias)
+    
+    def classify_batch(self, queries: List[str]) -> List[Tuple[Optional[str], float]]:
+        \"\"\"
+        Intención más probable de cada consulta y su probabilidad
+        
+        La etiqueta "none" se retorna como None, con su probabilidad.
+        \"\"\"
+        if not queries:
+            return []
+        
+        probabilities = self.predict_proba(queries)
+        best = probabilities.argmax(axis=1)
+        
+        return [
+            (None if self.labels[label] == NONE_LABEL else self.labels[label], float(probabilities[row, label]))
+            for row, label in enumerate(best)
+        ]
+    
+    def evaluate(self, examples: List[Tuple[str, str]], threshold: float = MODEL_THRESHOLD) -> Dict[str, Any]:
+        \"\"\"
+        Exactitud, precisión y exhaustividad por etiqueta y cobertura con el umbral
+        
+        covered son las consultas de alguna intención que el modelo acepta con
+        al menos threshold de probabilidad (las que dejarían de ir a Gemini).
+        \"\"\"
+        queries = [query for query, _ in examples]
+        predictions = self.classify_batch(queries)
+        expected = [None if label == NONE_LABEL else label for _, label in examples]
+        
+        per_label = {}
+        for label in sorted({e for e in expected if e} | {p for p, _ in predictions if p}):
+            true_positive = sum(1 for e, (p, _) in zip(expected, predictions) if e == label and p == label)
+            predicted = sum(1 for p, _ in predictions if p == label)
+            actual = sum(1 for e in expected if e == label)
+            per_label[label] = {
+                'precision': round(true_positive / predicted, 3) if predicted else 0.0,
+                'recall': round(true_positive / actual, 3) if actual else 0.0,
+                'support': actual
+            }
+        
+        accepted = [(e, p) for e, (p, probability) in zip(expected, predictions) if p and probability >= threshold]
+        intents = sum(1 for e in expected if e)
+        
+        return {
+            'examples': len(examples),
+            'accuracy': round(sum(1 for e, (p, _) in zip(expected, predictions) if e == p) / len(examples), 3),
+            'threshold': threshold,
+            'covered': round(sum(1 for e, p in accepted if e == p) / intents, 3) if intents else 0.0,
+            'accepted_precision': round(sum(1 for e, p in accepted if e == p) / len(accepted), 3) if accepted else 0.0,
+            'labels': per_label
+        }
+
+def load_model(path: str) -> Optional[IntentModel]:
+    \"\"\"
+    Modelo de un fichero .npz, o None si no se puede usar
+    \"\"\"
+    if np is None:
+        logger.warning("NYX_INTENT_MODEL configurado pero numpy no está instalado: solo patrones")
+        return None
+    
+    try:
+        model = IntentModel.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Error cargando el modelo de intenciones {path}: {e}")
+        return None
+    
+    logger.info(f"Modelo de intenciones cargado: {', '.join(model.labels)} ({model.meta.get('examples', '?')} ejemplos)")
+    return model
+
+def main():
+    parser = argparse.ArgumentParser(description='Modelo local de intenciones')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    train_parser = commands.add_parser('train', help='Entrena un modelo y lo guarda')
+    train_parser.add_argument('data', help='JSONL con query e intent')
+    train_parser.add_argument('-o', '--output', required=True, help='Fichero .npz')
+    train_parser.add_argument('--features', type=int, default=DEFAULT_FEATURES)
+    train_parser.add_argument('--epochs', type=int, default=30)
+    train_parser.add_argument('--learning-rate', type=float, default=2.0)
+    train_parser.add_argument('--holdout', type=float, default=0.2, help='Fracción reservada para evaluar')
+    
+    evaluate_parser = commands.add_parser('evaluate', help='Evalúa un modelo guardado')
+    evaluate_parser.add_argument('model')
+    evaluate_parser.add_argument('data')
+    evaluate_parser.add_argument('--threshold', type=float, default=MODEL_THRESHOLD)
+    
+    predict_parser = commands.add_parser('predict', help='Clasifica consultas')
+    predict_parser.add_argument('model')
+    predict_parser.add_argument('queries', nargs='+')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'train':
+        examples = load_examples(args.data)
+        random.Random(0).shuffle(examples)
+        held = int(len(examples) * args.holdout)
+        test, train = examples[:held], examples[held:]
+        
+        model = IntentModel.train(train, args.features, args.epochs, args.learning_rate)
+        model.save(args.output)
+        print(f"Modelo entrenado con {len(train)} ejemplos en {model.meta['train_seconds']}s -> {args.output}")
+        
+        if test:
+            print(json.dumps(model.evaluate(test), ensure_ascii=False, indent=2))
+    
+    elif args.command == 'evaluate':
+        model = IntentModel.load(args.model)
+        print(json.dumps(model.evaluate(load_examples(args.data), args.threshold), ensure_ascii=False, indent=2))
+    
+    else:
+        model = IntentModel.load(args.model)
+        for query, (intent, probability) in zip(args.queries, model.classify_batch(args.queries)):
+            print(f"{probability:.2f}  {intent or '-':<12} {query}")
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/src/intent_model.py', 'w') as f:
+    f.write(intent_model)
+
+print("✅ Modelo local de intenciones creado")
+
+# 17. Destilación de las decisiones de Gemini
+distillation = """\"\"\"
+Destilación de las decisiones de Gemini en el clasificador local
+
+Cada análisis de Gemini del nivel 2 (skill_required, skill_name, confidence)
+se guarda junto a la consulta en el JSONL de NYX_VERDICT_LOG. Esas decisiones
+son etiquetas gratuitas: una consulta para la que Gemini eligió la skill de
+calendario es un ejemplo de la intención 'calendar', y una que respondió
+directamente es un ejemplo de 'none'. Con ellas se reentrena el modelo de
+intent_model.py y se proyecta cuántas de las consultas que llegaron a Gemini
+se habrían resuelto en el nivel 1 con el modelo nuevo, y con qué precisión.
+
+El modelo nuevo solo se acepta si conserva todas las intenciones del modelo
+actual (las que no salgan en las decisiones se añaden con NYX_DISTILL_BASE),
+si en las consultas reservadas (no vistas al entrenar) acierta la skill en al
+menos NYX_DISTILL_MIN_PRECISION de las que resolvería localmente y si mejora
+la tasa local actual. Con
+NYX_DISTILL_INTERVAL el puente lo hace periódicamente y cambia el modelo en
+caliente.
+
+Uso:
+    python src/distillation.py report ../data/verdicts.jsonl
+    python src/distillation.py train ../data/verdicts.jsonl -o ../data/intent_model.npz [--base etiquetas.jsonl]
+\"\"\"
+
+import os
+import sys
+import copy
+import json
+import random
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from query_categories import normalize_query
+from jsonl_writer import JsonlWriter
+
+logger = logging.getLogger(__name__)
+
+# JSONL con las decisiones de Gemini del nivel 2 (vacío: no se guardan)
+VERDICT_LOG = os.getenv('NYX_VERDICT_LOG', '')
+
+# Segundos entre destilaciones automáticas en el puente (0: desactivadas)
+DISTILL_INTERVAL = float(os.getenv('NYX_DISTILL_INTERVAL', '0'))
+
+# Confianza mínima de Gemini para usar su decisión como etiqueta
+MIN_VERDICT_CONFIDENCE = float(os.getenv('NYX_DISTILL_MIN_CONFIDENCE', '0.7'))
+
+# Precisión mínima en las consultas reservadas para aceptar el modelo nuevo
+MIN_PRECISION = float(os.getenv('NYX_DISTILL_MIN_PRECISION', '0.95'))
+
+# Consultas distintas necesarias para entrenar
+MIN_EXAMPLES = int(os.getenv('NYX_DISTILL_MIN_EXAMPLES', '50'))
+
+# Ejemplos etiquetados a mano que se añaden a los de Gemini (opcional)
+DISTILL_BASE = os.getenv('NYX_DISTILL_BASE', '')
+
+# Dónde se guarda el modelo aceptado si NYX_INTENT_MODEL no está configurado
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent.parent / 'data' / 'intent_model.npz'
+
+HOLDOUT = 0.2
+
+class VerdictLog:
+    \"\"\"
+    Guarda las decisiones de Gemini junto a la consulta
+    \"\"\"
+    
+    def __init__(self, path: str = VERDICT_LOG):
+        self.writer = JsonlWriter(path, 'la decisión de Gemini')
+        self.recorded = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+    
+    @property
+    def path(self) -> str:
+        return self.writer.path
+    
+    @property
+    def enabled(self) -> bool:
+        return self.writer.enabled
+    
+    def record(self, query: str, verdict: Dict[str, Any]):
+        \"\"\"
+        Añade una decisión al fichero; los análisis fallidos no se guardan
+        \"\"\"
+        if not self.enabled or not isinstance(verdict, dict) or verdict.get('success') is False:
+            return
+        
+        line = {
+            'ts': datetime.now().isoformat(),
+            'query': query,
+            'skill_required': bool(verdict.get('skill_required')),
+            'skill_name': verdict.get('skill_name'),
+            'confidence': verdict.get('confidence'),
+            'type': verdict.get('type')
+        }
+        # Se escribe fuera del loop (JsonlWriter)
+        self.writer.append(line)
+        self.recorded += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'recorded': self.recorded,
+            'last_distillation': self.last_report
+        }
+
+def load_verdicts(path: str) -> List[Dict[str, Any]]:
+    \"\"\"
+    Decisiones válidas de un fichero de NYX_VERDICT_LOG, en orden
+    \"\"\"
+    verdicts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                verdict = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(verdict, dict) and verdict.get('query'):
+                verdicts.append(verdict)
+    return verdicts
+
+def verdict_skill(verdict: Dict[str, Any]) -> Optional[str]:
+    \"\"\"
+    Skill que eligió Gemini, o None si respondió directamente
+    \"\"\"
+    return verdict.get('skill_name') if verdict.get('skill_required') else None
+
+def _trusted(verdict: Dict[str, Any], min_confidence: float) -> bool:
+    confidence = verdict.get('confidence')
+    return not isinstance(confidence, (int, float)) or confidence >= min_confidence
+
+def build_examples(verdicts: List[Dict[str, Any]], skill_intents: Dict[str, str],
+                   min_confidence: float = MIN_VERDICT_CONFIDENCE) -> List[Tuple[str, str]]:
+    \"\"\"
+    Un ejemplo (consulta, intención) por consulta distinta
+    
+    La etiqueta es la intención local de la skill que eligió Gemini (las
+    skills sin nivel local y las respuestas directas son 'none'). Si Gemini
+    decidió distinto para la misma consulta gana la mayoría, y los empates
+    se descartan.
+    \"\"\"
+    from intent_model import NONE_LABEL
+    
+    votes: Dict[str, Counter] = {}
+    texts: Dict[str, str] = {}
+    for verdict in verdicts:
+        if not _trusted(verdict, min_confidence):
+            continue
+        key = normalize_query(verdict['query'])
+        label = skill_intents.get(verdict_skill(verdict), NONE_LABEL)
+        votes.setdefault(key, Counter())[label] += 1
+        texts.setdefault(key, verdict['query'])
+    
+    examples = []
+    for key, counter in votes.items():
+        ranked = counter.most_common(2)
+        if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+            continue
+        examples.append((texts[key], ranked[0][0]))
+    return examples
+
+class Distiller:
+    \"\"\"
+    Entrena un modelo con las decisiones de Gemini y proyecta su efecto
+    
+    classifier es el IntentClassifier con los patrones y el modelo actuales
+    (una copia de IntentClassifier.snapshot() si se usa en un hilo),
+    intent_skills la intención de cada skill con nivel local y
+    level1_confidence la confianza con la que el router resuelve en el nivel 1.
+    \"\"\"
+    
+    def __init__(self, classifier, intent_skills: Dict[str, str], level1_confidence: float,
+                 base_examples: Optional[List[Tuple[str, str]]] = None,
+                 min_confidence: float = MIN_VERDICT_CONFIDENCE, min_precision: float = MIN_PRECISION,
+                 min_examples: int = MIN_EXAMPLES):
+        self.classifier = classifier
+        self.intent_skills = dict(intent_skills)
+        self.skill_intents = {skill: intent for intent, skill in intent_skills.items()}
+        self.level1_confidence = level1_confidence
+        self.base_examples = list(base_examples or [])
+        self.min_confidence = min_confidence
+        self.min_precision = min_precision
+        self.min_examples = min_examples
+    
+    def run(self, verdicts: List[Dict[str, Any]], train: bool = True) -> Tuple[Optional[Any], Dict[str, Any]]:
+        \"\"\"
+        (modelo aceptado o None, informe)
+        
+        Se entrena primero sin las consultas reservadas, para medir la
+        precisión con consultas no vistas, y después con todas: ese es el
+        modelo que se proyecta sobre todo el tráfico y el que se acepta.
+        \"\"\"
+        from intent_model import IntentModel
+        
+        verdicts = [v for v in verdicts if _trusted(v, self.min_confidence)]
+        examples = build_examples(verdicts, self.skill_intents, self.min_confidence)
+        current = self.project(self.classifier, verdicts)
+        
+        report: Dict[str, Any] = {
+            'generated': datetime.now().isoformat(),
+            'verdicts': len(verdicts),
+            'examples': len(examples),
+            'labels': dict(Counter(label for _, label in examples)),
+            'current': current,
+            'accepted': False
+        }
+        
+        if not train:
+            return None, report
+        if len(examples) < self.min_examples:
+            report['reason'] = f'faltan ejemplos ({len(examples)} de {self.min_examples})'
+            return None, report
+        
+        # El modelo nuevo reemplaza al actual entero: no puede olvidar intenciones
+        missing = self._missing_labels(examples + self.base_examples)
+        if missing:
+            report['missing_labels'] = missing
+            report['reason'] = f"perdería las intenciones {', '.join(missing)} del modelo actual"
+            return None, report
+        
+        shuffled = list(examples)
+        random.Random(0).shuffle(shuffled)
+        held = max(1, int(len(shuffled) * HOLDOUT))
+        holdout_queries = {normalize_query(query) for query, _ in shuffled[:held]}
+        
+        candidate = IntentModel.train(shuffled[held:] + self.base_examples)
+        holdout = [v for v in verdicts if normalize_query(v['query']) in holdout_queries]
+        report['holdout'] = {
+            'current': self.project(self.classifier, holdout),
+            'candidate': self.project(self._with_model(candidate), holdout)
+        }
+        
+        model = IntentModel.train(examples + self.base_examples)
+        report['projected'] = self.project(self._with_model(model), verdicts)
+        
+        gain = report['holdout']['candidate']['local_rate'] - report['holdout']['current']['local_rate']
+        precision = report['holdout']['candidate']['precision']
+        
+        if gain <= 0:
+            report['reason'] = 'no mejora la tasa local en las consultas reservadas'
+        elif precision < self.min_precision:
+            report['reason'] = f'precisión {precision:.3f} por debajo de {self.min_precision}'
+        else:
+            report['accepted'] = True
+            return model, report
+        
+        return None, report
+    
+    def project(self, classifier, verdicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        \"\"\"
+        Cuántas de estas llamadas a Gemini se habrían resuelto en el nivel 1
+        
+        Una consulta se resuelve localmente si el clasificador da una
+        intención con skill local con al menos level1_confidence; es un
+        acierto si esa skill es la que eligió Gemini.
+        \"\"\"
+        if not verdicts:
+            return {'queries': 0, 'local': 0, 'local_rate': 0.0, 'correct': 0, 'precision': 0.0}
+        
+        local = correct = 0
+        classifications = classifier.classify_batch([v['query'] for v in verdicts], quiet=True)
+        for verdict, (intent, confidence) in zip(verdicts, classifications):
+            skill = self.intent_skills.get(intent) if intent else None
+            if skill is None or confidence < self.level1_confidence:
+                continue
+            local += 1
+            correct += skill == verdict_skill(verdict)
+        
+        return {
+            'queries': len(verdicts),
+            'local': local,
+            'local_rate': round(local / len(verdicts), 3),
+            'correct': correct,
+            'precision': round(correct / local, 3) if local else 0.0
+        }
+    
+    def _missing_labels(self, examples: List[Tuple[str, str]]) -> List[str]:
+        \"\"\"
+        Intenciones del modelo actual sin ningún ejemplo para el modelo nuevo
+        \"\"\"
+        current = self.classifier.model
+        if current is None:
+            return []
+        
+        labels = {label for _, label in examples}
+        return sorted(set(current.intents()) - labels)
+    
+    def _with_model(self, model):
+        candidate = copy.copy(self.classifier)
+        candidate.model = model
+        return candidate
+
+def distiller_for(router) -> Distiller:
+    \"\"\"
+    Distiller con los niveles y la confianza del router y una copia de su
+    clasificador, para poder ejecutarlo en un hilo
+    \"\"\"
+    base = []
+    if DISTILL_BASE:
+        from intent_model import load_examples
+        base = load_examples(DISTILL_BASE)
+    
+    return Distiller(router.intent_classifier.snapshot(), router.tiers.local_intents(),
+                     router.level1_confidence, base)
+
+def save_model(model, path: str):
+    \"\"\"
+    Guarda el modelo sin dejar un fichero a medias si otro proceso lo lee
+    \"\"\"
+    temporary = f'{path}.tmp'
+    model.save(temporary)
+    os.replace(temporary, path)
+
+async def distill_periodically(router, interval: float = DISTILL_INTERVAL):
+    \"\"\"
+    Reentrena el modelo cada interval segundos y lo cambia en caliente si se acepta
+    \"\"\"
+    verdict_log = router.verdict_log
+    path = os.getenv('NYX_INTENT_MODEL') or str(DEFAULT_MODEL_PATH)
+    logger.info(f"Destilación de Gemini cada {interval:g}s desde {verdict_log.path}")
+    
+    distilled_size = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Sin decisiones nuevas el resultado sería el mismo
+            await verdict_log.writer.flush()
+            size = os.path.getsize(verdict_log.path)
+            if size == distilled_size:
+                continue
+            
+            verdicts = await asyncio.to_thread(load_verdicts, verdict_log.path)
+            # El distiller se crea en el loop y el hilo solo usa su copia del clasificador
+            distiller = distiller_for(router)
+            model, report = await asyncio.to_thread(distiller.run, verdicts)
+            # Solo cuenta como destilado si la carga y el entrenamiento terminaron
+            distilled_size = size
+        except FileNotFoundError:
+            continue
+        except RuntimeError as e:
+            # Sin numpy no se puede entrenar: no tiene sentido reintentar
+            logger.warning(f"Destilación desactivada: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Error en la destilación: {e}")
+            continue
+        
+        verdict_log.last_report = report
+        if model is None:
+            logger.info(f"Destilación: modelo no aceptado ({report.get('reason')})")
+            continue
+        
+        # Si el modelo en uso cambió mientras se entrenaba, este ya no lo sustituye
+        if router.intent_classifier.model is not distiller.classifier.model:
+            logger.info("Destilación: el modelo en uso cambió durante el entrenamiento, se descarta")
+            continue
+        
+        await asyncio.to_thread(save_model, model, path)
+        router.intent_classifier.model = model
+        logger.info(f"Destilación: nuevo modelo en {path}, tasa local proyectada "
+                    f"{report['current']['local_rate']:.1%} -> {report['projected']['local_rate']:.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Destilación de las decisiones de Gemini')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    report_parser = commands.add_parser('report', help='Tasa local actual sobre las decisiones guardadas')
+    report_parser.add_argument('verdicts', help='Fichero de NYX_VERDICT_LOG')
+    
+    train_parser = commands.add_parser('train', help='Entrena, proyecta y guarda el modelo si se acepta')
+    train_parser.add_argument('verdicts', help='Fichero de NYX_VERDICT_LOG')
+    train_parser.add_argument('-o', '--output', required=True, help='Fichero .npz')
+    train_parser.add_argument('--base', default=DISTILL_BASE, help='JSONL etiquetado a mano que se añade')
+    train_parser.add_argument('--force', action='store_true', help='Guarda el modelo aunque no se acepte')
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    
+    from intent_classifier import IntentClassifier
+    from intent_model import IntentModel, load_examples
+    from query_router import LEVEL1_CONFIDENCE
+    from tiers import TierRegistry
+    
+    base = load_examples(args.base) if getattr(args, 'base', '') else []
+    distiller = Distiller(IntentClassifier(), TierRegistry(None).local_intents(), LEVEL1_CONFIDENCE, base)
+    verdicts = load_verdicts(args.verdicts)
+    
+    model, report = distiller.run(verdicts, train=args.command == 'train')
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    if args.command != 'train':
+        return
+    
+    if model is None and args.force and report['examples']:
+        model = IntentModel.train(build_examples(verdicts, distiller.skill_intents) + base)
+    if model is not None:
+        save_model(model, args.output)
+        print(f"Modelo guardado en {args.output}")
+    else:
+        print(f"Modelo no aceptado: {report.get('reason')}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/src/distillation.py', 'w') as f:
+    f.write(distillation)
+
+print("✅ Destilación de decisiones creada")
+
+# 18. Benchmark de la búsqueda de triggers
+bench_keywords = """#!/usr/bin/env python3
+\"\"\"
+Benchmark de la búsqueda de triggers con miles de palabras clave
+
+Compara el recorrido lineal de antes (para cada skill y cada trigger,
+`trigger in consulta`) con el autómata de keyword_matcher, que recorre la
+consulta una sola vez sea cual sea el número de triggers. A los triggers de las
+skills reales se añaden skills sintéticas de 20 triggers hasta el total
+pedido, y se comprueba que ambos encuentran las mismas skills.
+
+Uso:
+    python benchmarks/bench_keywords.py [--sizes 100,1000,5000,20000] [--queries 200]
+\"\"\"
+
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
+
+from keyword_matcher import KeywordMatcher
+from normalization import normalize, fold
+
+SKILLS_PATH = Path(__file__).parent.parent.parent / 'skills'
+
+QUERIES = [
+    'tengo una reunión mañana, ¿estoy libre el jueves?',
+    '¿qué es la fotosíntesis?',
+    'buscar noticias sobre inteligencia artificial',
+    '¿va a hacer frío o calor esta semana en madrid?',
+    'hola, ¿qué comandos tienes?',
+    'agendar una cita con el dentista para el mes que viene',
+    'explícame cómo funciona un motor eléctrico con detalle',
+    'precio del bitcoin hoy'
+]
+
+TRIGGERS_PER_SKILL = 20
+
+def load_triggers() -> Dict[str, List[str]]:
+    \"\"\"
+    Triggers de los skill.json del repositorio
+    \"\"\"
+    triggers = {}
+    for manifest in sorted(SKILLS_PATH.glob('*/skill.json')):
+        with open(manifest, 'r') as f:
+            config = json.load(f)
+        triggers[config['name']] = config.get('triggers', [])
+    return triggers
+
+def build_triggers(base: Dict[str, List[str]], total: int, rng: random.Random) -> Dict[str, List[str]]:
+    \"\"\"
+    Triggers reales más skills sintéticas hasta total triggers
+    \"\"\"
+    triggers = dict(base)
+    count = sum(len(words) for words in triggers.values())
+    skill = 0
+    while count < total:
+        size = min(TRIGGERS_PER_SKILL, total - count)
+        triggers[f'skill{skill}'] = [f'{rng.choice(["clave", "orden", "tarea"])}{skill}x{i}' for i in range(size)]
+        count += size
+        skill += 1
+    return triggers
+
+def build_queries(triggers: Dict[str, List[str]], count: int, rng: random.Random) -> List[str]:
+    \"\"\"
+    Consultas reales, algunas con un trigger sintético
+    \"\"\"
+    synthetic = [word for name, words in triggers.items() if name.startswith('skill') for word in words]
+    queries = []
+    for i in range(count):
+        query = QUERIES[i % len(QUERIES)]
+        if i % 2 and synthetic:
+            query = f'{query} {rng.choice(synthetic)}'
+        queries.append(normalize(query).folded)
+    return queries
+
+def bench(fn, queries: List[str], repeat: int) -> float:
+    \"\"\"
+    Microsegundos por consulta (mejor de repeat pasadas)
+    \"\"\"
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for query in queries:
+            fn(query)
+        best = min(best, time.perf_counter() - started)
+    return best / len(queries) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la búsqueda de triggers')
+    parser.add_argument('--sizes', default='100,1000,5000,20000', help='Triggers en total, separados por comas')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    rng = random.Random(42)
+    base = load_triggers()
+    
+    print(f"{'triggers':>9} {'skills':>7} {'lineal':>12} {'autómata':>12} {'mejora':>8}")
+    
+    for size in (int(s) for s in args.sizes.split(',')):
+        triggers = build_triggers(base, size, rng)
+        queries = build_queries(triggers, args.queries, rng)
+        # El recorrido lineal con los triggers ya sin tildes, para no contar fold()
+        folded = {name: [fold(word) for word in words] for name, words in triggers.items()}
+        
+        started = time.perf_counter()
+        matcher = KeywordMatcher(triggers)
+        build_ms = (time.perf_counter() - started) * 1000
+        
+        def linear(query: str) -> Optional[str]:
+            for name, words in folded.items():
+                for word in words:
+                    if word in query:
+                        return name
+            return None
+        
+        def automaton(query: str) -> Optional[str]:
+            found = matcher.scan(query)
+            return next((name for name in triggers if name in found), None)
+        
+        for query in queries:
+            if linear(query) != automaton(query):
+                print(f"❌ Skills distintas para {query!r}")
+                sys.exit(1)
+        
+        old_us = bench(linear, queries, args.repeat)
+        new_us = bench(automaton, queries, args.repeat)
+        total = sum(len(words) for words in triggers.values())
+        
+        print(f"{total:>9} {len(triggers):>7} {old_us:>10.1f}µs {new_us:>10.1f}µs {old_us / new_us:>7.1f}x"
+              f"   (construcción {build_ms:.1f}ms, {matcher.states} estados)")
+    
+    print("\\n✅ Misma skill en todas las consultas")
+
+if __name__ == '__main__':
+    main()
+"""
+
+with open('nyx/bridge/benchmarks/bench_keywords.py', 'w') as f:
+    f.write(bench_keywords)
+
+print("✅ Benchmark de triggers creado")
+
+# 19. Pruebas del puente (pytest)
+os.makedirs('nyx/bridge/tests', exist_ok=True)
+
+conftest = """\"\"\"
+Configuración de pytest para las pruebas del puente
+
+Los módulos del puente se importan igual que en main.py: bridge/src y
+clients/ van en sys.path.
+\"\"\"
+
+import sys
+from pathlib import Path
+
+BRIDGE_PATH = Path(__file__).parent.parent
+
+sys.path.append(str(BRIDGE_PATH.parent / 'clients'))
+sys.path.append(str(BRIDGE_PATH / 'src'))
+"""
+
+with open('nyx/bridge/tests/conftest.py', 'w') as f:
+    f.write(conftest)
+
+test_services = """\"\"\"
+Pruebas del contenedor de servicios compartidos
+\"\"\"
+
+import pytest
+
+from services import ServiceContainer
+from query_router import QueryRouter
+
+class Counter:
+    \"\"\"
+    Fábrica que cuenta cuántas instancias crea
+    \"\"\"
+    
+    def __init__(self):
+        self.created = 0
+    
+    def __call__(self, services):
+        self.created += 1
+        return object()
+
+class TestServiceContainer:
+    def setup_method(self):
+        self.services = ServiceContainer()
+        self.factory = Counter()
+        self.services.register('reloj', self.factory)
+    
+    def test_services_are_created_on_first_use(self):
+        assert 'reloj' not in self.services.created()
+        assert self.factory.created == 0
+        
+        first = self.services.get('reloj')
+        
+        assert self.services.reloj is first
+        assert self.factory.created == 1
+        assert 'reloj' in self.services.created()
+    
+    def test_provide_replaces_the_instance(self):
+        instance = object()
+        
+        self.services.provide('reloj', instance)
+        
+        assert self.services.reloj is instance
+        assert self.factory.created == 0
+    
+    def test_register_drops_the_previous_instance(self):
+        first = self.services.reloj
+        
+        self.services.register('reloj', Counter())
+        
+        assert self.services.reloj is not first
+    
+    def test_unknown_service(self):
+        with pytest.raises(KeyError):
+            self.services.get('desconocido')
+        with pytest.raises(AttributeError):
+            self.services.desconocido
+    
+    def test_factories_receive_the_container(self):
+        self.services.register('doble', lambda services: (services.reloj, services.reloj))
+        
+        first, second = self.services.doble
+        
+        assert first is second
+        assert self.factory.created == 1
+
+class TestSharedServices:
+    def test_router_and_skills_share_one_container(self):
+        services = ServiceContainer()
+        budget = object()
+        services.provide('budget_governor', budget)
+        
+        router = QueryRouter(services)
+        
+        assert router.services is services
+        assert router.budget_governor is budget
+        assert router.skill_manager.services is services
+    
+    def test_routers_do_not_create_external_clients_up_front(self):
+        router = QueryRouter(ServiceContainer())
+        
+        created = router.services.created()
+        
+        assert 'gemini_client' not in created
+        assert 'perplexity_client' not in created
+        assert 'budget_governor' not in created
+"""
+
+with open('nyx/bridge/tests/test_services.py', 'w') as f:
+    f.write(test_services)
+
+test_protocol = """\"\"\"
+Pruebas del protocolo con Node: frames que llegan partidos en varios trozos
+\"\"\"
+
+import asyncio
+
+import pytest
+
+import protocol
+from protocol import FramedCodec, NdjsonCodec, ProtocolError
+
+MESSAGES = [
+    {'type': 'query', 'message': '¿qué tengo mañana?', 'requestId': 1},
+    {'type': 'batch', 'queries': ['hola', 'adiós'], 'requestId': 2},
+    {'type': 'cancel', 'requestId': 1}
+]
+
+def codecs():
+    serializers = ['json'] + (['msgpack'] if protocol.msgpack is not None else [])
+    return [FramedCodec(serializer) for serializer in serializers] + [NdjsonCodec()]
+
+def read_in_chunks(codec, data: bytes, size: int) -> list:
+    \"\"\"
+    Mensajes leídos de un stream que entrega data en trozos de size bytes
+    \"\"\"
+    async def scenario():
+        reader = asyncio.StreamReader()
+        
+        async def feed():
+            for start in range(0, len(data), size):
+                reader.feed_data(data[start:start + size])
+                await asyncio.sleep(0)
+            reader.feed_eof()
+        
+        feeding = asyncio.create_task(feed())
+        messages = []
+        while True:
+            message = await codec.read(reader)
+            if message is None:
+                break
+            messages.append(message)
+        await feeding
+        return messages
+    
+    return asyncio.run(scenario())
+
+class TestFraming:
+    @pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+    @pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+    def test_messages_split_across_chunks(self, codec, size):
+        data = b''.join(codec.encode(message) for message in MESSAGES)
+        
+        assert read_in_chunks(codec, data, size) == MESSAGES
+    
+    @pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+    def test_iter_messages(self, codec):
+        data = b''.join(codec.encode(message) for message in MESSAGES)
+        
+        assert list(codec.iter_messages(data)) == MESSAGES
+    
+    def test_truncated_frame_ends_the_stream(self):
+        codec = FramedCodec('json')
+        data = codec.encode(MESSAGES[0]) + codec.encode(MESSAGES[1])[:-3]
+        
+        assert read_in_chunks(codec, data, 4) == [MESSAGES[0]]
+    
+    def test_oversized_frame_is_fatal(self):
+        codec = FramedCodec('json')
+        data = protocol.HEADER.pack(protocol.MAX_MESSAGE_BYTES + 1) + b'{}'
+        
+        with pytest.raises(ConnectionError):
+            read_in_chunks(codec, data, 2)
+    
+    def test_invalid_payload(self):
+        with pytest.raises(ProtocolError):
+            FramedCodec('json').decode(b'{no es json')
+
+class TestNegotiation:
+    def test_first_supported_offer_wins(self):
+        assert protocol.negotiate(['otro', 'framed-json', 'ndjson']) == 'framed-json'
+        assert protocol.negotiate(['ndjson', 'framed-json']) == 'ndjson'
+    
+    def test_falls_back_to_ndjson(self):
+        assert protocol.negotiate(['otro']) == 'ndjson'
+"""
+
+with open('nyx/bridge/tests/test_protocol.py', 'w') as f:
+    f.write(test_protocol)
+
+test_response_cache = """\"\"\"
+Pruebas de la caché de respuestas: ámbito, caducidad e invalidación
+\"\"\"
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+def gemini_result(text: str = 'respuesta') -> dict:
+    return {
+        'success': True,
+        'level': 2,
+        'method': 'gemini_direct',
+        'result': {'response': text, 'type': 'text'}
+    }
+
+def skill_result(level: int = 1, result_type: str = 'calendar_events') -> dict:
+    return {
+        'success': True,
+        'level': level,
+        'skill': 'calendar',
+        'result': {'success': True, 'content': 'eventos', 'type': result_type}
+    }
+
+class FakeClock:
+    \"\"\"
+    Sustituye a time.monotonic() para avanzar el tiempo a mano
+    \"\"\"
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(response_cache.time, 'monotonic', fake)
+    return fake
+
+class TestScope:
+    def setup_method(self):
+        self.cache = ResponseCache(max_entries=10, enabled=True)
+    
+    def test_gemini_answers_are_shared_between_users(self):
+        self.cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+        
+        hit = self.cache.get('¿Qué es la fotosíntesis?', 'luis')
+        
+        assert hit['result']['response'] == 'respuesta'
+        assert hit['cache']['scope'] == 'shared'
+    
+    def test_skill_answers_stay_with_their_user(self):
+        self.cache.put('qué tengo mañana', 'ana', skill_result())
+        
+        assert self.cache.get('qué tengo mañana', 'ana')['cache']['scope'] == 'user'
+        assert self.cache.get('qué tengo mañana', 'luis') is None
+    
+    def test_key_ignores_case_and_punctuation(self):
+        self.cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+        
+        assert self.cache.get('qué es la FOTOSÍNTESIS', 'ana') is not None
+        assert self.cache.get('¿Qué es la fotosíntesis de las algas?', 'ana') is None
+    
+    def test_key_ignores_accents(self):
+        self.cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+        
+        assert self.cache.get('que es la fotosintesis', 'ana') is not None
+        assert self.cache.contains('QUE ES LA FOTOSINTESIS', 'ana')
+    
+    def test_hit_is_a_copy(self):
+        self.cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+        
+        self.cache.get('¿Qué es la fotosíntesis?', 'ana')['result']['response'] = 'cambiada'
+        
+        assert self.cache.get('¿Qué es la fotosíntesis?', 'ana')['result']['response'] == 'respuesta'
+    
+    def test_failed_and_fallback_results_are_not_stored(self):
+        self.cache.put('a', 'ana', {'success': False, 'level': 2, 'error': 'boom'})
+        self.cache.put('b', 'ana', {**gemini_result(), 'fallback': {'source': 'stale_cache'}})
+        self.cache.put('c', 'ana', {'success': True, 'level': 3, 'result': {'success': False}})
+        
+        assert self.cache.stats()['size'] == 0
+    
+    def test_disabled_cache_stores_nothing(self):
+        cache = ResponseCache(enabled=False)
+        cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+        
+        assert cache.get('¿Qué es la fotosíntesis?', 'ana') is None
+        assert cache.stats()['size'] == 0
+    
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_entries=2, enabled=True)
+        cache.put('uno', 'ana', gemini_result())
+        cache.put('dos', 'ana', gemini_result())
+        cache.get('uno', 'ana')
+        cache.put('tres', 'ana', gemini_result())
+        
+        assert cache.get('dos', 'ana') is None
+        assert cache.get('uno', 'ana') is not None
+        assert cache.stats()['evictions'] == 1
+
+class TestTtl:
+    def setup_method(self):
+        self.cache = ResponseCache(max_entries=10, enabled=True, max_stale=3600)
+    
+    def test_level1_expires_after_its_ttl(self, clock):
+        self.cache.put('qué tengo mañana', 'ana', skill_result(level=1))
+        
+        clock.now += response_cache.LEVEL_TTLS[1] - 1
+        assert self.cache.get('qué tengo mañana', 'ana') is not None
+        
+        clock.now += 2
+        assert self.cache.get('qué tengo mañana', 'ana') is None
+    
+    def test_category_ttl_applies_when_shorter(self, clock):
+        self.cache.put('noticias de hoy', 'ana', {**gemini_result(), 'level': 3})
+        
+        assert self.cache.get('noticias de hoy', 'ana')['cache']['ttl_s'] == response_cache.CATEGORY_TTLS['news']
+        
+        clock.now += response_cache.CATEGORY_TTLS['news'] + 1
+        assert self.cache.get('noticias de hoy', 'ana') is None
+    
+    def test_expired_entry_is_served_as_stale(self, clock):
+        self.cache.put('noticias de hoy', 'ana', {**gemini_result(), 'level': 3})
+        clock.now += response_cache.CATEGORY_TTLS['news'] + 1
+        
+        stale = self.cache.get_stale('noticias de hoy', 'ana')
+        
+        assert stale['cache']['stale'] is True
+        assert self.cache.stats()['stale_hits'] == 1
+    
+    def test_stale_entry_is_dropped_after_max_stale(self, clock):
+        self.cache.put('noticias de hoy', 'ana', {**gemini_result(), 'level': 3})
+        clock.now += response_cache.CATEGORY_TTLS['news'] + 3600
+        
+        assert self.cache.get_stale('noticias de hoy', 'ana') is None
+        assert self.cache.stats()['expirations'] == 1
+
+class TestInvalidation:
+    def setup_method(self):
+        self.cache = ResponseCache(max_entries=10, enabled=True)
+        self.cache.put('qué tengo mañana', 'ana', skill_result())
+        self.cache.put('qué tengo mañana', 'luis', skill_result())
+        self.cache.put('¿Qué es la fotosíntesis?', 'ana', gemini_result())
+    
+    def test_created_event_invalidates_only_that_user(self):
+        self.cache.put('crear reunión mañana', 'ana', skill_result(result_type='event_created'))
+        
+        assert self.cache.get('qué tengo mañana', 'ana') is None
+        assert self.cache.get('qué tengo mañana', 'luis') is not None
+        assert self.cache.get('¿Qué es la fotosíntesis?', 'ana') is not None
+        assert self.cache.stats()['invalidations'] == 1
+    
+    def test_invalidate_user(self):
+        self.cache.invalidate('luis')
+        
+        assert self.cache.get('qué tengo mañana', 'luis') is None
+        assert self.cache.get('qué tengo mañana', 'ana') is not None
+    
+    def test_invalidate_all(self):
+        self.cache.invalidate()
+        
+        assert self.cache.stats()['size'] == 0
+        assert self.cache.stats()['invalidations'] == 3
+"""
+
+with open('nyx/bridge/tests/test_response_cache.py', 'w') as f:
+    f.write(test_response_cache)
+
+test_single_flight = """\"\"\"
+Pruebas del single-flight: una sola llamada a la API por clave en curso
+\"\"\"
+
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+class FakeApi:
+    \"\"\"
+    API que cuenta las llamadas y tarda hasta que se la libera
+    \"\"\"
+    
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+    
+    async def search(self, query: str) -> dict:
+        self.calls += 1
+        await self.release.wait()
+        return {'success': True, 'answer': query.upper(), 'sources': []}
+
+class TestSingleFlight:
+    def test_identical_calls_share_one_upstream_call(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            waiting = [
+                asyncio.create_task(flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')))
+                for _ in range(5)
+            ]
+            await asyncio.sleep(0)
+            api.release.set()
+            return flights, api, await asyncio.gather(*waiting)
+        
+        flights, api, results = asyncio.run(scenario())
+        
+        assert api.calls == 1
+        assert all(result['answer'] == 'HOY' for result in results)
+        assert flights.stats()['perplexity'] == {'calls': 5, 'collapsed': 4, 'cancelled': 0}
+        assert flights.stats()['in_flight'] == 0
+    
+    def test_each_waiter_gets_its_own_copy(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            api.release.set()
+            first, second = await asyncio.gather(
+                flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')),
+                flights.do(('perplexity', 'hoy'), lambda: api.search('hoy'))
+            )
+            return first, second
+        
+        first, second = asyncio.run(scenario())
+        first['sources'].append('modificada')
+        
+        assert second['sources'] == []
+    
+    def test_different_keys_call_separately(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            api.release.set()
+            await asyncio.gather(
+                flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')),
+                flights.do(('perplexity', 'mañana'), lambda: api.search('mañana')),
+                flights.do(('gemini', 'hoy'), lambda: api.search('hoy'))
+            )
+            return api
+        
+        assert asyncio.run(scenario()).calls == 3
+    
+    def test_finished_call_is_not_reused(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            api.release.set()
+            await flights.do(('perplexity', 'hoy'), lambda: api.search('hoy'))
+            await flights.do(('perplexity', 'hoy'), lambda: api.search('hoy'))
+            return api
+        
+        assert asyncio.run(scenario()).calls == 2
+    
+    def test_call_survives_while_someone_still_waits(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            first = asyncio.create_task(flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')))
+            second = asyncio.create_task(flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')))
+            await asyncio.sleep(0)
+            
+            first.cancel()
+            await asyncio.sleep(0)
+            api.release.set()
+            
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return flights, api, await second
+        
+        flights, api, result = asyncio.run(scenario())
+        
+        assert result['answer'] == 'HOY'
+        assert api.calls == 1
+        assert flights.stats()['perplexity']['cancelled'] == 0
+    
+    def test_call_is_cancelled_when_everyone_leaves(self):
+        async def scenario():
+            flights = SingleFlight()
+            api = FakeApi()
+            waiting = asyncio.create_task(flights.do(('perplexity', 'hoy'), lambda: api.search('hoy')))
+            await asyncio.sleep(0)
+            
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            return flights
+        
+        flights = asyncio.run(scenario())
+        
+        assert flights.stats()['perplexity']['cancelled'] == 1
+        assert flights.stats()['in_flight'] == 0
+"""
+
+with open('nyx/bridge/tests/test_single_flight.py', 'w') as f:
+    f.write(test_single_flight)
+
+test_circuit_breaker = """\"\"\"
+Pruebas de los circuit breakers: cerrado, abierto y semiabierto
+\"\"\"
+
+import asyncio
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+
+class FakeClock:
+    \"\"\"
+    Sustituye a time.monotonic() para avanzar el tiempo a mano
+    \"\"\"
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', fake)
+    return fake
+
+def make_breaker(**options) -> CircuitBreaker:
+    settings = {'failure_threshold': 3, 'reset_timeout': 30, 'half_open_max': 1, 'slow_call': 20}
+    settings.update(options)
+    return CircuitBreaker('prueba', **settings)
+
+def call(breaker: CircuitBreaker, success: bool = True) -> dict:
+    async def api():
+        return {'success': success}
+    return asyncio.run(breaker.call(api))
+
+def fail(breaker: CircuitBreaker, times: int = 1):
+    for _ in range(times):
+        call(breaker, success=False)
+
+class TestTransitions:
+    def test_opens_after_consecutive_failures(self, clock):
+        breaker = make_breaker()
+        
+        fail(breaker, 2)
+        assert breaker.state == CLOSED
+        
+        fail(breaker)
+        assert breaker.state == OPEN
+        assert breaker.counters['opened'] == 1
+    
+    def test_success_resets_the_failure_count(self, clock):
+        breaker = make_breaker()
+        
+        fail(breaker, 2)
+        call(breaker)
+        fail(breaker, 2)
+        
+        assert breaker.state == CLOSED
+    
+    def test_open_breaker_rejects_without_calling(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        calls = []
+        
+        async def api():
+            calls.append(1)
+            return {'success': True}
+        
+        response = asyncio.run(breaker.call(api))
+        
+        assert calls == []
+        assert response['circuit_open'] is True
+        assert response['retry_after'] == 30
+        assert breaker.counters['rejected'] == 1
+    
+    def test_guard_raises_circuit_open(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        
+        with pytest.raises(CircuitOpen):
+            with breaker.guard():
+                pass
+    
+    def test_half_open_after_reset_timeout(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        
+        clock.now += 29
+        assert breaker.state == OPEN
+        
+        clock.now += 1
+        assert breaker.state == HALF_OPEN
+        assert breaker.allows()
+    
+    def test_successful_trial_closes_it(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        clock.now += 30
+        
+        call(breaker)
+        
+        assert breaker.state == CLOSED
+    
+    def test_failed_trial_opens_it_again(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        clock.now += 30
+        
+        fail(breaker)
+        
+        assert breaker.state == OPEN
+        assert breaker.counters['opened'] == 2
+        assert breaker.retry_after() == 30
+    
+    def test_half_open_admits_limited_trials(self, clock):
+        breaker = make_breaker()
+        fail(breaker, 3)
+        clock.now += 30
+        
+        with breaker.guard():
+            assert not breaker.allows()
+        
+        assert breaker.state == CLOSED
+
+class TestFailures:
+    def test_exception_counts_as_failure(self, clock):
+        breaker = make_breaker(failure_threshold=1)
+        
+        with pytest.raises(RuntimeError):
+            with breaker.guard():
+                raise RuntimeError('boom')
+        
+        assert breaker.state == OPEN
+    
+    def test_slow_call_counts_as_failure(self, clock):
+        breaker = make_breaker(failure_threshold=1, slow_call=5)
+        
+        with breaker.guard():
+            clock.now += 6
+        
+        assert breaker.state == OPEN
+    
+    def test_cancellation_before_the_deadline_is_not_a_failure(self, clock):
+        breaker = make_breaker(failure_threshold=1)
+        
+        with pytest.raises(asyncio.CancelledError):
+            with breaker.guard():
+                raise asyncio.CancelledError()
+        
+        assert breaker.state == CLOSED
+        assert breaker.counters['failures'] == 0
+    
+    def test_zero_threshold_disables_the_breaker(self, clock):
+        breaker = make_breaker(failure_threshold=0)
+        
+        fail(breaker, 10)
+        
+        assert breaker.state == CLOSED
+        assert breaker.allows()
+"""
+
+with open('nyx/bridge/tests/test_circuit_breaker.py', 'w') as f:
+    f.write(test_circuit_breaker)
+
+test_intent_classifier = """\"\"\"
+Pruebas de PatternMatcher frente a la evaluación patrón a patrón
+
+PatternMatcher solo evalúa los patrones candidatos por las palabras de la
+consulta; las confianzas tienen que ser exactamente las de
+_calculate_confidence(), que los evalúa todos. Las estadísticas solo cuentan
+como locales las consultas que el router resolvería en el nivel 1.
+\"\"\"
+
+import random
+
+import pytest
+
+from intent_classifier import IntentClassifier, PatternMatcher, LEVEL1_CONFIDENCE
+from normalization import normalize, fold_pattern
+
+# Patrones con formas que el índice trata aparte: sin lista inicial, ancla,
+# grupo opcional, alternativa de nivel superior, prefijo de palabra...
+EXTRA_PATTERNS = [
+    r'(\\w)\\1',
+    r'(?i)hoy',
+    r'x*',
+    r'\\b\\w+\\b.*\\bhoy\\b',
+    r'\\b(hoy|sol)?x',
+    r'\\b(sol)\\b|clima',
+    r'^(qué|cuál)',
+    r'\\b(por qué|crear evento)\\b',
+    r'\\b(ho)',
+    r'\\b(Sol|REUNIÓN)\\b.*\\bsobre\\b',
+    r'\\b(?:libre|ocupado)\\b'
+]
+
+WORDS = (
+    'hola Hola HOY reunión Reunión mañana hoy libre qué es clima sol Sol buscar noticias '
+    'sobre aaa xx ocupado calendario evento agenda tiempo frío ayuda help cita semana por '
+    'qué dónde ſol crear hoyo hol quéhacer cuálquier x'
+).split()
+
+def reference(classifier: IntentClassifier, query: str) -> dict:
+    \"\"\"
+    Confianzas evaluando todos los patrones uno a uno, como antes de PatternMatcher
+    \"\"\"
+    confidences = {
+        intent: classifier._calculate_confidence(query, [fold_pattern(pattern) for pattern in patterns])
+        for intent, patterns in classifier.patterns.items()
+    }
+    return {intent: confidence for intent, confidence in confidences.items() if confidence}
+
+def random_queries(count: int, seed: int = 2):
+    rng = random.Random(seed)
+    for _ in range(count):
+        query = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 9)))
+        yield normalize(query.lower() if rng.random() < 0.5 else query).folded
+
+class TestPatternMatcher:
+    def setup_method(self):
+        self.classifier = IntentClassifier(model=None)
+    
+    def test_same_confidences_as_the_regex_loop(self):
+        matcher = self.classifier._get_matcher()
+        
+        for query in random_queries(2000):
+            assert matcher.confidences(query, self.classifier.confidence_weights) == \\
+                reference(self.classifier, query), query
+    
+    def test_same_confidences_with_unindexable_patterns(self):
+        for pattern in EXTRA_PATTERNS:
+            self.classifier.add_pattern('extra', pattern)
+        matcher = self.classifier._get_matcher()
+        
+        assert matcher._always, 'algún patrón de prueba tiene que evaluarse siempre'
+        for query in random_queries(2000, seed=7):
+            assert matcher.confidences(query, self.classifier.confidence_weights) == \\
+                reference(self.classifier, query), query
+    
+    @pytest.mark.parametrize('query, intent', [
+        ('agendar una reunión mañana, ¿estoy libre?', 'calendar'),
+        ('agendar una reunion manana, estoy libre?', 'calendar'),
+        ('qué es la fotosíntesis, buscar en internet', 'search'),
+        ('hola, ¿qué comandos tienes? ayuda', 'general')
+    ])
+    def test_classify(self, query, intent):
+        assert self.classifier.classify(query)[0] == intent
+    
+    def test_added_pattern_recompiles_the_matcher(self):
+        first = self.classifier._get_matcher()
+        
+        self.classifier.add_pattern('weather', r'\\b(paraguas)\\b')
+        
+        assert self.classifier._get_matcher() is not first
+        assert 'weather' in self.classifier._get_matcher().confidences('llevo paraguas', {
+            'exact_match': 1.0, 'partial_match': 0.7
+        })
+    
+    def test_leading_words(self):
+        assert PatternMatcher._leading_words(r'\\b(cita|agenda)\\b') == [('cita', True), ('agenda', True)]
+        assert PatternMatcher._leading_words(r'\\b(ho)') == [('ho', False)]
+        assert PatternMatcher._leading_words(r'\\b(hoy|sol)?x') is None
+        assert PatternMatcher._leading_words(r'\\b(sol)\\b|clima') is None
+
+class FixedModel:
+    \"\"\"
+    Modelo que da a todo la misma intención y probabilidad
+    \"\"\"
+    
+    threshold = 0.6
+    
+    def __init__(self, probability: float):
+        self.probability = probability
+    
+    def classify_batch(self, queries):
+        return [('calendar', self.probability) for _ in queries]
+
+class TestStats:
+    def test_model_answers_below_level1_are_not_local(self):
+        classifier = IntentClassifier(model=FixedModel(LEVEL1_CONFIDENCE - 0.1))
+        
+        assert classifier.classify('algo que no casa con ningún patrón') == ('calendar', LEVEL1_CONFIDENCE - 0.1)
+        stats = classifier.get_stats()
+        
+        assert stats['model'] == 1
+        assert stats['local_rate'] == 0.0
+    
+    def test_model_answers_at_level1_are_local(self):
+        classifier = IntentClassifier(model=FixedModel(LEVEL1_CONFIDENCE))
+        
+        classifier.classify('algo que no casa con ningún patrón')
+        
+        assert classifier.get_stats()['local_rate'] == 1.0
+"""
+
+with open('nyx/bridge/tests/test_intent_classifier.py', 'w') as f:
+    f.write(test_intent_classifier)
+
+test_keyword_matcher = """\"\"\"
+Pruebas de KeywordRegistry frente a las comprobaciones `palabra in consulta`
+
+También comprueban que SkillManager vuelve a registrar los triggers de sus
+skills cuando cambian.
+\"\"\"
+
+import random
+
+from keyword_matcher import KeywordMatcher, KeywordRegistry
+from skill_manager import SkillManager
+from normalization import normalize, fold
+
+GROUPS = {
+    'trigger:calendar': ['calendario', 'evento', 'reunión', 'cita', 'agenda', 'agendar'],
+    'trigger:perplexity': ['buscar', 'noticias', 'actualidad', 'qué pasa'],
+    'web_search': ['noticias', 'hoy', 'precio', 'últimas', 'actual', 'ahora'],
+    'category:weather': ['clima', 'tiempo', 'temperatura', 'lluvia'],
+    'solapadas': ['a', 'ag', 'age', 'agenda de', 'hoyo', 'oy']
+}
+
+WORDS = (
+    'agenda agendar reunión reunion REUNIÓN cita calendario noticias hoy hoyo ahora '
+    'actualidad precio últimas ultimas clima tiempo lluvia qué pasa buscar de la el '
+    'mañana frío ÁGENDA x'
+).split()
+
+def substring_matches(groups: dict, query: str) -> dict:
+    \"\"\"
+    Coincidencias comprobando cada palabra con `in`, como antes del autómata
+    \"\"\"
+    folded = normalize(query).folded
+    found = {}
+    for owner, keywords in groups.items():
+        matched = [keyword for keyword in keywords if fold(keyword) and fold(keyword) in folded]
+        if matched:
+            found[owner] = matched
+    return found
+
+def as_sets(matches: dict) -> dict:
+    return {owner: set(keywords) for owner, keywords in matches.items()}
+
+class TestKeywordRegistry:
+    def setup_method(self):
+        self.registry = KeywordRegistry()
+        for owner, keywords in GROUPS.items():
+            self.registry.register(owner, keywords)
+    
+    def test_same_matches_as_substring_checks(self):
+        rng = random.Random(3)
+        
+        for _ in range(2000):
+            query = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 8)))
+            assert as_sets(self.registry.matches(query)) == as_sets(substring_matches(GROUPS, query)), query
+    
+    def test_accents_and_case_are_ignored(self):
+        found = self.registry.matches('Tengo una REUNION, ¿qué pasa con la AGENDA?')
+        
+        assert set(found['trigger:calendar']) == {'reunión', 'agenda'}
+        assert found['trigger:perplexity'] == ['qué pasa']
+    
+    def test_result_is_cached_on_the_query(self):
+        query = normalize('noticias de hoy')
+        
+        first = self.registry.matches(query)
+        
+        assert query.keyword_matches == (self.registry.version, first)
+        assert self.registry.matches(query) is first
+    
+    def test_register_invalidates_cached_matches(self):
+        query = normalize('llevo paraguas')
+        assert 'category:weather' not in self.registry.matches(query)
+        
+        self.registry.register('category:weather', GROUPS['category:weather'] + ['paraguas'])
+        
+        assert self.registry.matches(query)['category:weather'] == ['paraguas']
+    
+    def test_unregister(self):
+        self.registry.unregister('web_search')
+        
+        assert 'web_search' not in self.registry.matches('noticias de hoy')
+        assert self.registry.keywords('web_search') == ()
+    
+    def test_matcher_is_rebuilt_only_after_changes(self):
+        self.registry.matches('hoy')
+        self.registry.matches('mañana')
+        self.registry.register('trigger:calendar', GROUPS['trigger:calendar'])
+        self.registry.matches('ahora')
+        
+        assert self.registry.stats()['builds'] == 1
+        
+        self.registry.register('nuevo', ['palabra'])
+        self.registry.matches('ahora')
+        
+        assert self.registry.stats()['builds'] == 2
+
+class TestKeywordMatcher:
+    def test_empty_keywords_are_ignored(self):
+        matcher = KeywordMatcher({'vacias': ['', 'hoy']})
+        
+        assert matcher.scan('hoy') == {'vacias': ['hoy']}
+        assert matcher.size == 1
+    
+    def test_overlapping_keywords(self):
+        matcher = KeywordMatcher({'a': ['he', 'she', 'his', 'hers']})
+        
+        assert set(matcher.scan('ushers')['a']) == {'he', 'she', 'hers'}
+
+class TestSkillTriggers:
+    def setup_method(self):
+        self.manager = SkillManager()
+        self.manager.skills = {'recetas': {'instance': None, 'config': {'triggers': ['receta']}, 'path': None}}
+    
+    def test_replaced_trigger_is_registered(self):
+        assert self.manager.get_skill_by_trigger('una receta de paella') == 'recetas'
+        
+        self.manager.skills['recetas']['config']['triggers'][0] = 'cocinar'
+        
+        assert self.manager.get_skill_by_trigger('una receta de paella') is None
+        assert self.manager.get_skill_by_trigger('qué puedo cocinar') == 'recetas'
+"""
+
+with open('nyx/bridge/tests/test_keyword_matcher.py', 'w') as f:
+    f.write(test_keyword_matcher)
+
+test_query_router = """\"\"\"
+Pruebas del router con Gemini y skills simulados
+
+Comprueban que /api/query y /api/query/stream llegan al mismo resultado, que
+la respuesta directa de Gemini se emite en varios fragmentos, que las
+consultas idénticas en curso comparten una sola llamada a Gemini y que
+las repetidas se sirven desde la caché. La clasificación con que el puente
+elige carril se reutiliza al enrutar, y la predicción sigue la política.
+\"\"\"
+
+import asyncio
+
+import pytest
+
+import deadline
+from query_router import QueryRouter
+from skill_base import Skill
+from routing_policy import AdaptivePolicy
+
+SKILL_ANALYSIS = {'skill_required': True, 'skill_name': 'calendar', 'structured_data': {}}
+DIRECT_ANALYSIS = {'skill_required': False, 'response': 'La fotosíntesis es...'}
+FAILED_ANALYSIS = {'success': False, 'error': 'Gemini no responde'}
+
+class FakeCalendar(Skill):
+    def __init__(self):
+        super().__init__({'name': 'calendar'})
+    
+    def execute(self, query, context):
+        return self.format_response('Mañana: reunión a las 10', 'calendar_events')
+
+class FakeGemini:
+    \"\"\"
+    Cliente de Gemini que responde siempre con el mismo análisis
+    \"\"\"
+    
+    def __init__(self, analysis: dict, delay: float = 0.0, chunks=('La fotosíntesis ', 'es...')):
+        self.analysis = analysis
+        self.delay = delay
+        self.chunks = chunks
+        self.calls = 0
+    
+    async def analyze_query(self, query, user_id='anonymous'):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return dict(self.analysis)
+    
+    async def stream_response(self, query, user_id='anonymous'):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+class BrokenStreamGemini(FakeGemini):
+    async def stream_response(self, query, user_id='anonymous'):
+        raise ConnectionError('streaming no disponible')
+        yield
+
+def make_router(gemini: FakeGemini) -> QueryRouter:
+    router = QueryRouter()
+    router.intent_classifier.classify = lambda query: (None, 0.1)
+    router.skill_manager.skills = {'calendar': {'instance': FakeCalendar(), 'config': {}, 'path': None}}
+    router.services.provide('gemini_client', gemini)
+    return router
+
+async def stream(router: QueryRouter, query: str) -> list:
+    return [event async for event in router.route_query_stream(query, 'ana', use_cache=False)]
+
+class TestStreamMatchesQuery:
+    @pytest.mark.parametrize('analysis, method', [
+        (SKILL_ANALYSIS, 'gemini_reasoning'),
+        (DIRECT_ANALYSIS, 'gemini_direct'),
+        (FAILED_ANALYSIS, 'local_help')
+    ])
+    def test_same_result(self, analysis, method):
+        async def scenario():
+            router = make_router(FakeGemini(analysis))
+            result = await router.route_query('algo que pensar', 'ana', use_cache=False)
+            events = await stream(router, 'algo que pensar')
+            return router, result, events
+        
+        router, result, events = asyncio.run(scenario())
+        streamed = events[-1]['result']
+        
+        assert result['method'] == streamed['method'] == method
+        assert result['level'] == streamed['level']
+        assert result['success'] == streamed['success']
+        assert ''.join(event['chunk'] for event in events if 'chunk' in event) == router._result_text(streamed)
+    
+    def test_skill_chosen_by_gemini_without_triggers(self):
+        async def scenario():
+            router = make_router(FakeGemini(SKILL_ANALYSIS))
+            return await stream(router, 'estoy libre el jueves por la tarde')
+        
+        streamed = asyncio.run(scenario())[-1]['result']
+        
+        assert streamed['method'] == 'gemini_reasoning'
+        assert streamed['analysis']['skill_name'] == 'calendar'
+
+class TestStreamingDirectAnswer:
+    def test_direct_answer_arrives_in_several_chunks(self):
+        async def scenario():
+            router = make_router(FakeGemini(DIRECT_ANALYSIS))
+            return await stream(router, 'algo que pensar')
+        
+        events = asyncio.run(scenario())
+        
+        assert [event['chunk'] for event in events[:-1]] == ['La fotosíntesis ', 'es...']
+        assert events[-1]['result']['result']['response'] == 'La fotosíntesis es...'
+        assert events[-1]['result']['result']['analysis']['skill_required'] is False
+    
+    def test_failed_stream_falls_back_to_the_analysis_answer(self):
+        async def scenario():
+            router = make_router(BrokenStreamGemini(DIRECT_ANALYSIS))
+            return await stream(router, 'algo que pensar')
+        
+        events = asyncio.run(scenario())
+        
+        assert [event['chunk'] for event in events[:-1]] == ['La fotosíntesis es...']
+        assert events[-1]['result']['method'] == 'gemini_direct'
+        assert events[-1]['result']['success'] is True
+
+class BudgetExhausted:
+    def get_budget_status(self):
+        return {'can_spend': False, 'percentage_used': 100}
+
+class TestClassifyOnce:
+    def test_route_query_reuses_the_classification(self):
+        async def scenario():
+            router = make_router(FakeGemini(DIRECT_ANALYSIS))
+            classification = router.classify('algo que pensar')
+            router.intent_classifier.classify = lambda query: pytest.fail('clasificada dos veces')
+            return await router.route_query('algo que pensar', 'ana', classification, use_cache=False)
+        
+        assert asyncio.run(scenario())['method'] == 'gemini_direct'
+    
+    def test_prediction_follows_the_routing_policy(self):
+        router = make_router(FakeGemini(DIRECT_ANALYSIS))
+        router.routing_policy.policy = AdaptivePolicy()
+        router.services.provide('budget_governor', BudgetExhausted())
+        query = 'Últimas noticias de hoy sobre el clima'
+        
+        assert router._rule_level(query, None, 0.1) == 3
+        assert router.predict_level(query, (None, 0.1)) == 2
+        assert router.routing_policy.counters['decisions'] == 0
+
+class TestDeadline:
+    def test_both_paths_report_the_exceeded_deadline(self):
+        async def scenario():
+            router = make_router(FakeGemini(DIRECT_ANALYSIS))
+            deadline.begin(0)
+            result = await router.route_query('algo que pensar', 'ana', use_cache=False)
+            events = await stream(router, 'algo que pensar')
+            return result, events[-1]['result']
+        
+        result, streamed = asyncio.run(scenario())
+        
+        assert result['deadline_exceeded'] is True
+        assert streamed['deadline_exceeded'] is True
+        assert result['stage'] == streamed['stage']
+
+class TestSharedCalls:
+    def test_identical_queries_share_one_analysis(self):
+        async def scenario():
+            gemini = FakeGemini(DIRECT_ANALYSIS, delay=0.05)
+            router = make_router(gemini)
+            results = await asyncio.gather(*[
+                router.route_query('Explícame la fotosíntesis', f'usuario{i}', use_cache=False)
+                for i in range(5)
+            ])
+            return gemini, results
+        
+        gemini, results = asyncio.run(scenario())
+        
+        assert gemini.calls == 1
+        assert all(result['result']['response'] == 'La fotosíntesis es...' for result in results)
+    
+    def test_repeated_query_is_served_from_the_cache(self):
+        async def scenario():
+            gemini = FakeGemini(DIRECT_ANALYSIS)
+            router = make_router(gemini)
+            router.response_cache.enabled = True
+            await router.route_query('Explícame la fotosíntesis', 'ana')
+            return gemini, await router.route_query('explícame la fotosíntesis.', 'luis')
+        
+        gemini, result = asyncio.run(scenario())
+        
+        assert gemini.calls == 1
+        assert result['cache']['hit'] is True
+"""
+
+with open('nyx/bridge/tests/test_query_router.py', 'w') as f:
+    f.write(test_query_router)
+
+test_distillation = """\"\"\"
+Pruebas de la destilación de las decisiones de Gemini
+
+El modelo nuevo reemplaza al actual entero, así que no puede perder
+intenciones, y se entrena con una copia del clasificador en uso.
+\"\"\"
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from intent_classifier import IntentClassifier
+from intent_model import IntentModel
+from distillation import Distiller
+
+def examples(text: str, label: str, count: int = 20):
+    return [(f'{text} {i}', label) for i in range(count)]
+
+def verdicts(text: str, skill, count: int = 40):
+    return [
+        {'query': f'{text} {i}', 'skill_required': skill is not None, 'skill_name': skill, 'confidence': 0.9}
+        for i in range(count)
+    ]
+
+@pytest.fixture
+def classifier():
+    model = IntentModel.train(
+        examples('que tiempo hace en madrid', 'weather')
+        + examples('apunta el dentista', 'calendar')
+        + examples('cuentame un chiste', 'none')
+    )
+    return IntentClassifier(model=model)
+
+LOG = verdicts('apunta el dentista el dia', 'calendar') + verdicts('hazme un poema', None)
+
+class TestLabels:
+    def test_model_that_forgets_an_intent_is_rejected(self, classifier):
+        distiller = Distiller(classifier.snapshot(), {'calendar': 'calendar'}, 0.8)
+        
+        model, report = distiller.run(LOG)
+        
+        assert model is None
+        assert report['missing_labels'] == ['weather']
+    
+    def test_base_examples_keep_the_intent(self, classifier):
+        distiller = Distiller(classifier.snapshot(), {'calendar': 'calendar'}, 0.8,
+                              examples('que tiempo hace', 'weather', 10))
+        
+        _, report = distiller.run(LOG)
+        
+        assert 'missing_labels' not in report
+
+class TestSnapshot:
+    def test_snapshot_does_not_follow_pattern_changes(self, classifier):
+        snapshot = classifier.snapshot()
+        
+        classifier.add_pattern('calendar', r'\\bdentista\\b')
+        
+        assert len(snapshot.patterns['calendar']) == len(classifier.patterns['calendar']) - 1
+        assert snapshot.model is classifier.model
+"""
+
+with open('nyx/bridge/tests/test_distillation.py', 'w') as f:
+    f.write(test_distillation)
+
+print("✅ Pruebas del puente creadas")
+
 print("\n🐍 Puente Python y componentes principales creados exitosamente")
\ No newline at end of file
@@ -8,9 +8,13 @@ Cliente para Google Gemini API
 import os
 import json
 import google.generativeai as genai
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, AsyncIterator, Optional, List
 import logging
 
+import deadline
+from timing import stage
+from circuit_breaker import CircuitBreaker
+
 logger = logging.getLogger(__name__)
 
 class GeminiClient:
@@ -18,7 +22,7 @@ class GeminiClient:
     Cliente para interactuar con Google Gemini API
     \"\"\"
     
-    def __init__(self):
+    def __init__(self, breaker: Optional[CircuitBreaker] = None):
         self.api_key = os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY no encontrada en variables de entorno")
@@ -26,20 +30,37 @@ class GeminiClient:
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel('gemini-1.5-pro')
         
+        # Con el circuito abierto las llamadas fallan al momento
+        self.breaker = breaker or CircuitBreaker('gemini')
+        
         logger.info("Gemini Client inicializado")
     
+    def _request_options(self) -> Dict[str, Any]:
+        \"\"\"
+        El timeout de la llamada es lo que queda del plazo de la request
+        \"\"\"
+        if deadline.remaining() is None:
+            return {}
+        return {'request_options': {'timeout': deadline.remaining()}}
+    
     async def analyze_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
         \"\"\"
         Analiza una consulta y determina qué acción tomar
         \"\"\"
+        return await self.breaker.call(lambda: self._analyze_query(query, user_id))
+    
+    async def _analyze_query(self, query: str, user_id: str) -> Dict[str, Any]:
         try:
             prompt = self._build_analysis_prompt(query)
+            options = self._request_options()
             
-            response = self.model.generate_content(prompt)
+            with stage('gemini.api'):
+                response = await self.model.generate_content_async(prompt, **options)
             
             # Intentar parsear como JSON estructurado
             try:
-                structured_response = json.loads(response.text)
+                with stage('gemini.parse'):
+                    structured_response = json.loads(response.text)
                 return structured_response
             except json.JSONDecodeError:
                 # Si no es JSON válido, tratar como respuesta de texto
@@ -56,6 +77,60 @@ class GeminiClient:
                 'success': False
             }
     
+    async def answer_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        \"\"\"
+        Responde directamente en texto, sin decidir ninguna skill
+        \"\"\"
+        return await self.breaker.call(lambda: self._answer_query(query, user_id))
+    
+    async def _answer_query(self, query: str, user_id: str) -> Dict[str, Any]:
+        try:
+            prompt = self._build_chat_prompt(query)
+            options = self._request_options()
+            
+            with stage('gemini.api'):
+                response = await self.model.generate_content_async(prompt, **options)
+            
+            return {
+                'response': response.text,
+                'success': True
+            }
+            
+        except Exception as e:
+            logger.error(f"Error en Gemini API: {e}")
+            return {
+                'error': str(e),
+                'success': False
+            }
+    
+    async def stream_response(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[str]:
+        \"\"\"
+        Genera una respuesta directa en texto, emitiendo los fragmentos según llegan
+        
+        Lanza CircuitOpen si el circuito de Gemini está abierto.
+        \"\"\"
+        prompt = self._build_chat_prompt(query)
+        options = self._request_options()
+        
+        with self.breaker.guard():
+            response = await self.model.generate_content_async(prompt, stream=True, **options)
+            
+            async for chunk in response:
+                text = getattr(chunk, 'text', '')
+                if text:
+                    yield text
+    
+    def _build_chat_prompt(self, query: str) -> str:
+        \"\"\"
+        Construye el prompt para responder directamente en texto
+        \"\"\"
+        return f\"\"\"
+Eres Nyx, un asistente personal inteligente. Responde directamente a la siguiente consulta del usuario de forma clara y útil.
+Responde en texto plano o Markdown, nunca en JSON.
+
+Consulta del usuario: "{query}"
+\"\"\"
+    
     def _build_analysis_prompt(self, query: str) -> str:
         \"\"\"
         Construye el prompt para análisis de consulta
@@ -107,7 +182,7 @@ Solicitud: {prompt}
 Responde de manera útil, creativa y personalizada.
 \"\"\"
             
-            response = self.model.generate_content(full_prompt)
+            response = await self.model.generate_content_async(full_prompt)
             return response.text
             
         except Exception as e:
@@ -127,7 +202,7 @@ Texto: "{text}"
 Responde solo con el JSON estructurado, sin explicaciones adicionales.
 \"\"\"
             
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             
             try:
                 return json.loads(response.text)
@@ -157,17 +232,24 @@ Cliente para Perplexity API
 import os
 import json
 import aiohttp
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional
 import logging
 
+import deadline
+from timing import stage
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
 logger = logging.getLogger(__name__)
 
+# Timeout total de una búsqueda sin plazo (el valor por defecto de aiohttp)
+DEFAULT_TIMEOUT_SECONDS = 300
+
 class PerplexityClient:
     \"\"\"
     Cliente para interactuar con Perplexity API
     \"\"\"
     
-    def __init__(self):
+    def __init__(self, breaker: Optional[CircuitBreaker] = None):
         self.api_key = os.getenv('PERPLEXITY_API_KEY')
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY no encontrada en variables de entorno")
@@ -175,70 +257,173 @@ class PerplexityClient:
         self.base_url = "https://api.perplexity.ai"
         self.model = "llama-3-sonar-small-32k-online"  # Modelo económico
         
+        # Con el circuito abierto las búsquedas fallan al momento
+        self.breaker = breaker or CircuitBreaker('perplexity')
+        
         logger.info("Perplexity Client inicializado")
     
+    def _headers(self) -> Dict[str, str]:
+        \"\"\"
+        Cabeceras de autenticación para la API
+        \"\"\"
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+    
+    def _build_payload(self, query: str, stream: bool = False) -> Dict[str, Any]:
+        \"\"\"
+        Construye el cuerpo de la request de búsqueda
+        \"\"\"
+        payload = {
+            'model': self.model,
+            'messages': [
+                {
+                    'role': 'system',
+                    'content': 'Eres un asistente de investigación. Proporciona respuestas precisas basadas en fuentes verificables y actualizadas.'
+                },
+                {
+                    'role': 'user',
+                    'content': query
+                }
+            ],
+            'max_tokens': 1000,
+            'temperature': 0.2,
+            'top_p': 0.9,
+            'search_domain_filter': ["perplexity.ai"],
+            'return_citations': True,
+            'search_recency_filter': "month"
+        }
+        
+        if stream:
+            payload['stream'] = True
+        
+        return payload
+    
     async def search(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
         \"\"\"
         Realiza una búsqueda usando Perplexity API
         \"\"\"
+        return await self.breaker.call(lambda: self._search(query, user_id))
+    
+    async def _search(self, query: str, user_id: str) -> Dict[str, Any]:
         try:
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._headers()
+            payload = self._build_payload(query)
             
-            payload = {
-                'model': self.model,
-                'messages': [
-                    {
-                        'role': 'system',
-                        'content': 'Eres un asistente de investigación. Proporciona respuestas precisas basadas en fuentes verificables y actualizadas.'
-                    },
-                    {
-                        'role': 'user',
-                        'content': query
-                    }
-                ],
-                'max_tokens': 1000,
-                'temperature': 0.2,
-                'top_p': 0.9,
-                'search_domain_filter': ["perplexity.ai"],
-                'return_citations': True,
-                'search_recency_filter': "month"
-            }
+            # El timeout de la búsqueda es lo que queda del plazo de la request
+            timeout = aiohttp.ClientTimeout(total=deadline.timeout(DEFAULT_TIMEOUT_SECONDS))
             
-            async with aiohttp.ClientSession() as session:
+            with stage('perplexity.api'):
+                async with aiohttp.ClientSession(timeout=timeout) as session:
+                    async with session.post(
+                        f"{self.base_url}/chat/completions",
+                        headers=headers,
+                        json=payload
+                    ) as response:
+                        
+                        if response.status == 200:
+                            data = await response.json()
+                            return self._parse_response(data)
+                        
+                        elif response.status == 429:
+                            error_data = await response.json()
+                            return {
+                                'error': 'Rate limit exceeded',
+                                'success': False,
+                                'retry_after': response.headers.get('Retry-After'),
+                                'details': error_data
+                            }
+                        
+                        else:
+                            error_text = await response.text()
+                            return {
+                                'error': f'API Error {response.status}: {error_text}',
+                                'success': False
+                            }
+        
+        except Exception as e:
+            logger.error(f"Error en Perplexity API: {e}")
+            return {
+                'error': str(e),
+                'success': False
+            }
+    
+    async def search_stream(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[Dict[str, Any]]:
+        \"\"\"
+        Realiza una búsqueda emitiendo {'chunk': texto} según llega la respuesta
+        
+        El último evento es {'response': ...} con el mismo formato que search().
+        \"\"\"
+        try:
+            with self.breaker.guard() as attempt:
+                async for event in self._search_stream(query, user_id):
+                    if 'response' in event:
+                        attempt.failed = event['response'].get('success') is False
+                    yield event
+        except CircuitOpen as e:
+            yield {'response': e.as_response()}
+    
+    async def _search_stream(self, query: str, user_id: str) -> AsyncIterator[Dict[str, Any]]:
+        parts = []
+        last_event = {}
+        
+        # Como en _search(): la búsqueda entera, fragmentos incluidos, dentro del plazo
+        timeout = aiohttp.ClientTimeout(total=deadline.timeout(DEFAULT_TIMEOUT_SECONDS))
+        
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
                 async with session.post(
                     f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
+                    headers=self._headers(),
+                    json=self._build_payload(query, stream=True)
                 ) as response:
                     
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._parse_response(data)
-                    
-                    elif response.status == 429:
-                        error_data = await response.json()
-                        return {
-                            'error': 'Rate limit exceeded',
-                            'success': False,
-                            'retry_after': response.headers.get('Retry-After'),
-                            'details': error_data
-                        }
-                    
-                    else:
+                    if response.status != 200:
                         error_text = await response.text()
-                        return {
-                            'error': f'API Error {response.status}: {error_text}',
-                            'success': False
+                        yield {
+                            'response': {
+                                'error': f'API Error {response.status}: {error_text}',
+                                'success': False,
+                                'retry_after': response.headers.get('Retry-After')
+                            }
                         }
+                        return
+                    
+                    # Server-Sent Events: una línea "data: {...}" por fragmento
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8').strip()
+                        if not line.startswith('data:'):
+                            continue
+                        
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
                         
+                        event = json.loads(data)
+                        last_event = event
+                        
+                        choices = event.get('choices') or [{}]
+                        delta = choices[0].get('delta', {}).get('content', '')
+                        if delta:
+                            parts.append(delta)
+                            yield {'chunk': delta}
+            
+            yield {
+                'response': self._parse_response({
+                    'choices': [{'message': {'content': ''.join(parts)}}],
+                    'citations': last_event.get('citations', []),
+                    'usage': last_event.get('usage', {})
+                })
+            }
+            
         except Exception as e:
-            logger.error(f"Error en Perplexity API: {e}")
-            return {
-                'error': str(e),
-                'success': False
+            logger.error(f"Error en Perplexity API (streaming): {e}")
+            yield {
+                'response': {
+                    'error': str(e),
+                    'success': False
+                }
             }
     
     def _parse_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
@@ -363,9 +548,11 @@ import os
 import json
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import logging
 
+from timing import stage
+
 logger = logging.getLogger(__name__)
 
 class BudgetGovernor:
@@ -412,8 +599,10 @@ class BudgetGovernor:
         return {
             'total_spent': 0.0,
             'requests_count': 0,
+            'abandoned_count': 0,
             'last_reset': datetime.now().isoformat(),
-            'transactions': []
+            'transactions': [],
+            'abandoned': []
         }
     
     def _should_reset_budget(self, last_reset: datetime) -> bool:
@@ -433,7 +622,7 @@ class BudgetGovernor:
         Guarda el uso actual al archivo
         \"\"\"
         try:
-            with open(self.budget_file, 'w') as f:
+            with stage('budget.save'), open(self.budget_file, 'w') as f:
                 json.dump(self.current_usage, f, indent=2)
         except Exception as e:
             logger.error(f"Error guardando presupuesto: {e}")
@@ -488,6 +677,30 @@ class BudgetGovernor:
         # Alertas de presupuesto
         self._check_budget_alerts()
     
+    def record_abandoned(self, details: Optional[Dict[str, Any]] = None):
+        \"\"\"
+        Registra una búsqueda cancelada antes de recibir la respuesta
+        
+        No suma al gasto porque no se conocen los tokens consumidos, pero se
+        cuenta aparte: la API puede haberla facturado igualmente.
+        \"\"\"
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'details': details or {}
+        }
+        
+        self.current_usage['abandoned_count'] = self.current_usage.get('abandoned_count', 0) + 1
+        abandoned = self.current_usage.setdefault('abandoned', [])
+        abandoned.append(entry)
+        
+        # Mantener solo las últimas 100 cancelaciones
+        if len(abandoned) > 100:
+            self.current_usage['abandoned'] = abandoned[-100:]
+        
+        self._save_usage()
+        
+        logger.warning(f"Búsqueda abandonada - Total abandonadas: {self.current_usage['abandoned_count']}")
+    
     def _check_budget_alerts(self):
         \"\"\"
         Verifica y emite alertas de presupuesto
@@ -514,6 +727,7 @@ class BudgetGovernor:
             'remaining': remaining,
             'percentage_used': round(percentage_used, 2),
             'requests_count': self.current_usage.get('requests_count', 0),
+            'abandoned_count': self.current_usage.get('abandoned_count', 0),
             'last_reset': self.current_usage.get('last_reset'),
             'can_spend': self.can_spend(),
             'status': self._get_status_message(percentage_used)
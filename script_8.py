@@ -5,8 +5,9 @@ skill_base = '''"""
 Clase base para todas las habilidades de Nyx
 """
 
+import inspect
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,8 +17,14 @@ class Skill(ABC):
     Clase base abstracta para todas las habilidades
     """
     
-    def __init__(self, config: Dict[str, Any]):
+    # Las skills que emiten texto parcial sobrescriben execute_stream y ponen esto a True
+    streaming = False
+    
+    def __init__(self, config: Dict[str, Any], services=None):
         self.config = config
+        # Contenedor de servicios del puente (None si la skill se usa por separado)
+        self.services = services
+        self._own_services = {}
         self.name = config.get('name', 'unnamed_skill')
         self.version = config.get('version', '0.1.0')
         self.description = config.get('description', '')
@@ -25,6 +32,20 @@ class Skill(ABC):
         
         logger.info(f"Skill {self.name} v{self.version} inicializada")
     
+    def get_service(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Retorna un servicio compartido del puente (cliente, gobernador...)
+        
+        Fuera del puente, sin contenedor, crea una instancia propia con factory
+        la primera vez que se pide.
+        """
+        if self.services is not None:
+            return self.services.get(name)
+        
+        if name not in self._own_services:
+            self._own_services[name] = factory()
+        return self._own_services[name]
+    
     @abstractmethod
     def execute(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -39,6 +60,24 @@ class Skill(ABC):
         """
         pass
     
+    async def execute_stream(self, query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta la habilidad emitiendo la respuesta a medida que se genera
+        
+        Produce {'chunk': texto} por cada fragmento y termina con
+        {'result': resultado}, el mismo Dict que retornaría execute().
+        Por defecto emite el resultado completo como un único fragmento.
+        """
+        result = self.execute(query, context)
+        if inspect.isawaitable(result):
+            result = await result
+        
+        content = result.get('content') if isinstance(result, dict) else None
+        if isinstance(content, str) and content:
+            yield {'chunk': content}
+        
+        yield {'result': result}
+    
     def validate_input(self, query: str, context: Dict[str, Any]) -> bool:
         """
         Valida la entrada antes de ejecutar
@@ -56,6 +95,17 @@ class Skill(ABC):
             'timestamp': None  # Se añadirá en el router
         }
     
+    def speculation_key(self, query: str, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Identifica la acción que execute() haría si es de solo lectura
+        
+        El router puede ejecutar la skill de forma especulativa (antes de
+        confirmar que es la adecuada) solo si esto retorna algo distinto de
+        None; dos contextos con la misma clave deben dar el mismo resultado.
+        Por defecto ninguna skill se especula.
+        """
+        return None
+    
     def get_help(self) -> str:
         """
         Retorna información de ayuda para esta habilidad
@@ -72,6 +122,1223 @@ with open('nyx/clients/skill_base.py', 'w') as f:
 
 print("✅ Skill base creada")
 
+# 1.1 Categorías de consulta compartidas por las skills y el puente
+query_categories = """\"\"\"
+Categorías de consultas, compartidas por las skills y el puente
+
+normalize_query está en normalization.py; se sigue pudiendo importar de aquí.
+\"\"\"
+
+from normalization import normalize_query
+from keyword_matcher import keywords
+
+# Palabras clave por categoría, por orden de prioridad
+CATEGORY_KEYWORDS = [
+    ('news', ['noticias', 'news', 'último', 'latest']),
+    ('financial', ['precio', 'cotización', 'stock', 'price']),
+    ('weather', ['clima', 'weather', 'temperatura']),
+    ('definition', ['qué es', 'what is', 'definición', 'definition']),
+    ('biography', ['quién es', 'who is', 'biografía'])
+]
+
+for category, words in CATEGORY_KEYWORDS:
+    keywords.register(f'category:{category}', words)
+
+def categorize_query(query: str) -> str:
+    \"\"\"
+    Categoriza una consulta: news, financial, weather, definition, biography o general
+    \"\"\"
+    found = keywords.matches(query)
+    
+    for category, _ in CATEGORY_KEYWORDS:
+        if f'category:{category}' in found:
+            return category
+    
+    return 'general'
+"""
+
+with open('nyx/clients/query_categories.py', 'w') as f:
+    f.write(query_categories)
+
+print("✅ Categorías de consulta creadas")
+
+# 1.2 Agrupación de llamadas idénticas en curso
+single_flight = """\"\"\"
+Agrupación de llamadas idénticas en curso (single-flight)
+
+Cuando varias consultas piden a la vez lo mismo a una API externa, solo la
+primera hace la llamada y las demás esperan su resultado. Cada una recibe su
+propia copia, y el gasto se registra una sola vez.
+\"\"\"
+
+import copy
+import asyncio
+import logging
+from typing import Dict, Any, Awaitable, Callable, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    \"\"\"
+    Llamada en curso y número de consultas que la esperan
+    \"\"\"
+    
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    \"\"\"
+    Comparte una llamada en curso entre las consultas con la misma clave
+    
+    Las claves son (espacio, clave), p. ej. ('perplexity', consulta normalizada).
+    La llamada solo se cancela cuando la abandonan todas las consultas que la esperan.
+    \"\"\"
+    
+    def __init__(self):
+        self._flights: Dict[Tuple[str, Hashable], _Flight] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+    
+    async def do(self, key: Tuple[str, Hashable], factory: Callable[[], Awaitable[Any]]) -> Any:
+        \"\"\"
+        Ejecuta factory() o se une a la llamada en curso con la misma clave
+        \"\"\"
+        counters = self.counters.setdefault(key[0], {'calls': 0, 'collapsed': 0, 'cancelled': 0})
+        counters['calls'] += 1
+        
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            counters['collapsed'] += 1
+            logger.info(f"Single-flight: consulta unida a una llamada en curso ({key[0]})")
+        
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # Nadie más espera el resultado: abortar la llamada
+                self._forget(key, flight)
+                flight.task.cancel()
+                counters['cancelled'] += 1
+            raise
+        finally:
+            flight.waiters -= 1
+        
+        return copy.deepcopy(result)
+    
+    def stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Llamadas, llamadas agrupadas y cancelaciones por espacio de claves
+        \"\"\"
+        return {
+            'in_flight': len(self._flights),
+            **{name: dict(values) for name, values in self.counters.items()}
+        }
+    
+    def _forget(self, key: Tuple[str, Hashable], flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+"""
+
+with open('nyx/clients/single_flight.py', 'w') as f:
+    f.write(single_flight)
+
+print("✅ Single-flight creado")
+
+# 1.3 Desglose de tiempos por etapa
+timing_module = """\"\"\"
+Desglose de tiempos por etapa de cada request
+
+El puente abre un registro por request y lo deja en una variable de contexto,
+así que el router, las skills, los clientes y el gobernador de presupuesto
+pueden medir sus etapas con stage() sin recibirlo como argumento. Las tareas
+creadas durante la request heredan el mismo registro. Fuera de una request
+stage() no mide nada.
+\"\"\"
+
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+# Límites superiores (ms) de los intervalos de los histogramas
+HISTOGRAM_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+_current: contextvars.ContextVar[Optional['TimingRecorder']] = contextvars.ContextVar('nyx_timing', default=None)
+
+class TimingRecorder:
+    \"\"\"
+    Duración acumulada de cada etapa de una request
+    \"\"\"
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+    
+    def add(self, name: str, elapsed_ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+    
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def summary(self) -> Dict[str, Any]:
+        \"\"\"
+        Mapa compacto etapa -> ms, más el total de la request
+        \"\"\"
+        return {
+            'total_ms': round(self.total_ms(), 1),
+            'stages': {name: round(elapsed, 1) for name, elapsed in self.stages.items()}
+        }
+
+class TimingHistograms:
+    \"\"\"
+    Histogramas acumulados por etapa de todas las requests del proceso
+    \"\"\"
+    
+    def __init__(self, buckets=HISTOGRAM_BUCKETS_MS):
+        self.buckets = list(buckets)
+        # etapa -> [contadores por intervalo (+ desbordamiento), número, suma]
+        self._data: Dict[str, list] = {}
+    
+    def observe(self, name: str, elapsed_ms: float):
+        entry = self._data.get(name)
+        if entry is None:
+            entry = self._data[name] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        
+        index = next((i for i, bound in enumerate(self.buckets) if elapsed_ms <= bound), len(self.buckets))
+        entry[0][index] += 1
+        entry[1] += 1
+        entry[2] += elapsed_ms
+    
+    def observe_request(self, recorder: TimingRecorder):
+        \"\"\"
+        Añade todas las etapas de una request terminada, y su total
+        \"\"\"
+        for name, elapsed in recorder.stages.items():
+            self.observe(name, elapsed)
+        self.observe('total', recorder.total_ms())
+    
+    def summary(self) -> Dict[str, Any]:
+        \"\"\"
+        Por etapa: número de muestras, media y recuento por intervalo ('le_<ms>')
+        \"\"\"
+        labels = [f'le_{bound}' for bound in self.buckets] + ['inf']
+        
+        return {
+            name: {
+                'count': count,
+                'avg_ms': round(total / count, 1) if count else 0.0,
+                'buckets': {label: value for label, value in zip(labels, counts) if value}
+            }
+            for name, (counts, count, total) in sorted(self._data.items())
+        }
+
+# Histogramas compartidos por el proceso
+histograms = TimingHistograms()
+
+def begin() -> TimingRecorder:
+    \"\"\"
+    Abre el registro de la request en curso (la tarea actual y sus hijas)
+    \"\"\"
+    recorder = TimingRecorder()
+    _current.set(recorder)
+    return recorder
+
+def current() -> Optional[TimingRecorder]:
+    return _current.get()
+
+@contextmanager
+def stage(name: str):
+    \"\"\"
+    Mide una etapa de la request en curso
+    \"\"\"
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, (time.perf_counter() - start) * 1000)
+"""
+
+with open('nyx/clients/timing.py', 'w') as f:
+    f.write(timing_module)
+
+print("✅ Medición de tiempos por etapa creada")
+
+# 1.4 Plazo de cada request
+deadline_module = """\"\"\"
+Plazo de cada request, propagado por el router, las skills y los clientes
+
+El puente fija el plazo al recibir la request (con el timeout con el que Node
+la espera) y lo deja en una variable de contexto. Cada etapa consulta el
+tiempo que queda para elegir su propio timeout o una alternativa más barata,
+y lo que ya no puede terminar a tiempo falla de inmediato con DeadlineExceeded.
+Sin plazo, remaining() es None y nada cambia.
+\"\"\"
+
+import time
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Optional
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('nyx_deadline', default=None)
+
+class DeadlineExceeded(Exception):
+    \"\"\"
+    La request ya no puede terminar dentro de su plazo
+    \"\"\"
+    
+    def __init__(self, stage: str):
+        super().__init__(f"Plazo de la request agotado en {stage}")
+        self.stage = stage
+
+def begin(timeout: Optional[float]):
+    \"\"\"
+    Fija el plazo de la request en curso, en segundos desde ahora (None: sin plazo)
+    \"\"\"
+    _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+
+def remaining() -> Optional[float]:
+    \"\"\"
+    Segundos que quedan hasta el plazo, o None si la request no tiene plazo
+    \"\"\"
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def timeout(default: Optional[float] = None) -> Optional[float]:
+    \"\"\"
+    Timeout para una llamada externa: lo que queda del plazo, o default
+    \"\"\"
+    left = remaining()
+    return left if left is not None else default
+
+def check(stage: str, needed: float = 0.0):
+    \"\"\"
+    Lanza DeadlineExceeded si no quedan al menos needed segundos
+    \"\"\"
+    left = remaining()
+    if left is not None and (left <= 0 or left < needed):
+        raise DeadlineExceeded(stage)
+
+async def within(awaitable: Awaitable[Any], stage: str) -> Any:
+    \"\"\"
+    Espera un resultado como mucho hasta el plazo y cancela el trabajo si se agota
+    \"\"\"
+    left = remaining()
+    if left is None:
+        return await awaitable
+    
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(stage)
+    
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage)
+"""
+
+with open('nyx/clients/deadline.py', 'w') as f:
+    f.write(deadline_module)
+
+print("✅ Propagación de plazos creada")
+
+# 1.5 Circuit breakers de las APIs externas
+circuit_breaker_module = """\"\"\"
+Circuit breakers de las APIs externas (Gemini, Perplexity)
+
+Cada backend tiene un breaker con tres estados. Cerrado: las llamadas pasan y
+se cuentan los fallos seguidos. Abierto: tras demasiados fallos las llamadas se
+rechazan al momento, sin esperar al timeout de la API. Semiabierto: pasado el
+tiempo de espera se deja pasar una llamada de prueba, que vuelve a cerrarlo si
+sale bien o lo abre otra vez si falla.
+
+Cuenta como fallo un resultado con success False, una excepción, una llamada
+más lenta que el umbral o una llamada cancelada porque se agotó el plazo de la
+request. Los umbrales se configuran por backend (NYX_BREAKER_GEMINI_FAILURES)
+o para todos (NYX_BREAKER_FAILURES).
+\"\"\"
+
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Awaitable, Callable
+
+import deadline
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Margen (segundos) para considerar que una cancelación se debe al plazo agotado
+DEADLINE_SLACK = 0.05
+
+def _setting(name: str, key: str, default: str) -> float:
+    \"\"\"
+    Valor de NYX_BREAKER_<NOMBRE>_<CLAVE>, o NYX_BREAKER_<CLAVE>, o default
+    \"\"\"
+    value = os.getenv(f'NYX_BREAKER_{name.upper()}_{key}') or os.getenv(f'NYX_BREAKER_{key}', default)
+    return float(value)
+
+class CircuitOpen(Exception):
+    \"\"\"
+    La llamada se rechaza porque el breaker del backend está abierto
+    \"\"\"
+    
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} no disponible temporalmente (circuito abierto)")
+        self.name = name
+        self.retry_after = retry_after
+    
+    def as_response(self) -> Dict[str, Any]:
+        \"\"\"
+        Error con el mismo formato que las respuestas fallidas de los clientes
+        \"\"\"
+        return {
+            'error': str(self),
+            'success': False,
+            'circuit_open': True,
+            'retry_after': round(self.retry_after, 1)
+        }
+
+class _Attempt:
+    \"\"\"
+    Llamada admitida por el breaker; el código que la hace marca failed
+    \"\"\"
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.failed = False
+
+class CircuitBreaker:
+    \"\"\"
+    Breaker de un backend
+    
+    failure_threshold fallos seguidos lo abren (0 lo desactiva), reset_timeout
+    son los segundos que pasa abierto antes de probar, half_open_max las llamadas
+    de prueba simultáneas y slow_call las que cuentan como fallo por lentas.
+    \"\"\"
+    
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None,
+                 half_open_max: int = None, slow_call: float = None):
+        self.name = name
+        self.failure_threshold = int(failure_threshold if failure_threshold is not None
+                                     else _setting(name, 'FAILURES', '5'))
+        self.reset_timeout = (reset_timeout if reset_timeout is not None
+                              else _setting(name, 'RESET_SECONDS', '30'))
+        self.half_open_max = max(1, int(half_open_max if half_open_max is not None
+                                        else _setting(name, 'HALF_OPEN_CALLS', '1')))
+        self.slow_call = (slow_call if slow_call is not None
+                          else _setting(name, 'SLOW_CALL_MS', '20000') / 1000)
+        
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        
+        self.counters = {'calls': 0, 'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+    
+    @property
+    def state(self) -> str:
+        \"\"\"
+        Estado actual; un breaker abierto pasa a semiabierto al cumplir la espera
+        \"\"\"
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._transition(HALF_OPEN)
+        return self._state
+    
+    def allows(self) -> bool:
+        \"\"\"
+        Indica si ahora se admitiría una llamada, sin reservarla
+        \"\"\"
+        if self.failure_threshold <= 0:
+            return True
+        
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._trials < self.half_open_max)
+    
+    def retry_after(self) -> float:
+        \"\"\"
+        Segundos hasta la próxima llamada de prueba
+        \"\"\"
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+    
+    @contextmanager
+    def guard(self):
+        \"\"\"
+        Admite una llamada o lanza CircuitOpen, y registra cómo termina
+        
+        Una excepción cuenta como fallo; el código protegido marca con
+        attempt.failed los errores que devuelve como resultado.
+        \"\"\"
+        if not self.allows():
+            self.counters['rejected'] += 1
+            raise CircuitOpen(self.name, self.retry_after())
+        
+        self.counters['calls'] += 1
+        if self._state == HALF_OPEN:
+            self._trials += 1
+        
+        attempt = _Attempt()
+        try:
+            yield attempt
+        except (asyncio.CancelledError, GeneratorExit):
+            # Nadie espera ya la respuesta: solo cuenta si se agotó el plazo o tardó demasiado
+            if self._timed_out(attempt):
+                self._record_failure()
+            else:
+                self._release()
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+        
+        if attempt.failed or time.monotonic() - attempt.started >= self.slow_call:
+            self._record_failure()
+        else:
+            self._record_success()
+    
+    async def call(self, factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        \"\"\"
+        Ejecuta factory() si el breaker lo admite
+        
+        Con el breaker abierto retorna el error de CircuitOpen sin llamar a la API.
+        \"\"\"
+        try:
+            with self.guard() as attempt:
+                result = await factory()
+                attempt.failed = isinstance(result, dict) and result.get('success') is False
+        except CircuitOpen as e:
+            return e.as_response()
+        
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        \"\"\"
+        Estado, umbrales y contadores del breaker
+        \"\"\"
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'retry_after_s': round(self.retry_after(), 1),
+            'failure_threshold': self.failure_threshold,
+            'reset_timeout_s': self.reset_timeout,
+            **self.counters
+        }
+    
+    def _timed_out(self, attempt: _Attempt) -> bool:
+        left = deadline.remaining()
+        return ((left is not None and left <= DEADLINE_SLACK)
+                or time.monotonic() - attempt.started >= self.slow_call)
+    
+    def _record_success(self):
+        self.counters['successes'] += 1
+        self._failures = 0
+        if self._state == HALF_OPEN:
+            self._release()
+            self._transition(CLOSED)
+    
+    def _record_failure(self):
+        self.counters['failures'] += 1
+        self._failures += 1
+        
+        if self._state == HALF_OPEN:
+            self._release()
+            self._open()
+        elif self._state == CLOSED and self.failure_threshold > 0 and self._failures >= self.failure_threshold:
+            self._open()
+    
+    def _release(self):
+        if self._state == HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+    
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.counters['opened'] += 1
+        self._transition(OPEN)
+    
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        
+        if state == OPEN:
+            logger.warning(f"Circuit breaker {self.name}: abierto tras {self._failures} fallos, "
+                           f"nueva prueba en {self.reset_timeout:.0f}s")
+        else:
+            logger.info(f"Circuit breaker {self.name}: {self._state} -> {state}")
+        
+        self._state = state
+        self._trials = 0
+
+class CircuitBreakers:
+    \"\"\"
+    Breakers del proceso por backend, creados al pedirlos por primera vez
+    \"\"\"
+    
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+    
+    def get(self, name: str) -> CircuitBreaker:
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name)
+        return self._breakers[name]
+    
+    def allows(self, name: str) -> bool:
+        return self.get(name).allows()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {name: breaker.stats() for name, breaker in sorted(self._breakers.items())}
+"""
+
+with open('nyx/clients/circuit_breaker.py', 'w') as f:
+    f.write(circuit_breaker_module)
+
+print("✅ Circuit breakers creados")
+
+# 1.6 Grabación del tráfico del router
+traffic_module = """\"\"\"
+Grabación del tráfico del router para reproducirlo después
+
+Con NYX_TRAFFIC_LOG cada consulta que atiende QueryRouter se añade como una
+línea JSONL: la consulta, la decisión de enrutado, un resumen del resultado,
+la latencia con su desglose por etapas y las respuestas de Gemini y
+Perplexity que hicieron falta. bridge/benchmarks/replay.py vuelve a pasar el
+fichero por el router sirviendo esas respuestas en lugar de las APIs, para
+comparar dos versiones del código con el mismo tráfico.
+\"\"\"
+
+import os
+import copy
+import json
+import time
+import logging
+import contextvars
+from datetime import datetime
+from typing import Dict, Any, AsyncIterator, Optional
+
+import timing
+
+logger = logging.getLogger(__name__)
+
+# Fichero JSONL donde se graba el tráfico (vacío: no se graba)
+TRAFFIC_LOG = os.getenv('NYX_TRAFFIC_LOG', '')
+
+# Versión del formato de cada línea
+FORMAT_VERSION = 1
+
+# Campos de la decisión de enrutado que se guardan
+DECISION_FIELDS = ('intent', 'confidence', 'proposed', 'level', 'policy', 'reason', 'budget_used')
+
+_capture: contextvars.ContextVar[Optional['Capture']] = contextvars.ContextVar('nyx_traffic', default=None)
+
+class Capture:
+    \"\"\"
+    Registro en curso de una consulta
+    \"\"\"
+    
+    def __init__(self, kind: str, query: str, user_id: str, use_cache: bool):
+        self.started = time.perf_counter()
+        self.token = None
+        self.record: Dict[str, Any] = {
+            'v': FORMAT_VERSION,
+            'ts': datetime.now().isoformat(),
+            'kind': kind,
+            'query': query,
+            'user_id': user_id,
+            'use_cache': use_cache,
+            'calls': []
+        }
+
+class TrafficRecorder:
+    \"\"\"
+    Graba las consultas del router en un fichero JSONL
+    \"\"\"
+    
+    def __init__(self, path: str = TRAFFIC_LOG):
+        self.path = path
+        self.recorded = 0
+        
+        if path:
+            logger.info(f"Grabación de tráfico activa en {path}")
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+    
+    def begin(self, kind: str, query: str, user_id: str, use_cache: bool) -> Optional[Capture]:
+        \"\"\"
+        Abre el registro de una consulta (kind: 'query' o 'stream')
+        \"\"\"
+        if not self.enabled:
+            return None
+        
+        capture = Capture(kind, query, user_id, use_cache)
+        capture.token = _capture.set(capture)
+        return capture
+    
+    def finish(self, capture: Optional[Capture], result: Optional[Dict[str, Any]]):
+        \"\"\"
+        Cierra el registro con el resultado y lo añade al fichero
+        \"\"\"
+        if capture is None:
+            return
+        
+        try:
+            _capture.reset(capture.token)
+        except ValueError:
+            # Cerrado desde otro contexto (p. ej. un stream abandonado)
+            pass
+        
+        record = capture.record
+        record['latency_ms'] = round((time.perf_counter() - capture.started) * 1000, 1)
+        record['result'] = summarize_result(result or {})
+        
+        recorder = timing.current()
+        if recorder is not None:
+            record['timing'] = recorder.summary()['stages']
+        
+        self._write(record)
+    
+    def wrap(self, client: Any, backend: str) -> Any:
+        \"\"\"
+        Cliente que graba sus respuestas, o el mismo si no se graba tráfico
+        \"\"\"
+        return RecordingClient(client, backend) if self.enabled else client
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, 'path': self.path, 'recorded': self.recorded}
+    
+    def _write(self, record: Dict[str, Any]):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\\n')
+            self.recorded += 1
+        except OSError as e:
+            logger.warning(f"No se pudo grabar el tráfico: {e}")
+            self.path = ''
+
+def note_decision(decision: Dict[str, Any]):
+    \"\"\"
+    Añade la decisión de enrutado a la consulta que se está grabando
+    \"\"\"
+    capture = _capture.get()
+    if capture is not None:
+        capture.record['decision'] = {field: decision.get(field) for field in DECISION_FIELDS}
+
+def record_call(backend: str, method: str, query: str, response: Any, latency_ms: float):
+    \"\"\"
+    Añade la respuesta de una API a la consulta que se está grabando
+    \"\"\"
+    capture = _capture.get()
+    if capture is not None:
+        capture.record['calls'].append({
+            'backend': backend,
+            'method': method,
+            'query': query,
+            'latency_ms': round(latency_ms, 1),
+            # Copia: el router añade campos a los resultados después de grabarlos
+            'response': copy.deepcopy(response)
+        })
+
+def summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    \"\"\"
+    Lo que se compara entre versiones: nivel, método, éxito, coste y alternativas
+    \"\"\"
+    inner = result.get('result')
+    cost = inner.get('cost', 0.0) if isinstance(inner, dict) else 0.0
+    
+    # Una respuesta de la caché no vuelve a costar lo que costó la original
+    if result.get('cache'):
+        cost = 0.0
+    
+    summary = {
+        'success': bool(result.get('success')),
+        'level': result.get('level'),
+        'method': result.get('method'),
+        'cost': cost or 0.0
+    }
+    if result.get('cache'):
+        summary['cached'] = True
+    if result.get('fallback'):
+        summary['fallback'] = result['fallback'].get('source')
+    
+    return summary
+
+class RecordingClient:
+    \"\"\"
+    Envuelve un cliente de API y graba cada respuesta en la consulta en curso
+    
+    El resto de atributos (estimate_cost, breaker...) son los del cliente original.
+    \"\"\"
+    
+    def __init__(self, client: Any, backend: str):
+        self._client = client
+        self._backend = backend
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+    
+    async def _recorded(self, method: str, query: str, pending) -> Dict[str, Any]:
+        started = time.perf_counter()
+        response = await pending
+        record_call(self._backend, method, query, response, (time.perf_counter() - started) * 1000)
+        return response
+    
+    async def analyze_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        return await self._recorded('analyze_query', query, self._client.analyze_query(query, user_id))
+    
+    async def answer_query(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        return await self._recorded('answer_query', query, self._client.answer_query(query, user_id))
+    
+    async def search(self, query: str, user_id: str = 'anonymous') -> Dict[str, Any]:
+        return await self._recorded('search', query, self._client.search(query, user_id))
+    
+    async def stream_response(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[str]:
+        started = time.perf_counter()
+        chunks = []
+        
+        try:
+            async for text in self._client.stream_response(query, user_id):
+                chunks.append(text)
+                yield text
+        except Exception as e:
+            record_call(self._backend, 'stream_response', query,
+                        {'chunks': chunks, 'raised': str(e)}, (time.perf_counter() - started) * 1000)
+            raise
+        
+        record_call(self._backend, 'stream_response', query, {'chunks': chunks},
+                    (time.perf_counter() - started) * 1000)
+    
+    async def search_stream(self, query: str, user_id: str = 'anonymous') -> AsyncIterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        events = []
+        
+        async for event in self._client.search_stream(query, user_id):
+            events.append(event)
+            yield event
+        
+        record_call(self._backend, 'search_stream', query, {'events': events},
+                    (time.perf_counter() - started) * 1000)
+"""
+
+with open('nyx/clients/traffic.py', 'w') as f:
+    f.write(traffic_module)
+
+print("✅ Grabación de tráfico creada")
+
+# 1.7 Normalización de consultas
+normalization_module = """\"\"\"
+Normalización de consultas, una sola vez por request
+
+Antes cada etapa (clasificador, router, triggers de las skills, categorías)
+repetía su propio lower() y ninguna quitaba las tildes, así que "reunion" no
+coincidía con "reunión". normalize() calcula de una vez la forma NFKC, la
+forma sin tildes, las palabras, el idioma y un hash del contenido; el puente
+lo hace al recibir la request y el resto de etapas reutiliza el resultado.
+\"\"\"
+
+import re
+import hashlib
+import unicodedata
+from functools import lru_cache
+from typing import Optional, Tuple
+
+_WORD = re.compile(r'\\w+')
+_PUNCTUATION = re.compile(r'[¿?¡!.,;:]+')
+_WHITESPACE = re.compile(r'\\s+')
+
+# Palabras frecuentes que delatan el idioma de la consulta, sin tildes
+_SPANISH_WORDS = frozenset(
+    'el la los las un una de del que y en por para con es son mi me tengo '
+    'hay hoy manana como cual cuando donde quien busca buscar sobre esta'.split()
+)
+_ENGLISH_WORDS = frozenset(
+    'the a an of and in on for with is are my me i have what how which when '
+    'where who search about today tomorrow show find'.split()
+)
+_SPANISH_MARKS = frozenset('¿¡ñáéíóú')
+
+class NormalizedQuery(str):
+    \"\"\"
+    Consulta con sus formas normalizadas, calculadas al crearla
+    
+    Es un str con el texto original, así que pasa por el router, las skills y
+    los logs como cualquier consulta; cada etapa lee de él la forma que
+    necesita:
+    
+    - text: NFKC y sin espacios en los extremos
+    - lowered: text en minúsculas
+    - folded: lowered sin tildes ni diéresis (para comparar con fold())
+    - tokens: palabras de folded
+    - language: 'es', 'en' o None si no se distingue
+    - key: clave de caché y single-flight (normalize_query)
+    - content_hash: hash corto de key
+    - keyword_matches: palabras clave encontradas (keyword_matcher), la primera
+      vez que se piden
+    \"\"\"
+    
+    def __new__(cls, query: str):
+        self = super().__new__(cls, query)
+        self.text = unicodedata.normalize('NFKC', query).strip()
+        self.lowered = self.text.lower()
+        self.folded = _strip_accents(self.lowered)
+        self.tokens = tuple(_WORD.findall(self.folded))
+        self.language = _detect_language(self.lowered, self.tokens)
+        self.key = normalize_query(self.text)
+        self.content_hash = hashlib.blake2b(self.key.encode('utf-8'), digest_size=8).hexdigest()
+        self.keyword_matches = None
+        return self
+
+def normalize(query: str) -> NormalizedQuery:
+    \"\"\"
+    Consulta normalizada; si ya lo está se devuelve tal cual
+    \"\"\"
+    if isinstance(query, NormalizedQuery):
+        return query
+    return NormalizedQuery(query)
+
+def normalize_query(query: str) -> str:
+    \"\"\"
+    Normaliza una consulta para compararla con otras (caché, single-flight)
+    \"\"\"
+    text = _PUNCTUATION.sub(' ', query.lower())
+    return _WHITESPACE.sub(' ', text).strip()
+
+@lru_cache(maxsize=4096)
+def fold(text: str) -> str:
+    \"\"\"
+    Minúsculas sin tildes, para comparar palabras clave con NormalizedQuery.folded
+    \"\"\"
+    return _strip_accents(unicodedata.normalize('NFKC', text).lower())
+
+def fold_pattern(pattern: str) -> str:
+    \"\"\"
+    Patrón de re sin tildes, para buscarlo en NormalizedQuery.folded
+    
+    No se pasa a minúsculas, que cambiaría clases como \\\\W o \\\\S; se compila con IGNORECASE.
+    \"\"\"
+    return _strip_accents(unicodedata.normalize('NFKC', pattern))
+
+def _strip_accents(text: str) -> str:
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize('NFD', text)
+    return unicodedata.normalize('NFC', ''.join(c for c in decomposed if not unicodedata.combining(c)))
+
+def _detect_language(lowered: str, tokens: Tuple[str, ...]) -> Optional[str]:
+    \"\"\"
+    Idioma por los signos propios del español y las palabras frecuentes
+    \"\"\"
+    spanish = sum(word in _SPANISH_WORDS for word in tokens)
+    english = sum(word in _ENGLISH_WORDS for word in tokens)
+    if any(char in _SPANISH_MARKS for char in lowered):
+        spanish += 2
+    
+    if spanish > english:
+        return 'es'
+    if english > spanish:
+        return 'en'
+    return None
+"""
+
+with open('nyx/clients/normalization.py', 'w') as f:
+    f.write(normalization_module)
+
+print("✅ Normalización de consultas creada")
+
+# 1.8 Búsqueda de palabras clave en una pasada
+keyword_matcher_module = """\"\"\"
+Búsqueda de muchas palabras clave en una sola pasada (Aho-Corasick)
+
+Los triggers de las skills (skill.json), los indicadores de búsqueda web, las
+categorías de consulta y las palabras de las skills se registran aquí, cada
+lista con su propietario ('trigger:calendar', 'web_search', 'category:news'...).
+Con todas ellas se construye un único autómata, que se recorre una vez por
+consulta y da todas las coincidencias con su propietario; el resultado se
+guarda en la NormalizedQuery, así que el resto de etapas de la misma request
+lo reutilizan. El coste ya no depende del número de palabras clave, sino de la
+longitud de la consulta.
+
+Las palabras y la consulta se comparan sin tildes ni mayúsculas (fold()), y
+como con `palabra in consulta` cuenta cualquier aparición, no solo palabras
+completas.
+\"\"\"
+
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from normalization import normalize, fold
+
+class KeywordMatcher:
+    \"\"\"
+    Autómata de Aho-Corasick sobre las palabras de varios propietarios
+    \"\"\"
+    
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        # Transiciones de cada estado, enlace de fallo y (propietario, palabra) que terminan en él
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[Tuple[str, str], ...]] = [()]
+        self.size = 0
+        
+        outputs: List[List[Tuple[str, str]]] = [[]]
+        for owner, keywords in groups.items():
+            for keyword in keywords:
+                folded = fold(keyword)
+                if not folded:
+                    continue
+                state = 0
+                for char in folded:
+                    following = self._goto[state].get(char)
+                    if following is None:
+                        following = len(self._goto)
+                        self._goto[state][char] = following
+                        self._goto.append({})
+                        self._fail.append(0)
+                        outputs.append([])
+                    state = following
+                if (owner, keyword) not in outputs[state]:
+                    outputs[state].append((owner, keyword))
+                    self.size += 1
+        
+        # Enlaces de fallo por anchura: el sufijo más largo que también es prefijo
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, following in self._goto[state].items():
+                pending.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                outputs[following].extend(outputs[self._fail[following]])
+        
+        self._output = [tuple(output) for output in outputs]
+        self.states = len(self._goto)
+    
+    def scan(self, text: str) -> Dict[str, List[str]]:
+        \"\"\"
+        Palabras de cada propietario que aparecen en un texto ya pasado por fold()
+        \"\"\"
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found: Dict[str, List[str]] = {}
+        
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for owner, keyword in output[state]:
+                keywords = found.setdefault(owner, [])
+                if keyword not in keywords:
+                    keywords.append(keyword)
+        
+        return found
+
+class KeywordRegistry:
+    \"\"\"
+    Listas de palabras registradas y el autómata construido con todas ellas
+    
+    El autómata se reconstruye la primera vez que se usa tras un cambio.
+    \"\"\"
+    
+    def __init__(self):
+        self._groups: Dict[str, Tuple[str, ...]] = {}
+        self._matcher: Optional[KeywordMatcher] = None
+        self._lock = threading.Lock()
+        self.version = 0
+        self.builds = 0
+    
+    def register(self, owner: str, keywords: Iterable[str]):
+        \"\"\"
+        Registra (o reemplaza) la lista de palabras de un propietario
+        \"\"\"
+        keywords = tuple(keywords)
+        with self._lock:
+            if self._groups.get(owner) == keywords:
+                return
+            self._groups[owner] = keywords
+            self._matcher = None
+            self.version += 1
+    
+    def unregister(self, owner: str):
+        \"\"\"
+        Quita la lista de un propietario
+        \"\"\"
+        with self._lock:
+            if self._groups.pop(owner, None) is not None:
+                self._matcher = None
+                self.version += 1
+    
+    def keywords(self, owner: str) -> Tuple[str, ...]:
+        return self._groups.get(owner, ())
+    
+    def matcher(self) -> KeywordMatcher:
+        \"\"\"
+        Autómata con todas las listas registradas
+        \"\"\"
+        with self._lock:
+            if self._matcher is None:
+                self._matcher = KeywordMatcher(self._groups)
+                self.builds += 1
+            return self._matcher
+    
+    def matches(self, query: str) -> Dict[str, List[str]]:
+        \"\"\"
+        Coincidencias de la consulta por propietario, en una sola pasada por request
+        \"\"\"
+        normalized = normalize(query)
+        cached = normalized.keyword_matches
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        
+        version = self.version
+        found = self.matcher().scan(normalized.folded)
+        normalized.keyword_matches = (version, found)
+        return found
+    
+    def stats(self) -> Dict[str, int]:
+        matcher = self._matcher
+        return {
+            'owners': len(self._groups),
+            'keywords': sum(len(keywords) for keywords in self._groups.values()),
+            'states': matcher.states if matcher else 0,
+            'builds': self.builds
+        }
+
+# Registro compartido por el puente, las categorías y las skills
+keywords = KeywordRegistry()
+"""
+
+with open('nyx/clients/keyword_matcher.py', 'w') as f:
+    f.write(keyword_matcher_module)
+
+print("✅ Búsqueda de palabras clave creada")
+
+# 1.9 Escritura de ficheros JSONL fuera del loop
+jsonl_writer_module = """\"\"\"
+Escritura de ficheros JSONL fuera del loop
+
+Las decisiones de enrutado y las de Gemini se guardan línea a línea mientras
+se atienden las consultas; abrir y escribir el fichero en el loop bloqueaba al
+resto de requests mientras durase la escritura. JsonlWriter acumula las líneas
+y las escribe por lotes en un hilo (asyncio.to_thread), una sola escritura en
+curso por fichero para que no se mezcle el orden. Sin loop en marcha (scripts,
+pruebas) escribe directamente.
+\"\"\"
+
+import json
+import asyncio
+import logging
+import weakref
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Escritores creados, para vaciarlos todos al cerrar el puente
+_writers: 'weakref.WeakSet[JsonlWriter]' = weakref.WeakSet()
+
+class JsonlWriter:
+    \"\"\"
+    Añade registros a un fichero JSONL sin bloquear el loop
+    
+    Si el fichero no se puede escribir se avisa una vez y se deja de guardar.
+    \"\"\"
+    
+    def __init__(self, path: str, label: str):
+        self.path = path
+        self.label = label
+        self.written = 0
+        self._pending: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        _writers.add(self)
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+    
+    def append(self, record: Dict[str, Any]):
+        \"\"\"
+        Encola un registro; se escribe en cuanto termine la escritura en curso
+        \"\"\"
+        if not self.path:
+            return
+        
+        self._pending.append(json.dumps(record, ensure_ascii=False) + '\\n')
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._take())
+            return
+        
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+    
+    async def flush(self):
+        \"\"\"
+        Espera a que se escriban los registros encolados
+        \"\"\"
+        while self._task is not None:
+            await asyncio.shield(self._task)
+    
+    async def _drain(self):
+        try:
+            while self._pending and self.path:
+                await asyncio.to_thread(self._write, self._take())
+        finally:
+            self._task = None
+    
+    def _take(self) -> List[str]:
+        lines, self._pending = self._pending, []
+        return lines
+    
+    def _write(self, lines: List[str]):
+        path = self.path
+        if not path or not lines:
+            return
+        
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+            self.written += len(lines)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar {self.label}: {e}")
+            self.path = ''
+
+async def flush_all():
+    \"\"\"
+    Vacía todos los escritores, antes de cerrar el puente
+    \"\"\"
+    for writer in list(_writers):
+        await writer.flush()
+"""
+
+with open('nyx/clients/jsonl_writer.py', 'w') as f:
+    f.write(jsonl_writer_module)
+
+print("✅ Escritura de JSONL fuera del loop creada")
+
 # 2. Calendar Skill
 calendar_skill_json = {
     "name": "calendar",
@@ -112,21 +1379,39 @@ import re
 sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
 
 from skill_base import Skill
-from calendar_client import CalendarClient
+from normalization import normalize
+from keyword_matcher import keywords
+
+# Palabras de cada acción, por orden de prioridad
+ACTION_KEYWORDS = [
+    ('create_event', ['crear', 'programar', 'agendar', 'schedule', 'create']),
+    ('find_free_slots', ['libre', 'disponible', 'hueco', 'free', 'available']),
+    ('list_events', ['listar', 'mostrar', 'próximos', 'eventos', 'list', 'show'])
+]
+for action, words in ACTION_KEYWORDS:
+    keywords.register(f'calendar:{action}', words)
 
 class CalendarSkill(Skill):
     """
     Habilidad para gestionar el calendario de Google
     """
     
-    def __init__(self, config: Dict[str, Any]):
-        super().__init__(config)
-        self.calendar_client = CalendarClient()
+    def __init__(self, config: Dict[str, Any], services=None):
+        super().__init__(config, services)
         
         # Configuración por defecto
         self.default_duration = self.config.get('config_schema', {}).get('default_duration_minutes', 60)
         self.timezone = self.config.get('config_schema', {}).get('timezone', 'UTC')
     
+    @property
+    def calendar_client(self):
+        """
+        Cliente de Google Calendar, creado en el primer uso: importar las
+        librerías de Google y autenticar es lo más lento del arranque
+        """
+        from calendar_client import CalendarClient
+        return self.get_service('calendar_client', CalendarClient)
+    
     def execute(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Ejecuta la habilidad de calendario
@@ -153,23 +1438,30 @@ class CalendarSkill(Skill):
         """
         Determina qué acción realizar basada en la consulta
         """
-        query_lower = query.lower()
-        
         # Si viene del nivel 2 (Gemini), usar datos estructurados
         if context.get('level') == 2 and context.get('structured_data'):
             structured_data = context['structured_data']
             if 'intent' in structured_data:
                 return structured_data['intent']
         
-        # Clasificación simple basada en palabras clave
-        if any(word in query_lower for word in ['crear', 'programar', 'agendar', 'schedule', 'create']):
-            return 'create_event'
-        elif any(word in query_lower for word in ['libre', 'disponible', 'hueco', 'free', 'available']):
-            return 'find_free_slots'
-        elif any(word in query_lower for word in ['listar', 'mostrar', 'próximos', 'eventos', 'list', 'show']):
-            return 'list_events'
-        else:
-            return 'list_events'  # Por defecto
+        # Clasificación simple basada en palabras clave (sin tildes: "proximos" también cuenta)
+        found = keywords.matches(query)
+        for action, _ in ACTION_KEYWORDS:
+            if f'calendar:{action}' in found:
+                return action
+        
+        return 'list_events'  # Por defecto
+    
+    def speculation_key(self, query: str, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Listar eventos y buscar huecos solo leen el calendario y dependen
+        únicamente de la consulta; crear eventos no se puede adelantar
+        """
+        action = self._determine_action(query, context)
+        
+        if action in ('list_events', 'find_free_slots'):
+            return action
+        return None
     
     def _list_events(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -295,20 +1587,21 @@ class CalendarSkill(Skill):
         Extrae rango de tiempo de la consulta
         """
         now = datetime.utcnow()
+        query_folded = normalize(query).folded
         
         # Patrones simples
-        if 'hoy' in query.lower() or 'today' in query.lower():
+        if 'hoy' in query_folded or 'today' in query_folded:
             return {
                 'start': now,
                 'end': now.replace(hour=23, minute=59)
             }
-        elif 'mañana' in query.lower() or 'tomorrow' in query.lower():
+        elif 'manana' in query_folded or 'tomorrow' in query_folded:
             tomorrow = now + timedelta(days=1)
             return {
                 'start': tomorrow.replace(hour=0, minute=0),
                 'end': tomorrow.replace(hour=23, minute=59)
             }
-        elif 'semana' in query.lower() or 'week' in query.lower():
+        elif 'semana' in query_folded or 'week' in query_folded:
             return {
                 'start': now,
                 'end': now + timedelta(days=7)
@@ -332,8 +1625,9 @@ class CalendarSkill(Skill):
             r'(\\d+)\\s*(?:hours?)'
         ]
         
+        query_lower = normalize(query).lowered
         for pattern in duration_patterns:
-            match = re.search(pattern, query.lower())
+            match = re.search(pattern, query_lower)
             if match:
                 number = int(match.group(1))
                 if 'hora' in pattern or 'hour' in pattern:
@@ -379,9 +1673,10 @@ class CalendarSkill(Skill):
         if not details.get('start_time'):
             now = datetime.utcnow()
             
-            if 'mañana' in query.lower() or 'tomorrow' in query.lower():
+            normalized = normalize(query)
+            if 'manana' in normalized.folded or 'tomorrow' in normalized.folded:
                 # Buscar hora específica
-                time_match = re.search(r'(\\d{1,2})(?::(\\d{2}))?\\s*(?:am|pm|h)?', query.lower())
+                time_match = re.search(r'(\\d{1,2})(?::(\\d{2}))?\\s*(?:am|pm|h)?', normalized.lowered)
                 if time_match:
                     hour = int(time_match.group(1))
                     minute = int(time_match.group(2) or 0)
@@ -28,32 +28,62 @@ Habilidad de búsqueda web usando Perplexity API
 """
 
 import sys
+import asyncio
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, List
 import re
 
 # Añadir clients al path
 sys.path.append(str(Path(__file__).parent.parent.parent / 'clients'))
 
 from skill_base import Skill
-from perplexity_client import PerplexityClient
-from budget_governor import BudgetGovernor
+from query_categories import categorize_query
+from normalization import normalize
+from keyword_matcher import keywords
+
+# Palabras que piden información reciente
+keywords.register('perplexity:temporal', ['último', 'reciente', 'actual', 'latest', 'recent', 'current'])
 
 class PerplexitySkill(Skill):
     """
     Habilidad para búsqueda web en tiempo real con Perplexity
     """
     
-    def __init__(self, config: Dict[str, Any]):
-        super().__init__(config)
-        self.perplexity_client = PerplexityClient()
-        self.budget_governor = BudgetGovernor()
+    streaming = True
+    
+    def __init__(self, config: Dict[str, Any], services=None):
+        super().__init__(config, services)
         
         # Configuración por defecto
         self.max_tokens = self.config.get('config_schema', {}).get('max_tokens', 1000)
         self.temperature = self.config.get('config_schema', {}).get('temperature', 0.2)
     
-    def execute(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    @property
+    def perplexity_client(self):
+        """
+        Cliente de Perplexity compartido, creado en el primer uso para no
+        importar aiohttp al arrancar
+        """
+        from perplexity_client import PerplexityClient
+        return self.get_service('perplexity_client', PerplexityClient)
+    
+    @property
+    def budget_governor(self):
+        """
+        Gobernador de presupuesto compartido con el router (nivel 3)
+        """
+        from budget_governor import BudgetGovernor
+        return self.get_service('budget_governor', BudgetGovernor)
+    
+    @property
+    def single_flight(self):
+        """
+        Búsquedas en curso compartidas con el router y las demás requests
+        """
+        from single_flight import SingleFlight
+        return self.get_service('single_flight', SingleFlight)
+    
+    async def execute(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Ejecuta búsqueda web usando Perplexity
         """
@@ -73,9 +103,9 @@ class PerplexitySkill(Skill):
                 'type': 'budget_exceeded'
             }
         
-        return self._perform_search(query, context)
+        return await self._perform_search(query, context)
     
-    def _perform_search(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    async def _perform_search(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Realiza la búsqueda web
         """
@@ -83,11 +113,14 @@ class PerplexitySkill(Skill):
             # Optimizar la consulta para búsqueda
             optimized_query = self._optimize_query(query)
             
-            # Realizar búsqueda
-            result = await self.perplexity_client.search(
-                optimized_query, 
-                context.get('user_id', 'anonymous')
+            # Realizar búsqueda (una sola vez si hay otra idéntica en curso). La
+            # clave es la consulta del usuario, como en el nivel 3 del router,
+            # para que la skill y el router compartan la misma búsqueda
+            search = await self.single_flight.do(
+                ('perplexity', normalize(query).key),
+                lambda: self._search_and_charge(optimized_query, query, context.get('user_id', 'anonymous'))
             )
+            result = search['response']
             
             if not result.get('success'):
                 return {
@@ -95,13 +128,6 @@ class PerplexitySkill(Skill):
                     'error': f"Error en búsqueda: {result.get('error', 'Error desconocido')}"
                 }
             
-            # Registrar gasto en presupuesto
-            estimated_cost = self.perplexity_client.estimate_cost(result)
-            self.budget_governor.record_usage(
-                estimated_cost, 
-                {'query': query[:100], 'tokens': result.get('usage', {})}
-            )
-            
             # Formatear respuesta
             response = self._format_search_response(result, query)
             
@@ -113,17 +139,91 @@ class PerplexitySkill(Skill):
                 'error': f"Error realizando búsqueda: {str(e)}"
             }
     
+    async def _search_and_charge(self, optimized_query: str, query: str, user_id: str) -> Dict[str, Any]:
+        """
+        Búsqueda de Perplexity con su registro en el presupuesto
+        """
+        try:
+            result = await self.perplexity_client.search(optimized_query, user_id)
+        except asyncio.CancelledError:
+            self.budget_governor.record_abandoned({'query': query[:100], 'skill': self.name})
+            raise
+        
+        # Registrar gasto en presupuesto
+        estimated_cost = self.perplexity_client.estimate_cost(result)
+        self.budget_governor.record_usage(
+            estimated_cost, 
+            {'query': query[:100], 'tokens': result.get('usage', {})}
+        )
+        
+        return {
+            'response': result,
+            'cost': estimated_cost
+        }
+    
+    async def execute_stream(self, query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta búsqueda web emitiendo la respuesta según la genera Perplexity
+        """
+        if not self.validate_input(query, context):
+            yield {'result': {'success': False, 'error': 'Consulta inválida'}}
+            return
+        
+        if not self.budget_governor.can_spend():
+            yield {
+                'result': {
+                    'success': False,
+                    'error': 'Presupuesto de búsqueda web agotado para este mes',
+                    'budget_status': self.budget_governor.get_budget_status(),
+                    'type': 'budget_exceeded'
+                }
+            }
+            return
+        
+        optimized_query = self._optimize_query(query)
+        result = {}
+        
+        try:
+            async for event in self.perplexity_client.search_stream(
+                optimized_query,
+                context.get('user_id', 'anonymous')
+            ):
+                if 'chunk' in event:
+                    yield event
+                else:
+                    result = event['response']
+        except asyncio.CancelledError:
+            self.budget_governor.record_abandoned({'query': query[:100], 'skill': self.name})
+            raise
+        
+        if not result.get('success'):
+            yield {
+                'result': {
+                    'success': False,
+                    'error': f"Error en búsqueda: {result.get('error', 'Error desconocido')}"
+                }
+            }
+            return
+        
+        estimated_cost = self.perplexity_client.estimate_cost(result)
+        self.budget_governor.record_usage(
+            estimated_cost,
+            {'query': query[:100], 'tokens': result.get('usage', {})}
+        )
+        
+        response = self._format_search_response(result, query)
+        yield {'result': self.format_response(response, 'search_result')}
+    
     def _optimize_query(self, query: str) -> str:
         """
         Optimiza la consulta para mejores resultados de búsqueda
         """
         # Limpiar consulta
-        query = query.strip()
+        normalized = normalize(query)
+        query = normalized.text
         
         # Añadir contexto temporal si es relevante
-        temporal_keywords = ['último', 'reciente', 'actual', 'latest', 'recent', 'current']
-        
-        if any(keyword in query.lower() for keyword in temporal_keywords):
+        if 'perplexity:temporal' in keywords.matches(normalized):
             if not any(year in query for year in ['2024', '2023', '2025']):
                 query += " 2024"
         
@@ -175,20 +275,7 @@ class PerplexitySkill(Skill):
         """
         Categoriza el tipo de consulta para optimización
         """
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ['noticias', 'news', 'último', 'latest']):
-            return 'news'
-        elif any(word in query_lower for word in ['precio', 'cotización', 'stock', 'price']):
-            return 'financial'
-        elif any(word in query_lower for word in ['clima', 'weather', 'temperatura']):
-            return 'weather'
-        elif any(word in query_lower for word in ['qué es', 'what is', 'definición', 'definition']):
-            return 'definition'
-        elif any(word in query_lower for word in ['quién es', 'who is', 'biografía']):
-            return 'biography'
-        else:
-            return 'general'
+        return categorize_query(query)
     
     def get_budget_status(self) -> Dict[str, Any]:
         """
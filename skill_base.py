@@ -2,8 +2,9 @@
 Clase base para todas las habilidades de Nyx
 """
 
+import inspect
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,8 +14,14 @@ class Skill(ABC):
     Clase base abstracta para todas las habilidades
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    # Las skills que emiten texto parcial sobrescriben execute_stream y ponen esto a True
+    streaming = False
+
+    def __init__(self, config: Dict[str, Any], services=None):
         self.config = config
+        # Contenedor de servicios del puente (None si la skill se usa por separado)
+        self.services = services
+        self._own_services = {}
         self.name = config.get('name', 'unnamed_skill')
         self.version = config.get('version', '0.1.0')
         self.description = config.get('description', '')
@@ -22,6 +29,20 @@ class Skill(ABC):
 
         logger.info(f"Skill {self.name} v{self.version} inicializada")
 
+    def get_service(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Retorna un servicio compartido del puente (cliente, gobernador...)
+
+        Fuera del puente, sin contenedor, crea una instancia propia con factory
+        la primera vez que se pide.
+        """
+        if self.services is not None:
+            return self.services.get(name)
+
+        if name not in self._own_services:
+            self._own_services[name] = factory()
+        return self._own_services[name]
+
     @abstractmethod
     def execute(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -36,6 +57,24 @@ class Skill(ABC):
         """
         pass
 
+    async def execute_stream(self, query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta la habilidad emitiendo la respuesta a medida que se genera
+
+        Produce {'chunk': texto} por cada fragmento y termina con
+        {'result': resultado}, el mismo Dict que retornaría execute().
+        Por defecto emite el resultado completo como un único fragmento.
+        """
+        result = self.execute(query, context)
+        if inspect.isawaitable(result):
+            result = await result
+
+        content = result.get('content') if isinstance(result, dict) else None
+        if isinstance(content, str) and content:
+            yield {'chunk': content}
+
+        yield {'result': result}
+
     def validate_input(self, query: str, context: Dict[str, Any]) -> bool:
         """
         Valida la entrada antes de ejecutar
@@ -53,6 +92,17 @@ class Skill(ABC):
             'timestamp': None  # Se añadirá en el router
         }
 
+    def speculation_key(self, query: str, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Identifica la acción que execute() haría si es de solo lectura
+
+        El router puede ejecutar la skill de forma especulativa (antes de
+        confirmar que es la adecuada) solo si esto retorna algo distinto de
+        None; dos contextos con la misma clave deben dar el mismo resultado.
+        Por defecto ninguna skill se especula.
+        """
+        return None
+
     def get_help(self) -> str:
         """
         Retorna información de ayuda para esta habilidad
@@ -2,45 +2,90 @@
 Gestor de habilidades de Nyx
 """
 
+import os
 import json
-import importlib
+import time
+import asyncio
+import inspect
+import importlib.util
 import sys
+import threading
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, AsyncIterator, Optional
 import logging
 
+import timing
+import traffic
+import deadline
+from deadline import DeadlineExceeded
+from keyword_matcher import keywords
+from startup import profiler
+
 logger = logging.getLogger(__name__)
 
+# Skills que se importan e instancian al arrancar, separadas por comas ('all':
+# todas); el resto se carga en su primera ejecución
+SKILLS_WARMUP = os.getenv('NYX_SKILLS_WARMUP', '')
+
 class SkillManager:
     """
     Maneja la carga, descubrimiento y ejecución de habilidades
+
+    Al arrancar solo se leen los skill.json: nombre, descripción y triggers
+    bastan para listar las skills y enrutar. El main.py de cada skill se
+    importa y se instancia (p. ej. el OAuth de Google del calendario) la
+    primera vez que se ejecuta, salvo las de NYX_SKILLS_WARMUP.
     """
 
-    def __init__(self):
+    def __init__(self, services=None):
+        # Contenedor de servicios compartidos que se inyecta en las skills
+        self.services = services
         self.skills = {}
+        self.sync_locks = {}
+        # Cargas en curso por skill, y lock para no instanciar una skill dos veces
+        self.loading = {}
+        self._load_lock = threading.Lock()
+        # Triggers registrados en keyword_matcher y forma de self.skills al registrarlos
+        self._trigger_owners = set()
+        self._trigger_shape = None
         self.skills_path = Path(__file__).parent.parent.parent / 'skills'
         self.load_skills()
 
     def load_skills(self):
         """
-        Descubre y carga todas las habilidades disponibles
+        Descubre las habilidades disponibles leyendo solo sus skill.json
+
+        Las de NYX_SKILLS_WARMUP se cargan además en este momento.
         """
-        logger.info("Cargando habilidades...")
+        logger.info("Descubriendo habilidades...")
 
         if not self.skills_path.exists():
             logger.warning(f"Directorio de skills no encontrado: {self.skills_path}")
             return
 
-        for skill_dir in self.skills_path.iterdir():
+        for skill_dir in sorted(self.skills_path.iterdir()):
             if skill_dir.is_dir() and (skill_dir / 'skill.json').exists():
                 try:
-                    self.load_skill(skill_dir)
+                    self.discover_skill(skill_dir)
                 except Exception as e:
-                    logger.error(f"Error cargando skill {skill_dir.name}: {e}")
+                    logger.error(f"Error leyendo el manifiesto de {skill_dir.name}: {e}")
+
+        warmup = list(self.skills) if SKILLS_WARMUP.strip() == 'all' else [
+            name.strip() for name in SKILLS_WARMUP.split(',') if name.strip()
+        ]
+        for skill_name in warmup:
+            if skill_name not in self.skills:
+                logger.warning(f"Skill de NYX_SKILLS_WARMUP no encontrada: {skill_name}")
+                continue
+            try:
+                with profiler.stage(f'skill:{skill_name}'):
+                    self.load_skill(skill_name)
+            except Exception as e:
+                logger.error(f"Error cargando skill {skill_name}: {e}")
 
-    def load_skill(self, skill_dir: Path):
+    def discover_skill(self, skill_dir: Path):
         """
-        Carga una habilidad específica
+        Registra una habilidad a partir de su skill.json, sin importarla
         """
         skill_json_path = skill_dir / 'skill.json'
 
@@ -49,27 +94,109 @@ class SkillManager:
 
         skill_name = skill_config['name']
 
+        self.skills[skill_name] = {
+            'instance': None,
+            'config': skill_config,
+            'path': skill_dir
+        }
+
+        logger.info(f"Skill descubierta: {skill_name}")
+
+    def load_skill(self, skill_name: str):
+        """
+        Importa e instancia una habilidad descubierta, si no lo estaba ya
+        """
+        with self._load_lock:
+            skill_data = self.skills[skill_name]
+            if skill_data['instance'] is None:
+                skill_data['instance'] = self._instantiate(skill_name, skill_data)
+                logger.info(f"Skill cargada: {skill_name}")
+            return skill_data['instance']
+
+    def _instantiate(self, skill_name: str, skill_data: Dict[str, Any]):
+        """
+        Importa el main.py de la skill y crea su instancia
+        """
+        skill_dir = skill_data['path']
+        skill_config = skill_data['config']
+
         # Añadir el directorio de la skill al path
         if str(skill_dir) not in sys.path:
             sys.path.append(str(skill_dir))
 
-        # Importar el módulo principal
-        module = importlib.import_module('main')
+        # Importar el módulo principal con un nombre propio: todas las skills
+        # tienen un main.py y con import_module('main') se pisarían entre ellas
+        module_name = f'nyx_skill_{skill_name}'
+        module = sys.modules.get(module_name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, skill_dir / 'main.py')
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except Exception:
+                del sys.modules[module_name]
+                raise
 
         # Obtener la clase principal
         skill_class_name = skill_config.get('class', f"{skill_name.title()}Skill")
         skill_class = getattr(module, skill_class_name)
 
-        # Instanciar la skill
-        skill_instance = skill_class(skill_config)
+        # Instanciar la skill con los servicios compartidos; las que no aceptan
+        # 'services' en el constructor los reciben como atributo
+        if 'services' in inspect.signature(skill_class).parameters:
+            skill_instance = skill_class(skill_config, services=self.services)
+        else:
+            skill_instance = skill_class(skill_config)
+            skill_instance.services = self.services
 
-        self.skills[skill_name] = {
-            'instance': skill_instance,
-            'config': skill_config,
-            'path': skill_dir
-        }
+        return skill_instance
 
-        logger.info(f"Skill cargada: {skill_name}")
+    async def _get_instance(self, skill_name: str):
+        """
+        Instancia de la skill, cargándola en un hilo la primera vez
+
+        La carga puede ser lenta (OAuth, clientes de APIs) y no debe bloquear el
+        loop; las requests concurrentes esperan a la misma carga, que sigue
+        aunque la request que la empezó agote su plazo.
+        """
+        instance = self.skills[skill_name]['instance']
+        if instance is not None:
+            return instance
+
+        loading = self._start_loading(skill_name)
+        with timing.stage('skill.load'):
+            return await deadline.within(asyncio.shield(loading), 'skill.load')
+
+    def _start_loading(self, skill_name: str) -> asyncio.Future:
+        """
+        Carga en curso de la skill, empezándola en un hilo si no lo estaba
+        """
+        loading = self.loading.get(skill_name)
+        if loading is None:
+            loading = asyncio.ensure_future(asyncio.to_thread(self.load_skill, skill_name))
+            self.loading[skill_name] = loading
+            loading.add_done_callback(lambda task: self._finish_loading(skill_name, task))
+        return loading
+
+    def _finish_loading(self, skill_name: str, loading: asyncio.Future):
+        """
+        Olvida la carga terminada; si falló, la próxima ejecución lo reintenta
+        """
+        self.loading.pop(skill_name, None)
+
+        # Marcar el error como recuperado aunque nadie espere ya el resultado
+        if not loading.cancelled():
+            loading.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Skills descubiertas y cargadas
+        """
+        return {
+            'discovered': len(self.skills),
+            'loaded': [name for name, data in self.skills.items() if data['instance'] is not None]
+        }
 
     def get_available_skills(self) -> List[Dict[str, Any]]:
         """
@@ -89,19 +216,51 @@ class SkillManager:
 
         return skills_list
 
-    def execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Ejecuta una habilidad específica
+
+        Las skills asíncronas se esperan directamente. Las síncronas se ejecutan
+        en un hilo para no bloquear el loop del puente, de una en una por skill
+        porque sus clientes (p. ej. googleapiclient) no son thread-safe. Ninguna
+        espera más allá del plazo de la request.
         """
+        started = time.perf_counter()
+        result = await self._execute_skill(skill_name, query, context)
+
+        # Con la grabación de tráfico activa, el resultado se guarda para reproducirlo
+        traffic.record_call('skill', skill_name, query, result, (time.perf_counter() - started) * 1000)
+
+        return result
+
+    async def _execute_skill(self, skill_name: str, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         if skill_name not in self.skills:
             return {
                 'error': f'Skill no encontrada: {skill_name}',
                 'success': False
             }
 
+        stage = f'skill.{skill_name}'
+
         try:
-            skill = self.skills[skill_name]['instance']
-            result = skill.execute(query, context)
+            deadline.check(stage)
+            skill = await self._get_instance(skill_name)
+
+            if asyncio.iscoroutinefunction(skill.execute):
+                with timing.stage(stage):
+                    result = await deadline.within(skill.execute(query, context), stage)
+            else:
+                lock = self.sync_locks.setdefault(skill_name, asyncio.Lock())
+                with timing.stage('skill.lock_wait'):
+                    await deadline.within(lock.acquire(), 'skill.lock_wait')
+
+                # El hilo no se puede interrumpir: el lock se libera cuando termina,
+                # aunque la request se cancele o agote su plazo antes
+                work = asyncio.ensure_future(asyncio.to_thread(skill.execute, query, context))
+                work.add_done_callback(lambda task: self._release_sync_lock(lock, task))
+
+                with timing.stage(stage):
+                    result = await deadline.within(asyncio.shield(work), stage)
 
             return {
                 'success': True,
@@ -109,6 +268,8 @@ class SkillManager:
                 'result': result
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error ejecutando skill {skill_name}: {e}")
             return {
@@ -117,17 +278,131 @@ class SkillManager:
                 'skill': skill_name
             }
 
+    def _release_sync_lock(self, lock: asyncio.Lock, work: asyncio.Future):
+        """
+        Libera el lock de una skill síncrona cuando su hilo termina
+        """
+        lock.release()
+
+        # Marcar el error como recuperado aunque nadie espere ya el resultado
+        if not work.cancelled():
+            work.exception()
+
+    def get_speculation_key(self, skill_name: str, query: str, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Acción de solo lectura que la skill haría con este contexto, o None si
+        no se puede ejecutar de forma especulativa
+
+        Si la skill aún no está cargada retorna None (la consulta sigue sin
+        especular) y empieza a cargarla en un hilo para las siguientes.
+        """
+        if skill_name not in self.skills:
+            return None
+
+        try:
+            instance = self.skills[skill_name]['instance']
+            if instance is None:
+                self._start_loading(skill_name)
+                return None
+            return instance.speculation_key(query, context)
+        except Exception as e:
+            logger.error(f"Error evaluando especulación de {skill_name}: {e}")
+            return None
+
+    async def execute_skill_stream(self, skill_name: str, query: str, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta una habilidad emitiendo {'chunk': texto} y al final {'result': ...}
+
+        Las skills sin streaming se ejecutan normalmente y su contenido se emite
+        como un único fragmento.
+        """
+        skill = None
+        if skill_name in self.skills:
+            try:
+                skill = await self._get_instance(skill_name)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Error cargando skill {skill_name}: {e}")
+                yield {'result': {'error': str(e), 'success': False, 'skill': skill_name}}
+                return
+
+        if not getattr(skill, 'streaming', False):
+            result = await self.execute_skill(skill_name, query, context)
+            skill_result = result.get('result')
+            content = skill_result.get('content') if isinstance(skill_result, dict) else None
+            if isinstance(content, str) and content:
+                yield {'chunk': content}
+            yield {'result': result}
+            return
+
+        started = time.perf_counter()
+        events = []
+
+        try:
+            async for event in skill.execute_stream(query, context):
+                if 'result' in event:
+                    event = {
+                        'result': {
+                            'success': True,
+                            'skill': skill_name,
+                            'result': event['result']
+                        }
+                    }
+                events.append(event)
+                yield event
+
+        except Exception as e:
+            logger.error(f"Error ejecutando skill {skill_name}: {e}")
+            event = {
+                'result': {
+                    'error': str(e),
+                    'success': False,
+                    'skill': skill_name
+                }
+            }
+            events.append(event)
+            yield event
+
+        traffic.record_call('skill', f'{skill_name}.stream', query, {'events': events},
+                            (time.perf_counter() - started) * 1000)
+
     def get_skill_by_trigger(self, query: str) -> Optional[str]:
         """
         Encuentra una skill basada en triggers de palabras clave
-        """
-        query_lower = query.lower()
 
-        for skill_name, skill_data in self.skills.items():
-            triggers = skill_data['config'].get('triggers', [])
+        Los triggers de todas las skills están en el registro de keyword_matcher,
+        que recorre la consulta una sola vez, sin tildes ni mayúsculas; si hay
+        varias, gana la primera skill cargada.
+        """
+        self._sync_triggers()
+        found = keywords.matches(query)
 
-            for trigger in triggers:
-                if trigger.lower() in query_lower:
-                    return skill_name
+        for skill_name in self.skills:
+            if f'trigger:{skill_name}' in found:
+                return skill_name
 
         return None
+
+    def _sync_triggers(self):
+        """
+        Registra los triggers de las skills si han cambiado
+
+        Se detectan las skills añadidas o quitadas y cualquier cambio en sus
+        triggers (también si se reemplaza uno por otro); el autómata se
+        reconstruye la próxima vez que se usa.
+        """
+        shape = tuple((name, tuple(data['config'].get('triggers', []))) for name, data in self.skills.items())
+        if shape == self._trigger_shape:
+            return
+
+        owners = set()
+        for skill_name, skill_data in self.skills.items():
+            owner = f'trigger:{skill_name}'
+            keywords.register(owner, skill_data['config'].get('triggers', []))
+            owners.add(owner)
+        for owner in self._trigger_owners - owners:
+            keywords.unregister(owner)
+
+        self._trigger_owners = owners
+        self._trigger_shape = shape